@@ -0,0 +1,341 @@
+"""
+Recording catalog: cached per-file statistics of the recordings in an external folder.
+
+recording_catalog.json (next to the day files) holds, per recording (key: path
+relative to the folder, e.g. "Data_11022026.duckdb" or "parquet/date=2026-02-12"):
+  - row_count, timestamp_count, t_min, t_max (ISO timestamps)
+  - variables (scalar tags) and arrays (array tags)
+  - tags: { name: {min, max, mean, count} } over the whole day
+  - rollup_levels stored (a rollups-only day, see retention, has row_count 0 and
+    its time range and variables taken from the rollups)
+  - size_bytes and mtime of the file when the stats were taken
+
+The recorder keeps the stats of the file it writes up to date from the batches
+it commits (RunningStats: no scan of the file, which only grows) and stores
+them at every checkpoint and when the file is closed (stop, rollover); it scans
+the file once at most, when reopening one whose entry is stale. While the file
+is open, get_entry() returns these live stats. Compaction adds the Parquet day
+and drops the .duckdb entry it archives/deletes. Readers call get_entry(), which
+returns the cached stats while size and mtime still match and rescans the file
+otherwise, so the history list and load dialog do not scan the recordings.
+
+Usage:
+  python catalog.py                  # (re)build the catalog of the folder next to this script
+  python catalog.py /path/to/folder
+"""
+
+import datetime
+import json
+import logging
+import os
+import sys
+import threading
+
+try:
+    from . import recording_store as rs
+    from . import rollups
+except ImportError:  # run as a script
+    import recording_store as rs
+    import rollups
+
+
+CATALOG_FILENAME = "recording_catalog.json"
+CATALOG_VERSION = 1
+
+# Recorder, compaction jobs and the GUI may update the same catalog
+_lock = threading.Lock()
+# Files being recorded: key -> RunningStats (see set_live / get_entry)
+_live = {}
+
+
+def external_dir_of(path):
+    """Folder holding the catalog of a recording (the parent of parquet/ for a Parquet day)."""
+    folder = os.path.dirname(os.path.abspath(path))
+    if rs.is_parquet_day(path):
+        folder = os.path.dirname(folder)
+    return folder
+
+
+def _key(path):
+    return os.path.relpath(os.path.abspath(path), external_dir_of(path)).replace(os.sep, "/")
+
+
+def catalog_path(external_dir):
+    return os.path.join(external_dir, CATALOG_FILENAME)
+
+
+def fingerprint(path):
+    """
+    (size_bytes, mtime) of a recording file or Parquet day folder. The .wal next to a .duckdb
+    file counts too: rows still in it (a crash) change the fingerprint, as checkpointing them does.
+    """
+    if rs.is_parquet_day(path):
+        mtimes = [os.path.getmtime(os.path.join(path, f)) for f in os.listdir(path)]
+        return rs.recording_disk_size(path), max(mtimes, default=0.0)
+    size_bytes, mtime = os.path.getsize(path), os.path.getmtime(path)
+    wal = path + ".wal"
+    if os.path.isfile(wal):
+        size_bytes += os.path.getsize(wal)
+        mtime = max(mtime, os.path.getmtime(wal))
+    return size_bytes, mtime
+
+
+def load_catalog(external_dir):
+    """{ key: entry } of a folder, {} if missing or unreadable."""
+    try:
+        with open(catalog_path(external_dir), encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != CATALOG_VERSION:
+        return {}
+    return data.get("files", {})
+
+
+def _save_catalog(external_dir, files):
+    target = catalog_path(external_dir)
+    tmp = target + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": CATALOG_VERSION, "files": files}, f, indent=1, sort_keys=True)
+    os.replace(tmp, target)
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def compute_stats(conn, db=None):
+    """Statistics of the recording reachable under `db` (see module docstring), without the fingerprint."""
+    t_min, t_max = rs.time_range(conn, db)
+    stats = {
+        "row_count": rs.row_count(conn, db),
+        "timestamp_count": rs.timestamp_count(conn, db),
+        "t_min": _iso(t_min),
+        "t_max": _iso(t_max),
+        "variables": rs.list_variables(conn, db),
+        "arrays": rs.list_array_tags(conn, db),
+        "tags": {},
+    }
+    levels = rollups.available_levels(conn, db)
+    stats["rollup_levels"] = levels
+    if t_min is None and levels:
+        # Rollups-only day (raw data past retention)
+        t0, t1 = rollups.rollup_time_range(conn, levels[0], db)
+        stats["t_min"], stats["t_max"] = _iso(t0), _iso(t1)
+        stats["variables"] = rollups.rollup_variables(conn, levels[0], db)
+    if levels:
+        # Coarsest rollup level: a few rows per tag instead of a full scan
+        rows = conn.execute(f"""
+            SELECT variable_name, min(min), max(max), sum(mean * count) / sum(count), sum(count)
+            FROM ({rollups.rollup_sql(conn, levels[-1], db)}) GROUP BY variable_name
+        """).fetchall()
+    else:
+        long_sql = rs.long_values_sql(conn, db)
+        rows = conn.execute(
+            f"SELECT variable_name, min(value), max(value), avg(value), count(value) FROM ({long_sql}) GROUP BY variable_name"
+        ).fetchall() if long_sql else []
+    for name, vmin, vmax, mean, count in rows:
+        stats["tags"][name] = {"min": vmin, "max": vmax, "mean": mean, "count": int(count or 0)}
+    return stats
+
+
+class RunningStats:
+    """
+    Stats of the file the recorder writes, updated from each committed batch instead of scanning
+    the file (see compute_stats for the fields). Started from the file's stats when it is opened.
+    """
+
+    def __init__(self, stats=None):
+        stats = stats or {}
+        self._lock = threading.Lock()
+        self.row_count = int(stats.get("row_count") or 0)
+        self.timestamp_count = int(stats.get("timestamp_count") or 0)
+        self.t_min = datetime.datetime.fromisoformat(stats["t_min"]) if stats.get("t_min") else None
+        self.t_max = datetime.datetime.fromisoformat(stats["t_max"]) if stats.get("t_max") else None
+        self.variables = set(stats.get("variables") or ())
+        self.arrays = set(stats.get("arrays") or ())
+        self.rollup_levels = list(stats.get("rollup_levels") or ())
+        # name -> [min, max, sum, count]
+        self.tags = {
+            name: [t["min"], t["max"], (t["mean"] or 0.0) * t["count"], t["count"]]
+            for name, t in (stats.get("tags") or {}).items() if t.get("count")
+        }
+
+    def add_cycles(self, cycles, rows=0, stored_timestamps=()):
+        """
+        Received cycles [(timestamp, {var_name: float})] (tag min/max/mean and time range, like the
+        rollups), `rows` written and the timestamps of the stored rows (new ones are counted).
+        """
+        with self._lock:
+            self.row_count += rows
+            last = self.t_max
+            self.timestamp_count += len({ts for ts in stored_timestamps if last is None or ts > last})
+            for ts, values in cycles:
+                if self.t_min is None or ts < self.t_min:
+                    self.t_min = ts
+                if self.t_max is None or ts > self.t_max:
+                    self.t_max = ts
+                for name, value in values.items():
+                    tag = self.tags.get(name)
+                    if tag is None:
+                        self.tags[name] = [value, value, value, 1]
+                        self.variables.add(name)
+                        continue
+                    if value < tag[0]:
+                        tag[0] = value
+                    if value > tag[1]:
+                        tag[1] = value
+                    tag[2] += value
+                    tag[3] += 1
+
+    def add_arrays(self, names):
+        with self._lock:
+            self.arrays.update(names)
+
+    def stats(self, rollup_levels=None):
+        """Stats as compute_stats() returns them (rollup_levels: levels now stored, if known)."""
+        with self._lock:
+            if rollup_levels is not None:
+                self.rollup_levels = list(rollup_levels)
+            return {
+                "row_count": self.row_count,
+                "timestamp_count": self.timestamp_count,
+                "t_min": _iso(self.t_min),
+                "t_max": _iso(self.t_max),
+                "variables": sorted(self.variables),
+                "arrays": sorted(self.arrays),
+                "tags": {
+                    name: {"min": t[0], "max": t[1], "mean": t[2] / t[3], "count": t[3]}
+                    for name, t in self.tags.items()
+                },
+                "rollup_levels": list(self.rollup_levels),
+            }
+
+
+def set_live(path, running):
+    """Serve the RunningStats of a file being recorded from get_entry() (None: the file is closed)."""
+    with _lock:
+        if running is None:
+            _live.pop(os.path.abspath(path), None)
+        else:
+            _live[os.path.abspath(path)] = running
+
+
+def update_entry(path, stats):
+    """Store stats for a recording, with its current fingerprint. Returns the entry."""
+    size_bytes, mtime = fingerprint(path)
+    entry = dict(stats, size_bytes=size_bytes, mtime=mtime,
+                 kind="parquet" if rs.is_parquet_day(path) else "duckdb",
+                 updated=datetime.datetime.now().isoformat(timespec="seconds"))
+    external_dir = external_dir_of(path)
+    with _lock:
+        files = load_catalog(external_dir)
+        files[_key(path)] = entry
+        _save_catalog(external_dir, files)
+    return entry
+
+
+def remove_entry(path):
+    external_dir = external_dir_of(path)
+    with _lock:
+        files = load_catalog(external_dir)
+        if files.pop(_key(path), None) is not None:
+            _save_catalog(external_dir, files)
+
+
+def scan_entry(path):
+    """Open a recording read-only, compute its stats and store them. Returns the entry."""
+    conn, db = rs.connect_recording(path)
+    try:
+        stats = compute_stats(conn, db)
+    finally:
+        conn.close()
+    return update_entry(path, stats)
+
+
+def get_entry(path, refresh=True, files=None):
+    """
+    Cached stats of a recording, or None. A stale or missing entry is rescanned when
+    refresh=True (the new entry is saved), otherwise None is returned.
+    `files` is an already loaded catalog of the recording's folder.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    running = _live.get(os.path.abspath(path))
+    if running is not None:
+        return dict(running.stats(), kind="duckdb", live=True)
+    if files is None:
+        files = load_catalog(external_dir_of(path))
+    entry = files.get(_key(path))
+    try:
+        current = fingerprint(path)
+    except OSError:
+        return None
+    if entry and (entry.get("size_bytes"), entry.get("mtime")) == current:
+        return entry
+    if not refresh:
+        return None
+    try:
+        return scan_entry(path)
+    except Exception as e:
+        logging.warning(f"Catalog: could not scan {os.path.basename(path)}: {e}")
+        return None
+
+
+def entry_time_range(entry):
+    """(t_min, t_max) datetimes of a catalog entry, or (None, None)."""
+    if not entry or not entry.get("t_min") or not entry.get("t_max"):
+        return None, None
+    return datetime.datetime.fromisoformat(entry["t_min"]), datetime.datetime.fromisoformat(entry["t_max"])
+
+
+def summarize(entries):
+    """Combined stats of several entries: {variables, t_min, t_max, row_count, timestamp_count}."""
+    names = set()
+    lows, highs = [], []
+    rows = stamps = 0
+    for entry in entries:
+        names.update(entry.get("variables", []))
+        t0, t1 = entry_time_range(entry)
+        if t0 is not None:
+            lows.append(t0)
+            highs.append(t1)
+        rows += entry.get("row_count", 0)
+        stamps += entry.get("timestamp_count", 0)
+    return {
+        "variables": sorted(names),
+        "t_min": min(lows) if lows else None,
+        "t_max": max(highs) if highs else None,
+        "row_count": rows,
+        "timestamp_count": stamps,
+    }
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    folder = argv[0] if argv else os.path.dirname(os.path.abspath(__file__))
+    try:
+        from .history import find_recordings
+    except ImportError:
+        from history import find_recordings
+    recordings = find_recordings(folder)
+    if not recordings:
+        print("No recordings found.")
+        return 1
+    files = load_catalog(folder)
+    for rec in recordings:
+        name = os.path.basename(rec['path'])
+        cached = get_entry(rec['path'], refresh=False, files=files) is not None
+        entry = get_entry(rec['path'], files=files)
+        if entry is None:
+            print(f"{name}: FAILED")
+            continue
+        state = "cached" if cached else "scanned"
+        print(f"{name}: {state}, {entry['row_count']:,} rows, {len(entry['variables'])} tags, "
+              f"{entry['t_min']} -> {entry['t_max']}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""
+Parquet compaction of closed recording days.
+
+At day rollover the recorder hands the closed .duckdb file to a CompactionJob,
+which writes it to external/parquet/date=YYYY-MM-DD/ as zstd-compressed
+Parquet, one file per table:
+  - samples.parquet: (timestamp, variable_name, value) of every scalar tag, whatever the
+    recording layout, sorted by variable_name then timestamp
+  - recording_tags / rollup_* / exchange_arrays / exchange_recipes / recording_compression /
+    dose_facts / state_intervals:
+    copied as-is, sorted by tag and time
+
+Row counts are verified against the source before the day folder is published.
+The folder records the .duckdb file it was made from (source.txt): a day that
+was already compacted from another file (Data_DDMMYYYY.duckdb and
+recording_YYYY-MM-DD.duckdb of the same day) is refused rather than replaced,
+and that file is left untouched. Then the .duckdb file is kept, moved to external/archive/, or deleted, depending
+on the 'after' action, and the recording catalog is updated. Readers open
+Parquet days through recording_store.attach_recording / connect_recording.
+
+Usage:
+  python compaction.py                      # compact all closed day files next to this script (keep .duckdb)
+  python compaction.py /path/to/folder      # compact all closed day files in a folder
+  python compaction.py --after archive      # ... and move the .duckdb files to archive/
+"""
+
+import argparse
+import datetime
+import logging
+import os
+import re
+import shutil
+import sys
+import threading
+
+import duckdb
+
+try:
+    from . import catalog
+    from . import pivot_cache
+    from . import recording_store as rs
+    from .dose_facts import DOSE_FACTS_TABLE
+    from .rollups import ROLLUP_LEVELS, rollup_table
+except ImportError:  # run as a script
+    import catalog
+    import pivot_cache
+    import recording_store as rs
+    from dose_facts import DOSE_FACTS_TABLE
+    from rollups import ROLLUP_LEVELS, rollup_table
+
+
+AFTER_KEEP = "keep"
+AFTER_ARCHIVE = "archive"
+AFTER_DELETE = "delete"
+AFTER_ACTIONS = (AFTER_KEEP, AFTER_ARCHIVE, AFTER_DELETE)
+
+ARCHIVE_DIRNAME = "archive"
+SOURCE_FILENAME = "source.txt"  # in a Parquet day: name of the .duckdb file it was compacted from
+
+_DAY_PATTERNS = (
+    (re.compile(r'^Data_(\d{2})(\d{2})(\d{4})\.duckdb$', re.IGNORECASE), lambda m: (m.group(3), m.group(2), m.group(1))),
+    (re.compile(r'^recording_(\d{4})-(\d{2})-(\d{2})\.duckdb$'), lambda m: (m.group(1), m.group(2), m.group(3))),
+)
+
+# table -> ORDER BY used when copying it to Parquet
+_COPIED_TABLES = {
+    rs.TAGS_TABLE: "tag_id",
+    rs.ARRAYS_TABLE: "tag_id, timestamp",
+    "exchange_recipes": "timestamp",
+    rs.COMPRESSION_TABLE: "variable_name",
+    DOSE_FACTS_TABLE: "dose_end",
+    rs.STATE_TABLE: "tag_id, start_ts",
+}
+_COPIED_TABLES.update({rollup_table(level): "tag_id, bucket" for level in ROLLUP_LEVELS})
+
+
+def day_of_file(db_path):
+    """Date of a Data_DDMMYYYY.duckdb / recording_YYYY-MM-DD.duckdb file, or None."""
+    fname = os.path.basename(db_path)
+    for pattern, groups in _DAY_PATTERNS:
+        m = pattern.match(fname)
+        if m:
+            year, month, day = groups(m)
+            try:
+                return datetime.date(int(year), int(month), int(day))
+            except ValueError:
+                return None
+    return None
+
+
+def parquet_day_dir(parquet_root, day):
+    return os.path.join(parquet_root, f"{rs.PARQUET_DAY_PREFIX}{day.isoformat()}")
+
+
+def compacted_from(day_dir):
+    """Name of the .duckdb file a Parquet day was compacted from, or None (unknown, e.g. a rollups-only day)."""
+    try:
+        with open(os.path.join(day_dir, SOURCE_FILENAME), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _check_day_dir(out_dir, source):
+    """Raise if the Parquet day exists and was not compacted from `source` (it would be overwritten)."""
+    if os.path.isdir(out_dir) and compacted_from(out_dir) != source:
+        raise RuntimeError(
+            f"{os.path.basename(out_dir)} already holds {compacted_from(out_dir) or 'another recording'}; "
+            f"{source} is not compacted over it"
+        )
+
+
+def compact_day_file(db_path, parquet_root, day=None, after=AFTER_KEEP, archive_dir=None):
+    """
+    Write one closed day file as Parquet and verify it. Returns dict:
+    { 'day', 'out_dir', 'rows', 'before_bytes', 'after_bytes', 'action' }.
+    Raises on failure, or when the day was compacted from another file (the .duckdb file is then
+    left untouched).
+    """
+    day = day or day_of_file(db_path)
+    if day is None:
+        raise ValueError(f"Cannot tell the day of {os.path.basename(db_path)}")
+    source = os.path.basename(db_path)
+    out_dir = parquet_day_dir(parquet_root, day)
+    _check_day_dir(out_dir, source)
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    counts = {}
+    conn = duckdb.connect(":memory:")
+    try:
+        rs.attach_recording(conn, db_path, "src")
+        tables = rs.recording_tables(conn, "src")
+        long_sql = rs.long_values_sql(conn, "src", states=False)  # state_intervals is copied as-is
+        if long_sql:
+            target = os.path.join(tmp_dir, f"{rs.PARQUET_SAMPLES}.parquet")
+            conn.execute(f"""
+                COPY (SELECT timestamp, variable_name, value FROM ({long_sql}) WHERE value IS NOT NULL
+                      ORDER BY variable_name, timestamp)
+                TO {rs.sql_string(target)} (FORMAT PARQUET, COMPRESSION ZSTD)
+            """)
+            expected = conn.execute(f"SELECT count(*) FROM ({long_sql}) WHERE value IS NOT NULL").fetchone()[0]
+            counts[rs.PARQUET_SAMPLES] = (expected, target)
+        for table, order_by in _COPIED_TABLES.items():
+            if table not in tables:
+                continue
+            target = os.path.join(tmp_dir, f"{table}.parquet")
+            conn.execute(f"""
+                COPY (SELECT * FROM src.{table} ORDER BY {order_by})
+                TO {rs.sql_string(target)} (FORMAT PARQUET, COMPRESSION ZSTD)
+            """)
+            counts[table] = (conn.execute(f"SELECT count(*) FROM src.{table}").fetchone()[0], target)
+        for table, (expected, target) in counts.items():
+            written = conn.execute(f"SELECT count(*) FROM read_parquet({rs.sql_string(target)})").fetchone()[0]
+            if written != expected:
+                raise RuntimeError(f"{table}: {written} rows in Parquet, {expected} in {os.path.basename(db_path)}")
+        rs.detach_recording(conn, "src")
+        with open(os.path.join(tmp_dir, SOURCE_FILENAME), "w", encoding="utf-8") as f:
+            f.write(source)
+        _check_day_dir(out_dir, source)  # another job may have published the day meanwhile
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    finally:
+        conn.close()
+
+    # Publish: replace an older compaction of the same file
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.replace(tmp_dir, out_dir)
+
+    before_bytes = os.path.getsize(db_path)
+    if after == AFTER_ARCHIVE:
+        archive_dir = archive_dir or os.path.join(os.path.dirname(db_path), ARCHIVE_DIRNAME)
+        os.makedirs(archive_dir, exist_ok=True)
+        shutil.move(db_path, os.path.join(archive_dir, os.path.basename(db_path)))
+    elif after == AFTER_DELETE:
+        os.remove(db_path)
+    if after in (AFTER_ARCHIVE, AFTER_DELETE) and os.path.isfile(db_path + ".wal"):
+        os.remove(db_path + ".wal")
+    try:
+        catalog.scan_entry(out_dir)
+        if after in (AFTER_ARCHIVE, AFTER_DELETE):
+            catalog.remove_entry(db_path)
+            pivot_cache.remove_cache(db_path)
+    except Exception as e:
+        logging.warning(f"Could not update recording catalog: {e}")
+    return {
+        'day': day,
+        'out_dir': out_dir,
+        'rows': counts.get(rs.PARQUET_SAMPLES, (0, None))[0],
+        'before_bytes': before_bytes,
+        'after_bytes': rs.recording_disk_size(out_dir),
+        'action': after,
+    }
+
+
+class CompactionJob(threading.Thread):
+    """Background compaction of one closed day file (started by the recorder at rollover)."""
+
+    def __init__(self, db_path, parquet_root, day=None, after=AFTER_KEEP):
+        super().__init__(daemon=True, name=f"compaction-{os.path.basename(db_path)}")
+        self.db_path = db_path
+        self.parquet_root = parquet_root
+        self.day = day
+        self.after = after if after in AFTER_ACTIONS else AFTER_KEEP
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = compact_day_file(self.db_path, self.parquet_root, self.day, self.after)
+            r = self.result
+            logging.info(
+                f"Compacted {os.path.basename(self.db_path)} -> {r['out_dir']}: {r['rows']:,} samples, "
+                f"{r['before_bytes'] / 1e6:.1f} MB -> {r['after_bytes'] / 1e6:.1f} MB (.duckdb {r['action']})"
+            )
+        except Exception as e:
+            self.error = str(e)
+            logging.error(f"Parquet compaction of {os.path.basename(self.db_path)} failed: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compact closed recording day files to Parquet.")
+    parser.add_argument('folder', nargs='?', default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument('--after', choices=AFTER_ACTIONS, default=AFTER_KEEP,
+                        help="What to do with the .duckdb file once verified (default: keep)")
+    args = parser.parse_args(argv)
+
+    today = datetime.date.today()
+    parquet_root = os.path.join(args.folder, rs.PARQUET_DIRNAME)
+    done = 0
+    for fname in sorted(os.listdir(args.folder)):
+        day = day_of_file(fname)
+        if day is None or day >= today:
+            continue  # not a day file, or still being recorded
+        db_path = os.path.join(args.folder, fname)
+        try:
+            r = compact_day_file(db_path, parquet_root, day, args.after)
+        except Exception as e:
+            print(f"{fname}: FAILED ({e})")
+            continue
+        done += 1
+        print(f"{fname}: {r['rows']:,} samples, {r['before_bytes'] / 1e6:.2f} MB -> "
+              f"{r['after_bytes'] / 1e6:.2f} MB Parquet (.duckdb {r['action']})")
+    if not done:
+        print("No closed recording day files compacted.")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""
+Lossy recording compression per tag: deadband and swinging-door trending.
+
+The recorder samples every tag at recording_interval_sec, even when a value is
+flat for hours. A tag with a compression setting only stores the samples
+needed to rebuild its trend within an error bound:
+  - deadband:      a sample is stored when it differs from the last stored value by
+                   more than `deviation` (absolute). Rebuilt as a step (hold last value).
+                   deviation 0 stores every change, which is lossless for discrete tags.
+  - deadband_pct:  same, with `deviation` in percent of the tag's span (CSV Max - Min).
+  - swinging_door: a sample is stored when the line from the last stored sample to
+                   the next one would no longer pass within `deviation` of every sample
+                   in between. Rebuilt by linear interpolation between stored samples.
+Every compressed tag still stores a sample at least every max_interval_sec, and
+the last received sample of each tag is stored when the day file is closed.
+
+Tags are configured with the optional Compression / CompDev columns of the
+exchange and recipe CSVs (see tag_settings()). Dose_number and tags without a
+setting are recorded losslessly; discrete tags (INT, BOOL, ...) only accept
+deadband.
+
+The settings used are stored in each day file (recording_compression table) so
+readers know how to fill the gaps, see recording_store.pivot_select_sql().
+Rollups are computed from every received sample, before compression, so
+min/max/mean trends stay exact.
+"""
+
+import copy
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+try:
+    from .recording_store import COMPRESSION_TABLE, INTERP_LINEAR, INTERP_STEP
+except ImportError:  # run as a script
+    from recording_store import COMPRESSION_TABLE, INTERP_LINEAR, INTERP_STEP
+
+
+MODE_NONE = "none"
+MODE_DEADBAND = "deadband"
+MODE_DEADBAND_PCT = "deadband_pct"
+MODE_SWINGING_DOOR = "swinging_door"
+MODES = (MODE_NONE, MODE_DEADBAND, MODE_DEADBAND_PCT, MODE_SWINGING_DOOR)
+
+# Store a sample of every compressed tag at least this often (flat signals stay visible)
+DEFAULT_MAX_INTERVAL_SEC = 600.0
+
+# Dose-relevant tags recorded losslessly whatever the CSV says
+LOSSLESS_TAGS = ("Dose_number",)
+# PLC types that are not compressed with swinging door (stored on change instead)
+DISCRETE_TYPES = ("INT", "DINT", "BOOL", "BYTE", "WORD", "DWORD")
+
+
+@dataclass
+class TagCompression:
+    """Compression setting of one tag."""
+    mode: str = MODE_NONE
+    deviation: float = 0.0
+    span: Optional[float] = None  # Max - Min of the tag, for deadband_pct
+
+    @property
+    def interpolation(self):
+        return INTERP_LINEAR if self.mode == MODE_SWINGING_DOOR else INTERP_STEP
+
+    def absolute_deviation(self):
+        if self.mode == MODE_DEADBAND_PCT:
+            return abs(self.deviation) / 100.0 * abs(self.span or 0.0)
+        return abs(self.deviation)
+
+
+def parse_mode(text):
+    """CSV Compression column -> mode ('' / 'none' / 'deadband' / 'deadband_pct' / 'swinging_door' / 'sdt')."""
+    value = (text or "").strip().lower().replace("-", "_").replace(" ", "_")
+    if value in ("", "none", "off", "lossless"):
+        return MODE_NONE
+    if value in ("sdt", "swingingdoor"):
+        return MODE_SWINGING_DOOR
+    if value in ("deadband%", "deadband_percent", "percent"):
+        return MODE_DEADBAND_PCT
+    if value in MODES:
+        return value
+    logging.warning(f"Unknown recording compression '{text}', recording losslessly")
+    return MODE_NONE
+
+
+def tag_settings(variable_metadata):
+    """{ var_name: TagCompression } of the compressed tags in the CSV metadata (see variable_loader)."""
+    settings = {}
+    for var_name, meta in (variable_metadata or {}).items():
+        mode = meta.get("compression") or MODE_NONE
+        if mode == MODE_NONE or meta.get("array_size"):
+            continue
+        if var_name in LOSSLESS_TAGS:
+            logging.info(f"Recording compression ignored for {var_name} (recorded losslessly)")
+            continue
+        if mode == MODE_SWINGING_DOOR and meta.get("type") in DISCRETE_TYPES:
+            logging.info(f"Swinging door does not apply to discrete tag {var_name}, using deadband")
+            mode = MODE_DEADBAND
+        span = meta.get("max", 0.0) - meta.get("min", 0.0)
+        settings[var_name] = TagCompression(mode, meta.get("compression_dev", 0.0), span)
+    return settings
+
+
+class _Deadband:
+    """Store a sample when it leaves the band around the last stored value."""
+
+    def __init__(self, deviation, max_interval):
+        self.deviation = deviation
+        self.max_interval = max_interval
+        self.stored = None  # (ts, value) last stored
+        self.snapshot = None  # (ts, value) last received, not stored yet
+
+    def offer(self, ts, value):
+        if (self.stored is None
+                or abs(value - self.stored[1]) > self.deviation
+                or (ts - self.stored[0]).total_seconds() >= self.max_interval):
+            self.stored, self.snapshot = (ts, value), None
+            return [(ts, value)]
+        self.snapshot = (ts, value)
+        return []
+
+    def flush(self):
+        if self.snapshot is None:
+            return []
+        out = [self.snapshot]
+        self.stored, self.snapshot = self.snapshot, None
+        return out
+
+
+class _SwingingDoor:
+    """Swinging-door trending: keep the slopes of the two doors pivoting on the last stored sample."""
+
+    def __init__(self, deviation, max_interval):
+        self.deviation = deviation
+        self.max_interval = max_interval
+        self.stored = None    # (ts, value) last stored (pivot of the doors)
+        self.snapshot = None  # (ts, value) last received, not stored yet
+        self.slope_up = self.slope_low = None
+
+    def _open(self, ts, value):
+        dt = (ts - self.stored[0]).total_seconds()
+        self.slope_up = (value + self.deviation - self.stored[1]) / dt
+        self.slope_low = (value - self.deviation - self.stored[1]) / dt
+
+    def offer(self, ts, value):
+        if self.stored is None:
+            self.stored, self.snapshot = (ts, value), None
+            return [(ts, value)]
+        dt = (ts - self.stored[0]).total_seconds()
+        if dt <= 0:
+            return []
+        out = []
+        if self.snapshot is None:
+            self._open(ts, value)
+        else:
+            self.slope_up = min(self.slope_up, (value + self.deviation - self.stored[1]) / dt)
+            self.slope_low = max(self.slope_low, (value - self.deviation - self.stored[1]) / dt)
+            slope = (value - self.stored[1]) / dt
+            if not self.slope_low <= slope <= self.slope_up or dt >= self.max_interval:
+                # The line from the pivot to this sample would leave the band of an earlier
+                # one: store the previous sample (its line fits every sample before it)
+                out.append(self.snapshot)
+                self.stored = self.snapshot
+                self._open(ts, value)
+        self.snapshot = (ts, value)
+        return out
+
+    def flush(self):
+        if self.snapshot is None:
+            return []
+        out = [self.snapshot]
+        self.stored, self.snapshot = self.snapshot, None
+        return out
+
+
+class RecordingCompressor:
+    """Filters recorded cycles through the per-tag compressors. Tags without a setting pass through."""
+
+    def __init__(self, settings, max_interval_sec=DEFAULT_MAX_INTERVAL_SEC):
+        self.settings = {name: s for name, s in (settings or {}).items() if s.mode != MODE_NONE}
+        self.max_interval_sec = max(1.0, float(max_interval_sec))
+        self.received = 0  # compressed-tag samples offered / stored (for the comm panel)
+        self.stored = 0
+        self._tags = {}
+
+    def __bool__(self):
+        return bool(self.settings)
+
+    def reset(self):
+        """Forget the stored points (new day file: every file starts with a stored sample per tag)."""
+        self._tags = {}
+
+    def snapshot(self):
+        """State a batch changes, for restore() when its transaction is rolled back."""
+        return {name: copy.copy(comp) for name, comp in self._tags.items()}, self.received, self.stored
+
+    def restore(self, snapshot):
+        self._tags, self.received, self.stored = snapshot
+
+    def _compressor(self, var_name):
+        comp = self._tags.get(var_name)
+        if comp is None:
+            setting = self.settings[var_name]
+            cls = _SwingingDoor if setting.mode == MODE_SWINGING_DOOR else _Deadband
+            comp = self._tags[var_name] = cls(setting.absolute_deviation(), self.max_interval_sec)
+        return comp
+
+    @staticmethod
+    def _group(points):
+        """[(ts, var_name, value)] -> [(ts, {var_name: value})] ordered by timestamp."""
+        by_ts = {}
+        for ts, var_name, value in points:
+            by_ts.setdefault(ts, {})[var_name] = value
+        return sorted(by_ts.items(), key=lambda item: item[0])
+
+    def filter_cycles(self, cycles):
+        """[(timestamp, {var_name: float})] -> the samples to store, in the same form."""
+        if not self.settings:
+            return cycles
+        points = []
+        for ts, cycle_values in cycles:
+            for var_name, value in cycle_values.items():
+                if var_name not in self.settings:
+                    points.append((ts, var_name, value))
+                    continue
+                self.received += 1
+                kept = self._compressor(var_name).offer(ts, value)
+                self.stored += len(kept)
+                points.extend((t, var_name, v) for t, v in kept)
+        return self._group(points)
+
+    def flush(self):
+        """Samples held back by the compressors (written before a day file is closed)."""
+        points = []
+        for var_name, comp in self._tags.items():
+            kept = comp.flush()
+            self.stored += len(kept)
+            points.extend((t, var_name, v) for t, v in kept)
+        return self._group(points)
+
+    def ratio(self):
+        """Received / stored samples of the compressed tags, or None."""
+        return self.received / self.stored if self.stored else None
+
+    def store_settings(self, conn):
+        """Write the settings to the recording_compression table of the open day file."""
+        create_compression_table(conn)
+        for var_name, setting in self.settings.items():
+            conn.execute(
+                f"INSERT OR REPLACE INTO {COMPRESSION_TABLE} VALUES (?, ?, ?, ?, ?)",
+                [var_name, setting.mode, setting.absolute_deviation(), setting.interpolation, self.max_interval_sec],
+            )
+
+
+def create_compression_table(conn):
+    """recording_compression: how the gaps of each sparsely stored tag are filled by readers."""
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {COMPRESSION_TABLE} (
+            variable_name VARCHAR PRIMARY KEY,
+            mode VARCHAR,
+            deviation DOUBLE,
+            interpolation VARCHAR,
+            max_interval_sec DOUBLE
+        )
+    ''')
@@ -0,0 +1,173 @@
+"""
+Dose-indexed fact table: one row per completed dose in each day file.
+
+Per-dose statistics over a long history would otherwise scan every sample of
+every day. The recorder watches Dose_number in every received cycle (before
+record modes and compression drop anything) and, when it changes, appends one
+row to dose_facts for the dose that just ended:
+  - dose_number, dose_start, dose_end (timestamps of its first / last received cycle)
+  - duration_sec (dose_start -> first cycle of the next dose) and cycles received
+  - one DOUBLE column per scalar tag: its value at the transition (last value of
+    the dose). Recipe tags hold the recipe active for the dose, i.e. their value
+    at dose_start.
+New tags add columns (ALTER TABLE). A dose is written to the file open when it
+ends; the dose in progress when recording starts is skipped (its start is
+unknown), the one in progress when it stops is not complete yet.
+
+Readers (offline dose table, analytics) read the table with dose_facts_sql()
+or history.history_dose_facts_sql() and aggregate it with dose_stats_sql().
+"""
+
+import logging
+
+try:
+    from .recording_store import qualified, quote_identifier, range_where, recording_tables
+except ImportError:  # run as a script
+    from recording_store import qualified, quote_identifier, range_where, recording_tables
+
+
+DOSE_FACTS_TABLE = "dose_facts"
+DOSE_VARIABLE = "Dose_number"
+FACT_COLUMNS = ("dose_number", "dose_start", "dose_end", "duration_sec", "cycles")
+
+
+def create_dose_facts_table(conn):
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {DOSE_FACTS_TABLE} (
+            dose_number BIGINT,
+            dose_start TIMESTAMP,
+            dose_end TIMESTAMP,
+            duration_sec DOUBLE,
+            cycles INTEGER
+        )
+    ''')
+
+
+class DoseFactWriter:
+    """Tracks Dose_number across received cycles and writes a dose_facts row at every transition."""
+
+    def __init__(self, recipe_tags=None, dose_variable=DOSE_VARIABLE):
+        self.recipe_tags = set(recipe_tags or ())
+        self.dose_variable = dose_variable
+        self.written = 0
+        self._columns = set()
+        self._last = {}          # var_name -> last received value (every tag)
+        self._dose = None        # dose in progress: number, start, last timestamp, cycles, recipe values
+        self._start_seen = False
+
+    def create_tables(self, conn):
+        """Create / load the table of a newly opened day file (the dose in progress carries over)."""
+        create_dose_facts_table(conn)
+        rows = conn.execute(
+            "SELECT column_name FROM duckdb_columns() "
+            "WHERE database_name = current_database() AND table_name = ?",
+            [DOSE_FACTS_TABLE],
+        ).fetchall()
+        self._columns = {r[0] for r in rows if r[0] not in FACT_COLUMNS}
+
+    def _ensure_columns(self, conn, var_names):
+        for var_name in var_names:
+            if var_name not in self._columns:
+                conn.execute(f"ALTER TABLE {DOSE_FACTS_TABLE} ADD COLUMN {quote_identifier(var_name)} DOUBLE")
+                self._columns.add(var_name)
+
+    def snapshot(self):
+        """State a batch changes, for restore() when its transaction is rolled back."""
+        dose = dict(self._dose) if self._dose is not None else None
+        return set(self._columns), dict(self._last), dose, self._start_seen, self.written
+
+    def restore(self, snapshot):
+        self._columns, self._last, self._dose, self._start_seen, self.written = snapshot
+
+    def _begin(self, number, ts):
+        recipe = {n: v for n, v in self._last.items() if n in self.recipe_tags}
+        self._dose = {"number": number, "start": ts, "end": ts, "cycles": 0, "recipe": recipe}
+
+    def observe(self, cycles):
+        """
+        [(timestamp, {var_name: float})] in time order -> fact rows of the doses completed in them:
+        [(dose_number, start, end, duration_sec, cycles, {var_name: value})].
+        """
+        facts = []
+        for ts, cycle_values in cycles:
+            number = cycle_values.get(self.dose_variable)
+            dose = self._dose
+            if number is not None and dose is not None and number != dose["number"]:
+                if self._start_seen:
+                    values = {n: v for n, v in self._last.items() if n != self.dose_variable}
+                    values.update(dose["recipe"])
+                    duration = (ts - dose["start"]).total_seconds()
+                    facts.append((int(dose["number"]), dose["start"], dose["end"], duration, dose["cycles"], values))
+                self._start_seen = True
+                dose = None
+            self._last.update(cycle_values)
+            if number is not None and dose is None:
+                if self._dose is None:
+                    logging.info(f"Dose facts: dose {int(number)} in progress, facts start with the next dose")
+                self._begin(number, ts)
+                dose = self._dose
+            if dose is not None:
+                dose["end"] = ts
+                dose["cycles"] += 1
+        return facts
+
+    def write(self, conn, facts):
+        """Insert fact rows (inside the caller's transaction). Returns the number of rows."""
+        if not facts:
+            return 0
+        names = sorted({n for *_, values in facts for n in values})
+        self._ensure_columns(conn, names)
+        columns = list(FACT_COLUMNS) + names
+        placeholders = ", ".join("?" for _ in columns)
+        conn.executemany(
+            f"INSERT INTO {DOSE_FACTS_TABLE} ({', '.join(quote_identifier(c) for c in columns)}) VALUES ({placeholders})",
+            [list(fact[:5]) + [fact[5].get(n) for n in names] for fact in facts],
+        )
+        self.written += len(facts)
+        return len(facts)
+
+
+# ---------------------------------------------------------------------------
+# Readers
+# ---------------------------------------------------------------------------
+def has_dose_facts(conn, db=None):
+    return DOSE_FACTS_TABLE in recording_tables(conn, db)
+
+
+def dose_fact_variables(conn, db=None):
+    """Tag columns of dose_facts (excluding the dose columns), in table order."""
+    rows = conn.execute(
+        """
+        SELECT column_name FROM duckdb_columns()
+        WHERE (database_name = coalesce(?, current_database()) OR schema_name = ?)
+          AND table_name = ?
+        ORDER BY column_index
+        """,
+        [db, db, DOSE_FACTS_TABLE],
+    ).fetchall()
+    return [r[0] for r in rows if r[0] not in FACT_COLUMNS]
+
+
+def dose_facts_sql(conn, db=None, t_from=None, t_to=None):
+    """SQL selecting the doses that ended within [t_from, t_to], or None when the file has no dose table."""
+    if not has_dose_facts(conn, db):
+        return None
+    return f"SELECT * FROM {qualified(db, DOSE_FACTS_TABLE)}{range_where('dose_end', t_from, t_to)}"
+
+
+def dose_stats_sql(facts_sql, var_names):
+    """
+    Statistics across the doses of facts_sql, one row per tag:
+    (variable_name, doses, mean, std, min, max).
+    """
+    parts = []
+    for name in var_names:
+        col = quote_identifier(name)
+        label = str(name).replace("'", "''")
+        parts.append(
+            f"SELECT '{label}' AS variable_name, count({col}) AS doses, avg({col}) AS mean, "
+            f"stddev_samp({col}) AS std, min({col}) AS min, max({col}) AS max FROM facts"
+        )
+    if not parts:
+        return None
+    return f"WITH facts AS ({facts_sql}) " + " UNION ALL ".join(parts)
@@ -0,0 +1,465 @@
+"""
+Crash-safe raw frame journal: the hot store in front of the recorder.
+
+With the journal enabled, PLCThread reads each data block as one byte frame
+(one db_read per DB instead of one per tag) and appends the frames of every
+recorded cycle to an append-only, memory-mapped journal. The acquisition loop
+never waits for DuckDB: the JournalConverter thread decodes the frames and
+feeds the RecorderThread, which writes them to the day file as usual.
+Only scalar tags of fixed-size types are journaled: array tags (and e.g.
+STRING tags) are read and submitted to the recorder directly, as without the
+journal, so they are not replayed after a crash.
+
+Journal folder (external/journal/):
+  - segment_<first seq>.jrn: preallocated segment files, memory-mapped. A segment
+    starts with a header (magic, version, frame layout as JSON: which tags sit
+    at which offset of which DB frame), followed by records:
+        header  <IIQQqqHHI: magic, payload length, seq, cycle, monotonic ns,
+                wall-clock us (naive local time), db number, reserved, crc32
+        payload raw frame bytes
+    seq numbers every record, cycle groups the frames read in one PLC cycle.
+  - position: last seq the recorder has committed, written by the recorder after
+    each commit (also kept in the day file's journal_position table, updated in
+    the same transaction as the samples).
+
+The journal is synced (msync) every sync_interval_sec by the converter thread;
+a cycle is acknowledged once its records are synced. Segments are deleted when
+every record in them is committed: the position only follows the seq the
+recorder commits. If a recorder batch fails, the recorder bumps its journal
+epoch and the converter resends every cycle after the committed seq.
+
+After a crash, the converter starts from the committed position and replays
+every later record found in the segments (a torn record at the end fails its
+crc and ends the replay), so no acknowledged cycle is lost. Replayed cycles
+keep their original timestamps but go to the day file open at replay time.
+
+Usage (decode a journal offline):
+  python frame_journal.py /path/to/journal out.parquet
+  python frame_journal.py /path/to/journal out.duckdb
+"""
+
+import datetime
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+
+
+JOURNAL_DIRNAME = "journal"
+POSITION_FILENAME = "position"
+SEGMENT_PREFIX = "segment_"
+SEGMENT_SUFFIX = ".jrn"
+DEFAULT_SEGMENT_BYTES = 16 * 1024 * 1024
+DEFAULT_SYNC_INTERVAL_SEC = 1.0
+
+_SEGMENT_MAGIC = b"DECJRNL1"
+_SEGMENT_HEADER = struct.Struct("<8sII")  # magic, version, layout JSON length
+_SEGMENT_VERSION = 1
+_RECORD_MAGIC = 0x4A524543  # "CERJ"
+_RECORD_HEADER = struct.Struct("<IIQQqqHHI")
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+# Big-endian S7 types -> (struct format, size)
+_S7_FORMATS = {
+    "REAL": (">f", 4),
+    "INT": (">h", 2),
+    "DINT": (">i", 4),
+    "WORD": (">H", 2),
+    "DWORD": (">I", 4),
+    "BYTE": (">B", 1),
+    "BOOL": (">B", 1),
+}
+
+
+def frame_layout(nodes):
+    """
+    Group scalar tags {name: (db_number, byte_offset, type)} into one frame per DB:
+    { db_number: {"start": offset, "size": bytes, "tags": [[name, offset in frame, type], ...]} }.
+    Tags of unsupported types (e.g. STRING) and arrays are left out.
+    """
+    per_db = {}
+    for name, spec in nodes.items():
+        if not isinstance(spec, (list, tuple)) or len(spec) != 3 or spec[2] not in _S7_FORMATS:
+            continue
+        db_number, offset, var_type = spec
+        per_db.setdefault(int(db_number), []).append((name, int(offset), var_type))
+    layout = {}
+    for db_number, tags in sorted(per_db.items()):
+        start = min(offset for _, offset, _ in tags)
+        end = max(offset + _S7_FORMATS[var_type][1] for _, offset, var_type in tags)
+        layout[db_number] = {
+            "start": start,
+            "size": end - start,
+            "tags": [[name, offset - start, var_type] for name, offset, var_type in tags],
+        }
+    return layout
+
+
+def decode_frame(frame, frame_spec, values=None):
+    """Decode the tags of one DB frame into values ({name: value}), rounded like PLCThread.read_signal."""
+    values = {} if values is None else values
+    for name, offset, var_type in frame_spec["tags"]:
+        fmt, size = _S7_FORMATS[var_type]
+        if offset + size > len(frame):
+            continue
+        value = struct.unpack_from(fmt, frame, offset)[0]
+        if var_type == "BOOL":
+            value = bool(value & 1)
+        elif var_type == "REAL":
+            value = round(value, 4 if "Density" in name else 3)
+        values[name] = value
+    return values
+
+
+def _wall_us(ts):
+    return (ts - _EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def _segment_paths(journal_dir):
+    """[(first seq, path)] of the segments, oldest first."""
+    found = []
+    if not os.path.isdir(journal_dir):
+        return found
+    for fname in os.listdir(journal_dir):
+        if fname.startswith(SEGMENT_PREFIX) and fname.endswith(SEGMENT_SUFFIX):
+            try:
+                found.append((int(fname[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]), os.path.join(journal_dir, fname)))
+            except ValueError:
+                continue
+    return sorted(found)
+
+
+def read_position(journal_dir):
+    """Last committed seq stored in the journal folder, 0 if none."""
+    try:
+        with open(os.path.join(journal_dir, POSITION_FILENAME), encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def write_position(journal_dir, seq):
+    target = os.path.join(journal_dir, POSITION_FILENAME)
+    with open(target + ".tmp", "w", encoding="utf-8") as f:
+        f.write(str(int(seq)))
+    os.replace(target + ".tmp", target)
+
+
+class SegmentReader:
+    """Reads the layout and the valid records of one segment file, from a byte offset."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            head = f.read(_SEGMENT_HEADER.size)
+            magic, version, layout_len = _SEGMENT_HEADER.unpack(head)
+            if magic != _SEGMENT_MAGIC or version != _SEGMENT_VERSION:
+                raise ValueError(f"{os.path.basename(path)} is not a frame journal segment")
+            self.layout = {int(db): spec for db, spec in json.loads(f.read(layout_len)).items()}
+        self.data_offset = _SEGMENT_HEADER.size + layout_len
+
+    def records(self, offset=None):
+        """Yield (next offset, seq, cycle, mono_ns, wall datetime, db_number, payload) up to the first invalid record."""
+        offset = self.data_offset if offset is None else offset
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            f.seek(offset)
+            while offset + _RECORD_HEADER.size <= size:
+                head = f.read(_RECORD_HEADER.size)
+                if len(head) < _RECORD_HEADER.size:
+                    return
+                magic, length, seq, cycle, mono_ns, wall_us, db_number, _, crc = _RECORD_HEADER.unpack(head)
+                if magic != _RECORD_MAGIC or offset + _RECORD_HEADER.size + length > size:
+                    return
+                payload = f.read(length)
+                if zlib.crc32(head[:-4] + payload) != crc:
+                    return  # torn or not yet complete
+                offset += _RECORD_HEADER.size + length
+                yield offset, seq, cycle, mono_ns, _EPOCH + datetime.timedelta(microseconds=wall_us), db_number, payload
+
+
+class FrameJournal:
+    """Append-only memory-mapped journal of raw DB frames (writer side, used by the acquisition thread)."""
+
+    def __init__(self, journal_dir, layout, segment_bytes=DEFAULT_SEGMENT_BYTES):
+        self.journal_dir = journal_dir
+        self.layout = layout
+        self.segment_bytes = max(64 * 1024, int(segment_bytes))
+        self._layout_json = json.dumps({str(db): spec for db, spec in layout.items()}).encode("utf-8")
+        self._lock = threading.Lock()
+        self._file = None
+        self._mm = None
+        self._pos = 0
+        os.makedirs(journal_dir, exist_ok=True)
+        segments = _segment_paths(journal_dir)
+        self.seq = self._last_seq(segments)
+        self.cycle = 0
+        self.synced_seq = self.seq
+        self.written_bytes = 0
+
+    @staticmethod
+    def _last_seq(segments):
+        """Highest valid seq in the existing segments (so numbering continues after a restart)."""
+        last = 0
+        for first, path in segments:
+            last = max(last, first - 1)
+            try:
+                for _, seq, *_ in SegmentReader(path).records():
+                    last = seq
+            except (OSError, ValueError):
+                continue
+        return last
+
+    def _open_segment(self):
+        # Always a fresh segment: an existing one may end with a torn record
+        path = os.path.join(self.journal_dir, f"{SEGMENT_PREFIX}{self.seq + 1:012d}{SEGMENT_SUFFIX}")
+        self._file = open(path, "w+b")
+        self._file.truncate(self.segment_bytes)
+        self._mm = mmap.mmap(self._file.fileno(), self.segment_bytes)
+        header = _SEGMENT_HEADER.pack(_SEGMENT_MAGIC, _SEGMENT_VERSION, len(self._layout_json)) + self._layout_json
+        self._mm[:len(header)] = header
+        self._pos = len(header)
+
+    def _close_segment(self):
+        if self._mm is not None:
+            self._mm.flush()
+            self._mm.close()
+            self._file.close()
+            self._mm = self._file = None
+
+    def append_cycle(self, frames, wall_ts):
+        """Append the frames {db_number: bytes} read in one cycle. Returns the seq of its last record."""
+        with self._lock:
+            self.cycle += 1
+            mono_ns = time.monotonic_ns()
+            wall_us = _wall_us(wall_ts)
+            for db_number, payload in frames.items():
+                payload = bytes(payload)
+                needed = _RECORD_HEADER.size + len(payload)
+                if self._mm is None or self._pos + needed > self.segment_bytes:
+                    self._close_segment()
+                    self._open_segment()
+                    if self._pos + needed > self.segment_bytes:
+                        raise ValueError(f"Frame of DB{db_number} ({len(payload)} bytes) exceeds the journal segment size")
+                self.seq += 1
+                head = _RECORD_HEADER.pack(_RECORD_MAGIC, len(payload), self.seq, self.cycle, mono_ns, wall_us,
+                                           int(db_number), 0, 0)
+                crc = zlib.crc32(head[:-4] + payload)
+                body_at = self._pos + _RECORD_HEADER.size
+                # Payload first, header last: a reader never sees a valid header before its payload
+                self._mm[body_at:body_at + len(payload)] = payload
+                self._mm[self._pos:body_at] = head[:-4] + struct.pack("<I", crc)
+                self._pos = body_at + len(payload)
+                self.written_bytes += needed
+            return self.seq
+
+    def sync(self):
+        """msync the written records; they are acknowledged afterwards. Returns the synced seq."""
+        with self._lock:
+            if self._mm is not None:
+                self._mm.flush()
+            self.synced_seq = self.seq
+            return self.synced_seq
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+            self.synced_seq = self.seq
+
+
+def read_cycles(journal_dir, after_seq=0, state=None, final=True):
+    """
+    Decode the records after `after_seq` into cycles: yields (last seq, wall timestamp, {name: value}).
+    `state` ({'path', 'offset', ...}) is updated so the next call continues where this one stopped.
+    With final=False the last cycle of the newest segment is held back, as the writer may still be
+    appending its frames.
+    """
+    state = {} if state is None else state
+    segments = _segment_paths(journal_dir)
+    for index, (first, path) in enumerate(segments):
+        newest = index + 1 == len(segments)
+        if not newest and segments[index + 1][0] - 1 <= after_seq:
+            continue  # every record of this segment is already committed
+        if state.get("path") is not None and path < state["path"]:
+            continue
+        if state.get("path") != path:
+            try:
+                reader = SegmentReader(path)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Journal: skipping {os.path.basename(path)}: {e}")
+                continue
+            state.update(path=path, offset=reader.data_offset, reader=reader)
+        reader = state["reader"]
+        cycle_id, cycle_ts, cycle_seq, cycle_offset, values = None, None, None, None, {}
+        record_offset = state["offset"]
+        for offset, seq, cycle, _, wall_ts, db_number, payload in reader.records(state["offset"]):
+            if seq > after_seq:
+                if cycle != cycle_id:
+                    if cycle_id is not None:
+                        yield cycle_seq, cycle_ts, values
+                        state["offset"] = record_offset
+                    cycle_id, cycle_ts, cycle_offset, values = cycle, wall_ts, record_offset, {}
+                cycle_seq = seq
+                spec = reader.layout.get(db_number)
+                if spec is not None:
+                    decode_frame(payload, spec, values)
+            else:
+                state["offset"] = offset
+            record_offset = offset
+        if cycle_id is None:
+            continue
+        if newest and not final:
+            state["offset"] = cycle_offset  # read it again once complete
+            return
+        # A cycle never spans segments: its frames are appended together
+        yield cycle_seq, cycle_ts, values
+        state["offset"] = record_offset
+
+
+class JournalConverter(threading.Thread):
+    """
+    Decodes journal records after the committed position and hands them to the recorder,
+    syncs the journal on schedule, and deletes fully committed segments.
+    Started before acquisition, it first replays what a crash left in the journal.
+    """
+
+    def __init__(self, journal, recorder, sync_interval_sec=DEFAULT_SYNC_INTERVAL_SEC, poll_sec=0.2):
+        super().__init__(daemon=True)
+        self.journal = journal
+        self.recorder = recorder
+        recorder.journal_dir = journal.journal_dir  # the recorder writes the position after each commit
+        self.sync_interval_sec = max(0.05, float(sync_interval_sec))
+        self.poll_sec = poll_sec
+        self.converted_seq = 0  # last seq handed to the recorder (not necessarily committed)
+        self.replayed_cycles = 0
+        self.resent_count = 0
+        self._epoch = None
+        self._cleaned_seq = 0
+        self._stop_event = threading.Event()
+        self._state = {}
+
+    def _committed(self):
+        return max(self.recorder.journal_seq or 0, read_position(self.journal.journal_dir))
+
+    def _convert(self, final=False):
+        epoch = self.recorder.journal_epoch
+        if epoch != self._epoch:
+            # A batch was not written: what was handed over since is ignored, start again from the committed seq
+            if self._epoch is not None:
+                self.resent_count += 1
+                logging.warning(f"Journal: recorder batch failed, resending cycles after seq {self._committed()}")
+            self._epoch = epoch
+            self.converted_seq = self._committed()
+            self._state = {}
+        count = 0
+        for seq, ts, values in read_cycles(self.journal.journal_dir, self.converted_seq, self._state, final):
+            if values and not self.recorder.submit_scalars(ts, values, journal_seq=seq, journal_epoch=epoch):
+                break  # recorder stopping: the rest stays in the journal
+            self.converted_seq = seq
+            count += 1
+        return count
+
+    def _cleanup(self):
+        committed = self.recorder.journal_seq or 0
+        if committed <= self._cleaned_seq:
+            return
+        self._cleaned_seq = committed
+        segments = _segment_paths(self.journal.journal_dir)
+        for (first, path), (next_first, _) in zip(segments, segments[1:]):
+            if next_first - 1 <= committed:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logging.warning(f"Journal: could not remove {os.path.basename(path)}: {e}")
+
+    def stats(self):
+        return {
+            "written_seq": self.journal.seq,
+            "synced_seq": self.journal.synced_seq,
+            "converted_seq": self.converted_seq,
+            "committed_seq": self.recorder.journal_seq or 0,
+            "replayed_cycles": self.replayed_cycles,
+            "resent": self.resent_count,
+        }
+
+    def run(self):
+        replayed = self._convert(final=True)
+        if replayed:
+            self.replayed_cycles = replayed
+            logging.info(f"Journal replay: {replayed} cycles after seq {self._committed()} handed to the recorder")
+        last_sync = time.monotonic()
+        while not self._stop_event.wait(self.poll_sec):
+            if time.monotonic() - last_sync >= self.sync_interval_sec:
+                self.journal.sync()
+                last_sync = time.monotonic()
+            try:
+                self._convert()
+                self._cleanup()
+            except Exception as e:
+                logging.error(f"Journal conversion failed: {e}")
+        self.journal.sync()
+        self._convert(final=True)
+
+    def stop(self, timeout=5.0):
+        """Convert what is left (call before stopping the recorder)."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout=timeout)
+        try:
+            self._cleanup()
+        except OSError as e:
+            logging.warning(f"Journal cleanup failed: {e}")
+
+
+def journal_to_table(journal_dir, target, after_seq=0):
+    """Decode a journal into a Parquet file or a DuckDB file (table journal_samples). Returns row count."""
+    import duckdb
+
+    timestamps, names, values = [], [], []
+    for _, ts, cycle_values in read_cycles(journal_dir, after_seq):
+        for name, value in cycle_values.items():
+            timestamps.append(ts)
+            names.append(name)
+            values.append(float(value))
+    batch = {
+        "timestamp": np.array(timestamps, dtype="datetime64[us]"),
+        "variable_name": np.array(names, dtype=object),
+        "value": np.array(values, dtype=np.float64),
+    }
+    is_parquet = target.lower().endswith(".parquet")
+    conn = duckdb.connect(":memory:" if is_parquet else target)
+    try:
+        conn.register("_journal_batch", batch)
+        select = "SELECT timestamp, variable_name, value FROM _journal_batch ORDER BY variable_name, timestamp"
+        if is_parquet:
+            quoted = "'" + target.replace("'", "''") + "'"
+            conn.execute(f"COPY ({select}) TO {quoted} (FORMAT PARQUET, COMPRESSION ZSTD)")
+        else:
+            conn.execute(f"CREATE OR REPLACE TABLE journal_samples AS {select}")
+        conn.unregister("_journal_batch")
+    finally:
+        conn.close()
+    return len(values)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print(__doc__)
+        return 1
+    journal_dir, target = argv
+    rows = journal_to_table(journal_dir, target)
+    print(f"{rows:,} samples decoded from {journal_dir} to {target}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main())
@@ -0,0 +1,318 @@
+"""
+Cross-day history: all recordings of an external folder as one time-partitioned table.
+
+Recordings are split per day (Data_DDMMYYYY.duckdb, legacy recording_YYYY-MM-DD.duckdb,
+compacted parquet/date=YYYY-MM-DD/ days) plus the legacy automation_data.db. For a
+requested [t_from, t_to] range:
+  1. select_recordings() prunes the day files by their date, with an hour of
+     slack on each side: rollover happens on the first batch written after
+     midnight, so a file may hold a few samples of the neighbouring day. Every
+     recording of a day is kept (e.g. Data_DDMMYYYY.duckdb and a custom-named
+     or recording_YYYY-MM-DD.duckdb file), except the .duckdb file a Parquet
+     day was compacted from (the same data twice).
+  2. attach_history() attaches the remaining ones read-only to one connection,
+     each under its own alias (h20260211, h20260211_2, ..., h_undated).
+  3. The history_* readers run the recording_store / rollups readers on every
+     alias with the time range pushed down and combine the results. Samples
+     and pivoted rows of a day with several recordings are deduplicated (a
+     Parquet day of unknown origin next to its .duckdb file).
+     create_history_view() exposes the samples as one (timestamp, variable_name,
+     value) view. history_dose_facts_sql() concatenates the per-dose rows of
+     the dose_facts tables (see dose_facts).
+
+Usage:
+  conn = duckdb.connect(":memory:")
+  aliases = attach_history(conn, select_recordings(find_recordings(folder), t_from, t_to))
+  conn.execute(f"CREATE TABLE offline_data AS {history_pivot_sql(conn, aliases, names, t_from, t_to)}")
+  detach_history(conn, aliases)
+"""
+
+import datetime
+import logging
+import os
+
+try:
+    from . import recording_store as rs
+    from . import rollups
+    from . import dose_facts
+    from .compaction import compacted_from, day_of_file
+except ImportError:  # run as a script
+    import recording_store as rs
+    import rollups
+    import dose_facts
+    from compaction import compacted_from, day_of_file
+
+
+LEGACY_DB_FILENAME = "automation_data.db"
+UNDATED_ALIAS = "h_undated"  # legacy automation_data.db or a browsed file
+
+KIND_DUCKDB = "duckdb"
+KIND_PARQUET = "parquet"
+
+# A day file may hold samples from just before or after its day (rollover on the next batch)
+_DAY_SLACK = datetime.timedelta(hours=1)
+
+
+def find_recordings(external_dir):
+    """
+    All recordings in external_dir, oldest first: [{ 'path', 'day', 'kind' }].
+    day is None for the legacy automation_data.db (not split per day).
+    """
+    found = []
+    if not external_dir or not os.path.isdir(external_dir):
+        return found
+    for fname in os.listdir(external_dir):
+        day = day_of_file(fname)
+        if day is not None:
+            found.append({'path': os.path.join(external_dir, fname), 'day': day, 'kind': KIND_DUCKDB})
+    parquet_root = os.path.join(external_dir, rs.PARQUET_DIRNAME)
+    if os.path.isdir(parquet_root):
+        for dname in os.listdir(parquet_root):
+            dpath = os.path.join(parquet_root, dname)
+            if not rs.is_parquet_day(dpath):
+                continue
+            try:
+                day = datetime.date.fromisoformat(dname[len(rs.PARQUET_DAY_PREFIX):])
+            except ValueError:
+                continue
+            found.append({'path': dpath, 'day': day, 'kind': KIND_PARQUET})
+    legacy_path = os.path.join(external_dir, LEGACY_DB_FILENAME)
+    if os.path.isfile(legacy_path):
+        found.append({'path': legacy_path, 'day': None, 'kind': KIND_DUCKDB})
+    found.sort(key=lambda e: (e['day'] or datetime.date.min, e['kind'] != KIND_DUCKDB))
+    return found
+
+
+def select_recordings(recordings, t_from=None, t_to=None):
+    """
+    Recordings that may hold samples in [t_from, t_to]: every recording of those days but the .duckdb
+    files their Parquet day was compacted from, legacy DB kept. A day's second and later recordings
+    get their own alias (entry['alias']).
+    """
+    by_day = {}
+    selected = []
+    for entry in recordings:
+        day = entry['day']
+        if day is None:
+            selected.append(entry)
+            continue
+        day_start = datetime.datetime.combine(day, datetime.time.min)
+        if t_from is not None and t_from > day_start + datetime.timedelta(days=1) + _DAY_SLACK:
+            continue
+        if t_to is not None and t_to < day_start - _DAY_SLACK:
+            continue
+        by_day.setdefault(day, []).append(entry)
+    for day in sorted(by_day):
+        entries = by_day[day]
+        sources = {compacted_from(e['path']) for e in entries if e['kind'] == KIND_PARQUET}
+        kept = [e for e in entries if e['kind'] == KIND_PARQUET or os.path.basename(e['path']) not in sources]
+        if len(kept) > 1:
+            logging.info(f"History: {day} has {len(kept)} recordings: "
+                         f"{', '.join(os.path.basename(e['path']) for e in kept)}")
+        # Parquet first: it keeps the plain day alias
+        kept.sort(key=lambda e: e['kind'] != KIND_PARQUET)
+        for n, entry in enumerate(kept, 1):
+            selected.append(entry if n == 1 else dict(entry, alias=f"{history_alias(entry)}_{n}"))
+    return selected
+
+
+def history_alias(entry):
+    if entry.get('alias'):
+        return entry['alias']
+    return f"h{entry['day'].strftime('%Y%m%d')}" if entry.get('day') else UNDATED_ALIAS
+
+
+def _day_groups(aliases):
+    """Aliases grouped by day, in order: [[h20260211, h20260211_2], [h20260212], ...]."""
+    groups = {}
+    for alias in aliases:
+        groups.setdefault(alias.split("_", 1)[0] if alias != UNDATED_ALIAS else alias, []).append(alias)
+    return list(groups.values())
+
+
+def _union_distinct(parts, union="UNION ALL"):
+    """One part as is, several (recordings of one day) without their duplicate rows."""
+    if len(parts) == 1:
+        return parts[0]
+    return "SELECT DISTINCT * FROM (" + f" {union} ".join(f"({p})" for p in parts) + ")"
+
+
+def attach_history(conn, recordings):
+    """Attach recordings read-only, one alias each. Unreadable files are skipped. Returns the aliases."""
+    aliases = []
+    for entry in recordings:
+        alias = history_alias(entry)
+        try:
+            rs.attach_recording(conn, entry['path'], alias)
+        except Exception as e:
+            logging.warning(f"History: skipping {os.path.basename(entry['path'])}: {e}")
+            continue
+        aliases.append(alias)
+    return aliases
+
+
+def detach_history(conn, aliases):
+    for alias in aliases:
+        try:
+            rs.detach_recording(conn, alias)
+        except Exception as e:
+            logging.warning(f"History: could not detach {alias}: {e}")
+
+
+def history_values_sql(conn, aliases, t_from=None, t_to=None):
+    """SQL yielding (timestamp, variable_name, value) over all aliases within the range, or None."""
+    parts = []
+    for group in _day_groups(aliases):
+        day_parts = [p for p in (rs.long_values_sql(conn, alias, t_from, t_to) for alias in group) if p]
+        if day_parts:
+            parts.append(_union_distinct(day_parts))
+    if not parts:
+        return None
+    return " UNION ALL ".join(f"({p})" for p in parts)
+
+
+def create_history_view(conn, aliases, t_from=None, t_to=None, name="history"):
+    """Create (or replace) a temp view over the samples of all aliases. Returns False if there is no data."""
+    values_sql = history_values_sql(conn, aliases, t_from, t_to)
+    if not values_sql:
+        return False
+    conn.execute(f"CREATE OR REPLACE TEMP VIEW {rs.quote_identifier(name)} AS {values_sql}")
+    return True
+
+
+def history_variables(conn, aliases):
+    names = set()
+    for alias in aliases:
+        names.update(rs.list_variables(conn, alias))
+    return sorted(names)
+
+
+def history_time_range(conn, aliases, t_from=None, t_to=None):
+    """(first, last) sample timestamp within the range, or (None, None)."""
+    lows, highs = [], []
+    for alias in aliases:
+        t0, t1 = rs.time_range(conn, alias, t_from, t_to)
+        if t0 is not None:
+            lows.append(t0)
+            highs.append(t1)
+    return (min(lows), max(highs)) if lows else (None, None)
+
+
+def history_row_count(conn, aliases, t_from=None, t_to=None):
+    """Stored rows within the range (summed per recording: an upper bound when a day has several)."""
+    return sum(rs.row_count(conn, alias, t_from, t_to) for alias in aliases)
+
+
+def history_timestamp_count(conn, aliases, t_from=None, t_to=None):
+    """
+    Distinct timestamps within the range (summed per recording; days do not overlap, the recordings of
+    one day may, so this is an upper bound then).
+    """
+    return sum(rs.timestamp_count(conn, alias, t_from, t_to) for alias in aliases)
+
+
+def _union_ordered(parts):
+    return "SELECT * FROM (" + " UNION ALL ".join(f"({p})" for p in parts) + ") ORDER BY timestamp"
+
+
+def history_pivot_sql(conn, aliases, var_names, t_from=None, t_to=None):
+    """
+    SQL returning one row per timestamp with one DOUBLE column per variable over all aliases.
+    Each recording is pivoted on its own (tag ids, wide columns), then the days are concatenated
+    (the recordings of one day without their duplicate rows).
+    """
+    parts = []
+    for group in _day_groups(aliases):
+        day_parts = [
+            rs.pivot_select_sql(conn, var_names, alias, t_from, t_to)
+            for alias in group if rs.long_values_sql(conn, alias)
+        ]
+        if day_parts:
+            parts.append(_union_distinct(day_parts))
+    return _union_ordered(parts) if parts else None
+
+
+def history_pick_level(conn, aliases, span_seconds, max_points, t_from=None, t_to=None):
+    """
+    Finest rollup level giving at most max_points buckets, stored in every recording
+    with samples in [t_from, t_to], or None.
+    """
+    common = None
+    for alias in aliases:
+        if rs.time_range(conn, alias, t_from, t_to)[0] is None:
+            continue
+        levels = set(rollups.available_levels(conn, alias))
+        common = levels if common is None else common & levels
+    for level in rollups.ROLLUP_LEVELS:
+        if common and level in common and span_seconds / rollups.ROLLUP_LEVELS[level] <= max_points:
+            return level
+    return None
+
+
+def _aliases_with_level(conn, aliases, level):
+    return [alias for alias in aliases if level in rollups.available_levels(conn, alias)]
+
+
+def history_bucket_count(conn, aliases, level, t_from=None, t_to=None):
+    with_level = _aliases_with_level(conn, aliases, level)
+    return rollups.bucket_count(conn, level, with_level, t_from, t_to) if with_level else 0
+
+
+def history_rollup_pivot_sql(conn, aliases, var_names, level, stat="mean", t_from=None, t_to=None):
+    """One row per rollup bucket (as 'timestamp') with one column per variable, over all aliases."""
+    with_level = _aliases_with_level(conn, aliases, level)
+    if not with_level:
+        return None
+    return rollups.pivot_rollup_sql(conn, var_names, level, stat, with_level, t_from, t_to)
+
+
+def history_rollup_levels(conn, aliases):
+    """Rollup levels stored in every recording that has rollups (e.g. days past raw retention), finest first."""
+    common = None
+    for alias in aliases:
+        levels = set(rollups.available_levels(conn, alias))
+        if levels:
+            common = levels if common is None else common & levels
+    return [level for level in rollups.ROLLUP_LEVELS if common and level in common]
+
+
+def history_rollup_variables(conn, aliases, level):
+    names = set()
+    for alias in _aliases_with_level(conn, aliases, level):
+        names.update(rollups.rollup_variables(conn, level, alias))
+    return sorted(names)
+
+
+def history_rollup_time_range(conn, aliases, level, t_from=None, t_to=None):
+    """(first, last) rollup bucket within the range, or (None, None)."""
+    lows, highs = [], []
+    for alias in _aliases_with_level(conn, aliases, level):
+        t0, t1 = rollups.rollup_time_range(conn, level, alias, t_from, t_to)
+        if t0 is not None:
+            lows.append(t0)
+            highs.append(t1)
+    return (min(lows), max(highs)) if lows else (None, None)
+
+
+def history_dose_variables(conn, aliases):
+    """Tags with a column in the dose_facts table of any alias."""
+    names = set()
+    for alias in aliases:
+        if dose_facts.has_dose_facts(conn, alias):
+            names.update(dose_facts.dose_fact_variables(conn, alias))
+    return sorted(names)
+
+
+def history_dose_facts_sql(conn, aliases, t_from=None, t_to=None):
+    """
+    SQL returning one row per dose ended within [t_from, t_to] over all aliases, ordered by
+    dose_end, or None. Days are matched by column name (tags added later are NULL before).
+    """
+    parts = []
+    for group in _day_groups(aliases):
+        day_parts = [p for p in (dose_facts.dose_facts_sql(conn, alias, t_from, t_to) for alias in group) if p]
+        if day_parts:
+            parts.append(_union_distinct(day_parts, "UNION ALL BY NAME"))
+    if not parts:
+        return None
+    return "SELECT * FROM (" + " UNION ALL BY NAME ".join(f"({p})" for p in parts) + ") ORDER BY dose_end"
@@ -0,0 +1,109 @@
+"""
+Discrete index linked to a variable, computed in DuckDB for offline data.
+
+Live, a graph with X = "Discrete index" linked to a variable (e.g.
+Dose_number) advances its index each time that variable's value changes and
+keeps a snapshot of the latest values at that moment (buffer_x_snapshots,
+exported one row per change). Offline the same rows are computed with window
+functions instead of a Python loop over every row:
+  - rows are taken in order (timestamp, or rowid for a table without one);
+  - each plotted variable is carried forward to its last value at or before
+    the row (last_value IGNORE NULLS), like the live snapshot;
+  - rows where the linked variable has a value different from its previous
+    value are kept (the first value counts as a change, as live);
+  - they are numbered 1, 2, 3... (the discrete index).
+
+Usage:
+  sql = linked_index_sql(f"({pivot_sql})", "timestamp", "Dose_number", ["Pressure"], time_col="timestamp")
+  index, timestamps, columns = fetch_linked_index(conn, sql, "Dose_number", ["Pressure"], with_time=True)
+  python linked_index.py Data_11022026.duckdb Dose_number Pressure [AvgDensity ...]
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+try:
+    from . import recording_store as rs
+except ImportError:  # run as a script
+    import recording_store as rs
+
+
+INDEX_COLUMN = "discrete_index"
+TIME_COLUMN = "timestamp"
+
+
+def linked_index_sql(source, order_col, linked, var_names, time_col=None):
+    """
+    SQL returning one row per change of `linked` in source (a table name or a parenthesized query):
+    discrete_index (1..n), time_col if given, the linked value, then each variable's last value so far.
+    """
+    order = rs.quote_identifier(order_col)
+    link = rs.quote_identifier(linked)
+    names = [v for v in dict.fromkeys(var_names) if v != linked]
+    cols = [rs.quote_identifier(v) for v in names]
+    time_sel = f"{rs.quote_identifier(time_col)} AS _time, " if time_col else ""
+    carried = ", ".join(
+        f"last_value({c} IGNORE NULLS) OVER (ORDER BY _ord ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS {c}"
+        for c in cols
+    )
+    return (
+        f"WITH src AS (SELECT {order} AS _ord, {time_sel}{link} AS _link{''.join(', ' + c for c in cols)} FROM {source}), "
+        f"carried AS (SELECT _ord, {'_time, ' if time_col else ''}_link{', ' + carried if carried else ''} FROM src), "
+        f"changes AS (SELECT *, lag(_link) OVER (ORDER BY _ord) AS _prev FROM carried WHERE _link IS NOT NULL) "
+        f"SELECT row_number() OVER (ORDER BY _ord) AS {INDEX_COLUMN}"
+        f"{', _time AS ' + rs.quote_identifier(TIME_COLUMN) if time_col else ''}, _link AS {link}"
+        f"{''.join(', ' + c for c in cols)} "
+        f"FROM changes WHERE _prev IS NULL OR _link IS DISTINCT FROM _prev ORDER BY _ord"
+    )
+
+
+def _as_column(values):
+    try:
+        return np.ma.filled(np.ma.asarray(values, dtype=np.float64), np.nan)
+    except (TypeError, ValueError):
+        return np.asarray(values, dtype=object)  # text column of a CSV
+
+
+def fetch_linked_index(conn, sql, linked, var_names, with_time=False):
+    """
+    Run linked_index_sql() (with_time: it was given a time_col): (index int64 array, timestamps
+    datetime64 array or None, {var_name: array} for var_names and the linked variable). Columns
+    are read by position (DuckDB may rename columns differing only in case).
+    """
+    result = list(conn.execute(sql).fetchnumpy().values())
+    index = np.asarray(result.pop(0), dtype=np.int64)
+    timestamps = None
+    if with_time:
+        timestamps = np.asarray(np.ma.filled(result.pop(0), np.datetime64("NaT")), dtype="datetime64[us]")
+    columns = {linked: _as_column(result.pop(0))}
+    names = [v for v in dict.fromkeys(var_names) if v != linked]
+    columns.update((v, _as_column(values)) for v, values in zip(names, result))
+    return index, timestamps, columns
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="One row per change of a variable in a recording, with snapshot values.")
+    parser.add_argument("recording", help="recording .duckdb file or Parquet day folder")
+    parser.add_argument("linked", help="variable whose changes define the index, e.g. Dose_number")
+    parser.add_argument("variables", nargs="*", help="variables to snapshot at each change")
+    parser.add_argument("--rows", type=int, default=10, help="rows to print")
+    args = parser.parse_args(argv)
+
+    conn, db = rs.connect_recording(args.recording)
+    try:
+        pivot = rs.pivot_select_sql(conn, [args.linked] + args.variables, db)
+        sql = linked_index_sql(f"({pivot})", TIME_COLUMN, args.linked, args.variables, time_col=TIME_COLUMN)
+        index, timestamps, columns = fetch_linked_index(conn, sql, args.linked, args.variables, with_time=True)
+        print(f"{len(index):,} changes of {args.linked}")
+        for i in range(min(args.rows, len(index))):
+            values = "  ".join(f"{v}={columns[v][i]}" for v in [args.linked] + args.variables)
+            print(f"{index[i]:>6}  {timestamps[i]}  {values}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
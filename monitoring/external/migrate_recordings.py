@@ -0,0 +1,240 @@
+"""
+Migrate daily recording files to the compact layout (see recording_store).
+
+Each Data_DDMMYYYY.duckdb (and legacy recording_YYYY-MM-DD.duckdb) file is
+rewritten into a new file with the recording_tags dictionary, typed sample
+tables and epoch-ms timestamps. Other tables (e.g. exchange_recipes) are copied
+unchanged. The sample count is verified before the original is replaced; the
+original is kept as <name>.duckdb.bak unless --no-backup is given.
+
+Today's file and files still opened by another process (the recorder) are
+skipped. A file left with a .wal by a crash is checkpointed first, so the rows
+in the WAL are migrated and no stale .wal is left next to the new file.
+
+Tag types come from snap7_node_ids.json in the same folder, then from wide
+column types; anything else is stored as FLOAT.
+
+Usage:
+  python migrate_recordings.py                        # migrate all day files next to this script
+  python migrate_recordings.py /path/to/folder        # migrate all day files in a folder
+  python migrate_recordings.py Data_11022026.duckdb   # migrate specific files
+  python migrate_recordings.py --dry-run              # report what would be migrated
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import re
+import sys
+
+import duckdb
+
+try:
+    from . import recording_store as rs
+    from .compaction import day_of_file
+except ImportError:  # run as a script
+    import recording_store as rs
+    from compaction import day_of_file
+
+
+DAY_FILE_PATTERN = re.compile(r'^(Data_\d{8}|recording_\d{4}-\d{2}-\d{2})\.duckdb$', re.IGNORECASE)
+
+# DuckDB column type of wide tables -> PLC type
+_WIDE_TO_PLC_TYPE = {"BOOLEAN": "BOOL", "INTEGER": "DINT", "SMALLINT": "INT", "BIGINT": "DINT"}
+
+
+def load_config_tag_types(folder):
+    """PLC type per scalar variable from snap7_node_ids.json, or {} if unavailable."""
+    config_path = os.path.join(folder, 'snap7_node_ids.json')
+    try:
+        with open(config_path) as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    node_config = config.get('snap7_variables') or config.get('Node_id_flexpts_S7_1500_snap7', {})
+    nodes = {k: v for k, v in node_config.items() if k != 'recipes'}
+    nodes.update(node_config.get('recipes', {}))
+    return {name: spec[2] for name, spec in nodes.items() if isinstance(spec, list) and len(spec) == 3}
+
+
+def find_day_files(folder):
+    """Sorted day-file paths in a folder."""
+    if not os.path.isdir(folder):
+        return []
+    return sorted(os.path.join(folder, f) for f in os.listdir(folder) if DAY_FILE_PATTERN.match(f))
+
+
+def _source_tag_types(conn, tag_types):
+    """Config types, completed with the column types of a wide table in the source."""
+    types = dict(tag_types or {})
+    rows = conn.execute(
+        "SELECT column_name, data_type FROM duckdb_columns() "
+        "WHERE database_name = 'src' AND table_name = ? AND column_name <> 'timestamp'",
+        [rs.WIDE_TABLE],
+    ).fetchall()
+    for name, data_type in rows:
+        types.setdefault(name, _WIDE_TO_PLC_TYPE.get(data_type, "REAL"))
+    return types
+
+
+def _source_name_system(conn, tables):
+    if rs.NARROW_TABLE in tables:
+        row = conn.execute(f"SELECT any_value(name_system) FROM src.{rs.NARROW_TABLE}").fetchone()
+        if row and row[0]:
+            return row[0]
+    return "Snap7"
+
+
+def _checkpoint_source(db_path, dry_run):
+    """
+    Merge a leftover .wal into the file (read-write open, CHECKPOINT). Returns an error message
+    when the file is locked by another process, else None. A dry run only checks the lock.
+    """
+    try:
+        conn = duckdb.connect(db_path, read_only=dry_run)
+    except duckdb.Error as e:
+        return f"in use ({e})"
+    try:
+        if not dry_run:
+            conn.execute("CHECKPOINT")
+    finally:
+        conn.close()
+    return None
+
+
+def migrate_recording(db_path, tag_types=None, keep_backup=True, dry_run=False):
+    """
+    Rewrite one recording file in the compact layout (never today's file or a file in use).
+    Returns dict: { 'path', 'status', 'rows', 'before_bytes', 'after_bytes' }.
+    """
+    result = {'path': db_path, 'status': 'skipped', 'rows': 0,
+              'before_bytes': os.path.getsize(db_path), 'after_bytes': None}
+    day = day_of_file(db_path)
+    if day is not None and day >= datetime.date.today():
+        result['status'] = "skipped (today's file)"
+        return result
+    locked = _checkpoint_source(db_path, dry_run)
+    if locked:
+        result['status'] = f"skipped, {locked}"
+        return result
+    result['before_bytes'] = os.path.getsize(db_path)
+    tmp_path = db_path[:-len('.duckdb')] + '.compact.tmp.duckdb'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = duckdb.connect(tmp_path)
+    migrated = False
+    try:
+        conn.execute(f"ATTACH '{db_path}' AS src (READ_ONLY)")
+        schemas = rs.detect_schemas(conn, 'src')
+        if not schemas or schemas == [rs.SCHEMA_COMPACT]:
+            result['status'] = 'already compact' if schemas else 'no data'
+            return result
+        tables = rs.recording_tables(conn, 'src')
+        long_sql = rs.long_values_sql(conn, 'src')
+        expected = conn.execute(f"SELECT count(*) FROM ({long_sql}) WHERE value IS NOT NULL").fetchone()[0]
+        result['rows'] = expected
+        if dry_run:
+            result['status'] = 'would migrate ' + '+'.join(schemas)
+            return result
+
+        # Tag dictionary: keep ids already assigned by the recorder, add the rest
+        tags = rs.TagDictionary(name_system=_source_name_system(conn, tables),
+                                tag_types=_source_tag_types(conn, tag_types))
+        tags.create_table(conn)
+        if rs.TAGS_TABLE in tables:
+            conn.execute(f"INSERT INTO {rs.TAGS_TABLE} SELECT * FROM src.{rs.TAGS_TABLE}")
+            tags.load(conn)
+        tags.ensure(conn, rs.list_variables(conn, 'src'))
+
+        for value_type in conn.execute(f"SELECT DISTINCT value_type FROM {rs.TAGS_TABLE}").fetchall():
+            value_type = value_type[0]
+            if value_type not in rs.COMPACT_TABLES:
+                continue  # array tags live in exchange_arrays
+            rs.create_compact_table(conn, value_type)
+            conn.execute(f"""
+                INSERT INTO {rs.COMPACT_TABLES[value_type]}
+                SELECT epoch_ms(l.timestamp) AS ts_ms, g.tag_id, {rs.compact_cast_sql(value_type, 'l.value')}
+                FROM ({long_sql}) l JOIN {rs.TAGS_TABLE} g USING (variable_name)
+                WHERE g.value_type = ? AND l.value IS NOT NULL
+                ORDER BY g.tag_id, ts_ms
+            """, [value_type])
+
+        # Copy non-scalar tables (recipes, arrays, ...) unchanged
+        scalar_tables = {rs.NARROW_TABLE, rs.WIDE_TABLE, rs.TAGS_TABLE} | set(rs.COMPACT_TABLES.values())
+        src_tables = conn.execute(
+            "SELECT table_name FROM duckdb_tables() WHERE database_name = 'src'"
+        ).fetchall()
+        for (table,) in src_tables:
+            if table not in scalar_tables:
+                conn.execute(f"CREATE TABLE {rs.quote_identifier(table)} AS SELECT * FROM src.{rs.quote_identifier(table)}")
+
+        written = rs.row_count(conn)
+        if written != expected:
+            raise RuntimeError(f"sample count mismatch after migration ({written} != {expected})")
+        conn.execute("DETACH src")
+        conn.execute("CHECKPOINT")
+        migrated = True
+    finally:
+        conn.close()
+        if not migrated and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    # The WAL belongs to the original (empty after the checkpoint above, but never left for the new file)
+    wal_path = db_path + '.wal'
+    if keep_backup:
+        os.replace(db_path, db_path + '.bak')
+        if os.path.exists(wal_path):
+            os.replace(wal_path, db_path + '.bak.wal')
+    elif os.path.exists(wal_path):
+        os.remove(wal_path)
+    os.replace(tmp_path, db_path)
+    result['status'] = 'migrated'
+    result['after_bytes'] = os.path.getsize(db_path)
+    return result
+
+
+def _mb(n):
+    return f"{n / (1024 * 1024):.2f} MB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate recording day files to the compact layout.")
+    parser.add_argument('paths', nargs='*', help="Folders or .duckdb files (default: folder of this script)")
+    parser.add_argument('--no-backup', action='store_true', help="Do not keep the original as .duckdb.bak")
+    parser.add_argument('--dry-run', action='store_true', help="Only report what would be migrated")
+    args = parser.parse_args(argv)
+
+    paths = args.paths or [os.path.dirname(os.path.abspath(__file__))]
+    files = []
+    for path in paths:
+        files.extend(find_day_files(path) if os.path.isdir(path) else [path])
+    if not files:
+        print("No recording day files found.")
+        return 1
+
+    total_before = total_after = 0
+    for db_path in files:
+        tag_types = load_config_tag_types(os.path.dirname(os.path.abspath(db_path)))
+        try:
+            res = migrate_recording(db_path, tag_types, keep_backup=not args.no_backup, dry_run=args.dry_run)
+        except Exception as e:
+            print(f"{os.path.basename(db_path)}: FAILED ({e})")
+            continue
+        line = f"{os.path.basename(db_path)}: {res['status']}, {res['rows']:,} samples, {_mb(res['before_bytes'])}"
+        if res['after_bytes'] is not None:
+            total_before += res['before_bytes']
+            total_after += res['after_bytes']
+            saved = 100.0 * (1 - res['after_bytes'] / res['before_bytes']) if res['before_bytes'] else 0.0
+            line += f" -> {_mb(res['after_bytes'])} ({saved:.0f}% smaller)"
+        print(line)
+    if total_before:
+        print(f"\nTotal: {_mb(total_before)} -> {_mb(total_after)} "
+              f"({100.0 * (1 - total_after / total_before):.0f}% smaller)")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main())
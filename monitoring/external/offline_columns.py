@@ -0,0 +1,109 @@
+"""
+Lazy column cache for offline recordings.
+
+Opening a recording used to pivot every tag over every timestamp into an
+in-memory offline_data table before any graph existed. The recordings now
+stay attached read-only and only the columns a graph asks for are pivoted
+(one query for the missing ones) and kept as float64 arrays:
+  - every pivot of a recording has the same rows (one per timestamp, see
+    recording_store.pivot_select_sql), so cached columns line up with the
+    timestamps read by the first query;
+  - columns not used for a while are evicted (least recently used first) once
+    the cache holds more than max_bytes; the timestamps are kept;
+  - columns() may be called from worker threads (see offline_tasks), one at a
+    time, each passing its own cursor of the connection;
+  - instead of pivot_sql, load_columns(conn, var_names) -> (timestamps,
+    {var_name: array}) can supply the columns, e.g. from the persistent
+    pivot caches of the recordings (pivot_cache.history_columns).
+
+Usage:
+  cache = OfflineColumnCache(conn, lambda c, names: history_pivot_sql(c, aliases, names, t_from, t_to))
+  timestamps, columns = cache.columns(["Pressure", "Dose_number"])
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+TIMESTAMP_COLUMN = "timestamp"
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+
+class OfflineColumnCache:
+    """Columns of an attached recording pivoted on request and kept in an LRU cache."""
+
+    def __init__(self, conn, pivot_sql=None, max_bytes=DEFAULT_CACHE_BYTES, load_columns=None):
+        self.conn = conn
+        self.pivot_sql = pivot_sql  # (conn, var_names) -> SQL: timestamp + one column per variable, ordered by timestamp
+        self.load_columns = load_columns  # or (conn, var_names) -> (timestamps, {var_name: array})
+        self.max_bytes = int(max_bytes)
+        self.timestamps = None      # datetime64[us] array, read with the first columns
+        self._columns = OrderedDict()  # var_name -> np.ndarray (float64, NaN where no value), oldest first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._columns)
+
+    @property
+    def nbytes(self):
+        return sum(col.nbytes for col in list(self._columns.values()))
+
+    def row_count(self):
+        return len(self.timestamps) if self.timestamps is not None else None
+
+    def columns(self, var_names, conn=None):
+        """
+        (timestamps, { var_name: np.ndarray }) of var_names, pivoting the ones not cached yet
+        (on conn if given, e.g. a worker thread's cursor, else on the cache's connection).
+        """
+        wanted = list(dict.fromkeys(v for v in var_names if v != TIMESTAMP_COLUMN))
+        with self._lock:
+            missing = [v for v in wanted if v not in self._columns]
+            self.hits += len(wanted) - len(missing)
+            if missing or self.timestamps is None:
+                self._load(conn or self.conn, missing)
+            for v in wanted:
+                self._columns.move_to_end(v)
+            self._evict(keep=set(wanted))
+            return self.timestamps, {v: self._columns[v] for v in wanted}
+
+    def _load(self, conn, var_names):
+        if self.load_columns is not None:
+            timestamps, loaded = self.load_columns(conn, var_names)
+            values = [loaded[v] for v in var_names]
+        else:
+            result = conn.execute(self.pivot_sql(conn, var_names)).fetchnumpy()
+            timestamps = result[TIMESTAMP_COLUMN]
+            # By position: the select list is timestamp + var_names (DuckDB renames columns differing only in case)
+            values = list(result.values())[1:]
+        if self.timestamps is not None and len(timestamps) != len(self.timestamps):
+            # Should not happen (every pivot has the same rows): start over from this one
+            logging.warning(
+                f"Offline columns: {len(timestamps)} rows instead of {len(self.timestamps)}, cache cleared"
+            )
+            self._columns.clear()
+            self.timestamps = None
+        if self.timestamps is None:
+            self.timestamps = np.asarray(timestamps, dtype="datetime64[us]")
+        self.misses += len(var_names)
+        for v, col in zip(var_names, values):
+            self._columns[v] = np.ma.filled(np.ma.asarray(col, dtype=np.float64), np.nan)
+
+    def _evict(self, keep):
+        while self.nbytes > self.max_bytes:
+            victim = next((v for v in self._columns if v not in keep), None)
+            if victim is None:
+                break
+            del self._columns[victim]
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._columns.clear()
+            self.timestamps = None
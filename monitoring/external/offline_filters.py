@@ -0,0 +1,251 @@
+"""
+Row filters for offline graphs and exports.
+
+Focusing an offline graph on a dose range or one recipe meant loading
+everything and zooming. A graph (or an export) can now take a filter: one
+condition per line or separated by ';', all of them required. Each condition
+is compiled to a DuckDB WHERE clause on the pivoted rows (one row per
+timestamp, see recording_store.pivot_select_sql) or on the offline_data
+table, so only matching rows reach Python:
+
+  time 2026-02-11 08:00 .. 2026-02-11 12:00     time range (also time >= ..., dd/mm/yyyy HH:MM)
+  dose 100..250                                  Dose_number range (also dose = 120, dose >= 100)
+  RecipeSpeed = 12.5                             recipe parameter equals (Recipe = 'PET 30ml' for text)
+  Pressure > 3.5                                 tag threshold (=, !=, <, <=, >, >=)
+  "Fill level" 10..20                            names with spaces or operators in double quotes
+
+Time conditions are also pushed into the range the recordings are pivoted over
+(time_range()). A row where a filtered tag has no value does not match.
+
+Usage:
+  filt = parse_filter("dose 100..250; Pressure > 3.5").resolve(columns)
+  sql = filtered_select_sql(f"({pivot_sql})", ["timestamp", "Pressure"], filt)
+  python offline_filters.py Data_11022026.duckdb "dose 100..250; Pressure > 3.5" [--columns Pressure] [--csv out.csv]
+"""
+
+import argparse
+import datetime
+import math
+import re
+import sys
+from collections import namedtuple
+
+try:
+    from . import recording_store as rs
+    from .dose_facts import DOSE_VARIABLE
+except ImportError:  # run as a script
+    import recording_store as rs
+    from dose_facts import DOSE_VARIABLE
+
+
+TIME_COLUMN = "timestamp"
+TIME_KEYWORDS = ("time", "timestamp")
+DOSE_KEYWORDS = ("dose",)
+BETWEEN = "between"
+DATETIME_FORMATS = ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y")
+
+_CONDITION_RE = re.compile(
+    r'^\s*(?P<name>"(?:[^"]|"")+"|[^\s=<>!"]+)\s*'
+    r'(?P<op>==|!=|<>|<=|>=|=|<|>)?\s*(?P<value>.*?)\s*$'
+)
+
+Condition = namedtuple("Condition", "column op value")  # value: (low, high) for BETWEEN
+
+
+def _parse_datetime(text):
+    text = text.strip().strip("'")
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        pass
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"not a date/time: {text!r} (use 2026-02-11 08:00 or 11/02/2026 08:00)")
+
+
+def _parse_value(text, is_time=False):
+    """datetime for time conditions, float for numbers, str for quoted or bare text."""
+    text = text.strip()
+    if not text:
+        raise ValueError("missing value")
+    if is_time:
+        return _parse_datetime(text)
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"":
+        return text[1:-1]
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def _parse_condition(text):
+    match = _CONDITION_RE.match(text)
+    if not match or not match.group("value"):
+        raise ValueError(f"expected 'name op value' or 'name low..high': {text.strip()!r}")
+    name, op, value = match.group("name"), match.group("op"), match.group("value")
+    if name.startswith('"'):
+        name = name[1:-1].replace('""', '"')
+    elif name.lower() in TIME_KEYWORDS:
+        name = TIME_COLUMN
+    elif name.lower() in DOSE_KEYWORDS:
+        name = DOSE_VARIABLE
+    is_time = name == TIME_COLUMN
+    if op is None:
+        if ".." not in value:
+            raise ValueError(f"expected an operator or a low..high range: {text.strip()!r}")
+        low, high = value.split("..", 1)
+        bounds = tuple(_finite(_parse_value(v, is_time), text) for v in (low, high))
+        return Condition(name, BETWEEN, bounds)
+    op = {"==": "=", "<>": "!="}.get(op, op)
+    return Condition(name, op, _finite(_parse_value(value, is_time), text))
+
+
+def _finite(value, condition):
+    """Reject inf / nan (no SQL literal, and no sample compares with them as meant)."""
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError(f"value must be a finite number: {condition.strip()!r}")
+    return value
+
+
+def parse_filter(text):
+    """OfflineFilter of a filter text (see module docstring); ValueError naming the faulty condition."""
+    conditions = []
+    for part in re.split(r"[;\n]", text or ""):
+        if part.strip():
+            conditions.append(_parse_condition(part))
+    return OfflineFilter(conditions, text)
+
+
+def _literal(value):
+    if isinstance(value, datetime.datetime):
+        return rs.sql_timestamp(value)
+    if isinstance(value, float):
+        return repr(value)
+    return rs.sql_string(value)
+
+
+class OfflineFilter:
+    """Parsed filter: conditions ANDed together (an empty filter keeps every row)."""
+
+    def __init__(self, conditions=(), text=""):
+        self.conditions = list(conditions)
+        self.text = (text or "").strip()
+
+    def __bool__(self):
+        return bool(self.conditions)
+
+    @property
+    def columns(self):
+        """Columns the conditions read besides the timestamp, in order of appearance."""
+        return list(dict.fromkeys(c.column for c in self.conditions if c.column != TIME_COLUMN))
+
+    def resolve(self, available):
+        """
+        Copy with the column names spelled as in `available` (case-insensitive match); ValueError
+        listing the unknown ones. Time conditions need a timestamp column too.
+        """
+        by_lower = {str(c).lower(): c for c in available}
+        conditions, unknown = [], []
+        for cond in self.conditions:
+            name = cond.column if cond.column in available else by_lower.get(str(cond.column).lower())
+            if name is None:
+                unknown.append(cond.column)
+            else:
+                conditions.append(cond._replace(column=name))
+        if unknown:
+            raise ValueError(f"unknown column(s) in filter: {', '.join(dict.fromkeys(unknown))}")
+        return OfflineFilter(conditions, self.text)
+
+    def time_range(self, t_from=None, t_to=None):
+        """[t_from, t_to] narrowed to the time conditions (inclusive bounds, for the pivot range)."""
+        for cond in self.conditions:
+            if cond.column != TIME_COLUMN:
+                continue
+            low = high = None
+            if cond.op == BETWEEN:
+                low, high = cond.value
+            elif cond.op in (">", ">=", "="):
+                low = cond.value
+            if cond.op in ("<", "<=", "="):
+                high = cond.value
+            if low is not None and (t_from is None or low > t_from):
+                t_from = low
+            if high is not None and (t_to is None or high < t_to):
+                t_to = high
+        return t_from, t_to
+
+    def where_sql(self):
+        """' WHERE ...' of the conditions, or ''."""
+        parts = []
+        for cond in self.conditions:
+            col = rs.quote_identifier(cond.column)
+            values = cond.value if cond.op == BETWEEN else (cond.value,)
+            if any(isinstance(v, str) for v in values) and cond.column != TIME_COLUMN:
+                col = f"CAST({col} AS VARCHAR)"  # text recipe values
+                values = tuple(v if isinstance(v, str) else f"{v:g}" for v in values)
+            if cond.op == BETWEEN:
+                parts.append(f"{col} BETWEEN {_literal(values[0])} AND {_literal(values[1])}")
+            else:
+                parts.append(f"{col} {cond.op} {_literal(values[0])}")
+        return (" WHERE " + " AND ".join(parts)) if parts else ""
+
+    def __str__(self):
+        return self.text or "; ".join(
+            f"{c.column} {c.value[0]}..{c.value[1]}" if c.op == BETWEEN else f"{c.column} {c.op} {c.value}"
+            for c in self.conditions
+        )
+
+
+def filtered_select_sql(source, columns, filt=None):
+    """SELECT columns FROM source (a table name or a parenthesized query), keeping the rows matching filt."""
+    cols = ", ".join(rs.quote_identifier(c) for c in columns)
+    return f"SELECT {cols} FROM {source}{filt.where_sql() if filt else ''}"
+
+
+def pivot_filtered_sql(pivot_sql, columns, filt, t_from=None, t_to=None):
+    """
+    SQL of the pivoted rows matching filt (all rows without one): pivot_sql(var_names, t_from, t_to) pivots
+    the columns and the filtered tags over [t_from, t_to] narrowed to the filter's time conditions, then
+    DuckDB filters them.
+    """
+    filt = filt or OfflineFilter()
+    var_names = [c for c in dict.fromkeys(list(columns) + filt.columns) if c != TIME_COLUMN]
+    t_from, t_to = filt.time_range(t_from, t_to)
+    return filtered_select_sql(f"({pivot_sql(var_names, t_from, t_to)})", columns, filt)
+
+
+def recording_filtered_sql(conn, columns, filt, db=None, t_from=None, t_to=None):
+    """SQL of the rows of one recording (attached as db) matching filt, see pivot_filtered_sql()."""
+    return pivot_filtered_sql(
+        lambda names, lo, hi: rs.pivot_select_sql(conn, names, db, lo, hi), columns, filt, t_from, t_to
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count (or export) the rows of a recording matching a filter.")
+    parser.add_argument("recording", help="recording .duckdb file or Parquet day folder")
+    parser.add_argument("filter", help='e.g. "dose 100..250; Pressure > 3.5"')
+    parser.add_argument("--columns", nargs="*", help="columns to export (default: every tag)")
+    parser.add_argument("--csv", help="write the matching rows to this CSV file")
+    args = parser.parse_args(argv)
+
+    conn, db = rs.connect_recording(args.recording)
+    try:
+        names = rs.list_variables(conn, db)
+        filt = parse_filter(args.filter).resolve([TIME_COLUMN] + names)
+        columns = [TIME_COLUMN] + [c for c in (args.columns or names) if c != TIME_COLUMN]
+        sql = recording_filtered_sql(conn, columns, filt, db)
+        if args.csv:
+            conn.execute(f"COPY ({sql}) TO {rs.sql_string(args.csv)} (HEADER, DELIMITER ';')")
+        rows = conn.execute(f"SELECT count(*) FROM ({sql})").fetchone()[0]
+        print(f"{rows:,} rows match {filt}" + (f" -> {args.csv}" if args.csv else ""))
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+Background work of the offline panel.
+
+Loading a recording or a large CSV and pivoting the columns of a graph used to
+run on the GUI thread and froze the window for tens of seconds. These jobs run
+in a small thread pool instead:
+  - a task runs its queries on its own cursors of the offline connection
+    (task.cursor(conn)); DuckDB releases the GIL while a query runs, so the
+    window keeps repainting;
+  - progress() is the DuckDB progress of the running query (progress bar
+    enabled, not printed) within the steps the task reported (task.step());
+  - cancel() interrupts the running queries and stops the task at its next
+    check(); the receiver ignores the results of a cancelled task;
+  - publish() hands partial results over before the task ends (e.g. the first
+    columns of a graph, drawn while the next ones are pivoted).
+
+The runner calls notify(task) from the worker thread after each publish() and
+when the task ends. The main window passes a Qt signal's emit (like the PLC
+threads' data_signal), so results are handled on the GUI thread:
+take_partials(), then result / error once task.done.
+
+Usage:
+  runner = OfflineTaskRunner(self.offline_task_signal.emit)
+  task = runner.submit("Loading CSV", load_csv, path)   # load_csv(task, path)
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_WORKERS = 2
+
+
+class TaskCancelled(Exception):
+    """Raised in a cancelled task by check() (an interrupted query raises DuckDB's InterruptException)."""
+
+
+class OfflineTask:
+    """One background job: fn(task, *args) in a worker thread, with progress, partial results and cancellation."""
+
+    def __init__(self, label, fn, args, notify):
+        self.label = label
+        self.result = None
+        self.error = None      # exception raised by fn (None when cancelled)
+        self.done = False
+        self.reported = False  # set by the receiver once it handled the end of the task
+        self._fn = fn
+        self._args = args
+        self._notify = notify
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._cursors = []
+        self._partials = []
+        self._step = (0, 1)
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """Stop the task: running queries are interrupted, the next check() raises TaskCancelled."""
+        self._cancel.set()
+        with self._lock:
+            cursors = list(self._cursors)
+        for cur in cursors:
+            try:
+                cur.interrupt()
+            except Exception:
+                pass
+
+    def check(self):
+        if self._cancel.is_set():
+            raise TaskCancelled(self.label)
+
+    def cursor(self, conn):
+        """A cursor of conn for this task's queries (its progress is reported, cancel() interrupts it)."""
+        self.check()
+        cur = conn.cursor()
+        try:
+            cur.execute("SET enable_progress_bar = true")
+            cur.execute("SET enable_progress_bar_print = false")
+        except Exception as e:
+            logging.debug(f"Query progress unavailable: {e}")
+        with self._lock:
+            self._cursors.append(cur)
+        return cur
+
+    def step(self, index, count):
+        """Report that step `index` of `count` starts (and stop here if cancelled)."""
+        self._step = (index, max(1, count))
+        self.check()
+
+    def progress(self):
+        """0..1: the steps done plus the progress of the running query within the current step."""
+        index, count = self._step
+        query = 0.0
+        with self._lock:
+            cursors = list(self._cursors)
+        for cur in cursors:
+            try:
+                percent = cur.query_progress()
+            except Exception:
+                continue
+            if percent > 0:
+                query = max(query, min(percent, 100.0) / 100.0)
+        return min(1.0, (index + query) / count)
+
+    def publish(self, partial):
+        """Hand a partial result to the receiver (from fn)."""
+        self.check()
+        with self._lock:
+            self._partials.append(partial)
+        self._notify(self)
+
+    def take_partials(self):
+        """The partial results published since the last call (receiver side)."""
+        with self._lock:
+            partials, self._partials = self._partials, []
+        return partials
+
+    def _run(self):
+        try:
+            self.result = self._fn(self, *self._args)
+        except Exception as e:
+            if not self.cancelled:
+                self.error = e
+                logging.error(f"{self.label} failed: {e}")
+        finally:
+            with self._lock:
+                cursors, self._cursors = self._cursors, []
+            for cur in cursors:
+                try:
+                    cur.close()
+                except Exception:
+                    pass
+            self.done = True
+            self._notify(self)
+
+
+class OfflineTaskRunner:
+    """Thread pool running OfflineTasks; notify(task) is called from the workers."""
+
+    def __init__(self, notify, max_workers=DEFAULT_WORKERS):
+        self._notify = notify
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="offline")
+        self._tasks = []
+        self._lock = threading.Lock()
+
+    def submit(self, label, fn, *args):
+        task = OfflineTask(label, fn, args, self._notify)
+        with self._lock:
+            self._tasks = [t for t in self._tasks if not t.done] + [task]
+        self._pool.submit(task._run)
+        return task
+
+    def active(self):
+        """Tasks queued or running, oldest first."""
+        with self._lock:
+            return [t for t in self._tasks if not t.done]
+
+    def cancel_all(self):
+        for task in self.active():
+            task.cancel()
+
+    def shutdown(self):
+        """Cancel everything and let the workers end on their own (the window is closing)."""
+        self.cancel_all()
+        self._pool.shutdown(wait=False, cancel_futures=True)
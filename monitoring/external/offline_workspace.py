@@ -0,0 +1,201 @@
+"""
+Disk-backed DuckDB workspaces for offline CSV files.
+
+Loading a CSV used to copy it into an in-memory DuckDB; multi-GB exports did
+not fit in RAM. A CSV is now imported once into its own DuckDB file (the
+offline_data table) in a temporary workspace folder:
+  - the workspace file is named after the CSV's path, mtime and size, so
+    opening an unchanged CSV again reuses it without parsing (read-only);
+    a modified CSV gets a new workspace;
+  - DuckDB runs with a memory_limit and spills to the workspace folder above
+    it; the CSV is parsed in parallel on all cores;
+  - the import writes a .tmp file renamed when complete, so a cancelled or
+    failed import never leaves a workspace that looks valid;
+  - the least recently opened workspaces are deleted once the folder holds
+    more than max_bytes.
+
+Usage:
+  conn, reused = open_csv_workspace("export_line3.csv", memory_limit_mb=2048)
+  python offline_workspace.py export_line3.csv [--memory-limit 2048] [--list] [--prune]
+"""
+
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import duckdb
+
+
+WORKSPACE_DIRNAME = "DecStudio_offline_workspaces"
+WORKSPACE_TABLE = "offline_data"
+INFO_TABLE = "workspace_info"
+DEFAULT_MEMORY_LIMIT_MB = 2048
+DEFAULT_WORKSPACE_BYTES = 20 * 1024 ** 3  # all workspaces together, least recently opened deleted first
+STALE_TMP_SEC = 24 * 3600
+
+
+def workspace_dir(folder=None):
+    folder = folder or os.path.join(tempfile.gettempdir(), WORKSPACE_DIRNAME)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def source_key(csv_path):
+    """(normalized path, mtime_ns, size) identifying one version of a CSV file."""
+    path = os.path.normcase(os.path.abspath(csv_path))
+    st = os.stat(path)
+    return path, st.st_mtime_ns, st.st_size
+
+
+def workspace_path(csv_path, folder=None):
+    """Workspace file of the current version of csv_path."""
+    path, mtime_ns, size = source_key(csv_path)
+    digest = hashlib.sha1(f"{path}|{mtime_ns}|{size}".encode("utf-8")).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(path))[0][:40]
+    return os.path.join(workspace_dir(folder), f"{stem}_{digest}.duckdb")
+
+
+def connect(path, memory_limit_mb=None, read_only=False, threads=None):
+    """DuckDB connection to a workspace file with a memory limit (spilling to the workspace folder)."""
+    config = {
+        "threads": int(threads or os.cpu_count() or 1),
+        "temp_directory": os.path.join(os.path.dirname(path), "spill"),
+    }
+    if memory_limit_mb:
+        config["memory_limit"] = f"{int(memory_limit_mb)}MB"
+    return duckdb.connect(path, read_only=read_only, config=config)
+
+
+def find_workspace(csv_path, folder=None):
+    """
+    Workspace file of csv_path if it was imported unchanged before, else None. The name holds
+    the source key and only complete imports are renamed to it, so the file is not opened here
+    (DuckDB refuses a second connection to a file open with another memory limit).
+    """
+    path = workspace_path(csv_path, folder)
+    return path if os.path.isfile(path) else None
+
+
+def import_csv(conn, csv_path):
+    """Parse csv_path (in parallel) into the offline_data table of conn and record its source key."""
+    source, mtime_ns, size = source_key(csv_path)
+    conn.execute(
+        f"CREATE TABLE {WORKSPACE_TABLE} AS SELECT * FROM read_csv(?, auto_detect = true, parallel = true)",
+        [csv_path],
+    )
+    # Provenance of the import (the workspace file name is the key)
+    conn.execute(f"CREATE TABLE {INFO_TABLE} (source_path VARCHAR, mtime_ns BIGINT, size BIGINT, imported_at TIMESTAMP)")
+    conn.execute(f"INSERT INTO {INFO_TABLE} VALUES (?, ?, ?, current_timestamp)", [source, mtime_ns, size])
+
+
+def open_csv_workspace(csv_path, memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB, folder=None, cursor=None,
+                       max_bytes=DEFAULT_WORKSPACE_BYTES):
+    """
+    (read-only connection with the offline_data table of csv_path, reused) importing the CSV
+    first unless an unchanged import exists. cursor(conn) gives the connection the import runs
+    on (e.g. a background task's cursor, interrupted on cancel); the connection itself by default.
+    """
+    path = find_workspace(csv_path, folder)
+    reused = path is not None
+    if not reused:
+        path = workspace_path(csv_path, folder)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        conn = connect(tmp, memory_limit_mb)
+        cur = cursor(conn) if cursor else conn
+        try:
+            import_csv(cur, csv_path)
+            cur.execute("CHECKPOINT")
+        except BaseException:
+            cur.close()
+            conn.close()
+            _remove(tmp)
+            raise
+        cur.close()  # the file stays open while any cursor of it is
+        conn.close()
+        os.replace(tmp, path)
+        prune_workspaces(folder, max_bytes, keep=(path,))
+    else:
+        os.utime(path)  # most recently used
+    return connect(path, memory_limit_mb, read_only=True), reused
+
+
+def list_workspaces(folder=None):
+    """[(path, bytes, last opened)] of the workspace files, most recently opened first."""
+    out = []
+    for path in glob.glob(os.path.join(workspace_dir(folder), "*.duckdb")):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        out.append((path, st.st_size, st.st_mtime))
+    return sorted(out, key=lambda w: w[2], reverse=True)
+
+
+def prune_workspaces(folder=None, max_bytes=DEFAULT_WORKSPACE_BYTES, keep=()):
+    """Delete the least recently opened workspaces above max_bytes, and leftover imports; returns the paths removed."""
+    removed = []
+    now = time.time()
+    for tmp in glob.glob(os.path.join(workspace_dir(folder), "*.tmp")):
+        try:
+            if now - os.path.getmtime(tmp) > STALE_TMP_SEC and _remove(tmp):
+                removed.append(tmp)
+        except OSError:
+            pass
+    total = 0
+    keep = {os.path.normcase(os.path.abspath(p)) for p in keep}
+    for path, size, _ in list_workspaces(folder):
+        total += size
+        if total > max_bytes and os.path.normcase(os.path.abspath(path)) not in keep and _remove(path):
+            removed.append(path)
+            total -= size
+    for path in removed:
+        logging.info(f"Offline workspace removed: {path}")
+    return removed
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:  # still open (another window), kept for the next prune
+        logging.warning(f"Could not remove offline workspace {path}: {e}")
+        return False
+    try:
+        os.remove(path + ".wal")
+    except OSError:
+        pass
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import a CSV into its offline workspace (or list / prune them).")
+    parser.add_argument("csv", nargs="?", help="CSV file to import")
+    parser.add_argument("--memory-limit", type=int, default=DEFAULT_MEMORY_LIMIT_MB, help="DuckDB memory limit (MB)")
+    parser.add_argument("--list", action="store_true", help="list the workspaces")
+    parser.add_argument("--prune", action="store_true", help="delete workspaces above the size budget")
+    args = parser.parse_args(argv)
+
+    if args.csv:
+        started = time.perf_counter()
+        conn, reused = open_csv_workspace(args.csv, args.memory_limit)
+        rows = conn.execute(f"SELECT count(*) FROM {WORKSPACE_TABLE}").fetchone()[0]
+        conn.close()
+        action = "reused" if reused else "imported"
+        print(f"{args.csv}: {rows} rows {action} in {time.perf_counter() - started:.2f} s -> {workspace_path(args.csv)}")
+    if args.prune:
+        print(f"Removed {len(prune_workspaces())} workspace file(s)")
+    if args.list or not (args.csv or args.prune):
+        for path, size, opened in list_workspaces():
+            print(f"{time.strftime('%d/%m/%Y %H:%M', time.localtime(opened))}  {size / 1e6:9.1f} MB  {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main())
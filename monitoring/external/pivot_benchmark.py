@@ -0,0 +1,90 @@
+"""
+Offline loading benchmark: per-variable CASE aggregation vs native PIVOT.
+
+The offline loader used to pivot the samples with one
+max(CASE WHEN variable_name = '...' THEN value END) per tag, which scans every
+sample once per column. recording_store.pivot_sql() uses DuckDB's PIVOT
+instead. This times both on a recording (.duckdb file or Parquet day), checks
+they return the same table, and times pivot_select_sql() as run by the loader.
+
+Usage:
+  python pivot_benchmark.py Data_11022026.duckdb [--repeat 3] [--tags 100]
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+import duckdb
+
+try:
+    from . import recording_store as rs
+except ImportError:  # run as a script
+    import recording_store as rs
+
+
+def case_pivot_sql(conn, var_names, db=None):
+    """The former loader query: one max(CASE WHEN ...) per variable over the long samples."""
+    cols = ", ".join(
+        f"max(CASE WHEN variable_name = {rs.sql_string(v)} THEN value END) AS {rs.quote_identifier(v)}"
+        for v in var_names
+    )
+    return f"SELECT timestamp, {cols} FROM ({rs.long_values_sql(conn, db)}) GROUP BY timestamp ORDER BY timestamp"
+
+
+def native_pivot_sql(conn, var_names, db=None):
+    """The same table with a native PIVOT over the long samples."""
+    keys = list(dict.fromkeys(str(v) for v in var_names))
+    pivot = rs.pivot_sql(rs.long_values_sql(conn, db), "timestamp", "variable_name", [rs.sql_string(k) for k in keys])
+    cols = rs.pivot_columns_sql(var_names, {v: keys.index(str(v)) for v in var_names})
+    return f"SELECT timestamp, {cols} FROM ({pivot}) ORDER BY timestamp"
+
+
+def _time(conn, sql, table, repeat):
+    """Best wall time of materialising sql into `table` over `repeat` runs."""
+    best = None
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        conn.execute(f"CREATE OR REPLACE TEMP TABLE {table} AS {sql}")
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the offline pivot query on a recording.")
+    parser.add_argument("recording", help="Data_DDMMYYYY.duckdb file or Parquet day folder")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per query (best time is shown)")
+    parser.add_argument("--tags", type=int, default=0, help="limit to the first N tags (0 = all)")
+    args = parser.parse_args(argv)
+
+    conn = duckdb.connect(":memory:")
+    rs.attach_recording(conn, args.recording, "rec")
+    var_names = rs.list_variables(conn, "rec")
+    if args.tags > 0:
+        var_names = var_names[:args.tags]
+    if not var_names:
+        print("No variables recorded.")
+        return 1
+    print(f"{args.recording}: {', '.join(rs.detect_schemas(conn, 'rec'))} layout, {len(var_names)} tags")
+
+    case_sec = _time(conn, case_pivot_sql(conn, var_names, "rec"), "case_pivot", args.repeat)
+    pivot_sec = _time(conn, native_pivot_sql(conn, var_names, "rec"), "native_pivot", args.repeat)
+    loader_sec = _time(conn, rs.pivot_select_sql(conn, var_names, "rec"), "loader_pivot", args.repeat)
+    rows = conn.execute("SELECT count(*) FROM native_pivot").fetchone()[0]
+    differing = conn.execute(
+        "SELECT count(*) FROM ((SELECT * FROM case_pivot EXCEPT ALL SELECT * FROM native_pivot) "
+        "UNION ALL (SELECT * FROM native_pivot EXCEPT ALL SELECT * FROM case_pivot))"
+    ).fetchone()[0]
+
+    print(f"CASE aggregation:  {case_sec:7.2f} s")
+    print(f"Native PIVOT:      {pivot_sec:7.2f} s  ({case_sec / pivot_sec:.1f}x)" if pivot_sec else "Native PIVOT: -")
+    print(f"Loader query:      {loader_sec:7.2f} s  (pivot_select_sql, gap filling included)")
+    print(f"{rows} rows, {'identical' if not differing else f'{differing} rows differ'}")
+    return 0 if not differing else 2
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main())
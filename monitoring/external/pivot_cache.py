@@ -0,0 +1,265 @@
+"""
+Persistent pivoted columns of recordings.
+
+Offline graphs pivot the columns they plot (see offline_columns); reopening a
+day recomputed those pivots from the samples every time. The pivoted columns
+of a recording are now kept on disk next to it and reused while the recording
+is unchanged:
+
+  pivot_cache/<recording>/manifest.json    source fingerprint, rows, column files
+  pivot_cache/<recording>/timestamps.npy   datetime64[us], one row per timestamp
+  pivot_cache/<recording>/c<n>.npy         float64 per variable (NaN: no value)
+
+  - a column is pivoted over the whole recording the first time it is asked
+    for (recording_store.pivot_select_sql, gap filling included), then read
+    back from its .npy file. The first pivot also stores the timestamps; later
+    ones take their rows from them instead of reading every sample's timestamp
+    again (compact recordings);
+  - the manifest holds the (size, mtime) fingerprint of the recording (see
+    catalog.fingerprint). A recording that grew since (today's file, still
+    being recorded) keeps its cached rows: only the last TAIL_REFRESH_SEC of
+    them and the new rows are pivoted again, for every cached column (filled
+    values near the end depend on the samples that follow);
+  - any other change (rewritten, stripped by retention, first timestamp moved)
+    drops the cache; retention and compaction remove the cache of the files
+    they delete.
+
+history_columns() reads the columns of several attached recordings (one
+history range) through their caches and concatenates them. A cache that
+cannot be written (read-only folder) is skipped with a warning.
+
+Usage:
+  timestamps, columns = history_columns(conn, [(entry['path'], alias)], ["Pressure"], t_from, t_to)
+  python pivot_cache.py [folder] [--clear]
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import shutil
+import sys
+
+import numpy as np
+
+try:
+    from . import recording_store as rs
+    from . import catalog
+except ImportError:  # run as a script
+    import recording_store as rs
+    import catalog
+
+
+PIVOT_CACHE_DIRNAME = "pivot_cache"
+MANIFEST_FILENAME = "manifest.json"
+TIMESTAMPS_FILENAME = "timestamps.npy"
+PIVOT_CACHE_VERSION = 1
+TAIL_REFRESH_SEC = 300  # rows of a growing recording pivoted again (filled values near the end may change)
+
+
+def cache_dir(path):
+    """Cache folder of a recording file or Parquet day (pivot_cache/ next to the day files)."""
+    key = catalog._key(path).replace("/", "__")
+    return os.path.join(catalog.external_dir_of(path), PIVOT_CACHE_DIRNAME, key)
+
+
+def remove_cache(path):
+    """Delete the cache of a recording (deleted, stripped or replaced)."""
+    folder = cache_dir(path)
+    if os.path.isdir(folder):
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def _float_column(values):
+    return np.ma.filled(np.ma.asarray(values, dtype=np.float64), np.nan)
+
+
+def _pivot(conn, db, var_names, t_from=None, axis=None):
+    """
+    (timestamps, [float64 columns]) of the recording under `db`, from t_from on if given.
+    axis: cached timestamps of the whole recording, the rows of the pivot (not read again).
+    """
+    if axis is None:
+        result = conn.execute(rs.pivot_select_sql(conn, var_names, db, t_from=t_from)).fetchnumpy()
+    else:
+        conn.register("_pivot_axis", {"ts_ms": axis.astype("datetime64[ms]").astype(np.int64)})
+        try:
+            sql = rs.pivot_select_sql(conn, var_names, db, t_from=t_from, axis_sql="SELECT ts_ms FROM _pivot_axis")
+            result = conn.execute(sql).fetchnumpy()
+        finally:
+            conn.unregister("_pivot_axis")
+    values = list(result.values())
+    timestamps = np.asarray(np.ma.filled(values[0], np.datetime64("NaT")), dtype="datetime64[us]")
+    return timestamps, [_float_column(v) for v in values[1:]]
+
+
+class RecordingPivotCache:
+    """Cached pivoted columns of one recording (see module docstring)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.folder = cache_dir(path)
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.folder, MANIFEST_FILENAME), encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return manifest if manifest.get("version") == PIVOT_CACHE_VERSION else None
+
+    def _write(self, manifest, timestamps, columns):
+        """Write changed column files, then the manifest (a reader never sees a manifest ahead of its files)."""
+        os.makedirs(self.folder, exist_ok=True)
+        if timestamps is not None:
+            self._save(TIMESTAMPS_FILENAME, timestamps)
+        for var_name, values in columns.items():
+            self._save(manifest["columns"][var_name], values)
+        target = os.path.join(self.folder, MANIFEST_FILENAME)
+        with open(target + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(target + ".tmp", target)
+
+    def _save(self, filename, values):
+        target = os.path.join(self.folder, filename)
+        with open(target + ".tmp", "wb") as f:
+            np.save(f, values)
+        os.replace(target + ".tmp", target)
+
+    def _load(self, filename):
+        return np.load(os.path.join(self.folder, filename))
+
+    def columns(self, conn, db, var_names):
+        """(timestamps, {var_name: float64 array}) of the whole recording attached under `db`."""
+        wanted = list(dict.fromkeys(var_names))
+        size_bytes, mtime = catalog.fingerprint(self.path)
+        manifest, timestamps, cached = self._open(conn, db, size_bytes, mtime, wanted)
+        missing = [v for v in wanted if v not in cached]
+        if missing:
+            pivot_ts, values = _pivot(conn, db, missing, axis=timestamps)
+            if timestamps is not None and len(pivot_ts) != len(timestamps):
+                # Should not happen (every pivot has the same rows): start over
+                logging.warning(f"Pivot cache of {os.path.basename(self.path)}: row count changed, rebuilt")
+                remove_cache(self.path)
+                return self.columns(conn, db, var_names)
+            new_columns = dict(zip(missing, values))
+            for v in missing:
+                manifest["columns"][v] = f"c{len(manifest['columns'])}.npy"
+            write_timestamps = timestamps is None
+            if write_timestamps:
+                timestamps = pivot_ts
+            manifest.update(size_bytes=size_bytes, mtime=mtime, rows=int(len(timestamps)))
+            try:
+                self._write(manifest, timestamps if write_timestamps else None, new_columns)
+            except OSError as e:
+                logging.warning(f"Pivot cache of {os.path.basename(self.path)} not written: {e}")
+            cached.update(new_columns)
+        return timestamps, {v: cached[v] for v in var_names}
+
+    def _open(self, conn, db, size_bytes, mtime, var_names):
+        """(manifest, timestamps, {var_name: cached column}) up to date with the recording, empty without a usable cache."""
+        manifest = self._read_manifest()
+        if manifest is not None:
+            try:
+                timestamps = self._load(TIMESTAMPS_FILENAME)
+                if (manifest["size_bytes"], manifest["mtime"]) == (size_bytes, mtime):
+                    columns = {v: self._load(manifest["columns"][v]) for v in var_names if v in manifest["columns"]}
+                else:
+                    timestamps, columns = self._refresh_tail(conn, db, manifest, timestamps, size_bytes, mtime)
+                return manifest, timestamps, columns
+            except (OSError, ValueError, KeyError) as e:
+                logging.info(f"Pivot cache of {os.path.basename(self.path)} rebuilt: {e}")
+        remove_cache(self.path)
+        return {"version": PIVOT_CACHE_VERSION, "source": catalog._key(self.path), "columns": {}}, None, {}
+
+    def _refresh_tail(self, conn, db, manifest, timestamps, size_bytes, mtime):
+        """
+        Cached columns of a recording that grew: the rows from TAIL_REFRESH_SEC before the last cached
+        one on are pivoted again (with the new rows) and the files rewritten. Raises ValueError when the
+        recording changed otherwise (the cache is then rebuilt).
+        """
+        first, _ = rs.time_range(conn, db)
+        if (size_bytes < manifest["size_bytes"] or not len(timestamps)
+                or first is None or np.datetime64(first, "us") != timestamps[0]):
+            raise ValueError("recording rewritten")
+        # Restart at a cached timestamp: a range pivot may add a row at its first bound (clipped states)
+        keep = int(np.searchsorted(timestamps, timestamps[-1] - np.timedelta64(TAIL_REFRESH_SEC, "s"), side="left"))
+        names = list(manifest["columns"])
+        tail_ts, tail_values = _pivot(conn, db, names, t_from=timestamps[keep].astype(datetime.datetime))
+        timestamps = np.concatenate([timestamps[:keep], tail_ts])
+        columns = {
+            v: np.concatenate([self._load(manifest["columns"][v])[:keep], tail])
+            for v, tail in zip(names, tail_values)
+        }
+        manifest.update(size_bytes=size_bytes, mtime=mtime, rows=int(len(timestamps)))
+        self._write(manifest, timestamps, columns)
+        logging.info(f"Pivot cache of {os.path.basename(self.path)}: {len(tail_ts)} rows pivoted again or added")
+        return timestamps, columns
+
+
+def history_columns(conn, recordings, var_names, t_from=None, t_to=None):
+    """
+    (timestamps, {var_name: float64 array}) over several attached recordings [(path, alias)], each read
+    through its cache, restricted to [t_from, t_to] and concatenated in time order. Rows repeated in two
+    recordings (same timestamp and values) are kept once. Recordings without samples (rollups only) are skipped.
+    """
+    parts_ts, parts = [], []
+    for path, alias in recordings:
+        if not rs.long_values_sql(conn, alias):
+            continue
+        timestamps, columns = RecordingPivotCache(path).columns(conn, alias, var_names)
+        lo = np.searchsorted(timestamps, np.datetime64(t_from, "us"), side="left") if t_from is not None else 0
+        hi = np.searchsorted(timestamps, np.datetime64(t_to, "us"), side="right") if t_to is not None else len(timestamps)
+        parts_ts.append(timestamps[lo:hi])
+        parts.append({v: columns[v][lo:hi] for v in var_names})
+    if not parts_ts:
+        return np.array([], dtype="datetime64[us]"), {v: np.array([]) for v in var_names}
+    timestamps = np.concatenate(parts_ts)
+    columns = {v: np.concatenate([p[v] for p in parts]) for v in var_names}
+    if len(timestamps) > 1 and (np.diff(timestamps) < np.timedelta64(0, "us")).any():
+        order = np.argsort(timestamps, kind="stable")  # e.g. the undated legacy DB next to day files
+        timestamps = timestamps[order]
+        columns = {v: c[order] for v, c in columns.items()}
+    if len(parts_ts) > 1 and len(timestamps) > 1:
+        # Recordings of one day holding the same rows (a Parquet day next to its .duckdb file): keep one
+        same = timestamps[1:] == timestamps[:-1]
+        for values in columns.values():
+            if not same.any():
+                break
+            same &= (values[1:] == values[:-1]) | (np.isnan(values[1:]) & np.isnan(values[:-1]))
+        if same.any():
+            keep = np.concatenate([[True], ~same])
+            timestamps = timestamps[keep]
+            columns = {v: c[keep] for v, c in columns.items()}
+    return timestamps, columns
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show (or clear) the pivot caches of a recordings folder.")
+    parser.add_argument("folder", nargs="?", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--clear", action="store_true", help="delete every pivot cache of the folder")
+    args = parser.parse_args(argv)
+
+    root = os.path.join(args.folder, PIVOT_CACHE_DIRNAME)
+    if not os.path.isdir(root):
+        print("No pivot caches.")
+        return 0
+    for name in sorted(os.listdir(root)):
+        folder = os.path.join(root, name)
+        size = sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder))
+        try:
+            with open(os.path.join(folder, MANIFEST_FILENAME), encoding="utf-8") as f:
+                manifest = json.load(f)
+            print(f"{name}: {manifest.get('rows', 0):,} rows, {len(manifest.get('columns', {}))} columns, {size / 1e6:.1f} MB")
+        except (OSError, ValueError):
+            print(f"{name}: no manifest, {size / 1e6:.1f} MB")
+    if args.clear:
+        shutil.rmtree(root)
+        print("Cleared.")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main())
@@ -4,14 +4,26 @@ import time
 import datetime
 import logging
 import json
-import duckdb
 import threading
 import os
 
+from .recorder import (
+    DEFAULT_CHECKPOINT_INTERVAL_SEC, DEFAULT_CHECKPOINT_WAL_BYTES, OVERFLOW_BLOCK, RecorderThread,
+    default_db_filename_for_date,
+)
+from .record_modes import RecordSchedule
+from .dose_facts import DOSE_VARIABLE, DoseFactWriter
+from .frame_journal import JOURNAL_DIRNAME, FrameJournal, JournalConverter, decode_frame, frame_layout
+from .recording_store import SCHEMA_NARROW
+
 class PLCThread(threading.Thread):
     def __init__(self, ip_address, signal_emitter, status_emitter=None, comm_speed=0.05,
                  recording_reference="time", recording_interval_sec=0.5, recording_trigger_variable=None,
-                 db_filename=None):
+                 db_filename=None, recording_overflow_policy=OVERFLOW_BLOCK, recording_queue_size=10000,
+                 recording_schema=SCHEMA_NARROW, recording_compaction=None, recording_compression=None,
+                 recording_journal=False, recording_modes=None, recording_states=None,
+                 recording_checkpoint_wal_bytes=DEFAULT_CHECKPOINT_WAL_BYTES,
+                 recording_checkpoint_sec=DEFAULT_CHECKPOINT_INTERVAL_SEC):
         super().__init__()
         self.ip_address = ip_address
         self.signal_emitter = signal_emitter
@@ -19,7 +31,7 @@ class PLCThread(threading.Thread):
         self.comm_speed = comm_speed  # Communication cycle time in seconds
         self.stop_event = threading.Event()
         self.client = snap7.client.Client()
-        self.db_connection = None
+        self.recorder = None  # RecorderThread, created in run()
         self.name_system = 'Snap7'
         self.read_count = 0
         self.error_count = 0
@@ -58,9 +70,26 @@ class PLCThread(threading.Thread):
         self.project_root = os.path.dirname(self.external_dir)
         # Daily DB files: each day gets its own .duckdb file for crash safety and history
         # db_filename: base name without extension, e.g. "Data_09022026". If None, auto-generated.
+        # The file itself is owned by the RecorderThread (inserts, checkpoints, day rollover).
         self._db_filename_base = db_filename  # None = use default Data_DDMMYYYY
-        self._current_db_date = None
-        self.db_path = None  # Set in init_duckdb() to today's file
+        self.recording_overflow_policy = recording_overflow_policy
+        self.recording_queue_size = recording_queue_size
+        # CHECKPOINT when the WAL reaches this size or this long after the last one (recorder thread)
+        self.recording_checkpoint_wal_bytes = recording_checkpoint_wal_bytes
+        self.recording_checkpoint_sec = recording_checkpoint_sec
+        self.recording_schema = recording_schema  # "compact", "narrow" (one row per tag) or "wide" (one row per cycle)
+        self.recording_compaction = recording_compaction  # closed day -> Parquet, then "keep"/"archive"/"delete" .duckdb; None = off
+        self.recording_compression = recording_compression  # {var_name: TagCompression} (deadband / swinging door); None = lossless
+        # Frame journal hot store: read one frame per DB, journal recorded cycles, convert to DuckDB in the background
+        # Per-tag record modes {var_name: TagRecordMode}: every polled cycle goes to the recorder, which keeps what is due
+        self.recording_modes = dict(recording_modes or {})
+        # Tags stored as state intervals (BOOL / Record = state, see state_intervals); None = samples
+        self.recording_states = list(recording_states or [])
+        self.recording_journal = bool(recording_journal)
+        self.journal = None
+        self.journal_converter = None
+        self.frame_layout = None
+        self._recording_stopped = False
         
         # Auto-generate snap7_node_ids.json from DB-named CSVs if available
         try:
@@ -89,70 +118,37 @@ class PLCThread(threading.Thread):
                 self.take_specific_nodes[key] = value
         
         # Add recipe variables from 'recipes' section
+        self.recipe_tags = []
         if 'recipes' in node_config:
             for key, value in node_config['recipes'].items():
                 self.take_specific_nodes[key] = value
+                self.recipe_tags.append(key)
+
+    def recorded_tag_types(self):
+        """PLC type per scalar variable ({name: 'REAL'|'INT'|'BOOL'|...}), used for typed wide columns."""
+        return {
+            name: spec[2] for name, spec in self.take_specific_nodes.items()
+            if isinstance(spec, (list, tuple)) and len(spec) == 3
+        }
 
     @staticmethod
     def default_db_filename_for_date(dt):
         """Return the default base filename for a date, e.g. 'Data_09022026'."""
-        return f"Data_{dt.strftime('%d%m%Y')}"
-
-    def get_db_path_for_date(self, dt):
-        """Get the .duckdb file path for a given date, using custom or default filename."""
-        if self._db_filename_base:
-            fname = self._db_filename_base
-        else:
-            fname = self.default_db_filename_for_date(dt)
-        return os.path.join(self.external_dir, f'{fname}.duckdb')
+        return default_db_filename_for_date(dt)
 
-    def _create_tables(self):
-        """Create recording tables if they don't exist."""
-        self.db_connection.execute('''
-            CREATE TABLE IF NOT EXISTS exchange_variables (
-                timestamp TIMESTAMP,
-                name_system VARCHAR,
-                variable_name VARCHAR,
-                value DOUBLE
-            )
-        ''')
-        self.db_connection.execute('''
-            CREATE TABLE IF NOT EXISTS exchange_recipes (
-                timestamp TIMESTAMP,
-                dose_number INTEGER,
-                pt_chamber_array REAL[],
-                pr_chamber_array REAL[]
-            )
-        ''')
+    @property
+    def db_path(self):
+        """Path of the daily .duckdb file currently written by the recorder (None before start)."""
+        return self.recorder.db_path if self.recorder else None
 
-    def init_duckdb(self):
-        """Open today's daily database file (.duckdb). Each day gets its own file.
-        If the file already exists (e.g. app restarted same day) it appends to it."""
-        today = datetime.date.today()
-        self._current_db_date = today
-        self.db_path = self.get_db_path_for_date(today)
-        self.db_connection = duckdb.connect(database=self.db_path, read_only=False)
-        self._create_tables()  # CREATE TABLE IF NOT EXISTS — safe to call on existing file
-        logging.info(f"DuckDB opened: {self.db_path}")
-
-    def _check_day_rollover(self):
-        """If midnight passed, checkpoint current DB, close it, and open a new daily file."""
-        today = datetime.date.today()
-        if today != self._current_db_date:
-            logging.info(f"Day rollover: closing {self._current_db_date}, opening {today}")
-            if self.db_connection:
-                try:
-                    self.db_connection.execute("CHECKPOINT")
-                    self.db_connection.close()
-                except Exception as e:
-                    logging.warning(f"Error closing DB on day rollover: {e}")
-            self._current_db_date = today
-            # On rollover, generate new default filename for the new day
-            self._db_filename_base = self.default_db_filename_for_date(today)
-            self.db_path = self.get_db_path_for_date(today)
-            self.db_connection = duckdb.connect(database=self.db_path, read_only=False)
-            self._create_tables()
-            logging.info(f"DuckDB day rollover complete: {self.db_path}")
+    def recorder_stats(self):
+        """Queue depth and drop counters of the recording writer, or None when not recording."""
+        if not self.recorder:
+            return None
+        stats = self.recorder.stats()
+        if self.journal_converter:
+            stats["journal"] = self.journal_converter.stats()
+        return stats
 
     def get_size_of_type(self, var_type):
         sizes = {
@@ -190,49 +186,114 @@ class PLCThread(threading.Thread):
             # Return None for any read error - this will be filtered out upstream
             return None
 
+    def _read_frames(self, current_values, trigger_states):
+        """Read every DB of the frame layout in one request each and decode its tags. Returns {db: bytes}."""
+        frames = {}
+        for db_number, spec in self.frame_layout.items():
+            try:
+                frames[db_number] = bytes(self.client.db_read(db_number, spec["start"], spec["size"]))
+            except Exception as e:
+                logging.debug(f"Skipping frame of DB{db_number} due to error: {e}")
+                continue
+            for var_name, value in decode_frame(frames[db_number], spec).items():
+                current_values[var_name] = value
+                self.signal_emitter.emit(var_name, value)
+                if var_name == 'FlexPTS_running':
+                    trigger_states[var_name] = bool(value)
+        return frames
+
     def log_data_to_duckdb(self, data):
-        if self.db_connection:
-            now = datetime.datetime.now()
-            for var_name, value in data.items():
-                # Convert value to double (skip arrays and None values)
-                if value is None:
-                    continue
-                if isinstance(value, (list, tuple)):
-                    continue  # Arrays are logged separately
-                try:
-                    numeric_value = float(value) if not isinstance(value, (int, float)) else value
-                    self.db_connection.execute(
-                        "INSERT INTO exchange_variables VALUES (?, ?, ?, ?)",
-                        (now, self.name_system, var_name, numeric_value)
-                    )
-                except (ValueError, TypeError):
-                    # Skip non-numeric values
-                    continue
+        """Hand one recorded cycle to the recorder queue (non-blocking unless policy is 'block')."""
+        if self.recorder:
+            self.recorder.submit_scalars(datetime.datetime.now(), data)
 
-    def log_array_data_to_duckdb(self, dose_number, pt_chamber_array, pr_chamber_array):
-        if self.db_connection:
+    def log_array_data_to_duckdb(self, dose_number, arrays):
+        """Hand array tags read this cycle ({var_name: [values]}) to the recorder, one record per tag."""
+        if self.recorder:
             now = datetime.datetime.now()
-            self.db_connection.execute(
-                "INSERT INTO exchange_recipes VALUES (?, ?, ?, ?)",
-                (now, dose_number, pt_chamber_array, pr_chamber_array)
-            )
+            for var_name, values in arrays.items():
+                self.recorder.submit_array(now, var_name, dose_number, values)
 
     def _emit_status(self, status_type, message, details=None):
         """Emit status update to UI"""
         if self.status_emitter:
             self.status_emitter.emit(status_type, message, details or {})
 
+    def _record_schedule(self):
+        """RecordSchedule for the per-tag modes (untouched tags follow the recording reference), or None."""
+        if not self.recording_modes:
+            return None
+        return RecordSchedule(
+            self.recording_modes,
+            default_interval_sec=self.recording_interval_sec,
+            trigger_variable=self.recording_trigger_variable,
+        )
+
+    def _dose_fact_writer(self):
+        """DoseFactWriter filling dose_facts at each Dose_number transition, or None without that tag."""
+        if DOSE_VARIABLE not in self.take_specific_nodes:
+            return None
+        return DoseFactWriter(recipe_tags=self.recipe_tags)
+
+    def _start_journal(self):
+        """Open the frame journal and start its converter (replays what a crash left behind)."""
+        scalar_nodes = {n: spec for n, spec in self.take_specific_nodes.items() if len(spec) == 3}
+        self.frame_layout = frame_layout(scalar_nodes)
+        self.journal = FrameJournal(os.path.join(self.external_dir, JOURNAL_DIRNAME), self.frame_layout)
+        self.journal_converter = JournalConverter(self.journal, self.recorder)
+        self.journal_converter.start()
+        logging.info(f"Frame journal enabled: {len(self.frame_layout)} DB frames, "
+                     f"{sum(spec['size'] for spec in self.frame_layout.values())} bytes per cycle")
+
+    def _stop_recording(self):
+        """Convert the rest of the journal, then flush and close the recorder (once, at the end of run())."""
+        converter, self.journal_converter = self.journal_converter, None
+        if converter:
+            converter.stop()
+            self.journal.close()
+        if self.recorder and not self._recording_stopped:
+            self._recording_stopped = True
+            self.recorder.stop()
+
     def run(self):
         self._emit_status("info", "Initializing database...")
-        try:
-            self.init_duckdb()
-            self._emit_status("info", "Database initialized successfully")
-        except Exception as e:
-            error_msg = f"Database initialization failed: {e}"
+        self.recorder = RecorderThread(
+            self.external_dir,
+            db_filename=self._db_filename_base,
+            name_system=self.name_system,
+            max_queue=self.recording_queue_size,
+            checkpoint_interval_sec=self.recording_checkpoint_sec,
+            checkpoint_wal_bytes=self.recording_checkpoint_wal_bytes,
+            # With the journal the converter, not the acquisition loop, waits for the writer
+            overflow_policy=OVERFLOW_BLOCK if self.recording_journal else self.recording_overflow_policy,
+            schema=self.recording_schema,
+            tag_types=self.recorded_tag_types(),
+            compaction_after=self.recording_compaction,
+            compression=self.recording_compression,
+            schedule=self._record_schedule(),
+            dose_facts=self._dose_fact_writer(),
+            state_tags=self.recording_states,
+        )
+        self.recorder.start()
+        if not self.recorder.wait_ready():
+            error_msg = f"Database initialization failed: {self.recorder.init_error or 'timeout'}"
             logging.error(error_msg)
             self._emit_status("error", error_msg)
+            self.recorder.stop()
             return
-        
+        self._emit_status("info", "Database initialized successfully")
+        if self.recording_journal:
+            try:
+                self._start_journal()
+            except Exception as e:
+                logging.error(f"Frame journal could not be opened, recording directly: {e}")
+                self.journal = self.journal_converter = None
+        try:
+            self._acquisition_loop()
+        finally:
+            self._stop_recording()
+
+    def _acquisition_loop(self):
         self._emit_status("info", f"Connecting to PLC at {self.ip_address}...")
         last_logged_dose_number = None
         # Track trigger variable states (persists across loop iterations)
@@ -263,8 +324,9 @@ class PLCThread(threading.Thread):
                     else:
                         scalar_vars.append((var_name, node_info))
                 
-                # Read scalar variables first (faster)
-                for var_name, node_info in scalar_vars:
+                # Read scalar variables first (faster); with the journal, one frame per DB
+                frames = self._read_frames(current_values, trigger_states) if self.journal else {}
+                for var_name, node_info in ([] if self.journal else scalar_vars):
                     try:
                         db_number, byte_offset, var_type = node_info
                         value = self.read_signal(db_number, byte_offset, var_type, var_name)
@@ -353,34 +415,25 @@ class PLCThread(threading.Thread):
                     if should_log:
                         self._last_recording_time = now  # for purge / stats
                 
-                if should_log:
-                    self.log_data_to_duckdb(current_values)
-                    dose_number = current_values.get('Dose_number')
-                    pt_chamber_array = current_values.get('arrPT_chamber') or current_values.get('PT_Chamber_Array')
-                    if pt_chamber_array and dose_number is not None:
-                        pr_chamber_array = current_values.get('arrPR_chamber') or current_values.get('PR_Chamber_Array')
-                        self.log_array_data_to_duckdb(dose_number, pt_chamber_array, pr_chamber_array)
-                
-                # For time-based we also log array when dose_number changes (even if not this interval)
-                if self.recording_reference == "time":
-                    dose_number = current_values.get('Dose_number')
-                    if dose_number != last_logged_dose_number:
-                        pt_chamber_array = current_values.get('arrPT_chamber') or current_values.get('PT_Chamber_Array')
-                        if pt_chamber_array:
-                            pr_chamber_array = current_values.get('arrPR_chamber') or current_values.get('PR_Chamber_Array')
-                            self.log_array_data_to_duckdb(dose_number, pt_chamber_array, pr_chamber_array)
-                        last_logged_dose_number = dose_number
+                if should_log or self.recording_modes:
+                    if self.journal:
+                        self.journal.append_cycle(frames, datetime.datetime.now())
+                    else:
+                        self.log_data_to_duckdb(current_values)
                 
-                # Day rollover check (every ~500 cycles): if midnight passed, open new daily file
-                if self.read_count % 500 == 0:
-                    self._check_day_rollover()
+                # Array tags read this cycle (every array tag, not only the chamber arrays) are recorded
+                # with the recorded cycle; for time-based we also log them when dose_number changes
+                dose_number = current_values.get('Dose_number')
+                log_arrays = should_log
+                if self.recording_reference == "time" and dose_number != last_logged_dose_number:
+                    log_arrays = True
+                    last_logged_dose_number = dose_number
+                if log_arrays:
+                    fresh_arrays = {n: v for n, v in current_values.items() if isinstance(v, list)}
+                    if fresh_arrays:
+                        self.log_array_data_to_duckdb(dose_number, fresh_arrays)
                 
-                # Periodic CHECKPOINT for crash safety (every ~1000 cycles ≈ 50s at 50ms)
-                if self.read_count % 1000 == 0 and self.db_connection:
-                    try:
-                        self.db_connection.execute("CHECKPOINT")
-                    except Exception as e:
-                        logging.debug(f"Checkpoint skipped: {e}")
+                # Day rollover and CHECKPOINT are handled by the recorder thread
                 
                 # Update stats every 100 reads
                 if self.read_count % 100 == 0:
@@ -392,6 +445,9 @@ class PLCThread(threading.Thread):
                         details["last_interval_ms"] = self._last_interval_ms
                     with self._comm_speed_lock:
                         details["requested_interval_ms"] = self.comm_speed * 1000
+                    rec_stats = self.recorder_stats()
+                    if rec_stats:
+                        details["recorder"] = rec_stats
                     self._emit_status("stats", "Communication active", details)
                 
                 # Get current speed value (thread-safe)
@@ -484,10 +540,6 @@ class PLCThread(threading.Thread):
         return pulse_thread_obj
 
     def stop(self):
+        # The acquisition loop ends its cycle, then run() converts the journal, flushes queued
+        # cycles, CHECKPOINTs and closes the daily file (join() to wait for it)
         self.stop_event.set()
-        if self.db_connection:
-            try:
-                self.db_connection.execute("CHECKPOINT")
-                self.db_connection.close()
-            except:
-                pass
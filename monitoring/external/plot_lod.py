@@ -0,0 +1,115 @@
+"""
+Level of detail for offline time plots.
+
+An offline graph keeps the full-resolution columns (see offline_columns) and
+only draws the visible X range at about screen resolution: each pixel column
+gets the min and max sample of the rows it covers, in their original order,
+so spikes stay visible. Once the visible range holds fewer rows than points
+to draw, the rows themselves are drawn (full resolution when zoomed in).
+
+Offline XY plots with many points are drawn as a density image instead: the
+points inside the visible X/Y range are counted per cell of a grid of about
+one cell per DENSITY_CELL_PX screen pixels (density_image), so drawing costs
+the same for ten thousand or ten million points; zooming re-bins.
+"""
+
+import numpy as np
+
+
+POINTS_PER_PIXEL = 2  # min + max of each pixel column
+DENSITY_CELL_PX = 2  # screen pixels per density image cell (each way)
+
+
+def as_float_array(values):
+    """
+    float64 array of a fetched column (fetchnumpy() array, list): NaN for NULL (masked),
+    None and time values. Only text columns fall back to converting element by element.
+    """
+    if not isinstance(values, np.ndarray):
+        try:
+            return np.asarray(values, dtype=np.float64)  # None -> NaN
+        except (TypeError, ValueError):
+            values = np.asarray(values, dtype=object)
+    if values.dtype.kind in "mM":
+        return np.full(len(values), np.nan)
+    if np.ma.isMaskedArray(values):
+        return np.ma.filled(values.astype(np.float64), np.nan)
+    try:
+        return values.astype(np.float64, copy=False)
+    except (TypeError, ValueError):
+        out = np.full(len(values), np.nan)
+        for i, v in enumerate(values):
+            try:
+                out[i] = float(v)
+            except (TypeError, ValueError):
+                pass
+        return out
+
+
+class DatetimeRows:
+    """Read-only sequence of datetimes over a datetime64 array (datetime objects take ~6x the memory)."""
+
+    def __init__(self, values):
+        if np.ma.isMaskedArray(values):
+            values = np.ma.filled(values, np.datetime64("NaT"))
+        self.values = np.asarray(values, dtype="datetime64[us]")
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.values[index].tolist()
+        return self.values[index].item()
+
+    def __iter__(self):
+        return iter(self.values.tolist())
+
+
+def visible_rows(x_min, x_max, n):
+    """(i0, i1) slice of the rows of an index axis shown in [x_min, x_max], one row of margin each side."""
+    i0 = max(0, int(np.floor(x_min)) - 1)
+    i1 = min(n, int(np.ceil(x_max)) + 2)
+    return i0, max(i0, i1)
+
+
+def minmax_decimate(y, max_points, offset=0):
+    """
+    (x, y) to draw for the rows y (x = offset + row): the rows themselves when there are at most
+    max_points, else the min and max row of max_points / 2 equal buckets. NaN rows are gaps.
+    """
+    n = len(y)
+    if n <= max_points:
+        return np.arange(offset, offset + n, dtype=np.float64), y
+    size = -(-n // max(1, max_points // POINTS_PER_PIXEL))
+    buckets = -(-n // size)
+    block = np.full(buckets * size, np.nan)
+    block[:n] = y
+    block = block.reshape(buckets, size)
+    nan = np.isnan(block)
+    lo = np.where(nan, np.inf, block).argmin(axis=1)
+    hi = np.where(nan, -np.inf, block).argmax(axis=1)
+    start = np.arange(buckets) * size
+    rows = np.empty(2 * buckets, dtype=np.int64)
+    rows[0::2] = start + np.minimum(lo, hi)
+    rows[1::2] = start + np.maximum(lo, hi)
+    rows = np.unique(rows[rows < n])
+    return (rows + offset).astype(np.float64), y[rows]
+
+
+def density_image(x, y, x_range, y_range, width, height):
+    """
+    (width, height) int64 counts of the points (x, y) in each cell of the x_range by y_range grid
+    (image[i, j]: i-th cell along X, j-th along Y). Points outside the range or not finite are ignored.
+    """
+    width, height = max(1, int(width)), max(1, int(height))
+    (x0, x1), (y0, y1) = x_range, y_range
+    if not (x1 > x0 and y1 > y0):
+        return np.zeros((width, height), dtype=np.int64)
+    with np.errstate(invalid="ignore"):
+        inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+    ix = ((x[inside] - x0) * (width / (x1 - x0))).astype(np.int64)
+    iy = ((y[inside] - y0) * (height / (y1 - y0))).astype(np.int64)
+    np.minimum(ix, width - 1, out=ix)  # points on the upper edge
+    np.minimum(iy, height - 1, out=iy)
+    return np.bincount(ix * height + iy, minlength=width * height).reshape(width, height)
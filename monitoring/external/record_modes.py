@@ -0,0 +1,178 @@
+"""
+Per-tag recording selection and rates.
+
+By default every tag follows the global recording reference: logged every
+recording_interval_sec ("time") or when the trigger variable changes
+("variable"). The optional Record column of the exchange / recipe CSVs
+overrides it per tag:
+  - off:              not recorded
+  - 10Hz, 100ms, 2s:  own rate (limited by the communication cycle)
+  - change:           recorded when its value changes
+  - edge:             recorded when it switches between zero / non-zero (status bits)
+  - state:            stored as state intervals (the default for BOOL tags, see state_intervals)
+Change and edge tags also store a sample every heartbeat_sec, so readers never
+have to look back further than that.
+
+With per-tag modes, PLCThread hands every polled cycle to the recorder and the
+RecordSchedule picks the due samples of each tag as the batch is written, so all
+rates share one queue and one batch stream. Readers fill the rows in between
+by holding each tag's last value (the modes are stored in the
+recording_compression table, see recording_store.reconstruct_sql()).
+"""
+
+import datetime
+import logging
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+try:
+    from .compression import DEFAULT_MAX_INTERVAL_SEC, create_compression_table
+    from .recording_store import COMPRESSION_TABLE, DEFAULT_FILL_KEY, INTERP_STEP
+except ImportError:  # run as a script
+    from compression import DEFAULT_MAX_INTERVAL_SEC, create_compression_table
+    from recording_store import COMPRESSION_TABLE, DEFAULT_FILL_KEY, INTERP_STEP
+
+
+MODE_OFF = "off"
+MODE_INTERVAL = "interval"
+MODE_CHANGE = "change"
+MODE_EDGE = "edge"
+MODE_STATE = "state"
+
+MIN_INTERVAL_SEC = 0.01
+
+_RATE_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*(hz|ms|s)?$")
+
+
+@dataclass
+class TagRecordMode:
+    """Recording mode of one tag."""
+    mode: str
+    interval_sec: Optional[float] = None  # MODE_INTERVAL only
+
+
+def parse_record_mode(text):
+    """CSV Record column -> TagRecordMode, or None for the global default ('' / 'default')."""
+    value = (text or "").strip().lower()
+    if value in ("", "default"):
+        return None
+    if value in (MODE_OFF, "no", "none"):
+        return TagRecordMode(MODE_OFF)
+    if value in (MODE_CHANGE, "on change"):
+        return TagRecordMode(MODE_CHANGE)
+    if value in (MODE_EDGE, "edges"):
+        return TagRecordMode(MODE_EDGE)
+    if value in (MODE_STATE, "states", "intervals"):
+        return TagRecordMode(MODE_STATE)
+    m = _RATE_PATTERN.match(value)
+    if m:
+        number, unit = float(m.group(1)), m.group(2) or "s"
+        if number > 0:
+            seconds = 1.0 / number if unit == "hz" else number / 1000.0 if unit == "ms" else number
+            return TagRecordMode(MODE_INTERVAL, max(MIN_INTERVAL_SEC, seconds))
+    logging.warning(f"Unknown record mode '{text}', using the global recording settings")
+    return None
+
+
+def tag_modes(variable_metadata):
+    """{ var_name: TagRecordMode } of the scalar tags with a Record setting in the CSV metadata."""
+    modes = {}
+    for var_name, meta in (variable_metadata or {}).items():
+        mode = meta.get("record_mode")
+        if mode is not None and not meta.get("array_size"):
+            modes[var_name] = mode
+    return modes
+
+
+class RecordSchedule:
+    """Selects, cycle by cycle, the samples due under each tag's mode (global default for the others)."""
+
+    def __init__(self, modes, default_interval_sec=0.5, trigger_variable=None, heartbeat_sec=DEFAULT_MAX_INTERVAL_SEC):
+        self.modes = dict(modes or {})
+        self.default_interval_sec = max(MIN_INTERVAL_SEC, float(default_interval_sec))
+        self.trigger_variable = trigger_variable  # default tags follow changes of this variable
+        self.heartbeat_sec = float(heartbeat_sec)
+        self.received = 0
+        self.kept = 0
+        self.reset()
+
+    def __bool__(self):
+        return bool(self.modes)
+
+    def reset(self):
+        self._next_due = {}     # var_name (or None for the default clock) -> timestamp
+        self._last = {}         # var_name -> (timestamp, value) last recorded
+        self._last_trigger = None
+
+    def snapshot(self):
+        """State a batch changes, for restore() when its transaction is rolled back."""
+        return dict(self._next_due), dict(self._last), self._last_trigger, self.received, self.kept
+
+    def restore(self, snapshot):
+        self._next_due, self._last, self._last_trigger, self.received, self.kept = snapshot
+
+    def _interval_due(self, key, ts, interval):
+        next_due = self._next_due.get(key)
+        if next_due is not None and ts < next_due:
+            return False
+        period = datetime.timedelta(seconds=interval)
+        # Keep the phase while on time; restart from this sample after a gap
+        self._next_due[key] = next_due + period if next_due is not None and ts < next_due + period else ts + period
+        return True
+
+    def _value_due(self, var_name, ts, value, edge):
+        last = self._last.get(var_name)
+        if last is None or (ts - last[0]).total_seconds() >= self.heartbeat_sec:
+            return True
+        return bool(value) != bool(last[1]) if edge else value != last[1]
+
+    def filter_cycles(self, cycles):
+        """[(timestamp, {var_name: float})] -> the samples due, in the same form (empty cycles dropped)."""
+        out = []
+        for ts, cycle_values in cycles:
+            if self.trigger_variable is not None:
+                trigger = cycle_values.get(self.trigger_variable)
+                default_due = trigger is not None and trigger != self._last_trigger
+                if trigger is not None:
+                    self._last_trigger = trigger
+            else:
+                default_due = self._interval_due(None, ts, self.default_interval_sec)
+            kept = {}
+            for var_name, value in cycle_values.items():
+                mode = self.modes.get(var_name)
+                if mode is None:
+                    due = default_due
+                elif mode.mode == MODE_OFF:
+                    due = False
+                elif mode.mode == MODE_INTERVAL:
+                    due = self._interval_due(var_name, ts, mode.interval_sec)
+                else:
+                    # change / edge; state tags too (their intervals are written from every cycle)
+                    due = self._value_due(var_name, ts, value, mode.mode == MODE_EDGE)
+                if due:
+                    kept[var_name] = value
+                    self._last[var_name] = (ts, value)
+            self.received += len(cycle_values)
+            self.kept += len(kept)
+            if kept:
+                out.append((ts, kept))
+        return out
+
+    def store_settings(self, conn):
+        """Register the sparse tags in recording_compression (step fill) unless compression already did."""
+        create_compression_table(conn)
+        for var_name, mode in self.modes.items():
+            if mode.mode in (MODE_OFF, MODE_STATE):
+                continue
+            max_interval = max(self.heartbeat_sec, mode.interval_sec or 0.0)
+            conn.execute(
+                f"INSERT OR IGNORE INTO {COMPRESSION_TABLE} VALUES (?, ?, ?, ?, ?)",
+                [var_name, mode.mode, 0.0, INTERP_STEP, max_interval],
+            )
+        if self.modes:
+            # Tags on the default rate have gaps on the rows of faster tags too
+            conn.execute(
+                f"INSERT OR IGNORE INTO {COMPRESSION_TABLE} VALUES (?, 'default', 0.0, ?, ?)",
+                [DEFAULT_FILL_KEY, INTERP_STEP, max(self.heartbeat_sec, self.default_interval_sec)],
+            )
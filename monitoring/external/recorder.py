@@ -0,0 +1,667 @@
+"""
+Background recording writer for the Snap7 acquisition loop.
+
+PLCThread decodes each cycle and hands it to RecorderThread through a bounded
+queue. The recorder owns the DuckDB connection: inserts, CHECKPOINT and the midnight
+day-file rollover all run here, so a slow disk never shows up as a missed PLC
+cycle.
+
+CHECKPOINT is scheduled on the size of the write-ahead log and the time since
+the last one, whichever comes first (checkpoint_wal_bytes /
+checkpoint_interval_sec). When the queue is idle a smaller WAL is checkpointed
+early, so the big ones rarely land in the middle of a burst. DuckDB's own
+automatic checkpoint is pushed above these limits. The duration, WAL size and
+trigger of the last checkpoint are reported in stats().
+
+When the queue is full the overflow policy decides what happens:
+  - "block":       the acquisition loop waits until the writer catches up (no data loss)
+  - "drop_oldest": the oldest queued cycle is discarded to make room (acquisition never waits)
+  - "spill":       the cycle is appended to a JSON-lines spill file; later cycles follow it into
+                   the file until it is replayed, right after the queued (older) cycles, so
+                   everything is written in time order
+
+Scalar cycles are written in the narrow layout (exchange_variables, the default)
+or, opted in, the compact or wide layout; array tags go to exchange_arrays, and
+every tag is registered in the file's recording_tags dictionary, see
+recording_store. 1 s / 1 min / 15 min rollups are maintained
+incrementally as cycles are written, see rollups. At day rollover the closed
+file is handed to a background Parquet compaction job, see compaction.
+
+Tags with a compression setting (deadband / swinging door, see compression)
+only store the samples needed to rebuild their trend; rollups still see every
+sample. Compression applies to the compact and narrow layouts.
+
+With per-tag record modes (see record_modes) the acquisition loop hands over
+every polled cycle and a RecordSchedule keeps the samples due for each tag
+before anything else sees them.
+
+Cycles replayed from the frame journal (see frame_journal) carry their journal
+seq; the highest one written is stored in the journal_position table in the
+same transaction and in the journal's position file right after the commit, so
+a crash never writes a journal cycle twice (not even into the next day's file).
+When a batch holding journal cycles fails, journal_epoch is bumped and journal
+items queued before it are ignored, so the committed seq never skips a cycle.
+
+BOOL and enumerated tags can be stored as state intervals (tag, state, start,
+end) instead of samples, see state_intervals (compact and narrow layouts).
+
+At every Dose_number transition in the received cycles one row is added to the
+dose_facts table for the completed dose, see dose_facts.
+"""
+
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import duckdb
+
+from .recording_store import (
+    PARQUET_DIRNAME, SCHEMA_NARROW, SCHEMA_WIDE, SCHEMAS, ArrayWriter, TagDictionary, list_variables, make_layout,
+    recording_tables,
+)
+from .rollups import RollupAccumulator, available_levels, create_rollup_tables, repair_rollups
+from .compaction import AFTER_ACTIONS, CompactionJob
+from .compression import RecordingCompressor
+from .frame_journal import write_position
+from .state_intervals import StateIntervalWriter
+from . import catalog
+
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_SPILL = "spill"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL)
+
+JOURNAL_POSITION_TABLE = "journal_position"
+
+# Checkpoint scheduling
+DEFAULT_CHECKPOINT_WAL_BYTES = 16 * 1024 * 1024
+DEFAULT_CHECKPOINT_INTERVAL_SEC = 60.0
+CHECKPOINT_IDLE_SEC = 1.0            # queue empty this long: checkpoint a smaller WAL early
+CHECKPOINT_IDLE_FRACTION = 0.25      # ... once it reaches this fraction of checkpoint_wal_bytes
+CHECKPOINT_MIN_SPACING_SEC = 5.0     # never closer than this, except on WAL size
+
+# Queue item kinds
+ITEM_SCALARS = "scalars"
+ITEM_ARRAY = "array"
+
+
+def default_db_filename_for_date(dt):
+    """Return the default base filename for a date, e.g. 'Data_09022026'."""
+    return f"Data_{dt.strftime('%d%m%Y')}"
+
+
+class RecorderThread(threading.Thread):
+    """Writer thread that drains recorded cycles from a bounded queue into the daily .duckdb file."""
+
+    def __init__(self, external_dir, db_filename=None, name_system="Snap7", max_queue=10000,
+                 overflow_policy=OVERFLOW_BLOCK, batch_size=500, checkpoint_interval_sec=DEFAULT_CHECKPOINT_INTERVAL_SEC,
+                 schema=SCHEMA_NARROW, tag_types=None, compaction_after=None, compression=None,
+                 schedule=None, dose_facts=None, state_tags=None, checkpoint_wal_bytes=DEFAULT_CHECKPOINT_WAL_BYTES):
+        super().__init__(daemon=True)
+        self.external_dir = external_dir
+        self.name_system = name_system
+        self.schema = schema if schema in SCHEMAS else SCHEMA_NARROW
+        self.tag_types = dict(tag_types or {})
+        self.tags = None
+        self.layout = None
+        self.array_writer = None
+        self.rollups = RollupAccumulator()
+        # Per-tag lossy compression {var_name: TagCompression}; the wide layout keeps one row per cycle
+        if compression and self.schema == SCHEMA_WIDE:
+            logging.info("Recording compression is not applied to the wide layout")
+            compression = None
+        self.compressor = RecordingCompressor(compression)
+        # Tags stored as state intervals instead of samples (not with the wide layout either)
+        if state_tags and self.schema == SCHEMA_WIDE:
+            logging.info("State intervals are not used with the wide layout")
+            state_tags = None
+        self.states = StateIntervalWriter(state_tags)
+        # Per-tag record modes (RecordSchedule); None = every submitted cycle is recorded
+        self.schedule = schedule or None
+        # One dose_facts row per completed dose (DoseFactWriter); None = off
+        self.dose_facts = dose_facts
+        # Parquet compaction of the closed day at rollover: "keep" / "archive" / "delete" the .duckdb, None = off
+        self.compaction_after = compaction_after if compaction_after in AFTER_ACTIONS else None
+        self.parquet_root = os.path.join(external_dir, PARQUET_DIRNAME)
+        self.compaction_jobs = []
+        self.overflow_policy = overflow_policy if overflow_policy in OVERFLOW_POLICIES else OVERFLOW_BLOCK
+        self.max_queue = max(1, int(max_queue))
+        self.batch_size = max(1, int(batch_size))
+        self.checkpoint_interval_sec = max(1.0, float(checkpoint_interval_sec))
+        self.checkpoint_wal_bytes = max(1024 * 1024, int(checkpoint_wal_bytes))
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._stop_event = threading.Event()
+        self._ready_event = threading.Event()
+        self._spill_lock = threading.Lock()
+        self.spill_path = os.path.join(external_dir, "recording_spill.jsonl")
+        # Spilling: new items go to the spill file until it is replayed (a leftover file is replayed first)
+        self._spilling = self.overflow_policy == OVERFLOW_SPILL and os.path.isfile(self.spill_path)
+
+        # Daily DB files: db_filename is a base name without extension; None = Data_DDMMYYYY
+        self._db_filename_base = db_filename
+        self._current_db_date = None
+        self.db_path = None
+        self.db_connection = None
+        self.init_error = None
+        self.journal_seq = None  # highest frame journal seq committed to the open file (or an earlier one)
+        self.journal_epoch = 0  # bumped when journal cycles are not written; older journal items are ignored
+        self.journal_dir = None  # frame journal folder: its position file is written after every commit
+        self.running_stats = None  # catalog stats of the open file, updated by each committed batch
+
+        # Counters shown in the comm panel (read from other threads, ints only)
+        self.peak_depth = 0
+        self.dropped_count = 0
+        self.spilled_count = 0
+        self.replayed_count = 0
+        self.written_rows = 0
+        self.write_errors = 0
+        self.last_batch_ms = None
+        self.checkpoint_count = 0
+        self.last_checkpoint_ms = None
+        self.max_checkpoint_ms = None
+        self.last_checkpoint_wal_bytes = None
+        self.last_checkpoint_reason = None
+        self.wal_bytes = 0
+        self._last_checkpoint_time = time.monotonic()
+        self._idle_since = None
+
+    # ------------------------------------------------------------------
+    # Paths
+    # ------------------------------------------------------------------
+    def get_db_path_for_date(self, dt):
+        """Get the .duckdb file path for a given date, using custom or default filename."""
+        fname = self._db_filename_base or default_db_filename_for_date(dt)
+        return os.path.join(self.external_dir, f'{fname}.duckdb')
+
+    # ------------------------------------------------------------------
+    # Producer side (called from the acquisition thread)
+    # ------------------------------------------------------------------
+    def submit_scalars(self, timestamp, values, journal_seq=None, journal_epoch=None):
+        """
+        Queue one recorded cycle of scalar values {var_name: value}. Returns False if dropped.
+        Journal cycles carry their seq and the journal_epoch they were read for.
+        """
+        return self._put((ITEM_SCALARS, timestamp, values, journal_seq, journal_epoch))
+
+    def submit_array(self, timestamp, var_name, dose_number, values):
+        """Queue one array tag record (e.g. arrPT_chamber for a dose). Returns False if dropped."""
+        return self._put((ITEM_ARRAY, timestamp, var_name, dose_number, list(values)))
+
+    def _put(self, item):
+        if self._stop_event.is_set():
+            return False
+        if self.overflow_policy == OVERFLOW_BLOCK:
+            # Wait for room, but never deadlock a stopping acquisition loop
+            while not self._stop_event.is_set():
+                try:
+                    self._queue.put(item, timeout=0.2)
+                    break
+                except queue.Full:
+                    continue
+            else:
+                return False
+        elif self.overflow_policy == OVERFLOW_SPILL:
+            with self._spill_lock:
+                if not self._spilling:
+                    try:
+                        self._queue.put_nowait(item)
+                    except queue.Full:
+                        self._spilling = True
+                if self._spilling:
+                    return self._spill(item)
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                # drop_oldest: discard the head of the queue and retry once
+                try:
+                    self._queue.get_nowait()
+                    self.dropped_count += 1
+                except queue.Empty:
+                    pass
+                try:
+                    self._queue.put_nowait(item)
+                except queue.Full:
+                    self.dropped_count += 1
+                    return False
+        depth = self._queue.qsize()
+        if depth > self.peak_depth:
+            self.peak_depth = depth
+        return True
+
+    def _spill(self, item):
+        """Append an item to the spill file (JSON lines, ISO timestamps; _spill_lock held). Returns False if dropped."""
+        kind, ts = item[0], item[1]
+        record = {"kind": kind, "ts": ts.isoformat()}
+        if kind == ITEM_SCALARS:
+            record["values"], record["journal_seq"], record["journal_epoch"] = item[2], item[3], item[4]
+        else:
+            record["name"], record["dose_number"], record["values"] = item[2], item[3], item[4]
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+            self.spilled_count += 1
+            return True
+        except (OSError, TypeError, ValueError) as e:
+            self.dropped_count += 1
+            logging.warning(f"Recording spill failed, cycle dropped: {e}")
+            return False
+
+    def _replay_spill(self):
+        """
+        Write the spilled items once the queue has drained (they are newer than every queued item).
+        Items spilled meanwhile go to a new file, replayed next; the queue is used again once no
+        spill file is left. Returns number of items written.
+        """
+        with self._spill_lock:
+            if not os.path.isfile(self.spill_path):
+                self._spilling = False
+                return 0
+            replay_path = self.spill_path + ".replay"
+            try:
+                os.replace(self.spill_path, replay_path)
+            except OSError as e:
+                logging.warning(f"Could not rotate spill file: {e}")
+                return 0
+        items = []
+        with open(replay_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    ts = datetime.datetime.fromisoformat(rec["ts"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if rec.get("kind") == ITEM_SCALARS:
+                    items.append((ITEM_SCALARS, ts, rec.get("values") or {}, rec.get("journal_seq"),
+                                  rec.get("journal_epoch")))
+                elif rec.get("kind") == ITEM_ARRAY and rec.get("name") and rec.get("values"):
+                    items.append((ITEM_ARRAY, ts, rec["name"], rec.get("dose_number"), rec["values"]))
+        for start in range(0, len(items), self.batch_size):
+            self._write_batch(items[start:start + self.batch_size])
+        os.remove(replay_path)
+        self.replayed_count += len(items)
+        return len(items)
+
+    # ------------------------------------------------------------------
+    # Stats
+    # ------------------------------------------------------------------
+    def stats(self):
+        """Snapshot of queue and writer counters for the comm panel."""
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_max": self.max_queue,
+            "queue_peak": self.peak_depth,
+            "dropped": self.dropped_count,
+            "spilled": self.spilled_count,
+            "written_rows": self.written_rows,
+            "write_errors": self.write_errors,
+            "last_batch_ms": self.last_batch_ms,
+            "overflow_policy": self.overflow_policy,
+            "schema": self.schema,
+            "compression_ratio": self.compressor.ratio(),
+            "scheduled_kept": (self.schedule.kept, self.schedule.received) if self.schedule else None,
+            "doses_written": self.dose_facts.written if self.dose_facts else None,
+            "state_intervals": self.states.written if self.states else None,
+            "wal_bytes": self.wal_bytes,
+            "checkpoints": self.checkpoint_count,
+            "last_checkpoint_ms": self.last_checkpoint_ms,
+            "max_checkpoint_ms": self.max_checkpoint_ms,
+            "last_checkpoint_wal_bytes": self.last_checkpoint_wal_bytes,
+            "last_checkpoint_reason": self.last_checkpoint_reason,
+        }
+
+    # ------------------------------------------------------------------
+    # Writer side
+    # ------------------------------------------------------------------
+    def _create_tables(self):
+        """Create recording tables if they don't exist."""
+        # Fresh dictionary per day file: tag ids are local to each file
+        self.tags = TagDictionary(name_system=self.name_system, tag_types=self.tag_types)
+        self.tags.create_table(self.db_connection)
+        self.layout = make_layout(self.schema, name_system=self.name_system, tag_types=self.tag_types, tags=self.tags)
+        self.layout.create_tables(self.db_connection)
+        self.array_writer = ArrayWriter(self.tags)
+        self.array_writer.create_tables(self.db_connection)
+        create_rollup_tables(self.db_connection)
+        self.rollups.reset()
+        self.compressor.reset()
+        if self.compressor:
+            self.compressor.store_settings(self.db_connection)
+        if self.schedule:
+            self.schedule.reset()
+            self.schedule.store_settings(self.db_connection)
+        if self.dose_facts:
+            self.dose_facts.create_tables(self.db_connection)
+        if self.states:
+            self.states.create_tables(self.db_connection)
+        if JOURNAL_POSITION_TABLE in recording_tables(self.db_connection):
+            seq = self.db_connection.execute(f"SELECT max(seq) FROM {JOURNAL_POSITION_TABLE}").fetchone()[0]
+            if seq is not None:
+                self.journal_seq = max(self.journal_seq or 0, seq)
+
+    def _open_day_file(self, day):
+        self._current_db_date = day
+        self.db_path = self.get_db_path_for_date(day)
+        existed = os.path.isfile(self.db_path)
+        # Entry of a cleanly closed file only: rows left in a .wal (crash) are replayed by connect()
+        clean = existed and not os.path.isfile(self.db_path + ".wal")
+        entry = catalog.get_entry(self.db_path, refresh=False) if clean else None
+        self.db_connection = duckdb.connect(database=self.db_path, read_only=False)
+        # The recorder schedules checkpoints itself; DuckDB's automatic one is only a backstop
+        self.db_connection.execute(f"SET wal_autocheckpoint = '{4 * self.checkpoint_wal_bytes // (1024 * 1024)}MB'")
+        self._last_checkpoint_time = time.monotonic()
+        self._create_tables()  # CREATE TABLE IF NOT EXISTS — safe to call on existing file
+        if existed and entry is None:
+            entry = self._scan_stats()  # stale entry (crash, file written elsewhere): scanned once, WAL replayed
+        self.running_stats = catalog.RunningStats(entry)
+        catalog.set_live(self.db_path, self.running_stats)
+
+    def init_duckdb(self):
+        """Open today's daily database file (.duckdb). Appends if it already exists."""
+        self._open_day_file(datetime.date.today())
+        logging.info(f"DuckDB opened: {self.db_path}")
+
+    def wait_ready(self, timeout=10.0):
+        """Block until the writer has opened its database (or failed). Returns True when usable."""
+        self._ready_event.wait(timeout)
+        return self.db_connection is not None and self.init_error is None
+
+    def _check_day_rollover(self):
+        """If midnight passed, checkpoint current DB, close it, and open a new daily file."""
+        today = datetime.date.today()
+        if today == self._current_db_date:
+            return
+        logging.info(f"Day rollover: closing {self._current_db_date}, opening {today}")
+        closed_path, closed_day = self.db_path, self._current_db_date
+        self._close_connection()
+        if self.compaction_after:
+            job = CompactionJob(closed_path, self.parquet_root, day=closed_day, after=self.compaction_after)
+            job.start()
+            self.compaction_jobs = [j for j in self.compaction_jobs if j.is_alive()] + [job]
+        # On rollover, generate new default filename for the new day
+        self._db_filename_base = default_db_filename_for_date(today)
+        self._open_day_file(today)
+        self._repair_rollups()
+        logging.info(f"DuckDB day rollover complete: {self.db_path}")
+
+    def _repair_rollups(self):
+        """Re-aggregate rollups for raw data written after the last stored bucket (restart, crash, old files)."""
+        try:
+            t0 = time.perf_counter()
+            self.tags.ensure(self.db_connection, list_variables(self.db_connection))
+            rows = repair_rollups(self.db_connection)
+            if rows:
+                logging.info(f"Rollups rebuilt from raw data: {rows} rows in {time.perf_counter() - t0:.1f} s")
+        except Exception as e:
+            logging.warning(f"Rollup repair failed: {e}")
+
+    def _wal_size(self):
+        try:
+            return os.path.getsize(self.db_path + ".wal")
+        except OSError:
+            return 0  # no WAL: everything is checkpointed
+
+    def _checkpoint_reason(self, idle):
+        """'wal' / 'time' / 'idle' when a checkpoint is due, else None."""
+        self.wal_bytes = self._wal_size()
+        elapsed = time.monotonic() - self._last_checkpoint_time
+        if self.wal_bytes >= self.checkpoint_wal_bytes:
+            return "wal"
+        if elapsed < CHECKPOINT_MIN_SPACING_SEC:
+            return None
+        if elapsed >= self.checkpoint_interval_sec and self.wal_bytes:
+            return "time"
+        if idle and self.wal_bytes >= self.checkpoint_wal_bytes * CHECKPOINT_IDLE_FRACTION:
+            return "idle"
+        return None
+
+    def _checkpoint(self, reason="time"):
+        if not self.db_connection:
+            return
+        stats = self._catalog_stats()
+        wal_bytes = self._wal_size()
+        t0 = time.perf_counter()
+        try:
+            self.db_connection.execute("CHECKPOINT")
+        except Exception as e:
+            logging.debug(f"Checkpoint skipped: {e}")
+        else:
+            ms = (time.perf_counter() - t0) * 1000
+            self.checkpoint_count += 1
+            self.last_checkpoint_ms = ms
+            self.max_checkpoint_ms = max(self.max_checkpoint_ms or 0.0, ms)
+            self.last_checkpoint_wal_bytes = wal_bytes
+            self.last_checkpoint_reason = reason
+            self.wal_bytes = self._wal_size()
+            logging.debug(f"Checkpoint ({reason}): {wal_bytes / 1e6:.1f} MB WAL in {ms:.0f} ms")
+            self._update_catalog(stats)
+        self._last_checkpoint_time = time.monotonic()
+
+    def _catalog_stats(self):
+        """Statistics of the open file for the recording catalog, from the committed batches (no scan)."""
+        try:
+            levels = available_levels(self.db_connection)
+        except Exception:
+            levels = None
+        return self.running_stats.stats(levels)
+
+    def _scan_stats(self):
+        """Statistics of the open file computed from its tables, or None if they cannot be computed."""
+        try:
+            return catalog.compute_stats(self.db_connection)
+        except Exception as e:
+            logging.warning(f"Catalog stats skipped: {e}")
+            return None
+
+    def _update_catalog(self, stats):
+        """Store stats taken before the last CHECKPOINT (the file size/mtime must be final)."""
+        if stats is None:
+            return
+        try:
+            catalog.update_entry(self.db_path, stats)
+        except Exception as e:
+            logging.warning(f"Could not update recording catalog: {e}")
+
+    def _close_connection(self):
+        if not self.db_connection:
+            return
+        try:
+            # Samples held back by the compressors close the day's trends
+            self._write_stored_cycles(self.compressor.flush())
+        except Exception as e:
+            logging.warning(f"Could not write compressed tags' last samples: {e}")
+        try:
+            # Open buckets are stored as partial rows; readers merge them
+            self.rollups.flush(self.db_connection, everything=True)
+        except Exception as e:
+            logging.warning(f"Could not flush rollups: {e}")
+        stats = self._catalog_stats()
+        try:
+            self.db_connection.execute("CHECKPOINT")
+            self.db_connection.close()
+        except Exception as e:
+            logging.warning(f"Error closing recording DB: {e}")
+            stats = None
+        self.db_connection = None
+        self._update_catalog(stats)
+        catalog.set_live(self.db_path, None)
+
+    def _write_batch(self, items):
+        """Insert a batch of queued items in one transaction."""
+        if not items or not self.db_connection:
+            return
+        cycles = []
+        array_rows = []
+        journal_seq = None
+        for item in items:
+            if item[0] == ITEM_SCALARS:
+                _, ts, cycle_values, seq, epoch = item
+                if seq is not None:
+                    if epoch != self.journal_epoch:
+                        continue  # queued before a failed batch: the converter sends it again
+                    journal_seq = max(journal_seq or 0, seq)
+                numeric = {}
+                for var_name, value in cycle_values.items():
+                    if value is None or isinstance(value, (list, tuple)):
+                        continue  # Arrays are logged separately
+                    try:
+                        numeric[var_name] = float(value)
+                    except (ValueError, TypeError):
+                        continue  # Skip non-numeric values
+                if numeric:
+                    cycles.append((ts, numeric))
+            else:
+                _, ts, var_name, dose_number, values = item
+                array_rows.append((ts, var_name, dose_number, values))
+        # A failed batch is rolled back: the in-memory state it advanced is put back as well
+        state = self._writer_state()
+        # Dose transitions are taken from every received cycle, before record modes drop samples
+        facts = self.dose_facts.observe(cycles) if self.dose_facts else []
+        received = cycles
+        if self.schedule:
+            cycles = self.schedule.filter_cycles(cycles)
+        t0 = time.perf_counter()
+        try:
+            self.db_connection.execute("BEGIN TRANSACTION")
+            self.tags.ensure(self.db_connection, (n for _, cv in cycles for n in cv))
+            scalar_rows = 0
+            stored = cycles
+            if self.states:
+                # Intervals follow every received change; the state tags' samples are not stored
+                scalar_rows = self.states.write(self.db_connection, received, self.tags)
+                stored = self.states.strip(stored)
+            written = self.compressor.filter_cycles(stored)
+            scalar_rows += self.layout.write_cycles(self.db_connection, written)
+            self.rollups.add_cycles(cycles, self.tags)
+            self.rollups.flush(self.db_connection)
+            self.array_writer.write_arrays(self.db_connection, array_rows)
+            if facts:
+                self.dose_facts.write(self.db_connection, facts)
+            if journal_seq is not None:
+                self._store_journal_seq(journal_seq)
+            self.db_connection.execute("COMMIT")
+        except Exception as e:
+            self.write_errors += 1
+            logging.error(f"Recording batch write failed ({len(items)} items): {e}")
+            try:
+                self.db_connection.execute("ROLLBACK")
+            except Exception:
+                pass
+            self._restore_writer_state(state)
+            if journal_seq is not None:
+                # The committed seq must not pass these cycles: later ones are ignored until the
+                # converter resends everything after it (see frame_journal.JournalConverter)
+                self.journal_epoch += 1
+        else:
+            self.written_rows += scalar_rows + len(array_rows)
+            if journal_seq is not None:
+                self.journal_seq = max(self.journal_seq or 0, journal_seq)
+                self._write_journal_position()
+            self.running_stats.add_cycles(cycles, scalar_rows, [ts for ts, _ in written])
+            if array_rows:
+                self.running_stats.add_arrays(r[1] for r in array_rows)
+        self.last_batch_ms = (time.perf_counter() - t0) * 1000
+
+    def _writer_state(self):
+        """
+        Snapshot of the state a batch advances (each writer's snapshot(): tag ids, layout and array
+        caches, open rollup buckets, compressors, record schedule, dose in progress, open state intervals).
+        """
+        writers = (self.tags, self.layout, self.array_writer, self.rollups, self.compressor,
+                   self.schedule, self.dose_facts, self.states)
+        return [(w, w.snapshot()) for w in writers if w is not None]
+
+    def _restore_writer_state(self, state):
+        """Put back a _writer_state() snapshot (the batch transaction was rolled back)."""
+        for writer, snapshot in state:
+            writer.restore(snapshot)
+
+    def _write_journal_position(self):
+        """
+        Keep the journal's position file at the committed seq. The journal_position table only
+        covers the open day file: after a restart on another day, the file is what stays.
+        """
+        if not self.journal_dir:
+            return
+        try:
+            write_position(self.journal_dir, self.journal_seq)
+        except OSError as e:
+            logging.warning(f"Journal position not written: {e}")
+
+    def _store_journal_seq(self, seq):
+        """Record the last journal seq written (inside the batch transaction)."""
+        self.db_connection.execute(f"CREATE TABLE IF NOT EXISTS {JOURNAL_POSITION_TABLE} (seq BIGINT)")
+        self.db_connection.execute(f"DELETE FROM {JOURNAL_POSITION_TABLE}")
+        self.db_connection.execute(f"INSERT INTO {JOURNAL_POSITION_TABLE} VALUES (?)", [int(seq)])
+
+    def _write_stored_cycles(self, cycles):
+        """Insert cycles that bypass compression and rollups (samples released by the compressors)."""
+        if not cycles:
+            return
+        self.db_connection.execute("BEGIN TRANSACTION")
+        try:
+            rows = self.layout.write_cycles(self.db_connection, cycles)
+            self.db_connection.execute("COMMIT")
+        except Exception:
+            self.db_connection.execute("ROLLBACK")
+            raise
+        self.written_rows += rows
+        self.running_stats.add_cycles((), rows)
+
+    def _drain(self, first_item):
+        batch = [first_item]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        try:
+            self.init_duckdb()
+        except Exception as e:
+            self.init_error = str(e)
+            logging.error(f"Recorder could not open database: {e}")
+            self._ready_event.set()
+            return
+        self._ready_event.set()
+        self._repair_rollups()
+        last_rollover_check = time.monotonic()
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            first = None
+            # The queued cycles are written: the spilled ones come next, before anything newer
+            replayed = self._spilling and self._queue.empty() and self._replay_spill()
+            if not replayed:
+                try:
+                    first = self._queue.get(timeout=0.2)
+                except queue.Empty:
+                    pass
+            if first is not None:
+                self._write_batch(self._drain(first))
+            if first is not None or replayed:
+                self._idle_since = None
+            now = time.monotonic()
+            if now - last_rollover_check >= 5.0:
+                last_rollover_check = now
+                self._check_day_rollover()
+            if first is None and not replayed and self._idle_since is None:
+                self._idle_since = now
+            reason = self._checkpoint_reason(self._idle_since is not None and now - self._idle_since >= CHECKPOINT_IDLE_SEC)
+            if reason:
+                self._checkpoint(reason)
+        while self._spilling and self._replay_spill():
+            pass
+        self._close_connection()
+        logging.info("Recorder stopped")
+
+    def stop(self, timeout=5.0):
+        """Flush queued items, checkpoint and close the database."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout=timeout)
@@ -0,0 +1,935 @@
+"""
+Recording storage layouts for the daily .duckdb files.
+
+Three layouts can be written by the recorder and are read transparently:
+  - narrow:  exchange_variables (timestamp, name_system, variable_name, value) — one row per tag per cycle
+  - wide:    exchange_cycles (timestamp, "<tag>", ...) — one row per recorded cycle, one typed column per tag
+  - compact: samples_<type> (ts_ms BIGINT, tag_id SMALLINT, value <native type>) — one row per tag per
+             cycle, epoch-ms timestamps, tag names and types kept once in the recording_tags dictionary
+
+Every file also carries the recording_tags dictionary (tag_id, variable_name,
+value_type, name_system) so other tables can reference tags by id.
+
+Array tags (e.g. arrPT_chamber, arrFT_Keyence1) go to exchange_arrays, one row
+per recorded array: (timestamp, tag_id, dose_number, segment, length, data BLOB
+of little-endian float32). load_array_matrix() reads N records of one tag back
+into one 2-D NumPy matrix viewing a single joined buffer.
+
+Writers (NarrowLayout / WideLayout / CompactLayout) are used by RecorderThread. Readers only
+need long_values_sql() / pivot_select_sql() and the small helpers below, which
+inspect which tables a file contains. A file may hold both tables (e.g. the
+layout was switched during the day); readers then union them.
+
+`db` arguments are the catalog or schema alias a recording is reachable under
+in the connection (e.g. "rec" after attach_recording()), or None for the main database.
+
+Readers that scan samples accept an optional [t_from, t_to] range, applied to
+the native timestamp column of each table (ts_ms for compact) so DuckDB can
+skip row groups outside it.
+
+The legacy automation_data.db (DatabaseManager) keeps (timestamp,
+variable_name, value) rows in a readings table; readers treat it like the
+narrow table.
+
+A closed day may also be stored as Parquet (see compaction): a date=YYYY-MM-DD
+folder with one file per table. attach_recording() exposes it as views in a
+schema, with the samples under the narrow table name, so every reader works on
+it unchanged.
+
+Tags recorded with lossy compression (see compression) only have the samples
+needed to rebuild their trend; the recording_compression table says how.
+long_values_sql() returns the stored samples, pivot_select_sql() fills the gaps
+of those tags (step: hold the last stored value, linear: interpolate).
+
+BOOL and enumerated tags may be stored as state intervals instead of samples
+(state_intervals: tag_id, state, start_ts, end_ts, see state_intervals).
+Readers turn each interval into a sample at its start (and one at its end when
+no interval follows), clipped to the requested range, and fill the rows in
+between as a step.
+"""
+
+import datetime
+import logging
+import os
+
+import duckdb
+import numpy as np
+
+
+SCHEMA_NARROW = "narrow"
+SCHEMA_WIDE = "wide"
+SCHEMA_COMPACT = "compact"
+SCHEMAS = (SCHEMA_NARROW, SCHEMA_WIDE, SCHEMA_COMPACT)
+
+NARROW_TABLE = "exchange_variables"
+WIDE_TABLE = "exchange_cycles"
+TAGS_TABLE = "recording_tags"
+ARRAYS_TABLE = "exchange_arrays"
+LEGACY_TABLE = "readings"  # automation_data.db
+COMPRESSION_TABLE = "recording_compression"  # (variable_name, mode, deviation, interpolation, max_interval_sec)
+STATE_TABLE = "state_intervals"  # (tag_id, state, start_ts, end_ts)
+ARRAY_VALUE_TYPE = "FLOAT[]"  # recording_tags.value_type of array tags
+ARRAY_DTYPE = np.dtype("<f4")
+
+# Compact layout: one sample table per native value type
+COMPACT_TABLES = {
+    "FLOAT": "samples_float",
+    "SMALLINT": "samples_smallint",
+    "INTEGER": "samples_integer",
+    "BOOLEAN": "samples_bool",
+}
+# PLC type -> compact value type
+COMPACT_VALUE_TYPES = {
+    "REAL": "FLOAT",
+    "LREAL": "FLOAT",
+    "INT": "SMALLINT",
+    "BYTE": "SMALLINT",
+    "DINT": "INTEGER",
+    "WORD": "INTEGER",
+    "DWORD": "INTEGER",
+    "BOOL": "BOOLEAN",
+}
+# FLOAT is read back rounded to float32 precision (7 significant digits), so 26863.92 stays 26863.92
+FLOAT_READ_DIGITS = 7
+# Compact timestamps are epoch milliseconds of the (naive, local) recording time
+COMPACT_TIMESTAMP = "epoch_ms(ts_ms)"
+
+# PLC type -> DuckDB column type for wide layout
+WIDE_COLUMN_TYPES = {
+    "REAL": "DOUBLE",
+    "LREAL": "DOUBLE",
+    "INT": "INTEGER",
+    "DINT": "INTEGER",
+    "WORD": "INTEGER",
+    "DWORD": "BIGINT",
+    "BYTE": "INTEGER",
+    "BOOL": "BOOLEAN",
+}
+
+
+# Reconstruction of compressed tags between stored samples
+INTERP_STEP = "step"
+INTERP_LINEAR = "linear"
+DEFAULT_FILL_KEY = "*"  # recording_compression row applying to every tag without its own row
+
+PARQUET_DIRNAME = "parquet"
+PARQUET_DAY_PREFIX = "date="
+PARQUET_SAMPLES = "samples"  # samples.parquet: (timestamp, variable_name, value) of every scalar tag
+
+
+def quote_identifier(name):
+    """Quote identifier for DuckDB (handles spaces, quotes and special chars)."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def qualified(db, table):
+    """Return table name qualified with the recording alias (if any)."""
+    return f"{db}.{table}" if db else table
+
+
+# ---------------------------------------------------------------------------
+# Writers
+# ---------------------------------------------------------------------------
+class NarrowLayout:
+    """One row per tag per cycle (legacy EAV layout)."""
+    name = SCHEMA_NARROW
+
+    def __init__(self, name_system="Snap7"):
+        self.name_system = name_system
+
+    def create_tables(self, conn):
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {NARROW_TABLE} (
+                timestamp TIMESTAMP,
+                name_system VARCHAR,
+                variable_name VARCHAR,
+                value DOUBLE
+            )
+        ''')
+
+    def snapshot(self):
+        """State a batch changes, for restore() when its transaction is rolled back (none here)."""
+        return None
+
+    def restore(self, snapshot):
+        pass
+
+    def write_cycles(self, conn, cycles):
+        """Insert [(timestamp, {var_name: float})] through a registered NumPy batch. Returns row count."""
+        timestamps, var_names, values = [], [], []
+        for ts, cycle_values in cycles:
+            for var_name, value in cycle_values.items():
+                timestamps.append(ts)
+                var_names.append(var_name)
+                values.append(value)
+        if not values:
+            return 0
+        batch = {
+            "timestamp": np.array(timestamps, dtype="datetime64[us]"),
+            "name_system": np.array([self.name_system] * len(values)),
+            "variable_name": np.array(var_names),
+            "value": np.array(values, dtype=np.float64),
+        }
+        conn.register("_recorder_batch", batch)
+        try:
+            conn.execute(
+                f"INSERT INTO {NARROW_TABLE} SELECT timestamp, name_system, variable_name, value FROM _recorder_batch"
+            )
+        finally:
+            conn.unregister("_recorder_batch")
+        return len(values)
+
+
+class WideLayout:
+    """One row per recorded cycle with one typed column per tag. New tags add columns (ALTER TABLE)."""
+    name = SCHEMA_WIDE
+
+    def __init__(self, tag_types=None):
+        # tag_types: {var_name: PLC type string}, e.g. {"Dose_number": "INT"}
+        self.tag_types = dict(tag_types or {})
+        self._columns = {}  # var_name -> DuckDB type, as present in the table
+
+    def snapshot(self):
+        """State a batch changes, for restore() when its transaction is rolled back."""
+        return dict(self._columns)
+
+    def restore(self, snapshot):
+        self._columns = snapshot
+
+    def _column_type(self, var_name):
+        plc_type = str(self.tag_types.get(var_name, "")).upper()
+        return WIDE_COLUMN_TYPES.get(plc_type, "DOUBLE")
+
+    def create_tables(self, conn):
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {WIDE_TABLE} (timestamp TIMESTAMP)")
+        rows = conn.execute(
+            "SELECT column_name, data_type FROM duckdb_columns() "
+            "WHERE database_name = current_database() AND table_name = ? AND column_name <> 'timestamp'",
+            [WIDE_TABLE],
+        ).fetchall()
+        self._columns = {name: dtype for name, dtype in rows}
+
+    def _ensure_columns(self, conn, var_names):
+        """Schema evolution: add a typed column for every tag not yet in the table."""
+        for var_name in var_names:
+            if var_name in self._columns:
+                continue
+            col_type = self._column_type(var_name)
+            conn.execute(f"ALTER TABLE {WIDE_TABLE} ADD COLUMN {quote_identifier(var_name)} {col_type}")
+            self._columns[var_name] = col_type
+            logging.info(f"Recording: added column {var_name} ({col_type}) to {WIDE_TABLE}")
+
+    def write_cycles(self, conn, cycles):
+        """Insert [(timestamp, {var_name: float})] as one row per cycle. Returns row count."""
+        if not cycles:
+            return 0
+        seen = []
+        for _, cycle_values in cycles:
+            for var_name in cycle_values:
+                if var_name not in self._columns and var_name not in seen:
+                    seen.append(var_name)
+        self._ensure_columns(conn, seen)
+        names = [n for n in self._columns if any(n in cv for _, cv in cycles)]
+        # Missing tags are NaN in the NumPy batch and become NULL on insert
+        batch = {"timestamp": np.array([ts for ts, _ in cycles], dtype="datetime64[us]")}
+        col_keys = {}
+        for i, var_name in enumerate(names):
+            key = f"c{i}"
+            col_keys[var_name] = key
+            batch[key] = np.array([cv.get(var_name, np.nan) for _, cv in cycles], dtype=np.float64)
+        select_cols = ", ".join(
+            f"CASE WHEN isnan({key}) THEN NULL ELSE {key} END::{self._columns[var_name]}"
+            for var_name, key in col_keys.items()
+        )
+        target_cols = ", ".join(quote_identifier(n) for n in names)
+        conn.register("_recorder_batch", batch)
+        try:
+            if names:
+                conn.execute(
+                    f"INSERT INTO {WIDE_TABLE} (timestamp, {target_cols}) SELECT timestamp, {select_cols} FROM _recorder_batch"
+                )
+            else:
+                conn.execute(f"INSERT INTO {WIDE_TABLE} (timestamp) SELECT timestamp FROM _recorder_batch")
+        finally:
+            conn.unregister("_recorder_batch")
+        return len(cycles)
+
+
+class TagDictionary:
+    """SMALLINT id and native value type per tag, stored in recording_tags."""
+
+    def __init__(self, name_system="Snap7", tag_types=None):
+        self.name_system = name_system
+        # tag_types: {var_name: PLC type string}; unknown tags are recorded as FLOAT
+        self.tag_types = dict(tag_types or {})
+        self._tags = {}  # var_name -> (tag_id, value_type)
+
+    def create_table(self, conn):
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {TAGS_TABLE} (
+                tag_id SMALLINT PRIMARY KEY,
+                variable_name VARCHAR UNIQUE,
+                value_type VARCHAR,
+                name_system VARCHAR
+            )
+        ''')
+        self.load(conn)
+
+    def load(self, conn):
+        rows = conn.execute(f"SELECT variable_name, tag_id, value_type FROM {TAGS_TABLE}").fetchall()
+        self._tags = {name: (tag_id, value_type) for name, tag_id, value_type in rows}
+
+    def snapshot(self):
+        """State a batch changes, for restore() when its transaction is rolled back."""
+        return dict(self._tags)
+
+    def restore(self, snapshot):
+        self._tags = snapshot
+
+    def value_type_for(self, var_name):
+        plc_type = str(self.tag_types.get(var_name, "")).upper()
+        return COMPACT_VALUE_TYPES.get(plc_type, "FLOAT")
+
+    def ensure(self, conn, var_names, value_type=None):
+        """
+        Register tags not yet in the dictionary (ids are assigned in order of first appearance).
+        value_type overrides the type derived from the PLC config (e.g. ARRAY_VALUE_TYPE).
+        """
+        new_names = [n for n in dict.fromkeys(var_names) if n not in self._tags]
+        if not new_names:
+            return
+        next_id = max((tag_id for tag_id, _ in self._tags.values()), default=0) + 1
+        for var_name in new_names:
+            tag_type = value_type or self.value_type_for(var_name)
+            conn.execute(
+                f"INSERT INTO {TAGS_TABLE} VALUES (?, ?, ?, ?)",
+                [next_id, var_name, tag_type, self.name_system],
+            )
+            self._tags[var_name] = (next_id, tag_type)
+            next_id += 1
+
+    def tag_id(self, var_name):
+        entry = self._tags.get(var_name)
+        return entry[0] if entry else None
+
+    def value_type(self, var_name):
+        entry = self._tags.get(var_name)
+        return entry[1] if entry else None
+
+
+def create_compact_table(conn, value_type):
+    """Create the compact sample table for a value type (FLOAT, SMALLINT, INTEGER or BOOLEAN)."""
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {COMPACT_TABLES[value_type]} (
+            ts_ms BIGINT,
+            tag_id SMALLINT,
+            value {value_type}
+        )
+    ''')
+
+
+def compact_cast_sql(value_type, expr):
+    """SQL casting a DOUBLE expression to the compact value type."""
+    if value_type == "BOOLEAN":
+        return f"({expr} <> 0)"
+    if value_type in ("SMALLINT", "INTEGER"):
+        return f"round({expr})::{value_type}"
+    return f"{expr}::{value_type}"
+
+
+def _compact_read_sql(value_type, expr):
+    """SQL reading a compact value back as DOUBLE."""
+    if value_type == "FLOAT":
+        return (
+            f"CASE WHEN {expr} = 0 OR NOT isfinite({expr}) THEN {expr}::DOUBLE "
+            f"ELSE round({expr}::DOUBLE, {FLOAT_READ_DIGITS - 1} - floor(log10(abs({expr}::DOUBLE)))::INTEGER) END"
+        )
+    return f"{expr}::DOUBLE"
+
+
+class CompactLayout:
+    """One row per tag per cycle with SMALLINT tag ids, native value types and epoch-ms timestamps."""
+    name = SCHEMA_COMPACT
+
+    def __init__(self, tags):
+        self.tags = tags  # TagDictionary shared with the recorder
+        self._created = set()
+
+    def create_tables(self, conn):
+        self.tags.create_table(conn)
+        tables = recording_tables(conn)
+        self._created = {vt for vt, table in COMPACT_TABLES.items() if table in tables}
+
+    def snapshot(self):
+        """State a batch changes, for restore() when its transaction is rolled back."""
+        return set(self._created)
+
+    def restore(self, snapshot):
+        self._created = snapshot
+
+    def write_cycles(self, conn, cycles):
+        """Insert [(timestamp, {var_name: float})] into the typed sample tables. Returns row count."""
+        self.tags.ensure(conn, (n for _, cv in cycles for n in cv))
+        per_type = {}
+        for ts, cycle_values in cycles:
+            for var_name, value in cycle_values.items():
+                rows = per_type.setdefault(self.tags.value_type(var_name), ([], [], []))
+                rows[0].append(ts)
+                rows[1].append(self.tags.tag_id(var_name))
+                rows[2].append(value)
+        written = 0
+        for value_type, (timestamps, tag_ids, values) in per_type.items():
+            if value_type not in self._created:
+                create_compact_table(conn, value_type)
+                self._created.add(value_type)
+            batch = {
+                "ts_ms": np.array(timestamps, dtype="datetime64[ms]").astype(np.int64),
+                "tag_id": np.array(tag_ids, dtype=np.int16),
+                "value": np.array(values, dtype=np.float64),
+            }
+            conn.register("_recorder_batch", batch)
+            try:
+                conn.execute(
+                    f"INSERT INTO {COMPACT_TABLES[value_type]} "
+                    f"SELECT ts_ms, tag_id, {compact_cast_sql(value_type, 'value')} FROM _recorder_batch"
+                )
+            finally:
+                conn.unregister("_recorder_batch")
+            written += len(values)
+        return written
+
+
+class ArrayWriter:
+    """Writes array records to exchange_arrays; segment numbers the records of one tag within a dose."""
+
+    def __init__(self, tags):
+        self.tags = tags  # TagDictionary shared with the recorder
+        self._segments = {}  # tag_id -> (dose_number, last segment)
+
+    def create_tables(self, conn):
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {ARRAYS_TABLE} (
+                timestamp TIMESTAMP,
+                tag_id SMALLINT,
+                dose_number INTEGER,
+                segment INTEGER,
+                length INTEGER,
+                data BLOB
+            )
+        ''')
+        self._segments = {}
+
+    def snapshot(self):
+        """State a batch changes, for restore() when its transaction is rolled back."""
+        return dict(self._segments)
+
+    def restore(self, snapshot):
+        self._segments = snapshot
+
+    def _next_segment(self, conn, tag_id, dose_number):
+        last = self._segments.get(tag_id)
+        if last is not None and last[0] == dose_number:
+            segment = last[1] + 1
+        else:
+            # First record of this dose since the file was opened: continue after rows already stored
+            row = conn.execute(
+                f"SELECT max(segment) FROM {ARRAYS_TABLE} WHERE tag_id = ? AND dose_number IS NOT DISTINCT FROM ?",
+                [tag_id, dose_number],
+            ).fetchone()
+            segment = 0 if not row or row[0] is None else row[0] + 1
+        self._segments[tag_id] = (dose_number, segment)
+        return segment
+
+    def write_arrays(self, conn, records):
+        """Insert [(timestamp, var_name, dose_number, values)]. Returns row count."""
+        if not records:
+            return 0
+        self.tags.ensure(conn, (r[1] for r in records), value_type=ARRAY_VALUE_TYPE)
+        rows = []
+        for ts, var_name, dose_number, values in records:
+            data = np.asarray(values, dtype=ARRAY_DTYPE)
+            tag_id = self.tags.tag_id(var_name)
+            dose = int(dose_number) if dose_number is not None else None
+            rows.append((ts, tag_id, dose, self._next_segment(conn, tag_id, dose), len(data), data.tobytes()))
+        conn.executemany(f"INSERT INTO {ARRAYS_TABLE} VALUES (?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+
+def make_layout(schema, name_system="Snap7", tag_types=None, tags=None):
+    """Return the writer for a schema name ('narrow', 'wide' or 'compact')."""
+    if schema == SCHEMA_WIDE:
+        return WideLayout(tag_types=tag_types)
+    if schema == SCHEMA_COMPACT:
+        return CompactLayout(tags or TagDictionary(name_system=name_system, tag_types=tag_types))
+    return NarrowLayout(name_system=name_system)
+
+
+# ---------------------------------------------------------------------------
+# Opening recordings (.duckdb files and Parquet days)
+# ---------------------------------------------------------------------------
+def sql_string(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def sql_timestamp(value):
+    """TIMESTAMP literal for a (naive) datetime."""
+    return f"TIMESTAMP '{value.isoformat(sep=' ')}'"
+
+
+def range_where(column, t_from=None, t_to=None, epoch_ms=False):
+    """' WHERE ...' keeping `column` within [t_from, t_to] (either may be None), or ''."""
+    conds = []
+    for op, t in ((">=", t_from), ("<=", t_to)):
+        if t is None:
+            continue
+        bound = f"epoch_ms({sql_timestamp(t)})" if epoch_ms else sql_timestamp(t)
+        conds.append(f"{column} {op} {bound}")
+    return (" WHERE " + " AND ".join(conds)) if conds else ""
+
+
+def is_parquet_day(path):
+    """True for a compacted day folder (parquet/date=YYYY-MM-DD)."""
+    return bool(path) and os.path.isdir(path) and os.path.basename(os.path.normpath(path)).startswith(PARQUET_DAY_PREFIX)
+
+
+def recording_disk_size(path):
+    """Size in bytes of a recording file or Parquet day folder."""
+    if is_parquet_day(path):
+        return sum(
+            os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)
+            if os.path.isfile(os.path.join(path, f))
+        )
+    return os.path.getsize(path)
+
+
+def attach_recording(conn, path, alias="rec"):
+    """Make a .duckdb file (ATTACH READ_ONLY) or a Parquet day (views in schema `alias`) reachable as `alias`."""
+    if not is_parquet_day(path):
+        conn.execute(f"ATTACH {sql_string(path)} AS {alias} (READ_ONLY)")
+        return
+    conn.execute(f"CREATE SCHEMA {alias}")
+    for fname in sorted(os.listdir(path)):
+        if not fname.endswith(".parquet"):
+            continue
+        table = fname[:-len(".parquet")]
+        source = f"read_parquet({sql_string(os.path.join(path, fname))})"
+        if table == PARQUET_SAMPLES:
+            conn.execute(
+                f"CREATE VIEW {alias}.{NARROW_TABLE} AS "
+                f"SELECT timestamp, NULL::VARCHAR AS name_system, variable_name, value FROM {source}"
+            )
+        else:
+            conn.execute(f"CREATE VIEW {alias}.{quote_identifier(table)} AS SELECT * FROM {source}")
+
+
+def detach_recording(conn, alias="rec"):
+    """Undo attach_recording()."""
+    attached = conn.execute(
+        "SELECT count(*) FROM duckdb_databases() WHERE database_name = ?", [alias]
+    ).fetchone()[0]
+    if attached:
+        conn.execute(f"DETACH {alias}")
+    else:
+        conn.execute(f"DROP SCHEMA IF EXISTS {alias} CASCADE")
+
+
+def connect_recording(path):
+    """
+    Open a recording for reading. Returns (conn, db): a read-only connection to a .duckdb file
+    with db=None, or an in-memory connection with a Parquet day attached as db='rec'.
+    """
+    if is_parquet_day(path):
+        conn = duckdb.connect(":memory:")
+        attach_recording(conn, path, "rec")
+        return conn, "rec"
+    return duckdb.connect(database=path, read_only=True), None
+
+
+# ---------------------------------------------------------------------------
+# Readers
+# ---------------------------------------------------------------------------
+def recording_tables(conn, db=None):
+    """Return the set of table/view names of the recording reachable under `db`."""
+    rows = conn.execute(
+        """
+        SELECT table_name FROM duckdb_tables()
+        WHERE database_name = coalesce(?, current_database()) OR schema_name = ?
+        UNION
+        SELECT view_name FROM duckdb_views()
+        WHERE NOT internal AND (database_name = coalesce(?, current_database()) OR schema_name = ?)
+        """,
+        [db, db, db, db],
+    ).fetchall()
+    return {r[0] for r in rows}
+
+
+def _compact_tables(tables):
+    """[(value_type, table)] of the compact sample tables present."""
+    if TAGS_TABLE not in tables:
+        return []
+    return [(vt, table) for vt, table in COMPACT_TABLES.items() if table in tables]
+
+
+def detect_schemas(conn, db=None):
+    """Return the layouts present in a recording, e.g. ['narrow'], ['wide'], ['compact'] or several."""
+    tables = recording_tables(conn, db)
+    found = []
+    if NARROW_TABLE in tables:
+        found.append(SCHEMA_NARROW)
+    if WIDE_TABLE in tables:
+        found.append(SCHEMA_WIDE)
+    if _compact_tables(tables):
+        found.append(SCHEMA_COMPACT)
+    return found
+
+
+def wide_columns(conn, db=None):
+    """Tag columns of the wide table (excluding timestamp), in table order."""
+    rows = conn.execute(
+        """
+        SELECT column_name FROM duckdb_columns()
+        WHERE (database_name = coalesce(?, current_database()) OR schema_name = ?)
+          AND table_name = ? AND column_name <> 'timestamp'
+        ORDER BY column_index
+        """,
+        [db, db, WIDE_TABLE],
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
+def state_samples_sql(db=None, t_from=None, t_to=None):
+    """
+    (timestamp, tag_id, value) step samples of the state intervals overlapping [t_from, t_to]:
+    one at the start of each interval (the range start for the first), one at the end of
+    the last interval of a run (the range end if it goes past it).
+    """
+    table = qualified(db, STATE_TABLE)
+    start = f"greatest(start_ts, {sql_timestamp(t_from)})" if t_from is not None else "start_ts"
+    end = f"least(end_ts, {sql_timestamp(t_to)})" if t_to is not None else "end_ts"
+    conds = []
+    if t_from is not None:
+        conds.append(f"end_ts >= {sql_timestamp(t_from)}")
+    if t_to is not None:
+        conds.append(f"start_ts <= {sql_timestamp(t_to)}")
+    where = (" WHERE " + " AND ".join(conds)) if conds else ""
+    runs = (
+        f"SELECT tag_id, state, start_ts, end_ts, "
+        f"lead(start_ts) OVER (PARTITION BY tag_id ORDER BY start_ts) AS next_start FROM {table}"
+    )
+    return (
+        f"SELECT {start} AS timestamp, tag_id, state AS value FROM {table}{where} "
+        f"UNION ALL SELECT {end} AS timestamp, tag_id, state AS value FROM ({runs}){where or ' WHERE true'} "
+        "AND end_ts > start_ts AND next_start IS DISTINCT FROM end_ts"
+    )
+
+
+def long_values_sql(conn, db=None, t_from=None, t_to=None, states=True):
+    """
+    SQL yielding (timestamp, variable_name, value DOUBLE) for every recorded sample
+    (within [t_from, t_to] if given), whatever the layout. Returns None if the recording
+    has no scalar table. states=False leaves out the state intervals.
+    """
+    parts = []
+    tables = recording_tables(conn, db)
+    where = range_where("timestamp", t_from, t_to)
+    for table in (NARROW_TABLE, LEGACY_TABLE):
+        if table in tables:
+            parts.append(f"SELECT timestamp, variable_name, value FROM {qualified(db, table)}{where}")
+    if WIDE_TABLE in tables and wide_columns(conn, db):
+        parts.append(
+            "SELECT timestamp, variable_name, value FROM ("
+            f"UNPIVOT (SELECT timestamp, COLUMNS(* EXCLUDE (timestamp))::DOUBLE FROM {qualified(db, WIDE_TABLE)}{where}) "
+            "ON COLUMNS(* EXCLUDE (timestamp)) INTO NAME variable_name VALUE value)"
+        )
+    compact_where = range_where("s.ts_ms", t_from, t_to, epoch_ms=True)
+    for value_type, table in _compact_tables(tables):
+        parts.append(
+            f"SELECT {COMPACT_TIMESTAMP} AS timestamp, g.variable_name, {_compact_read_sql(value_type, 's.value')} AS value "
+            f"FROM {qualified(db, table)} s JOIN {qualified(db, TAGS_TABLE)} g USING (tag_id){compact_where}"
+        )
+    if states and STATE_TABLE in tables and TAGS_TABLE in tables:
+        parts.append(
+            f"SELECT s.timestamp, g.variable_name, s.value FROM ({state_samples_sql(db, t_from, t_to)}) s "
+            f"JOIN {qualified(db, TAGS_TABLE)} g USING (tag_id)"
+        )
+    if not parts:
+        return None
+    return " UNION ALL ".join(parts)
+
+
+def list_variables(conn, db=None):
+    """Sorted list of recorded scalar variable names."""
+    names = set()
+    tables = recording_tables(conn, db)
+    for table in (NARROW_TABLE, LEGACY_TABLE):
+        if table in tables:
+            rows = conn.execute(f"SELECT DISTINCT variable_name FROM {qualified(db, table)}").fetchall()
+            names.update(r[0] for r in rows)
+    if WIDE_TABLE in tables:
+        names.update(wide_columns(conn, db))
+    id_tables = [t for _, t in _compact_tables(tables)]
+    if STATE_TABLE in tables and TAGS_TABLE in tables:
+        id_tables.append(STATE_TABLE)
+    if id_tables:
+        ids = " UNION ".join(f"SELECT DISTINCT tag_id FROM {qualified(db, t)}" for t in id_tables)
+        rows = conn.execute(
+            f"SELECT variable_name FROM {qualified(db, TAGS_TABLE)} WHERE tag_id IN ({ids})"
+        ).fetchall()
+        names.update(r[0] for r in rows)
+    return sorted(names)
+
+
+def _timestamp_sources(conn, db=None, t_from=None, t_to=None):
+    """[(table, timestamp expression, WHERE clause for [t_from, t_to])] for every scalar table present."""
+    tables = recording_tables(conn, db)
+    sources = []
+    where = range_where("timestamp", t_from, t_to)
+    for table in (NARROW_TABLE, LEGACY_TABLE, WIDE_TABLE):
+        if table in tables:
+            sources.append((qualified(db, table), "timestamp", where))
+    compact_where = range_where("ts_ms", t_from, t_to, epoch_ms=True)
+    for _, table in _compact_tables(tables):
+        sources.append((qualified(db, table), COMPACT_TIMESTAMP, compact_where))
+    if STATE_TABLE in tables:
+        sources.append((qualified(db, STATE_TABLE), "start_ts", range_where("start_ts", t_from, t_to)))
+    return sources
+
+
+def time_range(conn, db=None, t_from=None, t_to=None):
+    """Return (min_timestamp, max_timestamp) over all layouts, or (None, None) if empty."""
+    sources = _timestamp_sources(conn, db, t_from, t_to)
+    if not sources:
+        return None, None
+    union = " UNION ALL ".join(
+        f"SELECT min({ts}) AS t0, max({ts}) AS t1 FROM {table}{where}" for table, ts, where in sources
+    )
+    row = conn.execute(f"SELECT min(t0), max(t1) FROM ({union})").fetchone()
+    if row and row[0] is not None and row[1] is not None:
+        return row[0], row[1]
+    return None, None
+
+
+def row_count(conn, db=None, t_from=None, t_to=None):
+    """Number of stored rows across layouts (narrow/compact: tag samples, wide: cycles)."""
+    total = 0
+    for table, _, where in _timestamp_sources(conn, db, t_from, t_to):
+        total += conn.execute(f"SELECT count(*) FROM {table}{where}").fetchone()[0]
+    return total
+
+
+def timestamp_count(conn, db=None, t_from=None, t_to=None):
+    """Number of distinct recorded timestamps (rows of the pivoted table)."""
+    sources = _timestamp_sources(conn, db, t_from, t_to)
+    if not sources:
+        return 0
+    union = " UNION ".join(
+        f"SELECT DISTINCT {ts} AS timestamp FROM {table}{where}" for table, ts, where in sources
+    )
+    return conn.execute(f"SELECT count(*) FROM ({union})").fetchone()[0]
+
+
+def interpolation_modes(conn, db=None):
+    """
+    { var_name: 'step' | 'linear' } of the tags recorded with compression, their own record
+    mode or as state intervals, {} if none. A '*' key applies to every other tag.
+    """
+    tables = recording_tables(conn, db)
+    modes = {}
+    if STATE_TABLE in tables and TAGS_TABLE in tables:
+        rows = conn.execute(
+            f"SELECT variable_name FROM {qualified(db, TAGS_TABLE)} "
+            f"WHERE tag_id IN (SELECT DISTINCT tag_id FROM {qualified(db, STATE_TABLE)})"
+        ).fetchall()
+        modes.update((r[0], INTERP_STEP) for r in rows)
+    if COMPRESSION_TABLE in tables:
+        rows = conn.execute(f"SELECT variable_name, interpolation FROM {qualified(db, COMPRESSION_TABLE)}").fetchall()
+        modes.update(rows)
+    return modes
+
+
+def reconstruct_sql(pivot_sql, var_names, modes, where=""):
+    """
+    Wrap a pivot (timestamp + one column per variable) so compressed variables have a value on
+    every row: step holds the last stored value, linear interpolates between the stored samples
+    around the row (and holds the last one after it). `where` filters the filled rows.
+    """
+    modes = {v: modes.get(v, modes.get(DEFAULT_FILL_KEY)) for v in var_names}
+    modes = {v: mode for v, mode in modes.items() if mode}
+    if not modes:
+        return pivot_sql
+    prev_w = "(ORDER BY timestamp ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)"
+    next_w = "(ORDER BY timestamp ROWS BETWEEN CURRENT ROW AND UNBOUNDED FOLLOWING)"
+    helpers, outer = [], []
+    for i, v in enumerate(var_names):
+        col = quote_identifier(v)
+        if v not in modes:
+            outer.append(col)
+            continue
+        helpers.append(f"last_value({col} IGNORE NULLS) OVER {prev_w} AS _pv{i}")
+        if modes[v] != INTERP_LINEAR:
+            outer.append(f"_pv{i} AS {col}")
+            continue
+        stamp = f"CASE WHEN {col} IS NOT NULL THEN epoch_ms(timestamp) END"
+        helpers += [
+            f"last_value({stamp} IGNORE NULLS) OVER {prev_w} AS _pt{i}",
+            f"first_value({col} IGNORE NULLS) OVER {next_w} AS _nv{i}",
+            f"first_value({stamp} IGNORE NULLS) OVER {next_w} AS _nt{i}",
+        ]
+        outer.append(
+            f"coalesce(_pv{i} + (_nv{i} - _pv{i}) * (epoch_ms(timestamp) - _pt{i})::DOUBLE "
+            f"/ nullif(_nt{i} - _pt{i}, 0), _pv{i}) AS {col}"
+        )
+    return (
+        f"SELECT timestamp, {', '.join(outer)} FROM "
+        f"(SELECT *, {', '.join(helpers)} FROM ({pivot_sql})){where} ORDER BY timestamp"
+    )
+
+
+def pivot_select_sql(conn, var_names, db=None, t_from=None, t_to=None, axis_sql=None):
+    """
+    SQL returning one row per timestamp (within [t_from, t_to] if given) with one DOUBLE column
+    per variable, ordered by timestamp.
+    A wide-only recording is read as-is; compact recordings are pivoted on tag ids; narrow
+    (or mixed) recordings are pivoted on variable names. Compressed tags are filled in,
+    see reconstruct_sql().
+    axis_sql (compact recordings): SQL returning the ts_ms of every timestamp of the recording,
+    e.g. a registered copy of the pivot cache's timestamps; a few columns then take their rows
+    from it instead of scanning every sample again.
+    """
+    modes = interpolation_modes(conn, db)
+    if not any(v in modes for v in var_names) and DEFAULT_FILL_KEY not in modes:
+        return _pivot_sql(conn, var_names, db, t_from, t_to, axis_sql)
+    # Compressed tags store a sample at least every max_interval_sec: read that much
+    # around the range so its first and last rows can be filled too (state samples are clipped to it)
+    margin = None
+    if COMPRESSION_TABLE in recording_tables(conn, db):
+        margin = conn.execute(f"SELECT max(max_interval_sec) FROM {qualified(db, COMPRESSION_TABLE)}").fetchone()[0]
+    margin = datetime.timedelta(seconds=margin or 0)
+    pivot_sql = _pivot_sql(
+        conn, var_names, db,
+        t_from - margin if t_from is not None else None, t_to + margin if t_to is not None else None,
+        axis_sql,
+    )
+    return reconstruct_sql(pivot_sql, var_names, modes, range_where("timestamp", t_from, t_to))
+
+
+def _pivot_sql(conn, var_names, db=None, t_from=None, t_to=None, axis_sql=None):
+    schemas = detect_schemas(conn, db)
+    if schemas == [SCHEMA_WIDE]:
+        present = set(wide_columns(conn, db))
+        cols = ", ".join(
+            (f"{quote_identifier(v)}::DOUBLE AS {quote_identifier(v)}" if v in present
+             else f"NULL::DOUBLE AS {quote_identifier(v)}")
+            for v in var_names
+        )
+        where = range_where("timestamp", t_from, t_to)
+        return f"SELECT timestamp, {cols} FROM {qualified(db, WIDE_TABLE)}{where} ORDER BY timestamp"
+    if schemas == [SCHEMA_COMPACT]:
+        tag_ids = dict(conn.execute(f"SELECT variable_name, tag_id FROM {qualified(db, TAGS_TABLE)}").fetchall())
+        where = range_where("ts_ms", t_from, t_to, epoch_ms=True)
+        tables = recording_tables(conn, db)
+        samples = [
+            f"SELECT ts_ms, tag_id, {_compact_read_sql(vt, 'value')} AS value FROM {qualified(db, table)}{where}"
+            for vt, table in _compact_tables(tables)
+        ]
+        if STATE_TABLE in tables:
+            samples.append(f"SELECT epoch_ms(timestamp) AS ts_ms, tag_id, value FROM ({state_samples_sql(db, t_from, t_to)})")
+        samples = " UNION ALL ".join(samples)
+        ids = sorted({int(tag_ids[v]) for v in var_names if v in tag_ids})
+        if len(ids) < len(tag_ids):
+            # A few columns (offline graphs): decode only their samples, keep every timestamp as a row
+            axis = f"SELECT ts_ms FROM ({axis_sql}){where}" if axis_sql else f"SELECT DISTINCT ts_ms FROM ({samples})"
+            samples = (
+                f"SELECT * FROM ({samples}) WHERE tag_id IN ({', '.join(str(i) for i in ids) or 'NULL'}) "
+                f"UNION ALL SELECT ts_ms, NULL, NULL FROM ({axis})"
+            )
+        return (
+            f"SELECT {COMPACT_TIMESTAMP} AS timestamp, "
+            f"{pivot_columns_sql(var_names, {v: ids.index(int(tag_ids[v])) for v in var_names if v in tag_ids})} "
+            f"FROM ({pivot_sql(samples, 'ts_ms', 'tag_id', [str(i) for i in ids])}) ORDER BY ts_ms"
+        )
+    long_sql = long_values_sql(conn, db, t_from, t_to)
+    keys = list(dict.fromkeys(str(v) for v in var_names))
+    return (
+        f"SELECT timestamp, {pivot_columns_sql(var_names, {v: keys.index(str(v)) for v in var_names})} "
+        f"FROM ({pivot_sql(long_sql, 'timestamp', 'variable_name', [sql_string(k) for k in keys])}) ORDER BY timestamp"
+    )
+
+
+def pivot_sql(rows_sql, group_col, key_col, key_literals, value_expr="value"):
+    """
+    Native PIVOT of (group_col, key_col, value) rows: one row per group_col value and one
+    column per key literal, named p0, p1, ... in list order (names differing only in case
+    would share a column otherwise). Replaces one max(CASE WHEN ...) per tag, which scans
+    every row once per column. With no keys, only the group column is returned.
+    """
+    if not key_literals:
+        return f"SELECT DISTINCT {group_col} FROM ({rows_sql})"
+    keys = ", ".join(f"{literal} AS p{i}" for i, literal in enumerate(key_literals))
+    return f"PIVOT ({rows_sql}) ON {key_col} IN ({keys}) USING max({value_expr}) GROUP BY {group_col}"
+
+
+def pivot_columns_sql(var_names, key_index):
+    """Select list naming the pivot_sql() columns after the variables; {var_name: key position}, NULL when absent."""
+    return ", ".join(
+        (f"p{int(key_index[v])}::DOUBLE AS {quote_identifier(v)}" if v in key_index
+         else f"NULL::DOUBLE AS {quote_identifier(v)}")
+        for v in var_names
+    )
+
+
+def list_array_tags(conn, db=None):
+    """Sorted list of array tags recorded in exchange_arrays."""
+    tables = recording_tables(conn, db)
+    if ARRAYS_TABLE not in tables or TAGS_TABLE not in tables:
+        return []
+    rows = conn.execute(
+        f"SELECT variable_name FROM {qualified(db, TAGS_TABLE)} "
+        f"WHERE tag_id IN (SELECT DISTINCT tag_id FROM {qualified(db, ARRAYS_TABLE)}) ORDER BY variable_name"
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
+def load_array_matrix(conn, var_name, db=None, dose_from=None, dose_to=None, limit=None):
+    """
+    Load recorded arrays of one tag as a 2-D float32 matrix (one row per record, ordered by time).
+
+    The BLOB column is fetched as one NumPy object array and the records are joined into a
+    single buffer, viewed as the matrix without a per-record copy (the matrix is read-only;
+    copy it before modifying it in place). Records whose length differs from the most recent
+    one are skipped. Returns (matrix, dose_numbers, timestamps); matrix is None when nothing
+    was recorded.
+    """
+    tables = recording_tables(conn, db)
+    if ARRAYS_TABLE not in tables or TAGS_TABLE not in tables:
+        return None, np.array([], dtype=np.int64), []
+    where = ["g.variable_name = ?"]
+    params = [var_name]
+    if dose_from is not None:
+        where.append("a.dose_number >= ?")
+        params.append(int(dose_from))
+    if dose_to is not None:
+        where.append("a.dose_number <= ?")
+        params.append(int(dose_to))
+    sql = (
+        f"SELECT a.timestamp, coalesce(a.dose_number, -1) AS dose_number, a.length, a.data "
+        f"FROM {qualified(db, ARRAYS_TABLE)} a "
+        f"JOIN {qualified(db, TAGS_TABLE)} g USING (tag_id) WHERE {' AND '.join(where)} "
+        "ORDER BY a.timestamp"
+    )
+    if limit:
+        # Last `limit` records, still returned in time order
+        sql = f"SELECT * FROM ({sql} DESC LIMIT {int(limit)}) ORDER BY timestamp"
+    columns = conn.execute(sql, params).fetchnumpy()
+    lengths = np.asarray(columns["length"])
+    if not len(lengths):
+        return None, np.array([], dtype=np.int64), []
+    length = int(lengths[-1])
+    kept = lengths == length
+    if not kept.all():
+        logging.warning(f"{var_name}: skipped {int((~kept).sum())} array records with length != {length}")
+    blobs = np.asarray(columns["data"], dtype=object)[kept]
+    matrix = np.frombuffer(b"".join(blobs), dtype=ARRAY_DTYPE).reshape(len(blobs), length)
+    dose_numbers = np.asarray(columns["dose_number"])[kept].astype(np.int64)
+    timestamps = np.asarray(columns["timestamp"])[kept].astype("datetime64[us]").tolist()
+    return matrix, dose_numbers, timestamps
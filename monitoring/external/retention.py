@@ -0,0 +1,458 @@
+"""
+Retention and disk quota for recordings.
+
+A RetentionPolicy keeps:
+  - raw data (samples, arrays, 1 s rollups) for raw_days days,
+  - the 1 min / 15 min rollups, tag dictionary, recipes and dose facts for rollup_days days,
+  - everything under quota_bytes (0 = no quota).
+Every limit is 0 (disabled) by default: nothing is removed until a policy is
+set explicitly.
+
+Days past raw_days are "stripped": their rollups are written as a rollups-only
+Parquet day (parquet/date=YYYY-MM-DD/ without samples.parquet), rebuilt from
+the raw samples so old files without rollup tables keep their trends too. A
+day with several recordings (day files of both name formats, a Parquet day
+next to another .duckdb file) gets the rollups of all of them. Then
+the .duckdb file, its archive/ copy and the raw Parquet files are removed. Days
+past rollup_days are deleted. If usage is still above the quota, the oldest
+days are stripped, then deleted, until it fits.
+
+Today's file, the file being recorded and days being compacted are never
+touched, nor is the legacy automation_data.db. Every action is logged and
+appended to retention.log in the recordings folder; the recording catalog is
+updated.
+
+RetentionJob applies the policy in a background thread (shortly after start,
+then every interval and on request) with a single DuckDB thread and a pause
+between days, so recording is never blocked. The HMI only starts it once the
+user has applied a policy.
+
+Usage:
+  python retention.py --raw-days 30 --rollup-days 365 --quota-gb 20 [--dry-run] [folder]
+"""
+
+import argparse
+import datetime
+import logging
+import os
+import shutil
+import sys
+import threading
+from dataclasses import dataclass
+
+import duckdb
+
+try:
+    from . import catalog
+    from . import pivot_cache
+    from . import recording_store as rs
+    from . import rollups
+    from .compaction import ARCHIVE_DIRNAME, compacted_from, day_of_file, parquet_day_dir
+except ImportError:  # run as a script
+    import catalog
+    import pivot_cache
+    import recording_store as rs
+    import rollups
+    from compaction import ARCHIVE_DIRNAME, compacted_from, day_of_file, parquet_day_dir
+
+
+RETENTION_LOG_FILENAME = "retention.log"
+
+# 1 s rollups are almost as large as the raw data: they go with it
+KEPT_ROLLUP_LEVELS = ("1m", "15m")
+KEPT_TABLES = ("exchange_recipes", "dose_facts")
+
+ACTION_STRIP = "strip"
+ACTION_DELETE = "delete"
+
+
+@dataclass
+class RetentionPolicy:
+    """Days are counted from today (yesterday is 1 day old). 0 disables a limit."""
+    raw_days: int = 0
+    rollup_days: int = 0
+    quota_bytes: int = 0
+
+
+def _day_items(external_dir):
+    """{day: {'duckdb': [paths], 'archive': [paths], 'parquet': path or None}} of a recordings folder."""
+    days = {}
+
+    def items(day):
+        return days.setdefault(day, {'duckdb': [], 'archive': [], 'parquet': None})
+
+    for fname in os.listdir(external_dir):
+        day = day_of_file(fname)
+        if day is not None:
+            items(day)['duckdb'].append(os.path.join(external_dir, fname))
+    archive_dir = os.path.join(external_dir, ARCHIVE_DIRNAME)
+    if os.path.isdir(archive_dir):
+        for fname in os.listdir(archive_dir):
+            day = day_of_file(fname)
+            if day is not None:
+                items(day)['archive'].append(os.path.join(archive_dir, fname))
+    parquet_root = os.path.join(external_dir, rs.PARQUET_DIRNAME)
+    if os.path.isdir(parquet_root):
+        for dname in os.listdir(parquet_root):
+            dpath = os.path.join(parquet_root, dname)
+            if not rs.is_parquet_day(dpath):
+                continue
+            try:
+                day = datetime.date.fromisoformat(dname[len(rs.PARQUET_DAY_PREFIX):])
+            except ValueError:
+                continue
+            items(day)['parquet'] = dpath
+    return days
+
+
+def _parquet_has_samples(path):
+    return os.path.isfile(os.path.join(path, f"{rs.PARQUET_SAMPLES}.parquet"))
+
+
+def _has_raw(items):
+    if items['duckdb'] or items['archive']:
+        return True
+    return bool(items['parquet']) and _parquet_has_samples(items['parquet'])
+
+
+def _paths_size(items):
+    total = 0
+    for path in items['duckdb'] + items['archive']:
+        for p in (path, path + ".wal"):
+            if os.path.isfile(p):
+                total += os.path.getsize(p)
+    if items['parquet']:
+        total += rs.recording_disk_size(items['parquet'])
+    return total
+
+
+def storage_usage(external_dir):
+    """
+    Disk usage of the recordings of a folder:
+    { 'total_bytes', 'days', 'raw_days', 'rollup_only_days', 'oldest', 'newest' }.
+    """
+    usage = {'total_bytes': 0, 'days': 0, 'raw_days': 0, 'rollup_only_days': 0, 'oldest': None, 'newest': None}
+    if not external_dir or not os.path.isdir(external_dir):
+        return usage
+    days = _day_items(external_dir)
+    for day, items in days.items():
+        usage['total_bytes'] += _paths_size(items)
+        if _has_raw(items):
+            usage['raw_days'] += 1
+        else:
+            usage['rollup_only_days'] += 1
+    usage['days'] = len(days)
+    if days:
+        usage['oldest'], usage['newest'] = min(days), max(days)
+    return usage
+
+
+def _day_sources(items):
+    """
+    Recordings holding a day's data: the Parquet day and every .duckdb / archive copy of the day,
+    except the file the Parquet day was compacted from (same samples).
+    """
+    parquet = items['parquet']
+    compacted = compacted_from(parquet) if parquet and _parquet_has_samples(parquet) else None
+    sources = [parquet] if parquet else []
+    return sources + [p for p in items['duckdb'] + items['archive'] if os.path.basename(p) != compacted]
+
+
+def _merge_rollups_sql(parts):
+    """One rollup row per (bucket, tag_id) from rollup rows of several recordings (rollup table column order)."""
+    return f"""
+        SELECT bucket, tag_id, min(min) AS min, max(max) AS max, sum(sum) AS sum, sum(count)::INTEGER AS count,
+               arg_min(first, first_ts) AS first, min(first_ts) AS first_ts,
+               arg_max(last, last_ts) AS last, max(last_ts) AS last_ts
+        FROM ({" UNION ALL ".join(parts)})
+        GROUP BY bucket, tag_id
+    """
+
+
+def _write_rollup_day(sources, out_dir):
+    """
+    Write the kept rollup levels (rebuilt from uncompressed raw when present), tags and recipes of a day
+    as Parquet, from every recording of the day (tag ids renumbered when there are several).
+    """
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    conn = duckdb.connect(":memory:")
+    aliases = [f"src{i}" for i in range(len(sources))]
+    try:
+        conn.execute("SET threads = 1")
+        srcs = []
+        for path, alias in zip(sources, aliases):
+            rs.attach_recording(conn, path, alias)
+            srcs.append((alias, rs.recording_tables(conn, alias), rs.long_values_sql(conn, alias)))
+        tag_parts = []
+        for alias, tables, long_sql in srcs:
+            if rs.TAGS_TABLE in tables:
+                tag_parts.append(f"SELECT variable_name, value_type, name_system FROM {alias}.{rs.TAGS_TABLE}")
+            elif long_sql:
+                tag_parts.append(
+                    f"SELECT DISTINCT variable_name, 'FLOAT' AS value_type, NULL::VARCHAR AS name_system FROM ({long_sql})"
+                )
+        if not tag_parts:
+            raise RuntimeError("no tag dictionary and no samples")
+        if len(srcs) == 1 and rs.TAGS_TABLE in srcs[0][1]:
+            conn.execute(f"CREATE TEMP TABLE day_tags AS SELECT * FROM {srcs[0][0]}.{rs.TAGS_TABLE}")
+        else:
+            conn.execute(f"""
+                CREATE TEMP TABLE day_tags AS
+                SELECT (row_number() OVER (ORDER BY variable_name))::SMALLINT AS tag_id, variable_name,
+                       any_value(value_type) AS value_type, any_value(name_system) AS name_system
+                FROM ({" UNION ALL ".join(tag_parts)}) GROUP BY variable_name
+            """)
+        outputs = {rs.TAGS_TABLE: "SELECT * FROM day_tags ORDER BY tag_id"}
+        for level in KEPT_ROLLUP_LEVELS:
+            table = rollups.rollup_table(level)
+            raw_parts, stored_parts = [], []
+            for alias, tables, _ in srcs:
+                raw_sql = rollups.raw_with_tag_ids_sql(conn, alias, tags_table="day_tags")
+                # Rollups of a compressed recording (or one with state intervals) were taken from every
+                # received sample: keep them as stored
+                compressed = rs.COMPRESSION_TABLE in tables or rs.STATE_TABLE in tables
+                if raw_sql and not (compressed and table in tables):
+                    raw_parts.append(raw_sql)
+                elif table in tables and rs.TAGS_TABLE in tables:
+                    stored_parts.append(f"""
+                        SELECT r.bucket, d.tag_id, r.min, r.max, r.sum, r.count, r.first, r.first_ts, r.last, r.last_ts
+                        FROM {alias}.{table} r JOIN {alias}.{rs.TAGS_TABLE} s ON s.tag_id = r.tag_id
+                        JOIN day_tags d ON d.variable_name = s.variable_name
+                    """)
+            # Raw rows of several recordings: UNION drops the samples they share (see history)
+            parts = ([rollups.aggregate_sql(" UNION ".join(raw_parts), level)] if raw_parts else []) + stored_parts
+            if len(parts) == 1:
+                outputs[table] = f"SELECT * FROM ({parts[0]}) ORDER BY tag_id, bucket"
+            elif parts:
+                outputs[table] = f"SELECT * FROM ({_merge_rollups_sql(parts)}) ORDER BY tag_id, bucket"
+        for table in KEPT_TABLES:
+            parts = [f"SELECT * FROM {alias}.{table}" for alias, tables, _ in srcs if table in tables]
+            if parts:
+                outputs[table] = " UNION ALL BY NAME ".join(parts)
+        for table, sql in outputs.items():
+            target = os.path.join(tmp_dir, f"{table}.parquet")
+            conn.execute(f"COPY ({sql}) TO {rs.sql_string(target)} (FORMAT PARQUET, COMPRESSION ZSTD)")
+        for alias in aliases:
+            rs.detach_recording(conn, alias)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    finally:
+        conn.close()
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.replace(tmp_dir, out_dir)
+
+
+def _remove_file(path):
+    for p in (path, path + ".wal"):
+        if os.path.isfile(p):
+            os.remove(p)
+    catalog.remove_entry(path)
+    pivot_cache.remove_cache(path)
+
+
+def strip_day(external_dir, day, items):
+    """Replace a day's raw data by its rollups-only Parquet day. Returns bytes freed."""
+    before = _paths_size(items)
+    out_dir = items['parquet'] or parquet_day_dir(os.path.join(external_dir, rs.PARQUET_DIRNAME), day)
+    sources = _day_sources(items)
+    if len(sources) > 1:
+        logging.info(f"Retention: {day} has {len(sources)} recordings, their rollups are merged")
+    if sources:
+        _write_rollup_day(sources, out_dir)
+    pivot_cache.remove_cache(out_dir)  # no samples left to pivot
+    for path in items['duckdb'] + items['archive']:
+        _remove_file(path)
+    try:
+        catalog.scan_entry(out_dir)
+    except Exception as e:
+        logging.warning(f"Could not update recording catalog: {e}")
+    items.update({'duckdb': [], 'archive': [], 'parquet': out_dir})
+    return before - _paths_size(items)
+
+
+def delete_day(external_dir, day, items):
+    """Remove every file of a day. Returns bytes freed."""
+    freed = _paths_size(items)
+    for path in items['duckdb'] + items['archive']:
+        _remove_file(path)
+    if items['parquet']:
+        shutil.rmtree(items['parquet'])
+        catalog.remove_entry(items['parquet'])
+        pivot_cache.remove_cache(items['parquet'])
+    items.update({'duckdb': [], 'archive': [], 'parquet': None})
+    return freed
+
+
+def plan_retention(external_dir, policy, today=None, protected=()):
+    """[(day, action, reason)] the policy would apply now (quota actions assume earlier ones are done)."""
+    return _run(external_dir, policy, today, protected, dry_run=True)
+
+
+def apply_retention(external_dir, policy, today=None, protected=(), pause=None):
+    """
+    Apply the policy. Returns [(day, action, reason, freed_bytes)].
+    `protected` are paths never touched (e.g. the file being recorded); `pause` is an
+    optional callable run between days (the background job sleeps there).
+    """
+    return _run(external_dir, policy, today, protected, dry_run=False, pause=pause)
+
+
+def _run(external_dir, policy, today, protected, dry_run, pause=None):
+    today = today or datetime.date.today()
+    protected = {os.path.abspath(p) for p in protected if p}
+    days = _day_items(external_dir)
+    parquet_root = os.path.join(external_dir, rs.PARQUET_DIRNAME)
+    sizes = {day: _paths_size(items) for day, items in days.items()}
+    stripped, deleted = set(), set()
+    done = []
+
+    def touchable(day):
+        if day >= today or day in deleted:
+            return False
+        if any(os.path.abspath(p) in protected for p in days[day]['duckdb']):
+            return False
+        return not os.path.isdir(parquet_day_dir(parquet_root, day) + ".tmp")  # compaction running
+
+    def has_raw(day):
+        return day not in stripped and _has_raw(days[day])
+
+    def act(day, action, reason):
+        if dry_run:
+            done.append((day, action, reason))
+        else:
+            if pause and done:
+                pause()
+            freed = (delete_day if action == ACTION_DELETE else strip_day)(external_dir, day, days[day])
+            done.append((day, action, reason, freed))
+            _log_action(external_dir, day, action, reason, freed)
+        if action == ACTION_DELETE:
+            deleted.add(day)
+            sizes[day] = 0
+        else:
+            stripped.add(day)
+            sizes[day] = 0 if dry_run else _paths_size(days[day])  # rollups-only days are small
+
+    for day in sorted(days):
+        if not touchable(day):
+            continue
+        age = (today - day).days
+        if policy.rollup_days and age > policy.rollup_days:
+            act(day, ACTION_DELETE, f"older than {policy.rollup_days} days")
+        elif policy.raw_days and age > policy.raw_days and has_raw(day):
+            act(day, ACTION_STRIP, f"raw data older than {policy.raw_days} days")
+
+    if policy.quota_bytes:
+        reason = f"over disk quota ({policy.quota_bytes / 1e9:.1f} GB)"
+        for action in (ACTION_STRIP, ACTION_DELETE):
+            for day in sorted(days):
+                if sum(sizes.values()) <= policy.quota_bytes:
+                    break
+                if touchable(day) and (action == ACTION_DELETE or has_raw(day)):
+                    act(day, action, reason)
+    return done
+
+
+def _log_action(external_dir, day, action, reason, freed):
+    message = f"Retention: {action} {day.isoformat()} ({reason}), freed {freed / 1e6:.1f} MB"
+    logging.info(message)
+    try:
+        with open(os.path.join(external_dir, RETENTION_LOG_FILENAME), "a", encoding="utf-8") as f:
+            f.write(f"{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} {message}\n")
+    except OSError as e:
+        logging.warning(f"Could not write {RETENTION_LOG_FILENAME}: {e}")
+
+
+class RetentionJob(threading.Thread):
+    """Applies a RetentionPolicy in the background: after start_delay_sec, then every interval_sec."""
+
+    def __init__(self, external_dir, policy=None, interval_sec=3600.0, start_delay_sec=30.0,
+                 pause_sec=0.5, protected=None):
+        super().__init__(daemon=True, name="recording-retention")
+        self.external_dir = external_dir
+        self.policy = policy or RetentionPolicy()
+        self.interval_sec = max(60.0, float(interval_sec))
+        self.start_delay_sec = max(0.0, float(start_delay_sec))
+        self.pause_sec = pause_sec
+        # Callable returning the paths being recorded (never touched)
+        self.protected = protected or (lambda: ())
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self.last_run = None
+        self.last_actions = []
+        self.last_error = None
+        self.usage = None
+
+    def set_policy(self, policy):
+        """Replace the policy and apply it soon."""
+        self.policy = policy
+        self._wake.set()
+
+    def run_now(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+
+    def run(self):
+        _lower_thread_priority()
+        self._wake.wait(self.start_delay_sec)
+        while not self._stop_event.is_set():
+            self._wake.clear()
+            try:
+                actions = apply_retention(
+                    self.external_dir, self.policy, protected=self.protected(),
+                    pause=lambda: self._stop_event.wait(self.pause_sec),
+                )
+                self.last_actions = actions
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logging.error(f"Retention failed: {e}")
+            try:
+                self.usage = storage_usage(self.external_dir)
+            except OSError as e:
+                logging.warning(f"Could not measure recording usage: {e}")
+            self.last_run = datetime.datetime.now()
+            self._wake.wait(self.interval_sec)
+
+
+def _lower_thread_priority():
+    """Best effort: Linux applies nice values per thread."""
+    if sys.platform.startswith("linux") and hasattr(os, "setpriority"):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except OSError:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply the recording retention policy.")
+    parser.add_argument('folder', nargs='?', default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument('--raw-days', type=int, default=RetentionPolicy.raw_days)
+    parser.add_argument('--rollup-days', type=int, default=RetentionPolicy.rollup_days)
+    parser.add_argument('--quota-gb', type=float, default=0.0, help="Disk quota in GB (0 = none)")
+    parser.add_argument('--dry-run', action='store_true', help="Only print what would be done")
+    args = parser.parse_args(argv)
+    policy = RetentionPolicy(args.raw_days, args.rollup_days, int(args.quota_gb * 1e9))
+
+    before = storage_usage(args.folder)
+    if args.dry_run:
+        for day, action, reason in plan_retention(args.folder, policy):
+            print(f"{day}: would {action} ({reason})")
+    else:
+        for day, action, reason, freed in apply_retention(args.folder, policy):
+            print(f"{day}: {action} ({reason}), freed {freed / 1e6:.1f} MB")
+    after = storage_usage(args.folder)
+    print(f"Usage: {before['total_bytes'] / 1e6:.1f} MB -> {after['total_bytes'] / 1e6:.1f} MB, "
+          f"{after['raw_days']} raw days, {after['rollup_only_days']} rollup-only days")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main())
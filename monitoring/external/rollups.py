@@ -0,0 +1,309 @@
+"""
+Time-bucket rollups kept inside every recording file.
+
+The recorder feeds each written cycle into a RollupAccumulator, which keeps
+per-tag (min, max, sum, count, first, last) for the open 1 s, 1 min and 15 min
+buckets in memory. Completed buckets are appended to rollup_1s / rollup_1m /
+rollup_15m on each batch. The open buckets are appended when the file is
+closed (stop, day rollover).
+
+Rows are append-only: a bucket may be stored in several partial rows (e.g. the
+recorder was restarted in the middle of a minute). Readers merge them with
+rollup_sql(), so partial rows never show up as duplicates. When a file is
+opened, repair_rollups() re-aggregates the raw samples after the last stored
+bucket, so a crash loses no rollup data either.
+
+Bucket starts are aligned on the Unix epoch, like the CSV export resampling.
+"""
+
+import numpy as np
+
+try:
+    from . import recording_store as rs
+except ImportError:  # run as a script
+    import recording_store as rs
+
+
+# level name -> bucket size in seconds
+ROLLUP_LEVELS = {"1s": 1, "1m": 60, "15m": 900}
+
+
+def rollup_table(level):
+    return f"rollup_{level}"
+
+
+def create_rollup_tables(conn):
+    for level in ROLLUP_LEVELS:
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {rollup_table(level)} (
+                bucket TIMESTAMP,
+                tag_id SMALLINT,
+                min DOUBLE,
+                max DOUBLE,
+                sum DOUBLE,
+                count INTEGER,
+                first DOUBLE,
+                first_ts TIMESTAMP,
+                last DOUBLE,
+                last_ts TIMESTAMP
+            )
+        ''')
+
+
+class RollupAccumulator:
+    """In-memory open buckets per level: {(bucket_start_us, tag_id): [min, max, sum, count, first, first_ts, last, last_ts]}."""
+
+    def __init__(self):
+        self._open = {level: {} for level in ROLLUP_LEVELS}
+        self._latest_us = None
+
+    def add_cycles(self, cycles, tags):
+        """Accumulate [(timestamp, {var_name: float})]; tags is the recorder's TagDictionary."""
+        for ts, cycle_values in cycles:
+            t_us = int(np.datetime64(ts, "us").astype(np.int64))
+            if self._latest_us is None or t_us > self._latest_us:
+                self._latest_us = t_us
+            for level, size in ROLLUP_LEVELS.items():
+                size_us = size * 1_000_000
+                bucket = t_us - t_us % size_us
+                buckets = self._open[level]
+                for var_name, value in cycle_values.items():
+                    tag_id = tags.tag_id(var_name)
+                    if tag_id is None or value != value:  # unknown tag or NaN
+                        continue
+                    acc = buckets.get((bucket, tag_id))
+                    if acc is None:
+                        buckets[(bucket, tag_id)] = [value, value, value, 1, value, t_us, value, t_us]
+                        continue
+                    if value < acc[0]:
+                        acc[0] = value
+                    if value > acc[1]:
+                        acc[1] = value
+                    acc[2] += value
+                    acc[3] += 1
+                    if t_us < acc[5]:
+                        acc[4], acc[5] = value, t_us
+                    if t_us >= acc[7]:
+                        acc[6], acc[7] = value, t_us
+
+    def flush(self, conn, everything=False):
+        """Append completed buckets (or all open buckets when everything=True). Returns rows written."""
+        written = 0
+        for level, size in ROLLUP_LEVELS.items():
+            buckets = self._open[level]
+            if not buckets:
+                continue
+            if everything or self._latest_us is None:
+                keys = list(buckets)
+            else:
+                current = self._latest_us - self._latest_us % (size * 1_000_000)
+                keys = [k for k in buckets if k[0] < current]
+            if not keys:
+                continue
+            rows = [buckets.pop(k) for k in keys]
+            batch = {
+                "bucket": np.array([k[0] for k in keys], dtype="datetime64[us]"),
+                "tag_id": np.array([k[1] for k in keys], dtype=np.int16),
+                "min": np.array([r[0] for r in rows], dtype=np.float64),
+                "max": np.array([r[1] for r in rows], dtype=np.float64),
+                "sum": np.array([r[2] for r in rows], dtype=np.float64),
+                "count": np.array([r[3] for r in rows], dtype=np.int32),
+                "first": np.array([r[4] for r in rows], dtype=np.float64),
+                "first_ts": np.array([r[5] for r in rows], dtype="datetime64[us]"),
+                "last": np.array([r[6] for r in rows], dtype=np.float64),
+                "last_ts": np.array([r[7] for r in rows], dtype="datetime64[us]"),
+            }
+            conn.register("_rollup_batch", batch)
+            try:
+                conn.execute(f"INSERT INTO {rollup_table(level)} SELECT * FROM _rollup_batch")
+            finally:
+                conn.unregister("_rollup_batch")
+            written += len(rows)
+        return written
+
+    def reset(self):
+        self._open = {level: {} for level in ROLLUP_LEVELS}
+        self._latest_us = None
+
+    def snapshot(self):
+        """Open buckets (accumulators copied), for restore() when the batch transaction is rolled back."""
+        return {level: {k: acc[:] for k, acc in buckets.items()} for level, buckets in self._open.items()}, self._latest_us
+
+    def restore(self, snapshot):
+        self._open, self._latest_us = snapshot
+
+
+def raw_with_tag_ids_sql(conn, db=None, tags_table=None):
+    """
+    (timestamp, tag_id, value) for every raw sample, or None when the file has no scalar data.
+    Tag ids come from the recording's dictionary unless another tags_table is given.
+    """
+    long_sql = rs.long_values_sql(conn, db)
+    if not long_sql:
+        return None
+    return (
+        f"SELECT l.timestamp, g.tag_id, l.value FROM ({long_sql}) l "
+        f"JOIN {tags_table or rs.qualified(db, rs.TAGS_TABLE)} g USING (variable_name) WHERE l.value IS NOT NULL"
+    )
+
+
+def aggregate_sql(raw_sql, level):
+    """SQL aggregating (timestamp, tag_id, value) rows into rollup rows of a level (rollup table column order)."""
+    return f"""
+        SELECT time_bucket(INTERVAL '{ROLLUP_LEVELS[level]} seconds', timestamp, TIMESTAMP '1970-01-01') AS bucket,
+               tag_id, min(value) AS min, max(value) AS max, sum(value) AS sum, count(*)::INTEGER AS count,
+               arg_min(value, timestamp) AS first, min(timestamp) AS first_ts,
+               arg_max(value, timestamp) AS last, max(timestamp) AS last_ts
+        FROM ({raw_sql})
+        GROUP BY bucket, tag_id
+    """
+
+
+def repair_rollups(conn):
+    """
+    Rebuild rollup rows from raw samples after the last stored bucket of each level
+    (all of them when a level is empty). Tags must already be in recording_tags.
+    Returns the number of rollup rows written.
+    """
+    raw_sql = raw_with_tag_ids_sql(conn)
+    if not raw_sql:
+        return 0
+    written = 0
+    for level in ROLLUP_LEVELS:
+        table = rollup_table(level)
+        cutoff = conn.execute(f"SELECT max(bucket) FROM {table}").fetchone()[0]
+        where = ""
+        params = []
+        if cutoff is not None:
+            # The last stored bucket may be partial: drop it and re-aggregate from raw
+            conn.execute(f"DELETE FROM {table} WHERE bucket >= ?", [cutoff])
+            where = "WHERE timestamp >= ?"
+            params = [cutoff]
+        before = conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+        conn.execute(f"INSERT INTO {table} {aggregate_sql(f'SELECT * FROM ({raw_sql}) {where}', level)}", params)
+        written += conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0] - before
+    return written
+
+
+# ---------------------------------------------------------------------------
+# Readers
+# ---------------------------------------------------------------------------
+def available_levels(conn, db=None):
+    """Rollup levels present (and non-empty) in a recording, finest first."""
+    tables = rs.recording_tables(conn, db)
+    if rs.TAGS_TABLE not in tables:
+        return []
+    levels = []
+    for level in ROLLUP_LEVELS:
+        table = rollup_table(level)
+        if table in tables and conn.execute(f"SELECT count(*) FROM {rs.qualified(db, table)}").fetchone()[0]:
+            levels.append(level)
+    return levels
+
+
+def pick_level(conn, span_seconds, max_points, db=None):
+    """Finest available level giving at most max_points buckets over span_seconds, or None."""
+    for level in available_levels(conn, db):
+        if span_seconds / ROLLUP_LEVELS[level] <= max_points:
+            return level
+    return None
+
+
+def _bucket_where(level, column, t_from=None, t_to=None):
+    """' WHERE ...' keeping the buckets that overlap [t_from, t_to], or ''."""
+    conds = []
+    if t_from is not None:
+        conds.append(
+            f"{column} >= time_bucket(INTERVAL '{ROLLUP_LEVELS[level]} seconds', "
+            f"{rs.sql_timestamp(t_from)}, TIMESTAMP '1970-01-01')"
+        )
+    if t_to is not None:
+        conds.append(f"{column} <= {rs.sql_timestamp(t_to)}")
+    return (" WHERE " + " AND ".join(conds)) if conds else ""
+
+
+def _dbs(db):
+    """db may be one alias (or None) or a list of aliases (e.g. consecutive days, see history)."""
+    return list(db) if isinstance(db, (list, tuple)) else [db]
+
+
+def rollup_sql(conn, level, db=None, t_from=None, t_to=None):
+    """
+    SQL yielding merged rollup rows:
+    (bucket, variable_name, min, max, mean, count, first, last) — one row per bucket and tag,
+    restricted to the buckets overlapping [t_from, t_to] if given. With a list of aliases,
+    rows of the same bucket in several recordings (around midnight) are merged too.
+    """
+    rows = " UNION ALL ".join(
+        f"SELECT r.*, g.variable_name FROM {rs.qualified(d, rollup_table(level))} r "
+        f"JOIN {rs.qualified(d, rs.TAGS_TABLE)} g USING (tag_id){_bucket_where(level, 'r.bucket', t_from, t_to)}"
+        for d in _dbs(db)
+    )
+    return f"""
+        SELECT bucket, variable_name,
+               min(min) AS min, max(max) AS max, sum(sum) / sum(count) AS mean,
+               sum(count) AS count, arg_min(first, first_ts) AS first, arg_max(last, last_ts) AS last
+        FROM ({rows})
+        GROUP BY bucket, variable_name
+    """
+
+
+def pivot_rollup_sql(conn, var_names, level, stat="mean", db=None, t_from=None, t_to=None):
+    """SQL returning one row per bucket (as 'timestamp') with one column per variable holding `stat`."""
+    keys = list(dict.fromkeys(str(v) for v in var_names))
+    pivot = rs.pivot_sql(
+        rollup_sql(conn, level, db, t_from, t_to), "bucket", "variable_name", [rs.sql_string(k) for k in keys], stat
+    )
+    return (
+        f"SELECT bucket AS timestamp, {rs.pivot_columns_sql(var_names, {v: keys.index(str(v)) for v in var_names})} "
+        f"FROM ({pivot}) ORDER BY bucket"
+    )
+
+
+def rollup_variables(conn, level, db=None):
+    """Sorted names of the tags with rows in a rollup level."""
+    rows = conn.execute(
+        f"SELECT variable_name FROM {rs.qualified(db, rs.TAGS_TABLE)} "
+        f"WHERE tag_id IN (SELECT DISTINCT tag_id FROM {rs.qualified(db, rollup_table(level))})"
+    ).fetchall()
+    return sorted(r[0] for r in rows)
+
+
+def rollup_time_range(conn, level, db=None, t_from=None, t_to=None):
+    """(first bucket, last bucket) of a level within [t_from, t_to], or (None, None)."""
+    row = conn.execute(
+        f"SELECT min(bucket), max(bucket) FROM {rs.qualified(db, rollup_table(level))}"
+        f"{_bucket_where(level, 'bucket', t_from, t_to)}"
+    ).fetchone()
+    return (row[0], row[1]) if row and row[0] is not None else (None, None)
+
+
+def bucket_count(conn, level, db=None, t_from=None, t_to=None):
+    """Number of distinct buckets stored for a level (overlapping [t_from, t_to] if given)."""
+    buckets = " UNION ".join(
+        f"SELECT DISTINCT bucket FROM {rs.qualified(d, rollup_table(level))}"
+        f"{_bucket_where(level, 'bucket', t_from, t_to)}"
+        for d in _dbs(db)
+    )
+    return conn.execute(f"SELECT count(*) FROM ({buckets})").fetchone()[0]
+
+
+def resample_first_sql(conn, interval_sec, db=None):
+    """
+    Export resampling from rollups: SQL yielding (ts_bucket epoch seconds, variable_name, value = first
+    value in the bucket), with parameters (interval, interval, from, to). None when no stored level
+    divides interval_sec, in which case the caller resamples raw data.
+    """
+    for level in reversed(available_levels(conn, db)):
+        size = ROLLUP_LEVELS[level]
+        if interval_sec >= size and float(interval_sec / size).is_integer():
+            return f"""
+                SELECT (floor(epoch(r.bucket)::DOUBLE / ?) * ?) AS ts_bucket, g.variable_name,
+                       arg_min(r.first, r.first_ts) AS value
+                FROM {rs.qualified(db, rollup_table(level))} r
+                JOIN {rs.qualified(db, rs.TAGS_TABLE)} g USING (tag_id)
+                WHERE r.bucket >= ? AND r.bucket <= ?
+                GROUP BY ts_bucket, g.variable_name
+                ORDER BY ts_bucket, g.variable_name
+            """
+    return None
@@ -0,0 +1,235 @@
+"""
+State-interval encoding of BOOL and enumerated tags.
+
+Sampling a status bit every cycle stores thousands of identical 0/1 rows and
+makes "how long was the machine running" scan all of them. State tags are
+stored as intervals instead, one row per run of the same value:
+
+  state_intervals (tag_id SMALLINT, state DOUBLE, start_ts TIMESTAMP, end_ts TIMESTAMP)
+
+The recorder writes them from every received cycle (before record modes and
+compression): a new row when the value changes, the end_ts of the open row
+moved forward at every batch. A closed interval ends where the next one
+starts; the last one of a file ends at the last cycle received. Intervals
+restart in each day file.
+
+State tags are BOOL tags without a Record setting and tags with Record = state
+in the exchange / recipe CSVs (state_tags()). They apply to the compact and
+narrow layouts. Readers see them as step samples (recording_store.long_values_sql,
+pivot_select_sql), so plots and the offline table are unchanged; the queries
+below answer durations, transitions and time-in-state without touching samples.
+
+Usage:
+  python state_intervals.py [folder] [--from 2026-02-10T00:00] [--to 2026-02-12T00:00] [--tag FlexPTS_running]
+"""
+
+import argparse
+import datetime
+import logging
+import os
+import sys
+
+try:
+    from . import recording_store as rs
+    from .record_modes import MODE_STATE
+except ImportError:  # run as a script
+    import recording_store as rs
+    from record_modes import MODE_STATE
+
+
+STATE_TYPES = ("BOOL",)  # PLC types stored as state intervals by default
+
+
+def state_tags(variable_metadata):
+    """Sorted scalar tags stored as state intervals: BOOL tags without a Record setting, and Record = state."""
+    names = []
+    for var_name, meta in (variable_metadata or {}).items():
+        if meta.get("array_size"):
+            continue
+        mode = meta.get("record_mode")
+        if mode is not None:
+            if mode.mode == MODE_STATE:
+                names.append(var_name)
+        elif str(meta.get("type", "")).upper() in STATE_TYPES:
+            names.append(var_name)
+    return sorted(names)
+
+
+def is_state_tag(meta):
+    """True when a tag's CSV metadata makes it a state tag (drawn as a step trace)."""
+    mode = (meta or {}).get("record_mode")
+    if mode is not None:
+        return mode.mode == MODE_STATE
+    return str((meta or {}).get("type", "")).upper() in STATE_TYPES
+
+
+def create_state_table(conn):
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {rs.STATE_TABLE} (
+            tag_id SMALLINT,
+            state DOUBLE,
+            start_ts TIMESTAMP,
+            end_ts TIMESTAMP
+        )
+    ''')
+
+
+class StateIntervalWriter:
+    """Turns the values of the state tags in received cycles into state_intervals rows."""
+
+    def __init__(self, tags):
+        self.tags = set(tags or ())
+        self.written = 0  # intervals started (for the comm panel)
+        self._open = {}   # var_name -> [var_name, state, start_ts, end_ts, inserted]
+
+    def __bool__(self):
+        return bool(self.tags)
+
+    def create_tables(self, conn):
+        """Create the table of a newly opened day file; intervals restart in it."""
+        create_state_table(conn)
+        self._open = {}
+
+    def snapshot(self):
+        """State a batch changes, for restore() when its transaction is rolled back."""
+        return {name: row[:] for name, row in self._open.items()}, self.written
+
+    def restore(self, snapshot):
+        self._open, self.written = snapshot
+
+    def strip(self, cycles):
+        """Cycles without the state tags (their samples are not stored), empty cycles dropped."""
+        out = []
+        for ts, cycle_values in cycles:
+            kept = {n: v for n, v in cycle_values.items() if n not in self.tags}
+            if kept:
+                out.append((ts, kept))
+        return out
+
+    def write(self, conn, cycles, tag_dictionary):
+        """Extend / close / open intervals for [(timestamp, {var_name: float})] (inside the caller's transaction)."""
+        inserts, updates = [], {}
+        for ts, cycle_values in cycles:
+            for var_name in self.tags.intersection(cycle_values):
+                value = cycle_values[var_name]
+                row = self._open.get(var_name)
+                if row is not None:
+                    row[3] = ts  # extended, or ends where the next state starts
+                    if row[4]:
+                        updates[id(row)] = row
+                    if value == row[1]:
+                        continue
+                row = self._open[var_name] = [var_name, value, ts, ts, False]
+                inserts.append(row)
+        if updates:
+            values = ", ".join("(?, ?, ?)" for _ in updates)
+            conn.execute(
+                f"UPDATE {rs.STATE_TABLE} SET end_ts = u.end_ts FROM (VALUES {values}) u(tag_id, start_ts, end_ts) "
+                f"WHERE {rs.STATE_TABLE}.tag_id = u.tag_id AND {rs.STATE_TABLE}.start_ts = u.start_ts",
+                [v for row in updates.values() for v in (tag_dictionary.tag_id(row[0]), row[2], row[3])],
+            )
+        if inserts:
+            tag_dictionary.ensure(conn, {row[0] for row in inserts})
+            conn.executemany(
+                f"INSERT INTO {rs.STATE_TABLE} VALUES (?, ?, ?, ?)",
+                [[tag_dictionary.tag_id(row[0]), row[1], row[2], row[3]] for row in inserts],
+            )
+            for row in inserts:
+                row[4] = True
+            self.written += len(inserts)
+        return len(inserts)
+
+
+# ---------------------------------------------------------------------------
+# Readers
+# ---------------------------------------------------------------------------
+def has_state_intervals(conn, db=None):
+    tables = rs.recording_tables(conn, db)
+    return rs.STATE_TABLE in tables and rs.TAGS_TABLE in tables
+
+
+def state_variables(conn, db=None):
+    """Sorted tags stored as state intervals in the recording."""
+    if not has_state_intervals(conn, db):
+        return []
+    rows = conn.execute(
+        f"SELECT variable_name FROM {rs.qualified(db, rs.TAGS_TABLE)} "
+        f"WHERE tag_id IN (SELECT DISTINCT tag_id FROM {rs.qualified(db, rs.STATE_TABLE)}) ORDER BY variable_name"
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
+def intervals_sql(conn, db=None, var_names=None, t_from=None, t_to=None):
+    """
+    SQL yielding (variable_name, state, start_ts, end_ts, duration_sec) of the intervals overlapping
+    [t_from, t_to], clipped to it, or None when the recording has none.
+    """
+    if not has_state_intervals(conn, db):
+        return None
+    start = f"greatest(s.start_ts, {rs.sql_timestamp(t_from)})" if t_from is not None else "s.start_ts"
+    end = f"least(s.end_ts, {rs.sql_timestamp(t_to)})" if t_to is not None else "s.end_ts"
+    conds = []
+    if t_from is not None:
+        conds.append(f"s.end_ts >= {rs.sql_timestamp(t_from)}")
+    if t_to is not None:
+        conds.append(f"s.start_ts <= {rs.sql_timestamp(t_to)}")
+    if var_names is not None:
+        conds.append("g.variable_name IN (" + (", ".join(rs.sql_string(v) for v in var_names) or "NULL") + ")")
+    where = (" WHERE " + " AND ".join(conds)) if conds else ""
+    return (
+        f"SELECT variable_name, state, start_ts, end_ts, "
+        f"epoch(end_ts - start_ts) AS duration_sec FROM ("
+        f"SELECT g.variable_name, s.state, {start} AS start_ts, {end} AS end_ts "
+        f"FROM {rs.qualified(db, rs.STATE_TABLE)} s JOIN {rs.qualified(db, rs.TAGS_TABLE)} g USING (tag_id){where})"
+    )
+
+
+def time_in_state_sql(intervals):
+    """Per day (of the interval start), tag and state: (day, variable_name, state, intervals, seconds)."""
+    return (
+        f"SELECT start_ts::DATE AS day, variable_name, state, count(*) AS intervals, sum(duration_sec) AS seconds "
+        f"FROM ({intervals}) GROUP BY ALL ORDER BY day, variable_name, state"
+    )
+
+
+def transitions_sql(intervals):
+    """Per day and tag: (day, variable_name, transitions), a transition being an interval starting where another ended."""
+    return (
+        "SELECT start_ts::DATE AS day, variable_name, count(*) FILTER (WHERE prev_end = start_ts) AS transitions "
+        "FROM (SELECT *, lag(end_ts) OVER (PARTITION BY variable_name ORDER BY start_ts) AS prev_end "
+        f"FROM ({intervals})) GROUP BY ALL ORDER BY day, variable_name"
+    )
+
+
+def main(argv=None):
+    try:
+        from .history import attach_history, find_recordings, select_recordings
+    except ImportError:
+        from history import attach_history, find_recordings, select_recordings
+    import duckdb
+
+    parser = argparse.ArgumentParser(description="Time in state and transitions of the state tags of recordings.")
+    parser.add_argument("folder", nargs="?", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--from", dest="t_from", type=datetime.datetime.fromisoformat)
+    parser.add_argument("--to", dest="t_to", type=datetime.datetime.fromisoformat)
+    parser.add_argument("--tag", action="append", help="limit to a tag (repeatable)")
+    args = parser.parse_args(argv)
+
+    conn = duckdb.connect(":memory:")
+    aliases = attach_history(conn, select_recordings(find_recordings(args.folder), args.t_from, args.t_to))
+    parts = [intervals_sql(conn, alias, args.tag, args.t_from, args.t_to) for alias in aliases]
+    parts = [p for p in parts if p]
+    if not parts:
+        print("No state intervals found.")
+        return 1
+    intervals = " UNION ALL ".join(f"({p})" for p in parts)
+    for day, name, state, count, seconds in conn.execute(time_in_state_sql(intervals)).fetchall():
+        print(f"{day}  {name} = {state:g}: {count} intervals, {datetime.timedelta(seconds=round(seconds or 0))}")
+    for day, name, transitions in conn.execute(transitions_sql(intervals)).fetchall():
+        print(f"{day}  {name}: {transitions} transitions")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    sys.exit(main())
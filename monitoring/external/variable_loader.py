@@ -2,6 +2,8 @@
 Load exchange and recipe variable CSVs and provide structured data for the HMI.
 Handles Variable, Type, Min, Max, Unit, Name; groups variables by same Type+Min+Max
 for comparable plotting on the same axis.
+Optional columns: Decimals, Compression / CompDev (recording compression mode
+and deviation, see compression) and Record (per-tag record mode, see record_modes).
 """
 
 import csv
@@ -10,6 +12,13 @@ import os
 from dataclasses import dataclass, field
 from typing import Dict, List, Optional, Tuple
 
+try:
+    from .compression import parse_mode as parse_compression_mode
+    from .record_modes import parse_record_mode
+except ImportError:  # run as a script
+    from compression import parse_mode as parse_compression_mode
+    from record_modes import parse_record_mode
+
 
 @dataclass
 class LoadedVariables:
@@ -47,6 +56,12 @@ def _parse_decimals(val: str, default: int = 2) -> int:
         return default
 
 
+def _parse_compression(row) -> Tuple[str, float]:
+    """Parse the optional Compression / CompDev columns to (mode, deviation)."""
+    mode = parse_compression_mode(row.get("Compression", ""))
+    return mode, abs(_parse_number(row.get("CompDev", ""), 0.0))
+
+
 def _group_key(var_type: str, min_val: float, max_val: float) -> str:
     """Return a stable key for grouping variables with same type and range."""
     return f"{var_type}|{min_val}|{max_val}"
@@ -104,6 +119,7 @@ def load_exchange_csv(path: str) -> Tuple[List[str], Dict[str, dict]]:
                 unit = (row.get("Unit") or "").strip()
                 name = (row.get("Name") or "").strip()
                 decimals = _parse_decimals(row.get("Decimals", ""), 2)
+                compression_mode, compression_dev = _parse_compression(row)
 
                 gkey = _group_key(var_type, min_val, max_val)
                 if gkey not in group_keys_seen:
@@ -131,6 +147,9 @@ def load_exchange_csv(path: str) -> Tuple[List[str], Dict[str, dict]]:
                     "plc_var_name": plc_var or var_name,
                     "array_base_type": array_base or None,
                     "array_size": array_size,
+                    "compression": compression_mode,
+                    "compression_dev": compression_dev,
+                    "record_mode": parse_record_mode(row.get("Record", "")),
                 }
     except Exception as e:
         logging.error("Error loading exchange variables CSV %s: %s", path, e)
@@ -172,6 +191,7 @@ def load_recipe_csv(
                 unit = (row.get("Unit") or "").strip()
                 name = (row.get("Name") or "").strip()
                 decimals = _parse_decimals(row.get("Decimals", ""), 2)
+                compression_mode, compression_dev = _parse_compression(row)
 
                 gkey = _group_key(var_type, min_val, max_val)
                 if gkey not in group_keys_seen:
@@ -198,6 +218,9 @@ def load_recipe_csv(
                     "plc_var_name": plc_var or var_name,
                     "array_base_type": array_base or None,
                     "array_size": array_size,
+                    "compression": compression_mode,
+                    "compression_dev": compression_dev,
+                    "record_mode": parse_record_mode(row.get("Record", "")),
                 }
     except Exception as e:
         logging.error("Error loading recipe variables CSV %s: %s", path, e)
@@ -17,13 +17,29 @@ from PySide6.QtWidgets import (QMainWindow, QVBoxLayout, QHBoxLayout, QWidget,
                                QCheckBox, QLineEdit, QMessageBox, QFileDialog,
                                QTableWidget, QTableWidgetItem, QGroupBox, QHeaderView,
                                QDoubleSpinBox, QSpinBox, QDateTimeEdit, QRadioButton,
-                               QInputDialog, QMenuBar, QSizePolicy)
-from PySide6.QtCore import Qt, Slot, Signal, QTimer, QSettings, QDateTime, QPoint
+                               QInputDialog, QMenuBar, QSizePolicy, QProgressBar)
+from PySide6.QtCore import Qt, Slot, Signal, QTimer, QSettings, QDateTime, QPoint, QRectF
 from PySide6.QtGui import QPalette, QColor, QIcon, QPixmap, QPainter, QAction, QActionGroup
 import pyqtgraph as pg
 from collections import deque
 import numpy as np
 from external.plc_thread import PLCThread
+from external.recorder import OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL
+from external import recording_store
+from external import rollups
+from external import history
+from external import catalog
+from external import retention
+from external import compression
+from external import record_modes
+from external import state_intervals
+from external.offline_columns import OfflineColumnCache
+from external.offline_tasks import OfflineTaskRunner
+from external import offline_workspace
+from external import plot_lod
+from external import pivot_cache
+from external import offline_filters
+from external import linked_index
 from external.plc_ads_thread import PLCADSThread
 from external.plc_simulator import PLCSimulator
 from external.variable_loader import load_exchange_and_recipes
@@ -32,6 +48,13 @@ from shared.title_bar import CustomTitleBar, get_app_icon, get_project_root
 from shared.frameless_resize import FramelessResizeMixin
 
 
+# Offline loading: above this many time points, offer loading rollup means instead of raw data
+OFFLINE_ROLLUP_THRESHOLD = 200_000
+# Offline graphs: columns pivoted per query, each batch drawn as soon as it arrives
+OFFLINE_COLUMN_BATCH = 4
+# Offline XY plots: "Auto" draws a density image above this many points
+XY_DENSITY_AUTO_POINTS = 100_000
+
 # Color palette for limit lines (user can choose from these)
 LIMIT_LINE_COLORS = [
     ("#FF5252", "Red"),
@@ -117,9 +140,11 @@ class LoadPopup(FramelessResizeMixin, QDialog):
 
 class GraphConfigDialog(QDialog):
     """Dialog to configure graph parameters before creation."""
-    def __init__(self, variable_list, parent=None, selected_vars=None):
+    def __init__(self, variable_list, parent=None, selected_vars=None, offline_columns=None):
         super().__init__(parent)
         self._selected_vars = selected_vars or []
+        self._offline_columns = offline_columns  # offline graphs: columns a filter may use
+        self.offline_filter = None
         _icon = _app_icon()
         if not _icon.isNull():
             self.setWindowIcon(_icon)
@@ -229,6 +254,36 @@ class GraphConfigDialog(QDialog):
         self.deadband_spin.setToolTip("Quantize displayed values (e.g. 0.1 bar: 1.2xxx → 1.2, 1.3xxx → 1.3). 0 = off.")
         form_layout.addRow("Display deadband (0 = off):", self.deadband_spin)
 
+        # Offline row filter (run in DuckDB, see offline_filters)
+        self.filter_edit = None
+        if offline_columns is not None:
+            self.filter_edit = QLineEdit()
+            self.filter_edit.setPlaceholderText("e.g. dose 100..250; RecipeSpeed = 12; Pressure > 3.5")
+            self.filter_edit.setToolTip(
+                "Only plot the rows matching every condition (separated by ';'):\n"
+                "  time 2026-02-11 08:00 .. 2026-02-11 12:00\n"
+                "  dose 100..250  (Dose_number)\n"
+                "  RecipeSpeed = 12.5   or   Recipe = 'PET 30ml'\n"
+                "  Pressure > 3.5   (=, !=, <, <=, >, >=)\n"
+                '  "Fill level" 10..20  (names with spaces in double quotes)\n'
+                "Filtered in the database: only matching rows are loaded. Empty = all rows."
+            )
+            form_layout.addRow("Filter (optional):", self.filter_edit)
+
+        # Offline XY plots: points, or a density image re-binned at screen resolution (millions of points)
+        self.xy_display_label = QLabel("XY display:")
+        self.combo_xy_display = QComboBox()
+        self.combo_xy_display.addItem(f"Auto (density above {XY_DENSITY_AUTO_POINTS:,} points)", "auto")
+        self.combo_xy_display.addItem("Points", "points")
+        self.combo_xy_display.addItem("Density image", "density")
+        self.combo_xy_display.setToolTip(
+            "Density image: points counted per screen cell, colour = log10(points); re-binned on zoom.\n"
+            "Drawing cost does not depend on the number of points."
+        )
+        if offline_columns is not None:
+            form_layout.addRow(self.xy_display_label, self.combo_xy_display)
+        self._on_x_axis_changed(self.combo_x_axis.currentText())
+
         layout.addLayout(form_layout)
 
         # --- Limit Lines Section ---
@@ -322,6 +377,20 @@ class GraphConfigDialog(QDialog):
         discrete = x_src == "Discrete index (1, 2, 3…)"
         self.linked_var_label.setVisible(discrete)
         self.combo_linked_var.setVisible(discrete)
+        if hasattr(self, "combo_xy_display") and self._offline_columns is not None:
+            xy = x_src not in ("Time (Index)", "Discrete index (1, 2, 3…)", "timestamp")
+            self.xy_display_label.setVisible(xy)
+            self.combo_xy_display.setVisible(xy)
+
+    def accept(self):
+        """Check the filter before closing (the dialog stays open on an invalid one)."""
+        if self.filter_edit is not None:
+            try:
+                self.offline_filter = offline_filters.parse_filter(self.filter_edit.text()).resolve(self._offline_columns)
+            except ValueError as e:
+                QMessageBox.warning(self, "Invalid filter", str(e))
+                return
+        super().accept()
 
     def get_settings(self):
         out = {
@@ -343,6 +412,8 @@ class GraphConfigDialog(QDialog):
         else:
             out["y_axis_mode"] = "auto"
             out["y_axis_assignments"] = None
+        out["filter"] = self.offline_filter
+        out["xy_display"] = self.combo_xy_display.currentData()
         out["discrete_index_linked_variable"] = None
         if self.combo_x_axis.currentText() == "Discrete index (1, 2, 3…)":
             linked = self.combo_linked_var.currentData()
@@ -668,7 +739,7 @@ class RangeConfigDialog(QDialog):
 
 class ExportRecordingDialog(QDialog):
     """Dialog to export recorded session data to CSV with time range and sampling interval."""
-    INTERVALS_MS = [50, 500, 1000]  # 50 ms, 500 ms, 1 s
+    INTERVALS_MS = [50, 500, 1000, 60000, 900000]  # 50 ms, 500 ms, 1 s, 1 min, 15 min
 
     def __init__(self, db_path, time_min, time_max, parent=None):
         super().__init__(parent)
@@ -704,18 +775,40 @@ class ExportRecordingDialog(QDialog):
         layout.addRow("To:", self.to_edit)
         self.interval_combo = QComboBox()
         for ms in self.INTERVALS_MS:
-            if ms >= 1000:
+            if ms >= 60000:
+                self.interval_combo.addItem(f"{ms // 60000} min", ms / 1000.0)
+            elif ms >= 1000:
                 self.interval_combo.addItem(f"{ms // 1000} s", ms / 1000.0)
             else:
                 self.interval_combo.addItem(f"{ms} ms", ms / 1000.0)
         self.interval_combo.setCurrentIndex(1)  # 500 ms default
-        self.interval_combo.setToolTip("Sample interval for exported rows (50 ms, 500 ms, or 1 s).")
+        self.interval_combo.setToolTip(
+            "Sample interval for exported rows (50 ms to 15 min).\n"
+            "1 s and longer intervals are read from the recording's rollup tables when available."
+        )
         layout.addRow("Interval:", self.interval_combo)
+        self.filter_edit = QLineEdit()
+        self.filter_edit.setStyleSheet("background-color: #444; color: white; border: 1px solid #555; padding: 5px;")
+        self.filter_edit.setPlaceholderText("e.g. dose 100..250; Pressure > 3.5")
+        self.filter_edit.setToolTip(
+            "Only export the rows matching every condition (same syntax as the offline graph filter).\n"
+            "Empty = all rows."
+        )
+        layout.addRow("Filter:", self.filter_edit)
+        self.filter = None
         buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         buttons.accepted.connect(self.accept)
         buttons.rejected.connect(self.reject)
         layout.addRow(buttons)
 
+    def accept(self):
+        try:
+            self.filter = offline_filters.parse_filter(self.filter_edit.text())
+        except ValueError as e:
+            QMessageBox.warning(self, "Invalid filter", str(e))
+            return
+        super().accept()
+
     def get_from_to_interval(self):
         """Return (from_datetime, to_datetime, interval_seconds)."""
         from_qt = self.from_edit.dateTime().toPython()
@@ -724,25 +817,38 @@ class ExportRecordingDialog(QDialog):
         return from_qt, to_qt, interval_sec
 
 
-def export_recording_to_csv(db_path, from_dt, to_dt, interval_sec, csv_path):
+def export_recording_to_csv(db_path, from_dt, to_dt, interval_sec, csv_path, filt=None):
     """
-    Export exchange_variables from DuckDB to CSV with resampling by interval_sec.
+    Export recorded variables (any layout) from DuckDB to CSV with resampling by interval_sec.
     Columns: timestamp;var1;var2;... (semicolon-separated). Uses first value in each time bucket.
+    Intervals of 1 s and longer are resampled from the rollup tables when the file has them.
+    db_path may also be a compacted Parquet day folder.
+    With a filter (offline_filters.OfflineFilter), only the pivoted rows matching it are resampled.
     """
-    conn = duckdb.connect(database=db_path, read_only=True)
+    conn, db = recording_store.connect_recording(db_path)
     try:
-        # Resample: bucket by interval, first value per variable per bucket
+        if filt:
+            return _export_filtered_recording(conn, db, from_dt, to_dt, interval_sec, csv_path, filt)
         interval_placeholder = interval_sec
-        result = conn.execute("""
-            SELECT
-                (floor(epoch(timestamp)::DOUBLE / ?) * ?) AS ts_bucket,
-                variable_name,
-                first(value) AS value
-            FROM exchange_variables
-            WHERE timestamp >= ? AND timestamp <= ?
-            GROUP BY ts_bucket, variable_name
-            ORDER BY ts_bucket, variable_name
-        """, (interval_placeholder, interval_placeholder, from_dt, to_dt)).fetchall()
+        resample_sql = rollups.resample_first_sql(conn, interval_sec, db=db)
+        if not resample_sql:
+            long_sql = recording_store.long_values_sql(conn, db)
+            if not long_sql:
+                return 0
+            # Resample raw samples: bucket by interval, first value per variable per bucket
+            resample_sql = f"""
+                SELECT
+                    (floor(epoch(timestamp)::DOUBLE / ?) * ?) AS ts_bucket,
+                    variable_name,
+                    first(value) AS value
+                FROM ({long_sql})
+                WHERE timestamp >= ? AND timestamp <= ?
+                GROUP BY ts_bucket, variable_name
+                ORDER BY ts_bucket, variable_name
+            """
+        result = conn.execute(
+            resample_sql, (interval_placeholder, interval_placeholder, from_dt, to_dt)
+        ).fetchall()
         if not result:
             return 0
         # Build pivot: buckets -> { variable_name: value }
@@ -765,38 +871,40 @@ def export_recording_to_csv(db_path, from_dt, to_dt, interval_sec, csv_path):
         conn.close()
 
 
+def _export_filtered_recording(conn, db, from_dt, to_dt, interval_sec, csv_path, filt):
+    """Filtered export_recording_to_csv: filter the pivoted rows in DuckDB, then keep the first value per bucket."""
+    var_names = recording_store.list_variables(conn, db)
+    filt = filt.resolve(['timestamp'] + var_names)
+    rows_sql = offline_filters.recording_filtered_sql(conn, ['timestamp'] + var_names, filt, db, from_dt, to_dt)
+    firsts = ", ".join(
+        f"first({col} ORDER BY timestamp) FILTER (WHERE {col} IS NOT NULL)"
+        for col in (recording_store.quote_identifier(v) for v in var_names)
+    )
+    rows = conn.execute(
+        f"SELECT floor(epoch(timestamp)::DOUBLE / ?) * ? AS ts_bucket, {firsts} "
+        f"FROM ({rows_sql}) GROUP BY ts_bucket ORDER BY ts_bucket",
+        (interval_sec, interval_sec),
+    ).fetchall()
+    if not rows:
+        return 0
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        f.write("timestamp;" + ";".join(var_names) + "\n")
+        for ts_bucket, *values in rows:
+            row_vals = [datetime.fromtimestamp(ts_bucket).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]]
+            row_vals.extend("" if v is None else str(v) for v in values)
+            f.write(";".join(row_vals) + "\n")
+    return len(rows)
+
+
 def get_recording_time_range(db_path):
-    """Return (min_timestamp, max_timestamp) from exchange_variables, or (None, None) if empty."""
-    if not db_path or not os.path.isfile(db_path):
-        return None, None
-    try:
-        conn = duckdb.connect(database=db_path, read_only=True)
-        try:
-            row = conn.execute(
-                "SELECT min(timestamp), max(timestamp) FROM exchange_variables"
-            ).fetchone()
-            if row and row[0] is not None and row[1] is not None:
-                return row[0], row[1]
-            return None, None
-        finally:
-            conn.close()
-    except Exception:
-        return None, None
+    """Return (min_timestamp, max_timestamp) of the recording (from the catalog), or (None, None) if empty."""
+    return catalog.entry_time_range(catalog.get_entry(db_path))
 
 
 def recording_has_data(db_path):
-    """Return True if exchange_variables has at least one row."""
-    if not db_path or not os.path.isfile(db_path):
-        return False
-    try:
-        conn = duckdb.connect(database=db_path, read_only=True)
-        try:
-            n = conn.execute("SELECT count(*) FROM exchange_variables").fetchone()[0]
-            return n > 0
-        finally:
-            conn.close()
-    except Exception:
-        return False
+    """Return True if the recording (any layout, .duckdb or Parquet day) has at least one row."""
+    entry = catalog.get_entry(db_path)
+    return bool(entry and entry.get("row_count"))
 
 
 def _format_size(size_bytes):
@@ -822,55 +930,28 @@ def get_process_ram_mb():
 
 def list_recording_db_files(external_dir):
     """
-    List all Data_DDMMYYYY.duckdb (and legacy recording_YYYY-MM-DD.duckdb) files in external_dir.
-    Returns list of dicts: [{ 'path': str, 'date_str': str, 'date': date, 'size_bytes': int, 'size_label': str }]
-    sorted by date descending (newest first).
+    List all Data_DDMMYYYY.duckdb (and legacy recording_YYYY-MM-DD.duckdb) files in external_dir,
+    plus compacted Parquet days (external_dir/parquet/date=YYYY-MM-DD/) and the legacy automation_data.db.
+    Returns list of dicts: [{ 'path': str, 'date_str': str, 'date': date, 'size_bytes': int, 'size_label': str,
+    'kind': 'duckdb' | 'parquet', 'stats': catalog entry or None if not cached }] sorted by date descending
+    (newest first).
     """
-    import re, datetime as _dt
+    import datetime as _dt
     results = []
-    if not external_dir or not os.path.isdir(external_dir):
-        return results
-    # New format: Data_DDMMYYYY.duckdb  (e.g. Data_09022026.duckdb)
-    pat_new = re.compile(r'^Data_(\d{2})(\d{2})(\d{4})\.duckdb$')
-    # Old format: recording_YYYY-MM-DD.duckdb
-    pat_old = re.compile(r'^recording_(\d{4}-\d{2}-\d{2})\.duckdb$')
-    for fname in os.listdir(external_dir):
-        file_date = None
-        m_new = pat_new.match(fname)
-        m_old = pat_old.match(fname) if not m_new else None
-        if m_new:
-            day, month, year = m_new.group(1), m_new.group(2), m_new.group(3)
-            try:
-                file_date = _dt.date(int(year), int(month), int(day))
-            except ValueError:
-                continue
-        elif m_old:
-            try:
-                file_date = _dt.date.fromisoformat(m_old.group(1))
-            except ValueError:
-                continue
-        if file_date is not None:
-            fpath = os.path.join(external_dir, fname)
-            size_bytes = os.path.getsize(fpath)
-            results.append({
-                'path': fpath,
-                'date_str': file_date.strftime("%d/%m/%Y"),
-                'date': file_date,
-                'size_bytes': size_bytes,
-                'size_label': _format_size(size_bytes),
-            })
-    # Also check for legacy automation_data.db
-    legacy_path = os.path.join(external_dir, 'automation_data.db')
-    if os.path.isfile(legacy_path):
-        size_bytes = os.path.getsize(legacy_path)
-        if size_bytes > 4096:  # Only show if it has meaningful data
-            results.append({
-                'path': legacy_path,
-                'date_str': 'legacy',
-                'date': _dt.date.min,
-                'size_bytes': size_bytes,
-                'size_label': _format_size(size_bytes),
-            })
+    cached = catalog.load_catalog(external_dir) if external_dir and os.path.isdir(external_dir) else {}
+    for entry in history.find_recordings(external_dir):
+        size_bytes = recording_store.recording_disk_size(entry['path'])
+        if entry['day'] is None and size_bytes <= 4096:
+            continue  # Only show legacy automation_data.db if it has meaningful data
+        results.append({
+            'path': entry['path'],
+            'date_str': entry['day'].strftime("%d/%m/%Y") if entry['day'] else 'legacy',
+            'date': entry['day'] or _dt.date.min,
+            'size_bytes': size_bytes,
+            'size_label': _format_size(size_bytes),
+            'kind': entry['kind'],
+            'stats': catalog.get_entry(entry['path'], refresh=False, files=cached),
+        })
     results.sort(key=lambda x: x['date'], reverse=True)
     return results
 
@@ -881,10 +962,10 @@ def get_db_memory_info(db_path):
     Returns dict: { 'ram_bytes': int, 'ram_label': str, 'disk_bytes': int, 'disk_label': str, 'row_count': int }
     """
     info = {'ram_bytes': 0, 'ram_label': '0 B', 'disk_bytes': 0, 'disk_label': '0 B', 'row_count': 0}
-    if not db_path or not os.path.isfile(db_path):
+    if not db_path or not os.path.exists(db_path):
         return info
     try:
-        info['disk_bytes'] = os.path.getsize(db_path)
+        info['disk_bytes'] = recording_store.recording_disk_size(db_path)
         size = info['disk_bytes']
         if size < 1024:
             info['disk_label'] = f"{size} B"
@@ -894,25 +975,10 @@ def get_db_memory_info(db_path):
             info['disk_label'] = f"{size / (1024 * 1024):.1f} MB"
     except Exception:
         pass
-    try:
-        conn = duckdb.connect(database=db_path, read_only=True)
-        try:
-            # Get row count
-            row = conn.execute("SELECT count(*) FROM exchange_variables").fetchone()
-            info['row_count'] = row[0] if row else 0
-            # Get memory usage via pragma
-            try:
-                mem_row = conn.execute("CALL pragma_database_size()").fetchone()
-                if mem_row:
-                    # pragma_database_size returns: database_name, database_size, block_size, total_blocks, used_blocks, free_blocks, wal_size, memory_usage, memory_limit
-                    # Index depends on version; try to get memory_usage
-                    pass  # DuckDB read_only doesn't track RAM well; we'll use disk size
-            except Exception:
-                pass
-        finally:
-            conn.close()
-    except Exception:
-        pass
+    # Row count (tag samples for narrow/compact files, cycles for wide files) from the recording catalog
+    entry = catalog.get_entry(db_path)
+    if entry:
+        info['row_count'] = entry.get('row_count', 0)
     return info
 
 
@@ -944,6 +1010,7 @@ class DynamicPlotWidget(QWidget):
         self.graph_title = (graph_title or "").strip()
         self.graph_default_title = f"{' • '.join(variable_names)}  [vs {x_axis_source}]"
         self.display_deadband = float(display_deadband) if display_deadband else 0.0
+        self.offline_filter = None  # OfflineFilter the offline rows were queried with (shown in the title)
         self.y_axis_mode = y_axis_mode  # for 2 vars: "auto" | "same" | "dual"
         self._y_axis_assignments = y_axis_assignments or {}  # for 3+ vars: {var: "y1"|"y2"}
         
@@ -1056,6 +1123,9 @@ class DynamicPlotWidget(QWidget):
         self.buffer_x_change_timestamps = deque(maxlen=buffer_size)  # Timestamp when X variable changed (discrete/variable X)
         self.buffer_x_snapshots = deque(maxlen=buffer_size)  # Snapshot of Y+recipe values when X changed (discrete/variable X)
         self.buffer_size = buffer_size
+        self._static_lod = False  # offline time plot: full columns in buffers_y, visible range drawn decimated
+        self._lod_timer = None
+        self._density = None  # offline XY density image: {'image', 'bar', 'points': {var: (x, y)}, 'counts', 'rect'}
         self.p2 = None
         self.colors = ['#00E676', '#2979FF', '#FF1744', '#FFEA00', '#AA00FF', '#00B0FF', '#FF9100']
         # Initialize range settings from variable metadata
@@ -1314,6 +1384,12 @@ class DynamicPlotWidget(QWidget):
         """Shift X range so the graph shows the latest values (sliding window pinned to the right)."""
         if self.is_xy_plot or not self.range_settings["x"]["auto"]:
             return
+        if self._static_lod:
+            # Offline: the whole recording (columns are not limited to buffer_size)
+            n = len(self.buffer_timestamps) or max((len(y) for y in self.buffers_y.values()), default=0)
+            self._last_programmatic_x_range = (0, max(n - 1, 1))
+            self.plot_widget.plotItem.setXRange(0, max(n - 1, 1), padding=0)
+            return
         ref_var = self.variables[0] if self.variables else None
         window = self.buffer_size
         if self.is_discrete_index and getattr(self, "discrete_index_linked_variable", None):
@@ -1506,8 +1582,9 @@ class DynamicPlotWidget(QWidget):
             self.btn_export_csv.setStyleSheet(_btn_style)
 
     def get_display_title(self):
-        """Return the graph title to show (custom if set, else default)."""
-        return (self.graph_title or "").strip() or self.graph_default_title
+        """Return the graph title to show (custom if set, else default), marked when the rows are filtered."""
+        title = (self.graph_title or "").strip() or self.graph_default_title
+        return f"{title}  (filtered)" if self.offline_filter else title
 
     def _display_label(self, var_name):
         """Return display label for variable (Name [Unit] or variable id)."""
@@ -1527,8 +1604,8 @@ class DynamicPlotWidget(QWidget):
     def set_buffer_size(self, new_size):
         """Resize all buffers to new_size, copying existing data (truncates if smaller)."""
         new_size = max(100, min(500000, int(new_size)))
-        if new_size == self.buffer_size:
-            return
+        if new_size == self.buffer_size or self._static_lod or self._density is not None:
+            return  # offline time and density plots keep their full columns
         # Copy and resize deques
         self.buffer_timestamps = deque(list(self.buffer_timestamps)[-new_size:], maxlen=new_size)
         for var in self.buffers_y:
@@ -1554,6 +1631,9 @@ class DynamicPlotWidget(QWidget):
         opts = {"pen": pen, "symbol": symbol, "symbolBrush": symbolBrush, "antialias": True}
         if symbolSize is not None:
             opts["symbolSize"] = symbolSize
+        if not use_symbol and state_intervals.is_state_tag(self.variable_metadata.get(var)):
+            # State tags (BOOL, Record = state) hold their value until the next change
+            opts["stepMode"] = "right"
         if isinstance(plot_item, pg.ViewBox):
             line = pg.PlotCurveItem(name=var, **opts)
             plot_item.addItem(line)
@@ -1899,27 +1979,22 @@ class DynamicPlotWidget(QWidget):
         if not self.show_delta_on_graph:
             self.line_delta.hide()
             return
+        if self._static_lod:
+            self._refresh_lod()
+            return
         v1, v2 = self.variables[0], self.variables[1]
-        b1 = list(self.buffers_y.get(v1, []))
-        b2 = list(self.buffers_y.get(v2, []))
+        b1 = plot_lod.as_float_array(self.buffers_y.get(v1, []))
+        b2 = plot_lod.as_float_array(self.buffers_y.get(v2, []))
         n = min(len(b1), len(b2))
-        if n == 0:
-            self.line_delta.hide()
-            return
-        delta = []
-        for i in range(n):
-            try:
-                a, b = float(b1[i]), float(b2[i])
-                if not (np.isnan(a) or np.isnan(b) or np.isinf(a) or np.isinf(b)):
-                    delta.append(b - a)
-            except (ValueError, TypeError):
-                continue
-        if delta:
+        delta = b2[:n] - b1[:n]
+        delta = delta[np.isfinite(delta)]
+        if len(delta):
             if self.is_discrete_index:
                 if getattr(self, "discrete_index_linked_variable", None):
-                    x_delta = list(self.buffers_x_discrete)[:len(delta)]
+                    x_delta = plot_lod.as_float_array(self.buffers_x_discrete)[:len(delta)]
+                    delta = delta[:len(x_delta)]
                 else:
-                    x_delta = list(range(1, len(delta) + 1))
+                    x_delta = np.arange(1, len(delta) + 1, dtype=np.float64)
                 self.line_delta.setData(x_delta, delta)
             else:
                 self.line_delta.setData(delta)
@@ -2041,66 +2116,247 @@ class DynamicPlotWidget(QWidget):
             self._apply_aligned_dual_y_range()
 
     def set_static_data(self, x_data, y_series):
-        """Load static (offline) data once: x_data = list or None (use index), y_series = {var_name: [y values]}."""
-        n = 0
-        for var_name in self.variables:
-            if var_name not in y_series:
-                continue
-            ys = y_series[var_name]
-            clean = []
-            for v in ys:
-                try:
-                    f = float(v)
-                    if not (np.isnan(f) or np.isinf(f)):
-                        clean.append(f)
-                except (ValueError, TypeError):
-                    pass
-            self.buffers_y[var_name] = deque(clean, maxlen=self.buffer_size)
-            n = max(n, len(clean))
-        if n == 0:
-            return
-        if x_data is None or len(x_data) < n:
-            x_list = list(range(1, n + 1)) if self.is_discrete_index else list(range(n))
-        else:
-            x_list = []
-            for v in x_data[:n]:
-                try:
-                    f = float(v)
-                    if not (np.isnan(f) or np.isinf(f)):
-                        x_list.append(f)
-                except (ValueError, TypeError):
-                    pass
-            if len(x_list) != n:
-                x_list = list(range(1, n + 1)) if self.is_discrete_index else list(range(n))
+        """
+        Load static (offline) data once: x_data = array / list or None (use index), y_series = {var_name: values}.
+        Values are converted and NaN-filtered as whole arrays (plot_lod.as_float_array); XY plots keep the
+        rows where both X and Y are finite. Every row is kept (buffer_size only limits live data): large XY
+        plots are drawn as a density image instead (set_static_density), index plots are downsampled.
+        """
+        xs = plot_lod.as_float_array(x_data) if x_data is not None and self.is_xy_plot else None
         for var_name in self.variables:
-            if var_name not in self.buffers_y or var_name not in self.lines:
+            if var_name not in y_series or var_name not in self.lines:
                 continue
-            y_list = list(self.buffers_y[var_name])
-            min_len = min(len(x_list), len(y_list))
-            if min_len == 0:
+            ys = plot_lod.as_float_array(y_series[var_name])
+            if xs is not None and len(xs) == len(ys):
+                keep = np.isfinite(xs) & np.isfinite(ys)
+                x_arr, y_arr = xs[keep], ys[keep]
+            else:
+                y_arr = ys[np.isfinite(ys)]
+                x_arr = np.arange(len(y_arr), dtype=np.float64)
+                self._downsample_static_line(var_name)
+            self.buffers_y[var_name] = y_arr
+            if not len(y_arr):
                 continue
             if self.is_xy_plot:
-                self.buffers_x[var_name] = deque(x_list[:min_len], maxlen=self.buffer_size)
-                self.lines[var_name].setData(x_list[:min_len], y_list[:min_len])
+                self.buffers_x[var_name] = x_arr
+                self.lines[var_name].setData(x_arr, y_arr)
             elif self.is_discrete_index:
-                x_plot = list(range(1, min_len + 1))
-                self.lines[var_name].setData(x_plot, y_list[:min_len])
+                self.lines[var_name].setData(np.arange(1, len(y_arr) + 1, dtype=np.float64), y_arr)
             else:
-                self.lines[var_name].setData(y_list[:min_len])
-            if y_list:
-                last_val = y_list[-1]
-                data = [d for d in y_list if isinstance(d, (int, float)) and not np.isnan(d)]
-                min_v = min(data) if data else 0.0
-                max_v = max(data) if data else 0.0
-                dl = self._display_label(var_name)
-                fmt = self._format_value(var_name, last_val)
-                min_fmt = self._format_value(var_name, min_v)
-                max_fmt = self._format_value(var_name, max_v)
-                txt = f"{dl}: {fmt} <span style='font-size:10px; color:#aaa;'>(Min:{min_fmt} Max:{max_fmt})</span>"
-                self.value_labels[var_name].setText(txt)
+                self.lines[var_name].setData(y_arr)
+            dl = self._display_label(var_name)
+            fmt = self._format_value(var_name, float(y_arr[-1]))
+            min_fmt = self._format_value(var_name, float(y_arr.min()))
+            max_fmt = self._format_value(var_name, float(y_arr.max()))
+            txt = f"{dl}: {fmt} <span style='font-size:10px; color:#aaa;'>(Min:{min_fmt} Max:{max_fmt})</span>"
+            self.value_labels[var_name].setText(txt)
+        if len(self.variables) == 2:
+            self._update_delta_line()
+
+    def set_static_linked_index(self, index, change_timestamps, columns):
+        """
+        Offline discrete index linked to a variable (see linked_index): index = 1..n, one per change of the
+        linked variable, change_timestamps = datetime64 array or None, columns = {var_name: value at each change}.
+        Fills the buffers live updates fill (buffers_x_discrete, buffer_x_change_timestamps, buffer_x_snapshots),
+        so the tooltip and the CSV export (one row per change with its snapshot) work as live.
+        """
+        index = np.asarray(index)
+        n = len(index)
+        maxlen = max(self.buffer_size, n)  # every change is kept (buffer_size only limits live data)
+        self.buffers_x_discrete = deque(index.tolist(), maxlen=maxlen)
+        times = plot_lod.DatetimeRows(change_timestamps[-n:]) if change_timestamps is not None else []
+        self.buffer_x_change_timestamps = deque(times, maxlen=maxlen)
+        snapshot_values = {
+            v: [None if isinstance(x, float) and np.isnan(x) else x for x in np.asarray(col)[-n:].tolist()]
+            for v, col in columns.items()
+        }
+        self.buffer_x_snapshots = deque(
+            ({v: vals[i] for v, vals in snapshot_values.items()} for i in range(n)), maxlen=maxlen
+        )
+        self._discrete_index_counter = int(index[-1]) if n else 0
+        x_arr = index.astype(np.float64)
+        for var_name in self.variables:
+            if var_name not in columns or var_name not in self.lines:
+                continue
+            y_arr = plot_lod.as_float_array(columns[var_name])[-n:]
+            self._downsample_static_line(var_name)
+            self.buffers_y[var_name] = y_arr
+            finite = y_arr[np.isfinite(y_arr)]
+            if not len(finite):
+                continue
+            self.lines[var_name].setData(x_arr, y_arr, connect="finite")
+            dl = self._display_label(var_name)
+            fmt = self._format_value(var_name, float(finite[-1]))
+            min_fmt = self._format_value(var_name, float(finite.min()))
+            max_fmt = self._format_value(var_name, float(finite.max()))
+            txt = f"{dl}: {fmt} <span style='font-size:10px; color:#aaa;'>(Min:{min_fmt} Max:{max_fmt})</span>"
+            self.value_labels[var_name].setText(txt)
         if len(self.variables) == 2:
             self._update_delta_line()
 
+    def _downsample_static_line(self, var_name):
+        """Static index plot: draw only the visible rows, min/max per pixel when there are more (like plot_lod)."""
+        line = self.lines[var_name]
+        if isinstance(line, pg.PlotDataItem):  # curves of extra Y axes are plain PlotCurveItems
+            line.setClipToView(True)
+            line.setDownsampling(auto=True, method="peak")
+
+    def set_static_density(self, x_data, y_series):
+        """
+        Offline XY plot drawn as a density image: every finite (x, y) point of y_series (all Y variables
+        together) is kept and the visible range is binned at screen resolution (plot_lod.density_image),
+        shown as an image with a colour bar of log10(points per cell). Zooming / panning re-bins, so drawing
+        costs the same whatever the number of points. Called again with more columns as they arrive.
+        """
+        xs = plot_lod.as_float_array(x_data)
+        first = self._density is None
+        if first:
+            image = pg.ImageItem()
+            image.setColorMap(pg.colormap.get("viridis"))
+            image.setZValue(-1)  # below limit lines and crosshair
+            self.plot_widget.addItem(image)
+            bar = pg.ColorBarItem(colorMap=pg.colormap.get("viridis"), label="log10(points)", interactive=False)
+            bar.setImageItem(image, insert_in=self.plot_widget.plotItem)
+            self._density = {'image': image, 'bar': bar, 'points': {}, 'counts': None, 'rect': None}
+            self._lod_timer = QTimer(self)
+            self._lod_timer.setSingleShot(True)
+            self._lod_timer.setInterval(30)  # coalesce the range changes of a drag / wheel
+            self._lod_timer.timeout.connect(self._refresh_density)
+            vb = self.plot_widget.plotItem.vb
+            vb.sigRangeChanged.connect(lambda *args: self._lod_timer.start())
+            if hasattr(vb, "sigResized"):
+                vb.sigResized.connect(lambda *args: self._lod_timer.start())
+        for var_name in self.variables:
+            if var_name not in y_series or var_name not in self.lines:
+                continue
+            ys = plot_lod.as_float_array(y_series[var_name])
+            if len(xs) != len(ys):
+                continue
+            keep = np.isfinite(xs) & np.isfinite(ys)
+            x_arr, y_arr = xs[keep], ys[keep]
+            self._density['points'][var_name] = (x_arr, y_arr)
+            self.buffers_x[var_name], self.buffers_y[var_name] = x_arr, y_arr  # CSV export
+            self.lines[var_name].setData([], [])
+            if not len(y_arr):
+                continue
+            dl = self._display_label(var_name)
+            fmt = self._format_value(var_name, float(y_arr[-1]))
+            min_fmt = self._format_value(var_name, float(y_arr.min()))
+            max_fmt = self._format_value(var_name, float(y_arr.max()))
+            txt = f"{dl}: {fmt} <span style='font-size:10px; color:#aaa;'>(Min:{min_fmt} Max:{max_fmt})</span>"
+            self.value_labels[var_name].setText(txt)
+        points = [p for p in self._density['points'].values() if len(p[0])]
+        if first and points:
+            # Start on the whole data (the image does not drive auto-range)
+            x_all = np.concatenate([p[0] for p in points])
+            y_all = np.concatenate([p[1] for p in points])
+            vb = self.plot_widget.plotItem.vb
+            vb.disableAutoRange()
+            vb.setRange(xRange=(x_all.min(), x_all.max()), yRange=(y_all.min(), y_all.max()), padding=0.02)
+        self._refresh_density()
+
+    def _refresh_density(self):
+        """Re-bin the density image for the visible range (see plot_lod.density_image)."""
+        if self._density is None:
+            return
+        vb = self.plot_widget.plotItem.vb
+        x_range, y_range = vb.viewRange()
+        width = max(50, int(vb.width() or self.plot_widget.width())) // plot_lod.DENSITY_CELL_PX
+        height = max(50, int(vb.height() or self.plot_widget.height())) // plot_lod.DENSITY_CELL_PX
+        counts = np.zeros((max(1, width), max(1, height)), dtype=np.int64)
+        for x_arr, y_arr in self._density['points'].values():
+            counts += plot_lod.density_image(x_arr, y_arr, x_range, y_range, width, height)
+        with np.errstate(divide="ignore"):
+            image = np.where(counts > 0, np.log10(counts), np.nan)  # empty cells transparent
+        top = float(np.nanmax(image)) if counts.any() else 1.0
+        self._density['counts'] = counts
+        self._density['rect'] = (x_range[0], y_range[0], x_range[1] - x_range[0], y_range[1] - y_range[0])
+        self._density['image'].setImage(image, autoLevels=False, levels=(0, max(top, 1.0)))
+        self._density['image'].setRect(QRectF(*self._density['rect']))
+        self._density['bar'].setLevels((0, max(top, 1.0)))
+
+    def _show_density_tooltip(self, mouse_point):
+        """Tooltip of a density image: the cursor position and the number of points in its cell."""
+        counts, rect = self._density['counts'], self._density['rect']
+        if counts is None or not rect[2] or not rect[3]:
+            return
+        i = int((mouse_point.x() - rect[0]) / rect[2] * counts.shape[0])
+        j = int((mouse_point.y() - rect[1]) / rect[3] * counts.shape[1])
+        n = int(counts[i, j]) if 0 <= i < counts.shape[0] and 0 <= j < counts.shape[1] else 0
+        x_fmt = self._format_value(self.x_axis_source, mouse_point.x())
+        y_fmt = self._format_value(self.variables[0], mouse_point.y())
+        self.tooltip.setHtml(
+            f"<div style='background-color: #333; color: white; padding: 8px; border-radius: 4px;'>"
+            f"<b>{self.x_axis_source}: {x_fmt}</b><br/>Y: {y_fmt}<br/>Points in cell: <b>{n:,}</b></div>"
+        )
+        self.tooltip.setPos(mouse_point.x(), mouse_point.y())
+        self.tooltip.show()
+        self.crosshair_v.setPos(mouse_point.x())
+        self.crosshair_v.show()
+        self.crosshair_h.setPos(mouse_point.y())
+        self.crosshair_h.show()
+
+    def set_static_columns(self, timestamps, y_series):
+        """
+        Offline time plot: keep the full columns (timestamps = datetime64 array or None,
+        y_series = {var_name: float64 array}) and draw the visible X range at screen resolution.
+        Zooming / panning redraws it (min/max per pixel, the rows themselves when zoomed in).
+        Called again with more columns as the background query delivers them (the view is kept).
+        """
+        self._static_lod = True
+        if isinstance(timestamps, np.ndarray) and timestamps.dtype.kind == "M":
+            self.buffer_timestamps = plot_lod.DatetimeRows(timestamps)
+        else:
+            self.buffer_timestamps = []  # e.g. a CSV without a timestamp column: index axis
+        for var_name in self.lines:
+            self.buffers_y[var_name] = y_series.get(var_name, np.array([]))
+        for var_name, ys in self.buffers_y.items():
+            finite = ys[np.isfinite(ys)] if len(ys) else ys
+            if not len(finite) or var_name not in self.value_labels:
+                continue
+            dl = self._display_label(var_name)
+            fmt = self._format_value(var_name, float(finite[-1]))
+            min_fmt = self._format_value(var_name, float(finite.min()))
+            max_fmt = self._format_value(var_name, float(finite.max()))
+            txt = f"{dl}: {fmt} <span style='font-size:10px; color:#aaa;'>(Min:{min_fmt} Max:{max_fmt})</span>"
+            self.value_labels[var_name].setText(txt)
+        if self._lod_timer is None:
+            self._lod_timer = QTimer(self)
+            self._lod_timer.setSingleShot(True)
+            self._lod_timer.setInterval(30)  # coalesce the range changes of a drag / wheel
+            self._lod_timer.timeout.connect(self._refresh_lod)
+            vb = self.plot_widget.plotItem.vb
+            vb.sigXRangeChanged.connect(lambda *args: self._lod_timer.start())
+            if hasattr(vb, "sigResized"):
+                vb.sigResized.connect(lambda *args: self._lod_timer.start())
+            self._update_time_plot_x_range()
+        self._refresh_lod()
+
+    def _refresh_lod(self):
+        """Redraw the static columns for the visible X range (see plot_lod)."""
+        if not self._static_lod:
+            return
+        vb = self.plot_widget.plotItem.vb
+        x_min, x_max = vb.viewRange()[0]
+        max_points = max(200, int(vb.width() or self.plot_widget.width())) * plot_lod.POINTS_PER_PIXEL
+        for var_name, ys in self.buffers_y.items():
+            line = self.lines.get(var_name)
+            if line is None:
+                continue
+            i0, i1 = plot_lod.visible_rows(x_min, x_max, len(ys))
+            x, y = plot_lod.minmax_decimate(ys[i0:i1], max_points, i0)
+            line.setData(x, y, connect="finite")
+        if getattr(self, "line_delta", None) is not None and len(self.variables) == 2:
+            y1 = self.buffers_y.get(self.variables[0])
+            y2 = self.buffers_y.get(self.variables[1])
+            if not self.show_delta_on_graph or y1 is None or y2 is None:
+                self.line_delta.hide()
+                return
+            i0, i1 = plot_lod.visible_rows(x_min, x_max, min(len(y1), len(y2)))
+            x, y = plot_lod.minmax_decimate(y2[i0:i1] - y1[i0:i1], max_points, i0)
+            self.line_delta.setData(x, y, connect="finite")
+            self.line_delta.show()
+
     def update_data_array(self, var_name, array_values):
         """Add all array values at once to the graph.
         Arrays contain oversampled data that should be plotted together.
@@ -2256,6 +2512,16 @@ class DynamicPlotWidget(QWidget):
                 pass
         return []
 
+    @staticmethod
+    def _value_at(y_data, idx):
+        """y_data[idx] (list, deque or array), or None when out of range or NaN."""
+        if y_data is None or idx >= len(y_data):
+            return None
+        value = y_data[idx]
+        if isinstance(value, float) and np.isnan(value):
+            return None
+        return value
+
     def mouse_moved(self, evt):
         pos = evt[0]
         # Check mouse is over the plot (use plot widget scene rect so discrete and time behave the same)
@@ -2269,46 +2535,61 @@ class DynamicPlotWidget(QWidget):
         ref_var = self.variables[0] if self.variables else None
         if not ref_var:
             return
+        if self._density is not None:
+            self._show_density_tooltip(mouse_point)
+            return
 
-        # Capture all filtered data ONCE as a synchronized snapshot from the actual plot lines
-        # This ensures the tooltip shows exactly what is displayed on the plot
-        filtered_y_data = {var: self._get_filtered_y_data(var) for var in self.variables}
-        ref_y_filtered = filtered_y_data.get(ref_var, [])
-        n_pts_filtered = len(ref_y_filtered)
-
-        if self.is_xy_plot:
-            x_raw = self.buffers_x.get(ref_var, [])
-            x_data = np.array([float(x) for x in x_raw if x is not None and isinstance(x, (int, float)) and not np.isnan(x)])
-        elif self.is_discrete_index and getattr(self, "discrete_index_linked_variable", None):
-            n_x = len(self.buffers_x_discrete)
-            min_len = min(n_x, n_pts_filtered)
-            if min_len == 0:
+        if self._static_lod:
+            # Offline level-of-detail plot: look the row up in the full-resolution columns
+            filtered_y_data = self.buffers_y
+            n_rows = len(self.buffers_y.get(ref_var, []))
+            if n_rows == 0:
                 self.tooltip.hide()
                 self.crosshair_v.hide()
                 self.crosshair_h.hide()
                 return
-            x_data = np.array(list(self.buffers_x_discrete)[:min_len], dtype=float)
-            # Truncate y data to match x data length
-            filtered_y_data = {var: filtered_y_data[var][:min_len] for var in self.variables}
-        elif self.is_discrete_index:
-            # For discrete index without linked variable, use x data from plot line to stay synchronized
-            ref_x_from_plot = self._get_filtered_x_data(ref_var)
-            if ref_x_from_plot:
-                x_data = np.array(ref_x_from_plot, dtype=float)
-            else:
-                x_data = np.arange(1, n_pts_filtered + 1, dtype=float) if n_pts_filtered > 0 else np.array([])
+            idx = int(min(max(round(mouse_point.x()), 0), n_rows - 1))
+            x_val = float(idx)
         else:
-            x_data = np.arange(n_pts_filtered, dtype=float) if n_pts_filtered > 0 else np.array([])
-        if len(x_data) == 0:
-            self.tooltip.hide()
-            self.crosshair_v.hide()
-            self.crosshair_h.hide()
-            return
+            # Capture all filtered data ONCE as a synchronized snapshot from the actual plot lines
+            # This ensures the tooltip shows exactly what is displayed on the plot
+            filtered_y_data = {var: self._get_filtered_y_data(var) for var in self.variables}
+            ref_y_filtered = filtered_y_data.get(ref_var, [])
+            n_pts_filtered = len(ref_y_filtered)
 
-        idx = np.abs(x_data - mouse_point.x()).argmin()
-        if idx >= len(x_data):
-            return
-        x_val = x_data[idx]
+            if self.is_xy_plot:
+                x_data = plot_lod.as_float_array(self.buffers_x.get(ref_var, []))
+                x_data = x_data[~np.isnan(x_data)]
+            elif self.is_discrete_index and getattr(self, "discrete_index_linked_variable", None):
+                n_x = len(self.buffers_x_discrete)
+                min_len = min(n_x, n_pts_filtered)
+                if min_len == 0:
+                    self.tooltip.hide()
+                    self.crosshair_v.hide()
+                    self.crosshair_h.hide()
+                    return
+                x_data = np.array(list(self.buffers_x_discrete)[:min_len], dtype=float)
+                # Truncate y data to match x data length
+                filtered_y_data = {var: filtered_y_data[var][:min_len] for var in self.variables}
+            elif self.is_discrete_index:
+                # For discrete index without linked variable, use x data from plot line to stay synchronized
+                ref_x_from_plot = self._get_filtered_x_data(ref_var)
+                if ref_x_from_plot:
+                    x_data = np.array(ref_x_from_plot, dtype=float)
+                else:
+                    x_data = np.arange(1, n_pts_filtered + 1, dtype=float) if n_pts_filtered > 0 else np.array([])
+            else:
+                x_data = np.arange(n_pts_filtered, dtype=float) if n_pts_filtered > 0 else np.array([])
+            if len(x_data) == 0:
+                self.tooltip.hide()
+                self.crosshair_v.hide()
+                self.crosshair_h.hide()
+                return
+
+            idx = np.abs(x_data - mouse_point.x()).argmin()
+            if idx >= len(x_data):
+                return
+            x_val = x_data[idx]
 
         html = f"<div style='background-color: #333; color: white; padding: 8px; border-radius: 4px;'>"
         if self.is_xy_plot:
@@ -2334,19 +2615,18 @@ class DynamicPlotWidget(QWidget):
 
         # Look up y values using the synchronized snapshot
         for var in self.variables:
-            y_data = filtered_y_data[var]
-            if y_data and idx < len(y_data):
-                y_val = y_data[idx]
+            y_val = self._value_at(filtered_y_data.get(var), idx)
+            if y_val is not None:
                 color = self.lines[var].opts['pen'].color().name()
                 y_fmt = self._format_value(var, y_val)
                 html += f"<span style='color: {color}; font-weight: bold;'>{var}: {y_fmt}</span><br/>"
 
         if len(self.variables) == 2:
-            y1_data = filtered_y_data.get(self.variables[0], [])
-            y2_data = filtered_y_data.get(self.variables[1], [])
-            if y1_data and y2_data and idx < len(y1_data) and idx < len(y2_data):
+            y1_val = self._value_at(filtered_y_data.get(self.variables[0]), idx)
+            y2_val = self._value_at(filtered_y_data.get(self.variables[1]), idx)
+            if y1_val is not None and y2_val is not None:
                 try:
-                    v1, v2 = float(y1_data[idx]), float(y2_data[idx])
+                    v1, v2 = float(y1_val), float(y2_val)
                     if not (np.isnan(v1) or np.isnan(v2)):
                         delta = v2 - v1
                         # Use max decimals of the two variables for delta
@@ -2419,9 +2699,9 @@ class DynamicPlotWidget(QWidget):
         self.crosshair_v.setPos(x_val)
         self.crosshair_v.show()
         # Horizontal crosshair: snap to the reference variable's Y value at this index
-        ref_y_data = filtered_y_data.get(ref_var, [])
-        if ref_y_data and idx < len(ref_y_data):
-            self.crosshair_h.setPos(float(ref_y_data[idx]))
+        ref_y_val = self._value_at(filtered_y_data.get(ref_var), idx)
+        if ref_y_val is not None:
+            self.crosshair_h.setPos(float(ref_y_val))
             self.crosshair_h.show()
         else:
             self.crosshair_h.hide()
@@ -2454,6 +2734,7 @@ class _GraphAreaWithBackground(QWidget):
 class MainWindow(FramelessResizeMixin, QMainWindow):
     data_signal = Signal(str, object)
     status_signal = Signal(str, str, object)  # status_type, message, details
+    offline_task_signal = Signal(object)  # OfflineTask with partial results or finished (from its worker)
 
     def __init__(self):
         super().__init__()
@@ -2733,6 +3014,178 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
         self.recording_trigger_row_widget.setLayout(rec_trigger_row)
         self.recording_trigger_row_widget.setVisible(False)
         recording_layout.addWidget(self.recording_trigger_row_widget)
+        rec_overflow_row = QHBoxLayout()
+        rec_overflow_label = QLabel("Queue full:")
+        rec_overflow_label.setStyleSheet("color: #aaa; font-size: 11px;")
+        rec_overflow_label.setFixedWidth(_label_w)
+        rec_overflow_label.setMinimumHeight(_row_h)
+        rec_overflow_label.setAlignment(Qt.AlignmentFlag.AlignVCenter)
+        self.recording_overflow_combo = QComboBox()
+        self.recording_overflow_combo.addItem("Block acquisition", OVERFLOW_BLOCK)
+        self.recording_overflow_combo.addItem("Drop oldest", OVERFLOW_DROP_OLDEST)
+        self.recording_overflow_combo.addItem("Spill to disk", OVERFLOW_SPILL)
+        self.recording_overflow_combo.setStyleSheet("background-color: #444; color: white; border: 1px solid #555; padding: 5px;")
+        self.recording_overflow_combo.setMinimumHeight(_row_h)
+        self.recording_overflow_combo.setToolTip(
+            "What to do when the recording writer falls behind and its queue is full.\n"
+            "Block: PLC reads wait for the disk (no data loss).\n"
+            "Drop oldest: discard the oldest queued cycle (PLC reads never wait).\n"
+            "Spill to disk: append to a spill file and replay it when the writer catches up."
+        )
+        rec_overflow_row.addWidget(rec_overflow_label)
+        rec_overflow_row.addWidget(self.recording_overflow_combo)
+        recording_layout.addLayout(rec_overflow_row)
+        rec_schema_row = QHBoxLayout()
+        rec_schema_label = QLabel("Schema:")
+        rec_schema_label.setStyleSheet("color: #aaa; font-size: 11px;")
+        rec_schema_label.setFixedWidth(_label_w)
+        rec_schema_label.setMinimumHeight(_row_h)
+        rec_schema_label.setAlignment(Qt.AlignmentFlag.AlignVCenter)
+        self.recording_schema_combo = QComboBox()
+        self.recording_schema_combo.addItem("Narrow (row per tag)", recording_store.SCHEMA_NARROW)
+        self.recording_schema_combo.addItem("Compact (tag dictionary)", recording_store.SCHEMA_COMPACT)
+        self.recording_schema_combo.addItem("Wide (row per cycle)", recording_store.SCHEMA_WIDE)
+        self.recording_schema_combo.setStyleSheet("background-color: #444; color: white; border: 1px solid #555; padding: 5px;")
+        self.recording_schema_combo.setMinimumHeight(_row_h)
+        self.recording_schema_combo.setToolTip(
+            "Table layout of the daily recording file.\n"
+            "Narrow: one row per variable per cycle (exchange_variables, the layout read by external tools).\n"
+            "Compact: one row per variable per cycle with tag ids, native types and ms timestamps (smallest);\n"
+            "tools reading exchange_variables directly do not see it.\n"
+            "Wide: one row per cycle with one typed column per variable (exchange_cycles);\n"
+            "smaller files and faster offline loading. Every layout is read transparently."
+        )
+        rec_schema_row.addWidget(rec_schema_label)
+        rec_schema_row.addWidget(self.recording_schema_combo)
+        recording_layout.addLayout(rec_schema_row)
+        rec_compaction_row = QHBoxLayout()
+        rec_compaction_label = QLabel("Closed days:")
+        rec_compaction_label.setStyleSheet("color: #aaa; font-size: 11px;")
+        rec_compaction_label.setFixedWidth(_label_w)
+        rec_compaction_label.setMinimumHeight(_row_h)
+        rec_compaction_label.setAlignment(Qt.AlignmentFlag.AlignVCenter)
+        self.recording_compaction_combo = QComboBox()
+        self.recording_compaction_combo.addItem("No compaction", "")
+        self.recording_compaction_combo.addItem("Parquet, keep .duckdb", "keep")
+        self.recording_compaction_combo.addItem("Parquet, archive .duckdb", "archive")
+        self.recording_compaction_combo.addItem("Parquet, delete .duckdb", "delete")
+        self.recording_compaction_combo.setStyleSheet("background-color: #444; color: white; border: 1px solid #555; padding: 5px;")
+        self.recording_compaction_combo.setMinimumHeight(_row_h)
+        self.recording_compaction_combo.setToolTip(
+            "At midnight the closed day file is rewritten as zstd Parquet in parquet/date=YYYY-MM-DD/.\n"
+            "Keep: leave the .duckdb file in place (the day then takes about twice the disk space).\n"
+            "Archive: move it to archive/. Delete: remove it once verified.\n"
+            "A day already compacted from another file (e.g. a custom recording name) is not overwritten.\n"
+            "Parquet days show up in Offline history and load like .duckdb files."
+        )
+        rec_compaction_row.addWidget(rec_compaction_label)
+        rec_compaction_row.addWidget(self.recording_compaction_combo)
+        recording_layout.addLayout(rec_compaction_row)
+        rec_compression_row = QHBoxLayout()
+        rec_compression_label = QLabel("Compression:")
+        rec_compression_label.setStyleSheet("color: #aaa; font-size: 11px;")
+        rec_compression_label.setFixedWidth(_label_w)
+        rec_compression_label.setMinimumHeight(_row_h)
+        rec_compression_label.setAlignment(Qt.AlignmentFlag.AlignVCenter)
+        self.recording_compression_combo = QComboBox()
+        self.recording_compression_combo.addItem("Per variable (CSV)", "csv")
+        self.recording_compression_combo.addItem("Off (lossless)", "")
+        self.recording_compression_combo.setStyleSheet("background-color: #444; color: white; border: 1px solid #555; padding: 5px;")
+        self.recording_compression_combo.setMinimumHeight(_row_h)
+        self.recording_compression_combo.setToolTip(
+            "Per variable: use the Compression / CompDev columns of the variable CSVs.\n"
+            "deadband: store a sample when it moves more than CompDev (deadband_pct: % of Max - Min); read back as steps.\n"
+            "swinging_door: store the samples needed to stay within CompDev of a straight line; read back linearly.\n"
+            f"Compressed variables still store a sample every {compression.DEFAULT_MAX_INTERVAL_SEC / 60:.0f} min. "
+            "Dose_number and variables without a setting are recorded losslessly.\n"
+            "Not applied to the Wide schema."
+        )
+        rec_compression_row.addWidget(rec_compression_label)
+        rec_compression_row.addWidget(self.recording_compression_combo)
+        recording_layout.addLayout(rec_compression_row)
+        rec_modes_row = QHBoxLayout()
+        rec_modes_label = QLabel("Tag rates:")
+        rec_modes_label.setStyleSheet("color: #aaa; font-size: 11px;")
+        rec_modes_label.setFixedWidth(_label_w)
+        rec_modes_label.setMinimumHeight(_row_h)
+        rec_modes_label.setAlignment(Qt.AlignmentFlag.AlignVCenter)
+        self.recording_modes_combo = QComboBox()
+        self.recording_modes_combo.addItem("Per variable (CSV)", "csv")
+        self.recording_modes_combo.addItem("Off (all tags as above)", "")
+        self.recording_modes_combo.setStyleSheet("background-color: #444; color: white; border: 1px solid #555; padding: 5px;")
+        self.recording_modes_combo.setMinimumHeight(_row_h)
+        self.recording_modes_combo.setToolTip(
+            "Per variable: use the Record column of the variable CSVs to choose what is recorded and how often.\n"
+            "off = not recorded, 10Hz / 100ms / 2s = own rate (limited by the communication speed),\n"
+            "change = when the value changes, edge = when a status bit switches.\n"
+            "Variables without a Record value follow the Reference / Interval settings above."
+        )
+        rec_modes_row.addWidget(rec_modes_label)
+        rec_modes_row.addWidget(self.recording_modes_combo)
+        recording_layout.addLayout(rec_modes_row)
+        rec_states_row = QHBoxLayout()
+        rec_states_label = QLabel("States:")
+        rec_states_label.setStyleSheet("color: #aaa; font-size: 11px;")
+        rec_states_label.setFixedWidth(_label_w)
+        rec_states_label.setMinimumHeight(_row_h)
+        rec_states_label.setAlignment(Qt.AlignmentFlag.AlignVCenter)
+        self.recording_states_combo = QComboBox()
+        self.recording_states_combo.addItem("Samples (every recorded cycle)", "")
+        self.recording_states_combo.addItem("Intervals (BOOL / Record = state)", "intervals")
+        self.recording_states_combo.setStyleSheet("background-color: #444; color: white; border: 1px solid #555; padding: 5px;")
+        self.recording_states_combo.setMinimumHeight(_row_h)
+        self.recording_states_combo.setToolTip(
+            "Intervals: BOOL variables (and variables with Record = state in the CSVs) are stored as\n"
+            "state intervals (state, start, end) written at each change instead of one row per cycle.\n"
+            "Durations, transitions and time in state per day are then quick to query; plots show them as steps.\n"
+            "Not used with the Wide layout."
+        )
+        rec_states_row.addWidget(rec_states_label)
+        rec_states_row.addWidget(self.recording_states_combo)
+        recording_layout.addLayout(rec_states_row)
+        rec_journal_row = QHBoxLayout()
+        rec_journal_label = QLabel("Hot store:")
+        rec_journal_label.setStyleSheet("color: #aaa; font-size: 11px;")
+        rec_journal_label.setFixedWidth(_label_w)
+        rec_journal_label.setMinimumHeight(_row_h)
+        rec_journal_label.setAlignment(Qt.AlignmentFlag.AlignVCenter)
+        self.recording_journal_combo = QComboBox()
+        self.recording_journal_combo.addItem("Off (write DuckDB directly)", "")
+        self.recording_journal_combo.addItem("Frame journal (crash-safe)", "journal")
+        self.recording_journal_combo.setStyleSheet("background-color: #444; color: white; border: 1px solid #555; padding: 5px;")
+        self.recording_journal_combo.setMinimumHeight(_row_h)
+        self.recording_journal_combo.setToolTip(
+            "Frame journal: each DB is read as one byte frame and recorded cycles are appended to a\n"
+            "memory-mapped journal (external/journal/), synced every second. A background converter\n"
+            "writes them to the day file; after a power cut the journal is replayed on the next start.\n"
+            "PLC reads never wait for the database (the overflow policy then only applies to the converter)."
+        )
+        rec_journal_row.addWidget(rec_journal_label)
+        rec_journal_row.addWidget(self.recording_journal_combo)
+        recording_layout.addLayout(rec_journal_row)
+        rec_checkpoint_row = QHBoxLayout()
+        rec_checkpoint_label = QLabel("Checkpoint:")
+        rec_checkpoint_label.setStyleSheet("color: #aaa; font-size: 11px;")
+        rec_checkpoint_label.setFixedWidth(_label_w)
+        rec_checkpoint_label.setMinimumHeight(_row_h)
+        rec_checkpoint_label.setAlignment(Qt.AlignmentFlag.AlignVCenter)
+        self.recording_checkpoint_combo = QComboBox()
+        # data: "<WAL MB>:<max seconds>"
+        self.recording_checkpoint_combo.addItem("Balanced (16 MB WAL / 60 s)", "16:60")
+        self.recording_checkpoint_combo.addItem("Durable (4 MB WAL / 10 s)", "4:10")
+        self.recording_checkpoint_combo.addItem("Fewer stalls (64 MB WAL / 5 min)", "64:300")
+        self.recording_checkpoint_combo.setStyleSheet("background-color: #444; color: white; border: 1px solid #555; padding: 5px;")
+        self.recording_checkpoint_combo.setMinimumHeight(_row_h)
+        self.recording_checkpoint_combo.setToolTip(
+            "When the recorder writes its write-ahead log (WAL) into the day file: when the WAL reaches\n"
+            "the size or after the time, whichever comes first (earlier when the recorder is idle).\n"
+            "Smaller values lose less after a power cut; larger ones mean fewer, longer checkpoints.\n"
+            "Checkpoints run in the recorder thread, never in the PLC read loop; duration and WAL size\n"
+            "are shown in the communication panel."
+        )
+        rec_checkpoint_row.addWidget(rec_checkpoint_label)
+        rec_checkpoint_row.addWidget(self.recording_checkpoint_combo)
+        recording_layout.addLayout(rec_checkpoint_row)
         connection_frame_layout.addWidget(self.recording_section)
         self.recording_section.setVisible(False)
 
@@ -2884,7 +3337,7 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
             QPushButton:hover { background-color: #2580b8; }
             QPushButton:pressed { background-color: #0d5a8a; }
         """)
-        self.offline_load_csv_btn.setToolTip("Load a CSV file into memory for plotting")
+        self.offline_load_csv_btn.setToolTip("Load a CSV file for plotting (imported into a disk workspace)")
         self.offline_load_csv_btn.clicked.connect(self.load_offline_csv)
         btn_row.addWidget(self.offline_load_csv_btn)
 
@@ -2900,6 +3353,30 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
         btn_row.addWidget(self.offline_load_db_btn)
         offline_main.addLayout(btn_row)
 
+        # Row 1b: DuckDB memory limit of the CSV workspaces (imported on disk, spilled above the limit)
+        workspace_row = QHBoxLayout()
+        workspace_row.setSpacing(4)
+        workspace_label = QLabel("CSV workspace RAM:")
+        workspace_label.setStyleSheet("color: #aaa; font-size: 10px;")
+        workspace_row.addWidget(workspace_label)
+        self.offline_memory_limit_spin = QDoubleSpinBox()
+        self.offline_memory_limit_spin.setRange(0.0, 256.0)
+        self.offline_memory_limit_spin.setDecimals(1)
+        self.offline_memory_limit_spin.setSingleStep(0.5)
+        self.offline_memory_limit_spin.setSuffix(" GB")
+        self.offline_memory_limit_spin.setSpecialValueText("auto")
+        self.offline_memory_limit_spin.setValue(offline_workspace.DEFAULT_MEMORY_LIMIT_MB / 1024)
+        self.offline_memory_limit_spin.setStyleSheet(
+            "background-color: #1e1e1e; color: #ccc; border: 1px solid #3e3e42; border-radius: 3px; font-size: 10px; padding: 2px 4px;"
+        )
+        self.offline_memory_limit_spin.setToolTip(
+            "CSV files are imported once into a DuckDB file in the temp folder (reused while the CSV is unchanged).\n"
+            "DuckDB keeps at most this much RAM and spills to disk above it ('auto' = DuckDB default, 80% of RAM)."
+        )
+        workspace_row.addWidget(self.offline_memory_limit_spin)
+        workspace_row.addStretch()
+        offline_main.addLayout(workspace_row)
+
         # Row 2: Recording history (available daily .duckdb files)
         history_frame = QFrame()
         history_frame.setStyleSheet("""
@@ -2921,6 +3398,7 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
         """)
         self.offline_history_list.setToolTip("Double-click a day to load it, or select and click 'Load Selected Day'")
         self.offline_history_list.itemDoubleClicked.connect(self._load_selected_history_day)
+        self.offline_history_list.currentRowChanged.connect(self._on_history_day_selected)
         history_layout.addWidget(self.offline_history_list)
         history_btn_row = QHBoxLayout()
         history_btn_row.setSpacing(4)
@@ -2942,8 +3420,130 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
         history_btn_row.addWidget(self.offline_refresh_btn)
         history_btn_row.addStretch()
         history_layout.addLayout(history_btn_row)
+        # Cross-day range: loads every recording the From/To span touches as one table
+        _range_edit_style = "QDateTimeEdit { background-color: #1e1e1e; color: #ccc; border: 1px solid #3e3e42; border-radius: 3px; font-size: 10px; padding: 2px 4px; }"
+        _range_label_style = "color: #aaa; font-size: 10px; border: none;"
+        today_start = datetime.combine(datetime.now().date(), datetime.min.time())
+        history_range_row = QHBoxLayout()
+        history_range_row.setSpacing(4)
+        range_from_label = QLabel("From:")
+        range_from_label.setStyleSheet(_range_label_style)
+        history_range_row.addWidget(range_from_label)
+        self.offline_range_from_edit = QDateTimeEdit(QDateTime(today_start))
+        self.offline_range_from_edit.setDisplayFormat("dd/MM/yyyy HH:mm")
+        self.offline_range_from_edit.setCalendarPopup(True)
+        self.offline_range_from_edit.setStyleSheet(_range_edit_style)
+        history_range_row.addWidget(self.offline_range_from_edit, 1)
+        range_to_label = QLabel("To:")
+        range_to_label.setStyleSheet(_range_label_style)
+        history_range_row.addWidget(range_to_label)
+        self.offline_range_to_edit = QDateTimeEdit(QDateTime(today_start + timedelta(days=1) - timedelta(seconds=1)))
+        self.offline_range_to_edit.setDisplayFormat("dd/MM/yyyy HH:mm")
+        self.offline_range_to_edit.setCalendarPopup(True)
+        self.offline_range_to_edit.setStyleSheet(_range_edit_style)
+        history_range_row.addWidget(self.offline_range_to_edit, 1)
+        history_layout.addLayout(history_range_row)
+        self.offline_load_range_btn = QPushButton("Load Range")
+        self.offline_load_range_btn.setCursor(Qt.PointingHandCursor)
+        self.offline_load_range_btn.setStyleSheet("""
+            QPushButton { background-color: #3a5a3a; color: white; font-size: 10px; padding: 4px 8px; border: none; border-radius: 3px; }
+            QPushButton:hover { background-color: #4a6a4a; }
+        """)
+        self.offline_load_range_btn.setToolTip(
+            "Load all recordings between From and To as one table (spans midnight and several days).\n"
+            "Selecting a day in the list presets the range to that day."
+        )
+        self.offline_load_range_btn.clicked.connect(self._load_history_range)
+        history_btn_row.insertWidget(history_btn_row.count() - 1, self.offline_load_range_btn)
+        self.offline_load_doses_btn = QPushButton("Load Doses")
+        self.offline_load_doses_btn.setCursor(Qt.PointingHandCursor)
+        self.offline_load_doses_btn.setStyleSheet("""
+            QPushButton { background-color: #3a4a5a; color: white; font-size: 10px; padding: 4px 8px; border: none; border-radius: 3px; }
+            QPushButton:hover { background-color: #4a5a6a; }
+        """)
+        self.offline_load_doses_btn.setToolTip(
+            "Load one row per completed dose between From and To (dose table written by the recorder):\n"
+            "every tag's value at the dose transition and the recipe of the dose.\n"
+            "Plot against Dose_number; the Analytics window then gives per-dose statistics."
+        )
+        self.offline_load_doses_btn.clicked.connect(self._load_history_doses)
+        history_btn_row.insertWidget(history_btn_row.count() - 1, self.offline_load_doses_btn)
         offline_main.addWidget(history_frame)
 
+        # Row 2b: Storage usage and retention policy (applied by a background RetentionJob)
+        storage_frame = QFrame()
+        storage_frame.setStyleSheet("""
+            QFrame { background-color: #2d2d30; border: 1px solid #3e3e42; border-radius: 4px; }
+        """)
+        storage_layout = QVBoxLayout(storage_frame)
+        storage_layout.setContentsMargins(6, 6, 6, 6)
+        storage_layout.setSpacing(4)
+        storage_title = QLabel("Storage & Retention")
+        storage_title.setStyleSheet("font-weight: bold; color: #aaa; font-size: 10px; border: none;")
+        storage_layout.addWidget(storage_title)
+        self.offline_storage_label = QLabel("Usage: --")
+        self.offline_storage_label.setStyleSheet("color: #6a9; font-size: 10px; border: none;")
+        self.offline_storage_label.setWordWrap(True)
+        storage_layout.addWidget(self.offline_storage_label)
+        _spin_style = "background-color: #1e1e1e; color: #ccc; border: 1px solid #3e3e42; border-radius: 3px; font-size: 10px; padding: 2px 4px;"
+        _storage_label_style = "color: #aaa; font-size: 10px; border: none;"
+        retention_row = QHBoxLayout()
+        retention_row.setSpacing(4)
+        raw_label = QLabel("Raw:")
+        raw_label.setStyleSheet(_storage_label_style)
+        retention_row.addWidget(raw_label)
+        self.retention_raw_days_spin = QSpinBox()
+        self.retention_raw_days_spin.setRange(0, 3650)
+        self.retention_raw_days_spin.setSuffix(" d")
+        self.retention_raw_days_spin.setSpecialValueText("forever")
+        self.retention_raw_days_spin.setValue(retention.RetentionPolicy.raw_days)
+        self.retention_raw_days_spin.setStyleSheet(_spin_style)
+        self.retention_raw_days_spin.setToolTip("Days of raw samples and arrays to keep; older days keep only their 1 min / 15 min rollups.")
+        retention_row.addWidget(self.retention_raw_days_spin, 1)
+        rollup_label = QLabel("Rollups:")
+        rollup_label.setStyleSheet(_storage_label_style)
+        retention_row.addWidget(rollup_label)
+        self.retention_rollup_days_spin = QSpinBox()
+        self.retention_rollup_days_spin.setRange(0, 36500)
+        self.retention_rollup_days_spin.setSuffix(" d")
+        self.retention_rollup_days_spin.setSpecialValueText("forever")
+        self.retention_rollup_days_spin.setValue(retention.RetentionPolicy.rollup_days)
+        self.retention_rollup_days_spin.setStyleSheet(_spin_style)
+        self.retention_rollup_days_spin.setToolTip("Days after which a recording day is deleted completely.")
+        retention_row.addWidget(self.retention_rollup_days_spin, 1)
+        quota_label = QLabel("Quota:")
+        quota_label.setStyleSheet(_storage_label_style)
+        retention_row.addWidget(quota_label)
+        self.retention_quota_spin = QDoubleSpinBox()
+        self.retention_quota_spin.setRange(0.0, 10000.0)
+        self.retention_quota_spin.setDecimals(1)
+        self.retention_quota_spin.setSuffix(" GB")
+        self.retention_quota_spin.setSpecialValueText("none")
+        self.retention_quota_spin.setStyleSheet(_spin_style)
+        self.retention_quota_spin.setToolTip(
+            "Hard limit for all recordings. Above it the oldest days are reduced to rollups, then deleted.\n"
+            "Today's file is never touched."
+        )
+        retention_row.addWidget(self.retention_quota_spin, 1)
+        storage_layout.addLayout(retention_row)
+        retention_btn_row = QHBoxLayout()
+        retention_btn_row.setSpacing(4)
+        self.retention_apply_btn = QPushButton("Apply Policy")
+        self.retention_apply_btn.setCursor(Qt.PointingHandCursor)
+        self.retention_apply_btn.setStyleSheet("""
+            QPushButton { background-color: #444; color: #ccc; font-size: 10px; padding: 4px 8px; border: none; border-radius: 3px; }
+            QPushButton:hover { background-color: #555; }
+        """)
+        self.retention_apply_btn.setToolTip(
+            "Save the policy and apply it now in the background, then every hour (shows what will be removed first).\n"
+            "Nothing is removed until a policy is applied; all limits at 0 disable retention."
+        )
+        self.retention_apply_btn.clicked.connect(self._apply_retention_policy)
+        retention_btn_row.addWidget(self.retention_apply_btn)
+        retention_btn_row.addStretch()
+        storage_layout.addLayout(retention_btn_row)
+        offline_main.addWidget(storage_frame)
+
         # Row 3: Status labels (loaded file + memory)
         self.offline_path_label = QLabel("No file loaded")
         self.offline_path_label.setStyleSheet("color: #888; font-size: 10px;")
@@ -2954,12 +3554,50 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
         self.offline_memory_label.setWordWrap(True)
         offline_main.addWidget(self.offline_memory_label)
 
+        # Row 4: Progress of the background loads / graph queries (hidden when idle)
+        self.offline_progress_frame = QWidget()
+        progress_row = QHBoxLayout(self.offline_progress_frame)
+        progress_row.setContentsMargins(0, 0, 0, 0)
+        progress_row.setSpacing(4)
+        self.offline_progress_label = QLabel("")
+        self.offline_progress_label.setStyleSheet("color: #aaa; font-size: 10px;")
+        progress_row.addWidget(self.offline_progress_label)
+        self.offline_progress_bar = QProgressBar()
+        self.offline_progress_bar.setRange(0, 1000)
+        self.offline_progress_bar.setTextVisible(False)
+        self.offline_progress_bar.setFixedHeight(8)
+        self.offline_progress_bar.setStyleSheet("""
+            QProgressBar { background-color: #1e1e1e; border: 1px solid #3e3e42; border-radius: 3px; }
+            QProgressBar::chunk { background-color: #1a6fa5; border-radius: 2px; }
+        """)
+        progress_row.addWidget(self.offline_progress_bar, 1)
+        self.offline_cancel_btn = QPushButton("Cancel")
+        self.offline_cancel_btn.setCursor(Qt.PointingHandCursor)
+        self.offline_cancel_btn.setStyleSheet("""
+            QPushButton { background-color: #444; color: #ccc; font-size: 10px; padding: 2px 8px; border: none; border-radius: 3px; }
+            QPushButton:hover { background-color: #cc3333; color: white; }
+        """)
+        self.offline_cancel_btn.setToolTip("Stop the running offline loads and graph queries.")
+        self.offline_cancel_btn.clicked.connect(self._cancel_offline_tasks)
+        progress_row.addWidget(self.offline_cancel_btn)
+        self.offline_progress_frame.hide()
+        offline_main.addWidget(self.offline_progress_frame)
+
         self.load_popup = LoadPopup(self.offline_panel, self)
 
         # Offline state: DuckDB connection and column list (set when CSV loaded)
         self.offline_db = None
+        self.offline_cache = None  # OfflineColumnCache of an attached recording (None: offline_data table)
+        self.offline_filtered_sql = None  # (conn, columns, OfflineFilter) -> SQL of a filtered graph's rows
         self.offline_csv_path = None
+        self.offline_workspace = None  # workspace file of the loaded CSV (offline_workspace)
         self.offline_columns = []
+        # Loads and graph queries run in worker threads; results come back through offline_task_signal
+        self.offline_tasks = OfflineTaskRunner(self.offline_task_signal.emit)
+        self._offline_task_handlers = {}  # OfflineTask -> (on_partial, on_done)
+        self.offline_progress_timer = QTimer()
+        self.offline_progress_timer.setInterval(100)
+        self.offline_progress_timer.timeout.connect(self._update_offline_progress)
 
         self.lbl_vars = QLabel("DATA POINTS")
         self.lbl_vars.setStyleSheet("font-weight: bold; font-size: 12px; color: #888; margin-bottom: 5px; margin-top: 10px;")
@@ -3051,11 +3689,14 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
         self.disconnect_btn.clicked.connect(self.disconnect_plc)
         self.data_signal.connect(self.update_plot)
         self.status_signal.connect(self.update_comm_status)
+        self.offline_task_signal.connect(self._on_offline_task_event)
         self.speed_input.editingFinished.connect(self.update_speed_while_connected)
         self.on_device_type_changed(self.device_type_combo.currentText())
         self._update_variable_path_display()
         self._load_last_config()
         self._during_init = False
+        if self._retention_enabled():
+            self._start_retention_job()
         self._apply_graph_background_theme()
 
         # Subtle RAM usage indicator (bottom-left, almost hidden)
@@ -3107,6 +3748,56 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
         speed = s.value("speed")
         if speed:
             self.speed_input.setText(speed)
+        overflow = s.value("recording_overflow_policy")
+        if overflow:
+            idx = self.recording_overflow_combo.findData(overflow)
+            if idx >= 0:
+                self.recording_overflow_combo.setCurrentIndex(idx)
+        schema = s.value("recording_schema")
+        if schema:
+            idx = self.recording_schema_combo.findData(schema)
+            if idx >= 0:
+                self.recording_schema_combo.setCurrentIndex(idx)
+        for key, spin, cast in (("retention_raw_days", self.retention_raw_days_spin, int),
+                                ("retention_rollup_days", self.retention_rollup_days_spin, int),
+                                ("retention_quota_gb", self.retention_quota_spin, float),
+                                ("offline_memory_limit_gb", self.offline_memory_limit_spin, float)):
+            value = s.value(key)
+            if value is not None:
+                try:
+                    spin.setValue(cast(value))
+                except (TypeError, ValueError):
+                    pass
+        compaction = s.value("recording_compaction")
+        if compaction is not None:
+            idx = self.recording_compaction_combo.findData(compaction)
+            if idx >= 0:
+                self.recording_compaction_combo.setCurrentIndex(idx)
+        rec_modes = s.value("recording_modes")
+        if rec_modes is not None:
+            idx = self.recording_modes_combo.findData(rec_modes)
+            if idx >= 0:
+                self.recording_modes_combo.setCurrentIndex(idx)
+        rec_checkpoint = s.value("recording_checkpoint")
+        if rec_checkpoint is not None:
+            idx = self.recording_checkpoint_combo.findData(rec_checkpoint)
+            if idx >= 0:
+                self.recording_checkpoint_combo.setCurrentIndex(idx)
+        rec_states = s.value("recording_states")
+        if rec_states is not None:
+            idx = self.recording_states_combo.findData(rec_states)
+            if idx >= 0:
+                self.recording_states_combo.setCurrentIndex(idx)
+        rec_journal = s.value("recording_journal")
+        if rec_journal is not None:
+            idx = self.recording_journal_combo.findData(rec_journal)
+            if idx >= 0:
+                self.recording_journal_combo.setCurrentIndex(idx)
+        rec_compression = s.value("recording_compression")
+        if rec_compression is not None:
+            idx = self.recording_compression_combo.findData(rec_compression)
+            if idx >= 0:
+                self.recording_compression_combo.setCurrentIndex(idx)
         # Restore Connection section collapsed state
         conn_collapsed = s.value("connection_section_collapsed", False)
         if isinstance(conn_collapsed, str):
@@ -3134,6 +3825,18 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
         s.setValue("exchange_path", self.exchange_variables_path or "")
         s.setValue("recipe_path", self.recipe_variables_path or "")
         s.setValue("speed", self.speed_input.text().strip())
+        s.setValue("recording_overflow_policy", self.recording_overflow_combo.currentData() or OVERFLOW_BLOCK)
+        s.setValue("recording_schema", self.recording_schema_combo.currentData() or recording_store.SCHEMA_NARROW)
+        s.setValue("recording_compaction", self.recording_compaction_combo.currentData() or "")
+        s.setValue("recording_compression", self.recording_compression_combo.currentData() or "")
+        s.setValue("recording_journal", self.recording_journal_combo.currentData() or "")
+        s.setValue("recording_modes", self.recording_modes_combo.currentData() or "")
+        s.setValue("recording_states", self.recording_states_combo.currentData() or "")
+        s.setValue("recording_checkpoint", self.recording_checkpoint_combo.currentData() or "")
+        s.setValue("retention_raw_days", self.retention_raw_days_spin.value())
+        s.setValue("retention_rollup_days", self.retention_rollup_days_spin.value())
+        s.setValue("retention_quota_gb", self.retention_quota_spin.value())
+        s.setValue("offline_memory_limit_gb", self.offline_memory_limit_spin.value())
         s.sync()
 
     def _set_default_db_filename(self):
@@ -3245,7 +3948,8 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
             "read_error": None,             # ADS: last variable read failure (e.g. symbol not found)
             "ip_address": None,
             "last_interval_ms": None,      # Actual time between last two received packages (ms)
-            "requested_interval_ms": None  # Requested cycle time (ms), e.g. 50 for 50ms
+            "requested_interval_ms": None, # Requested cycle time (ms), e.g. 50 for 50ms
+            "recorder": None               # Recording writer queue/drop counters (Snap7 only)
         }
 
     def create_comm_info_panel(self):
@@ -3319,6 +4023,14 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
         self.comm_db_size_label.setToolTip("Current recording database disk size (today's .duckdb file)")
         content_layout.addWidget(self.comm_db_size_label)
 
+        self.comm_recorder_label = QLabel("Rec queue: --")
+        self.comm_recorder_label.setStyleSheet("color: #aaa; font-size: 10px;")
+        self.comm_recorder_label.setToolTip(
+            "Recording writer queue depth (current / capacity), peak depth, dropped and spilled cycles, "
+            "and duration of the last batch insert."
+        )
+        content_layout.addWidget(self.comm_recorder_label)
+
         self.comm_message_label = QLabel("")
         self.comm_message_label.setStyleSheet("color: #888; font-size: 10px;")
         self.comm_message_label.setWordWrap(True)
@@ -3354,17 +4066,68 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
 
     def _unload_offline_data(self):
         """Unload offline DuckDB/CSV and clear variable list for Online mode."""
+        self.offline_tasks.cancel_all()
         if self.offline_db:
             try:
                 self.offline_db.close()
             except Exception:
                 pass
             self.offline_db = None
+        self.offline_cache = None
+        self.offline_filtered_sql = None
         self.offline_csv_path = None
+        self.offline_workspace = None
         self.offline_columns = []
         self.offline_path_label.setText("No file loaded")
         self.offline_memory_label.setText("")
 
+    def _submit_offline_task(self, label, fn, *args, on_partial=None, on_done=None):
+        """
+        Run fn(task, *args) in the offline worker pool (see offline_tasks) with the progress row shown.
+        on_partial(task, partial) and on_done(task) are called on the GUI thread.
+        """
+        task = self.offline_tasks.submit(label, fn, *args)
+        self._offline_task_handlers[task] = (on_partial, on_done)
+        self._update_offline_progress()
+        self.offline_progress_timer.start()
+        return task
+
+    @Slot(object)
+    def _on_offline_task_event(self, task):
+        """Partial results or end of a background offline task (queued from its worker thread)."""
+        on_partial, on_done = self._offline_task_handlers.get(task, (None, None))
+        for partial in task.take_partials():
+            if on_partial is None or task.cancelled:
+                continue
+            try:
+                on_partial(task, partial)
+            except Exception as e:
+                logging.error(f"{task.label} failed: {e}")
+                task.cancel()
+        if task.done and not task.reported:
+            task.reported = True
+            self._offline_task_handlers.pop(task, None)
+            if on_done is not None:
+                on_done(task)
+            self._update_offline_progress()
+
+    def _update_offline_progress(self):
+        """Progress row of the offline panel: label and mean progress of the running tasks (hidden when idle)."""
+        tasks = self.offline_tasks.active()
+        if not tasks:
+            self.offline_progress_timer.stop()
+            self.offline_progress_frame.hide()
+            return
+        more = f" (+{len(tasks) - 1})" if len(tasks) > 1 else ""
+        self.offline_progress_label.setText(tasks[0].label + more)
+        self.offline_progress_bar.setValue(int(1000 * sum(t.progress() for t in tasks) / len(tasks)))
+        self.offline_progress_frame.show()
+
+    def _cancel_offline_tasks(self):
+        """Cancel button: interrupt the running loads / graph queries (their results are dropped)."""
+        self.offline_tasks.cancel_all()
+        self._update_offline_progress()
+
     def _set_offline_mode(self, active):
         """Set offline mode and update sidebar + variable list."""
         self._offline_mode_active = active
@@ -3415,7 +4178,7 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
         self.recording_trigger_row_widget.setVisible(ref == "variable")
 
     def _refresh_offline_history(self):
-        """Scan external/ for Data_DDMMYYYY.duckdb files and populate the history list with sizes."""
+        """Scan external/ for Data_DDMMYYYY.duckdb files and Parquet days and populate the history list with sizes."""
         self.offline_history_list.clear()
         ext_dir = os.path.join(os.path.dirname(__file__), "external")
         self._offline_db_files = list_recording_db_files(ext_dir)
@@ -3428,8 +4191,21 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
                 day_label += "  (today)"
             elif day_label == 'legacy':
                 day_label = "legacy (automation_data.db)"
+            if entry.get('kind') == 'parquet':
+                day_label += "  (Parquet)"
             text = f"{day_label}    {entry['size_label']}"
+            stats = entry.get('stats')
+            t0, t1 = catalog.entry_time_range(stats)
+            if t0 is not None and stats.get('row_count'):
+                text += f"    {t0.strftime('%H:%M')}–{t1.strftime('%H:%M')}    {stats['row_count']:,} rows"
+            elif t0 is not None and stats.get('rollup_levels'):
+                text += f"    {t0.strftime('%H:%M')}–{t1.strftime('%H:%M')}    rollups only"
             self.offline_history_list.addItem(text)
+            if stats:
+                self.offline_history_list.item(self.offline_history_list.count() - 1).setToolTip(
+                    f"{entry['path']}\n{len(stats.get('variables', []))} variables, "
+                    f"{stats.get('timestamp_count', 0):,} time points"
+                )
             total_bytes += entry['size_bytes']
         # Update total history size label
         n_files = len(self._offline_db_files)
@@ -3442,7 +4218,20 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
     def _update_offline_memory_label(self, loaded_file_bytes=0, loaded_row_count=0):
         """Update the offline memory label with loaded file info + total history size."""
         # Loaded file info
-        if loaded_file_bytes > 0:
+        self._offline_loaded_info = (loaded_file_bytes, loaded_row_count)
+        if loaded_file_bytes > 0 and self.offline_cache is not None:
+            cache = self.offline_cache
+            loaded_text = (
+                f"Loaded: {_format_size(loaded_file_bytes)} on disk, {loaded_row_count:,} rows, "
+                f"{len(cache)} column{'s' if len(cache) != 1 else ''} in RAM ({_format_size(cache.nbytes)})"
+            )
+        elif loaded_file_bytes > 0 and self.offline_workspace:
+            workspace_bytes = os.path.getsize(self.offline_workspace) if os.path.isfile(self.offline_workspace) else 0
+            loaded_text = (
+                f"Loaded: {_format_size(loaded_file_bytes)} CSV, {loaded_row_count:,} rows "
+                f"in a disk workspace ({_format_size(workspace_bytes)})"
+            )
+        elif loaded_file_bytes > 0:
             loaded_text = f"Loaded: {_format_size(loaded_file_bytes)} on disk, {loaded_row_count:,} rows in RAM"
         else:
             loaded_text = ""
@@ -3472,19 +4261,53 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
         self._load_duckdb_recording(entry['path'])
 
     def load_offline_duckdb_file(self):
-        """Browse for a .duckdb file and load it for offline plotting."""
+        """Browse for a .duckdb file (or a file of a compacted Parquet day) and load it for offline plotting."""
         ext_dir = os.path.join(os.path.dirname(__file__), "external")
         path, _ = QFileDialog.getOpenFileName(
             self, "Select DuckDB recording file", ext_dir,
-            "DuckDB (*.duckdb *.db);;All files (*)"
+            "Recordings (*.duckdb *.db *.parquet);;DuckDB (*.duckdb *.db);;Parquet day (*.parquet);;All files (*)"
         )
         if not path:
             return
         path = os.path.normpath(path)
+        if path.lower().endswith(".parquet"):
+            path = os.path.dirname(path)  # a Parquet day is loaded as its date=YYYY-MM-DD folder
         self._load_duckdb_recording(path)
 
     def _load_duckdb_recording(self, db_path):
-        """Load a .duckdb recording file (read-only) and populate variables for offline plotting."""
+        """Load a .duckdb recording file or Parquet day (read-only) and populate variables for offline plotting."""
+        self._load_recordings([{'path': db_path, 'day': None}], os.path.basename(db_path), db_path)
+
+    def _load_history_range(self):
+        """Load every recording overlapping the From/To range (across days) as one offline table."""
+        t_from = self.offline_range_from_edit.dateTime().toPython()
+        t_to = self.offline_range_to_edit.dateTime().toPython()
+        if t_to <= t_from:
+            self._show_toast("'To' must be after 'From'.")
+            return
+        ext_dir = os.path.join(os.path.dirname(__file__), "external")
+        entries = history.select_recordings(history.find_recordings(ext_dir), t_from, t_to)
+        # Exact pruning on the time ranges cached in the recording catalog (unknown ranges are kept)
+        cached = catalog.load_catalog(ext_dir)
+        kept = []
+        for e in entries:
+            t0, t1 = catalog.entry_time_range(catalog.get_entry(e['path'], refresh=False, files=cached))
+            if t0 is None or (t0 <= t_to and t1 >= t_from):
+                kept.append(e)
+        entries = kept
+        if not entries:
+            self._show_toast("No recordings in the selected range.")
+            return
+        label = f"{t_from.strftime('%d/%m/%Y %H:%M')} → {t_to.strftime('%d/%m/%Y %H:%M')}"
+        self._load_recordings(entries, label, ext_dir, t_from, t_to)
+
+    def _load_history_doses(self):
+        """Load the dose_facts rows of the doses ended between From and To (across days) as the offline table."""
+        t_from = self.offline_range_from_edit.dateTime().toPython()
+        t_to = self.offline_range_to_edit.dateTime().toPython()
+        if t_to <= t_from:
+            self._show_toast("'To' must be after 'From'.")
+            return
         if (self.plc_thread and self.plc_thread.is_alive()) or (self.ads_thread and self.ads_thread.is_alive()) or (self.simulator_thread and self.simulator_thread.isRunning()):
             reply = QMessageBox.question(
                 self, "Disconnect to Load Offline?",
@@ -3494,114 +4317,307 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
             if reply != QMessageBox.Yes:
                 return
             self.disconnect_plc()
-        try:
-            if self.offline_db:
-                try:
-                    self.offline_db.close()
-                except Exception:
-                    pass
-                self.offline_db = None
-
-            # Open read-only so we don't interfere with active recording
-            self.offline_db = duckdb.connect(database=db_path, read_only=True)
+        ext_dir = os.path.join(os.path.dirname(__file__), "external")
+        entries = history.select_recordings(history.find_recordings(ext_dir), t_from, t_to)
+        self.offline_tasks.cancel_all()  # a new load replaces the running ones
+        self._submit_offline_task(
+            "Loading doses…", self._read_history_doses, entries, t_from, t_to,
+            on_done=lambda task: self._finish_history_doses(task, entries, ext_dir, t_from, t_to),
+        )
 
-            # Get variable names from exchange_variables
-            result = self.offline_db.execute(
-                "SELECT DISTINCT variable_name FROM exchange_variables ORDER BY variable_name"
-            ).fetchall()
-            var_names = [row[0] for row in result]
-            if not var_names:
-                QMessageBox.warning(self, "No data", f"No recording data found in:\n{os.path.basename(db_path)}")
+    @staticmethod
+    def _read_history_doses(task, entries, t_from, t_to):
+        """Worker: dose table of the recordings in a new memory DB ({'db', 'var_names', 'n_doses'}, db closed on failure)."""
+        db = duckdb.connect(":memory:")
+        try:
+            cur = task.cursor(db)
+            task.step(0, 2)
+            aliases = history.attach_history(cur, entries)
+            facts_sql = history.history_dose_facts_sql(cur, aliases, t_from, t_to)
+            var_names = history.history_dose_variables(cur, aliases)
+            n_doses = 0
+            if facts_sql:
+                task.step(1, 2)
+                # 'timestamp' (dose end) keeps the time axis; the dose columns get tag-like names
+                tag_cols = ", ".join(recording_store.quote_identifier(v) for v in var_names)
+                cur.execute(
+                    "CREATE TABLE offline_data AS SELECT dose_end AS timestamp, dose_number AS Dose_number, "
+                    f"duration_sec AS Dose_duration_s, cycles AS Dose_cycles{', ' + tag_cols if tag_cols else ''} "
+                    f"FROM ({facts_sql})"
+                )
+                n_doses = cur.execute("SELECT count(*) FROM offline_data").fetchone()[0]
+            history.detach_history(cur, aliases)
+            return {'db': db, 'var_names': var_names, 'n_doses': n_doses}
+        except BaseException:
+            db.close()
+            raise
+
+    def _finish_history_doses(self, task, entries, ext_dir, t_from, t_to):
+        """GUI side of _load_history_doses: replace the offline data with the dose table."""
+        if task.cancelled:
+            if task.result:
+                task.result['db'].close()
+            self._show_toast("Loading cancelled")
+            return
+        if task.error is not None:
+            QMessageBox.warning(self, "Load failed", f"Could not load the dose table:\n{task.error}")
+            return
+        db, var_names, n_doses = task.result['db'], task.result['var_names'], task.result['n_doses']
+        if not n_doses:
+            db.close()
+            self._show_toast("No completed doses recorded in the selected range.")
+            return
+        if self.offline_db:
+            try:
                 self.offline_db.close()
-                self.offline_db = None
-                return
+            except Exception:
+                pass
+        self.offline_db = db
+        self.offline_cache = None
+        self.offline_filtered_sql = self._offline_table_sql
+        self.offline_workspace = None
+        label = f"Doses {t_from.strftime('%d/%m/%Y %H:%M')} → {t_to.strftime('%d/%m/%Y %H:%M')}"
+        self.offline_columns = ['timestamp', 'Dose_number', 'Dose_duration_s', 'Dose_cycles'] + var_names
+        self.offline_csv_path = ext_dir
+        self.var_list.clear()
+        self.all_variables = list(self.offline_columns)
+        for col in self.offline_columns:
+            self.var_list.addItem(col)
+        self.offline_path_label.setText(f"Loaded: {label}")
+        self.offline_path_label.setToolTip("\n".join(e['path'] for e in entries))
+        self._update_offline_memory_label(0, n_doses)
+        self._update_ram_label()
+        self._show_toast(f"Loaded {n_doses:,} doses — {len(var_names)} vars", 4000)
+        self._set_offline_mode(True)
 
-            # Get time range and row count (total rows, not unique timestamps)
-            t_row = self.offline_db.execute(
-                "SELECT min(timestamp), max(timestamp), count(*) FROM exchange_variables"
-            ).fetchone()
-            t_min, t_max, row_count = t_row if t_row else (None, None, 0)
+    def _on_history_day_selected(self, row):
+        """Preset the From/To range to the selected day."""
+        files = getattr(self, '_offline_db_files', None) or []
+        if row < 0 or row >= len(files) or files[row]['date_str'] == 'legacy':
+            return
+        day = files[row]['date']
+        start = datetime.combine(day, datetime.min.time())
+        self.offline_range_from_edit.setDateTime(QDateTime(start))
+        self.offline_range_to_edit.setDateTime(QDateTime(start + timedelta(days=1) - timedelta(seconds=1)))
 
-            # Estimate unique timestamps (pivot rows) and RAM
-            n_vars = len(var_names)
-            try:
-                ts_count = self.offline_db.execute(
-                    "SELECT count(DISTINCT timestamp) FROM exchange_variables"
-                ).fetchone()[0]
-            except Exception:
-                ts_count = row_count // max(n_vars, 1)
-            # RAM estimate: pivot table = ts_count rows x (1 timestamp + n_vars doubles)
-            # ~8 bytes per double + 8 bytes per timestamp + DuckDB overhead (~2x)
-            estimated_ram_bytes = ts_count * (8 + n_vars * 8) * 2
-            estimated_ram_mb = estimated_ram_bytes / (1024 * 1024)
-            current_ram = get_process_ram_mb() or 0
-
-            # Show confirmation with RAM estimate
-            disk_sz = _format_size(os.path.getsize(db_path))
-            time_str = ""
-            if t_min and t_max:
-                time_str = f"\nTime range: {t_min.strftime('%H:%M:%S')} → {t_max.strftime('%H:%M:%S')}"
+    def _load_recordings(self, entries, label, source_path, t_from=None, t_to=None):
+        """
+        Attach one or more recordings (history entries: {'path', 'day'}) read-only, restricted to
+        [t_from, t_to] if given, and populate variables for offline plotting. The recordings are
+        scanned in the background (_scan_recordings); the current offline data stays loaded until
+        the new one is ready. Graphs pivot the columns they plot through self.offline_cache.
+        """
+        if (self.plc_thread and self.plc_thread.is_alive()) or (self.ads_thread and self.ads_thread.is_alive()) or (self.simulator_thread and self.simulator_thread.isRunning()):
             reply = QMessageBox.question(
-                self,
-                "Load recording?",
-                f"{os.path.basename(db_path)}  ({disk_sz} on disk)\n"
-                f"{n_vars} variables, {ts_count:,} time points{time_str}\n\n"
-                f"Estimated RAM for pivot table: ~{estimated_ram_mb:.0f} MB\n"
-                f"Current app RAM: {current_ram:.0f} MB → ~{current_ram + estimated_ram_mb:.0f} MB after load",
-                QMessageBox.StandardButton.Ok | QMessageBox.StandardButton.Cancel,
-                QMessageBox.StandardButton.Ok,
+                self, "Disconnect to Load Offline?",
+                "Disconnect from PLC/simulation to load offline data?",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.No
             )
-            if reply != QMessageBox.StandardButton.Ok:
-                self.offline_db.close()
-                self.offline_db = None
+            if reply != QMessageBox.Yes:
                 return
+            self.disconnect_plc()
+        self.offline_tasks.cancel_all()  # a new load replaces the running ones
+        self._submit_offline_task(
+            f"Loading {label}…", self._scan_recordings, entries, t_from, t_to,
+            on_done=lambda task: self._finish_load_recordings(task, entries, label, source_path, t_from, t_to),
+        )
 
-            # Pivot: create an offline_data table in memory from the recording
-            # Close the read-only connection and create a memory DB that queries the file
-            self.offline_db.close()
-            self.offline_db = duckdb.connect(":memory:")
-            # Attach the recording file as read-only
-            self.offline_db.execute(f"ATTACH '{db_path}' AS rec (READ_ONLY)")
-
-            # Build pivot query: timestamp + each variable as a column
-            var_cols = ", ".join(
-                f"max(CASE WHEN variable_name = '{v}' THEN value END) AS \"{v}\""
-                for v in var_names
+    @staticmethod
+    def _scan_recordings(task, entries, t_from, t_to):
+        """
+        Worker: attach the recordings to a new memory DB and read what the load needs (variables,
+        time range, counts, rollup level). Returns a dict with the connection ('db'), closed on failure.
+        """
+        # Attach read-only to a memory DB so we don't interfere with active recording
+        db = duckdb.connect(":memory:")
+        try:
+            cur = task.cursor(db)
+            task.step(0, 4)
+            aliases = history.attach_history(cur, entries)
+
+            # Whole files: variables, time range and counts come from the recording catalog
+            task.step(1, 4)
+            summary = None
+            if t_from is None and t_to is None:
+                cached = [catalog.get_entry(e['path']) for e in entries]
+                if all(cached) and all(c.get('row_count') for c in cached):
+                    summary = catalog.summarize(cached)
+            if summary:
+                var_names = summary['variables']
+                t_min, t_max = summary['t_min'], summary['t_max']
+            else:
+                # Get variable names (any layout, across all attached recordings)
+                var_names = history.history_variables(cur, aliases)
+                t_min, t_max = history.history_time_range(cur, aliases, t_from, t_to)
+            rollup_only_levels = []
+            if not var_names or t_min is None:
+                # Days past raw-data retention only keep their rollups
+                rollup_only_levels = history.history_rollup_levels(cur, aliases)
+                if rollup_only_levels:
+                    var_names = history.history_rollup_variables(cur, aliases, rollup_only_levels[0])
+                    t_min, t_max = history.history_rollup_time_range(
+                        cur, aliases, rollup_only_levels[0], t_from, t_to
+                    )
+            info = {
+                'db': db, 'aliases': aliases, 'var_names': var_names, 't_min': t_min, 't_max': t_max,
+                'rollup_only_levels': rollup_only_levels, 'row_count': 0, 'ts_count': 0,
+                'rollup_level': None, 'n_buckets': 0,
+                'disk_size': sum(recording_store.recording_disk_size(e['path']) for e in entries),
+            }
+            if not var_names or t_min is None:
+                return info
+
+            # Row count (total rows, not unique timestamps)
+            task.step(2, 4)
+            if rollup_only_levels:
+                row_count = ts_count = 0
+            elif summary:
+                row_count = summary['row_count']
+                ts_count = summary['timestamp_count']
+            else:
+                row_count = history.history_row_count(cur, aliases, t_from, t_to)
+                # Estimate unique timestamps (pivot rows) and RAM
+                try:
+                    ts_count = history.history_timestamp_count(cur, aliases, t_from, t_to)
+                except Exception:
+                    ts_count = row_count // max(len(var_names), 1)
+
+            # Long recordings: offer the finest rollup level that keeps the table small
+            task.step(3, 4)
+            rollup_level = None
+            if rollup_only_levels:
+                # Finest stored level that keeps the table small, else the coarsest
+                rollup_level = rollup_only_levels[-1]
+                for level in rollup_only_levels:
+                    if history.history_bucket_count(cur, aliases, level, t_from, t_to) <= OFFLINE_ROLLUP_THRESHOLD:
+                        rollup_level = level
+                        break
+            elif ts_count > OFFLINE_ROLLUP_THRESHOLD:
+                rollup_level = history.history_pick_level(
+                    cur, aliases, (t_max - t_min).total_seconds(), OFFLINE_ROLLUP_THRESHOLD, t_from, t_to
+                )
+            n_buckets = history.history_bucket_count(cur, aliases, rollup_level, t_from, t_to) if rollup_level else 0
+            info.update(row_count=row_count, ts_count=ts_count, rollup_level=rollup_level, n_buckets=n_buckets)
+            return info
+        except BaseException:
+            db.close()
+            raise
+
+    def _finish_load_recordings(self, task, entries, label, source_path, t_from, t_to):
+        """GUI side of _load_recordings: rollup choice, then replace the offline data with the attached recordings."""
+        if task.cancelled:
+            if task.result:
+                task.result['db'].close()
+            self._show_toast("Loading cancelled")
+            return
+        if task.error is not None:
+            QMessageBox.warning(
+                self, "Load failed",
+                f"Could not load DuckDB recording:\n{task.error}"
             )
-            self.offline_db.execute(f"""
-                CREATE TABLE offline_data AS
-                SELECT timestamp, {var_cols}
-                FROM rec.exchange_variables
-                GROUP BY timestamp
-                ORDER BY timestamp
-            """)
-            self.offline_db.execute("DETACH rec")
+            return
+        info = task.result
+        db, aliases, var_names = info['db'], info['aliases'], info['var_names']
+        t_min, t_max = info['t_min'], info['t_max']
+        rollup_only_levels, rollup_level = info['rollup_only_levels'], info['rollup_level']
+        row_count, ts_count, disk_size = info['row_count'], info['ts_count'], info['disk_size']
+        if not var_names or t_min is None:
+            QMessageBox.warning(self, "No data", f"No recording data found in:\n{label}")
+            db.close()
+            return
+        try:
+            n_vars = len(var_names)
+            # Columns are pivoted when a graph needs them: ~8 bytes per time point each
+            column_ram_mb = ts_count * 8 / (1024 * 1024)
+            use_rollup = False
+            if rollup_only_levels or rollup_level:
+                # Raw data too long (or removed by retention): choose between raw columns and rollup means
+                disk_sz = _format_size(disk_size)
+                time_fmt = '%H:%M:%S' if t_min.date() == t_max.date() else '%d/%m/%Y %H:%M:%S'
+                time_str = f"\nTime range: {t_min.strftime(time_fmt)} → {t_max.strftime(time_fmt)}"
+                files_str = f", {len(aliases)} recordings" if len(aliases) > 1 else ""
+                if rollup_only_levels:
+                    message = (
+                        f"{label}  ({disk_sz} on disk{files_str})\n"
+                        f"{n_vars} variables, rollups only (raw data removed by retention){time_str}"
+                    )
+                else:
+                    message = (
+                        f"{label}  ({disk_sz} on disk{files_str})\n"
+                        f"{n_vars} variables, {ts_count:,} time points{time_str}\n\n"
+                        f"Raw data: ~{column_ram_mb:.0f} MB of RAM per plotted variable"
+                    )
+                box = QMessageBox(self)
+                box.setWindowTitle("Load recording?")
+                box.setIcon(QMessageBox.Icon.Question)
+                ok_btn = None if rollup_only_levels else box.addButton(QMessageBox.StandardButton.Ok)
+                n_buckets = info['n_buckets']
+                message += (
+                    f"\n\nRollup ({rollup_level} mean per bucket): {n_buckets:,} time points, "
+                    f"~{n_buckets * 8 / (1024 * 1024):.1f} MB per plotted variable"
+                )
+                rollup_btn = box.addButton(f"Load {rollup_level} means", QMessageBox.ButtonRole.AcceptRole)
+                box.addButton(QMessageBox.StandardButton.Cancel)
+                box.setDefaultButton(rollup_btn)
+                box.setText(message)
+                box.exec()
+                clicked = box.clickedButton()
+                if clicked is None or clicked not in [b for b in (ok_btn, rollup_btn) if b is not None]:
+                    db.close()
+                    return
+                use_rollup = clicked is rollup_btn
+
+            if self.offline_db:
+                try:
+                    self.offline_db.close()
+                except Exception:
+                    pass
+            self.offline_db = db
+            # The recordings stay attached: graphs pivot the columns they plot (cached, LRU) on their own cursor
+            # (each recording is pivoted on its own layout and kept in its pivot cache on disk,
+            # rollups give one row per bucket)
+            # Filtered graphs skip the cache: their columns and filtered tags are pivoted and filtered in DuckDB
+            if use_rollup:
+                def pivot_sql(conn, names, lo=t_from, hi=t_to):
+                    return history.history_rollup_pivot_sql(conn, aliases, names, rollup_level, t_from=lo, t_to=hi)
+                self.offline_cache = OfflineColumnCache(db, pivot_sql)
+            else:
+                recordings = [(e['path'], history.history_alias(e)) for e in entries if history.history_alias(e) in aliases]
+
+                def load_columns(conn, names):
+                    return pivot_cache.history_columns(conn, recordings, names, t_from, t_to)
+
+                def pivot_sql(conn, names, lo, hi):
+                    return history.history_pivot_sql(conn, aliases, names, lo, hi)
+                self.offline_cache = OfflineColumnCache(db, load_columns=load_columns)
+
+            def filtered_sql(conn, columns, filt):
+                return offline_filters.pivot_filtered_sql(
+                    lambda names, lo, hi: pivot_sql(conn, names, lo, hi), columns, filt, t_from, t_to
+                )
+            self.offline_filtered_sql = filtered_sql
+            self.offline_workspace = None
 
             self.offline_columns = ['timestamp'] + var_names
-            self.offline_csv_path = db_path
+            self.offline_csv_path = source_path
             self.var_list.clear()
             self.all_variables = list(self.offline_columns)
             for col in self.offline_columns:
                 self.var_list.addItem(col)
 
             # Update status
-            fname = os.path.basename(db_path)
-            disk_size = os.path.getsize(db_path)
-            if disk_size < 1024 * 1024:
-                sz = f"{disk_size / 1024:.1f} KB"
-            else:
-                sz = f"{disk_size / (1024 * 1024):.1f} MB"
-            time_info = ""
-            if t_min and t_max:
-                time_info = f"\nTime: {t_min.strftime('%H:%M:%S')} → {t_max.strftime('%H:%M:%S')}"
-            self.offline_path_label.setText(f"Loaded: {fname}")
-            self.offline_path_label.setToolTip(db_path)
+            self.offline_path_label.setText(f"Loaded: {label}")
+            self.offline_path_label.setToolTip("\n".join(e['path'] for e in entries))
 
             # Update memory label with loaded file info + history total
             self._update_offline_memory_label(disk_size, row_count)
 
             self._update_ram_label()  # Refresh RAM indicator after load
-            self._show_toast(f"Loaded {fname} — {len(var_names)} vars, {row_count:,} rows", 4000)
+            if use_rollup:
+                self.offline_path_label.setText(f"Loaded: {label} ({rollup_level} means)")
+                self._show_toast(f"Loaded {label} — {len(var_names)} vars, {rollup_level} rollup means", 4000)
+            else:
+                self._show_toast(f"Loaded {label} — {len(var_names)} vars, {row_count:,} rows", 4000)
             self._set_offline_mode(True)
         except Exception as e:
             logging.error(f"Failed to load DuckDB recording: {e}")
@@ -3609,18 +4625,24 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
                 self, "Load failed",
                 f"Could not load DuckDB recording:\n{e}"
             )
+            if self.offline_db is not db:
+                db.close()
             if self.offline_db:
                 try:
                     self.offline_db.close()
                 except Exception:
                     pass
                 self.offline_db = None
+            self.offline_cache = None
             self.offline_columns = []
             self.offline_csv_path = None
             self.offline_path_label.setText("No file loaded")
 
     def load_offline_csv(self):
-        """Load a user-selected CSV into DuckDB and populate variable list for offline plotting."""
+        """
+        Load a user-selected CSV (in the background) and populate variable list for offline plotting.
+        The CSV is imported into a disk workspace with a DuckDB memory limit, reused while the file is unchanged.
+        """
         if (self.plc_thread and self.plc_thread.is_alive()) or (self.ads_thread and self.ads_thread.is_alive()) or (self.simulator_thread and self.simulator_thread.isRunning()):
             reply = QMessageBox.question(
                 self, "Disconnect to Load Offline?",
@@ -3637,72 +4659,94 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
             return
         path = os.path.normpath(path)
 
-        # Show RAM estimate before loading (CSV in-memory ≈ 1.5-3x file size)
+        memory_limit_mb = int(self.offline_memory_limit_spin.value() * 1024)
+        # First import: show what it costs (an unchanged CSV reuses its workspace without parsing)
         try:
-            file_size = os.path.getsize(path)
-            estimated_ram_mb = (file_size * 2) / (1024 * 1024)  # ~2x file size in RAM
-            current_ram = get_process_ram_mb() or 0
-            reply = QMessageBox.question(
-                self,
-                "Load CSV?",
-                f"{os.path.basename(path)}  ({_format_size(file_size)} on disk)\n\n"
-                f"Estimated RAM: ~{estimated_ram_mb:.0f} MB\n"
-                f"Current app RAM: {current_ram:.0f} MB → ~{current_ram + estimated_ram_mb:.0f} MB after load",
-                QMessageBox.StandardButton.Ok | QMessageBox.StandardButton.Cancel,
-                QMessageBox.StandardButton.Ok,
-            )
-            if reply != QMessageBox.StandardButton.Ok:
-                return
+            if not offline_workspace.find_workspace(path):
+                file_size = os.path.getsize(path)
+                limit_text = _format_size(memory_limit_mb * 1024 * 1024) if memory_limit_mb else "auto (80% of RAM)"
+                reply = QMessageBox.question(
+                    self,
+                    "Load CSV?",
+                    f"{os.path.basename(path)}  ({_format_size(file_size)} on disk)\n\n"
+                    f"Imported once into a disk workspace in\n{offline_workspace.workspace_dir()}\n"
+                    f"(reused next time while the file is unchanged).\n"
+                    f"DuckDB RAM limit: {limit_text}",
+                    QMessageBox.StandardButton.Ok | QMessageBox.StandardButton.Cancel,
+                    QMessageBox.StandardButton.Ok,
+                )
+                if reply != QMessageBox.StandardButton.Ok:
+                    return
         except Exception:
-            pass  # If estimation fails, proceed anyway
+            pass  # If the check fails, proceed anyway
+
+        self.offline_tasks.cancel_all()  # a new load replaces the running ones
+        if self.offline_workspace and self.offline_workspace == offline_workspace.workspace_path(path):
+            self._unload_offline_data()  # DuckDB opens a file once per configuration: reopened by the load
+        self._submit_offline_task(
+            f"Loading {os.path.basename(path)}…", self._read_offline_csv, path, memory_limit_mb,
+            on_done=lambda task: self._finish_offline_csv(task, path),
+        )
 
+    @staticmethod
+    def _read_offline_csv(task, path, memory_limit_mb):
+        """
+        Worker: the CSV's workspace (offline_data table), imported unless unchanged since the last load
+        ({'db', 'workspace', 'reused', 'columns', 'row_count'}, db closed on failure).
+        """
+        db, reused = offline_workspace.open_csv_workspace(path, memory_limit_mb, cursor=task.cursor)
         try:
-            if self.offline_db:
-                try:
-                    self.offline_db.close()
-                except Exception:
-                    pass
-                self.offline_db = None
-            self.offline_db = duckdb.connect(":memory:")
-            # Load CSV into DuckDB for fast querying (avoids re-reading CSV on each plot)
-            self.offline_db.execute(
-                "CREATE TABLE offline_data AS SELECT * FROM read_csv_auto(?)",
-                [path]
-            )
+            cur = task.cursor(db)
             # Get column names
-            result = self.offline_db.execute(
+            result = cur.execute(
                 "SELECT column_name FROM information_schema.columns WHERE table_name = 'offline_data' ORDER BY ordinal_position"
             ).fetchall()
-            self.offline_columns = [row[0] for row in result]
-            self.offline_csv_path = path
-            self.var_list.clear()
-            self.all_variables = list(self.offline_columns)
-            for col in self.offline_columns:
-                self.var_list.addItem(col)
-            self.offline_path_label.setText(f"Loaded: {os.path.basename(path)}")
-            self.offline_path_label.setToolTip(path)
-            # Update memory label with CSV file size
-            csv_size = os.path.getsize(path) if os.path.isfile(path) else 0
-            row_count = self.offline_db.execute("SELECT count(*) FROM offline_data").fetchone()[0]
-            self._update_offline_memory_label(csv_size, row_count)
-            self._update_ram_label()  # Refresh RAM indicator after load
-            self._show_toast(f"Loaded {os.path.basename(path)} — {len(self.offline_columns)} columns", 4000)
-            self._set_offline_mode(True)
-        except Exception as e:
-            logging.error(f"Failed to load CSV into DuckDB: {e}")
+            row_count = cur.execute("SELECT count(*) FROM offline_data").fetchone()[0]
+            return {
+                'db': db, 'workspace': offline_workspace.workspace_path(path), 'reused': reused,
+                'columns': [row[0] for row in result], 'row_count': row_count,
+            }
+        except BaseException:
+            db.close()
+            raise
+
+    def _finish_offline_csv(self, task, path):
+        """GUI side of load_offline_csv: replace the offline data with the CSV table."""
+        if task.cancelled:
+            if task.result:
+                task.result['db'].close()
+            self._show_toast("Loading cancelled")
+            return
+        if task.error is not None:
             QMessageBox.warning(
                 self, "Load failed",
-                f"Could not load CSV into DuckDB:\n{e}"
+                f"Could not load CSV into DuckDB:\n{task.error}"
             )
-            if self.offline_db:
-                try:
-                    self.offline_db.close()
-                except Exception:
-                    pass
-                self.offline_db = None
-            self.offline_columns = []
-            self.offline_csv_path = None
-            self.offline_path_label.setText("No file loaded")
+            return
+        if self.offline_db:
+            try:
+                self.offline_db.close()
+            except Exception:
+                pass
+        self.offline_db = task.result['db']
+        self.offline_cache = None
+        self.offline_filtered_sql = self._offline_table_sql
+        self.offline_workspace = task.result['workspace']
+        self.offline_columns = task.result['columns']
+        self.offline_csv_path = path
+        self.var_list.clear()
+        self.all_variables = list(self.offline_columns)
+        for col in self.offline_columns:
+            self.var_list.addItem(col)
+        self.offline_path_label.setText(f"Loaded: {os.path.basename(path)}")
+        self.offline_path_label.setToolTip(path)
+        # Update memory label with CSV file size
+        csv_size = os.path.getsize(path) if os.path.isfile(path) else 0
+        self._update_offline_memory_label(csv_size, task.result['row_count'])
+        self._update_ram_label()  # Refresh RAM indicator after load
+        reused = " (workspace reused)" if task.result['reused'] else ""
+        self._show_toast(f"Loaded {os.path.basename(path)} — {len(self.offline_columns)} columns{reused}", 4000)
+        self._set_offline_mode(True)
 
     def start_plc_thread(self):
         if (self.plc_thread and self.plc_thread.is_alive()) or (self.ads_thread and self.ads_thread.is_alive()) or (self.simulator_thread and self.simulator_thread.isRunning()):
@@ -3762,6 +4806,19 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
         recording_reference = "time"
         recording_interval_sec = 0.5
         recording_trigger_variable = None
+        recording_overflow_policy = self.recording_overflow_combo.currentData() or OVERFLOW_BLOCK
+        recording_schema = self.recording_schema_combo.currentData() or recording_store.SCHEMA_NARROW
+        recording_compaction = self.recording_compaction_combo.currentData() or None
+        recording_modes = None
+        if self.recording_modes_combo.currentData() == "csv":
+            recording_modes = record_modes.tag_modes(self.variable_metadata) or None
+        wal_mb, checkpoint_sec = (self.recording_checkpoint_combo.currentData() or "16:60").split(":")
+        recording_states = None
+        if self.recording_states_combo.currentData() == "intervals":
+            recording_states = state_intervals.state_tags(self.variable_metadata) or None
+        recording_compression = None
+        if self.recording_compression_combo.currentData() == "csv":
+            recording_compression = compression.tag_settings(self.variable_metadata) or None
         if device_type == "Snap7" and getattr(self, "recording_section", None) and self.recording_section.isVisible():
             ref = self.recording_ref_combo.currentData() or "time"
             recording_reference = ref
@@ -3835,6 +4892,15 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
                 recording_interval_sec=recording_interval_sec,
                 recording_trigger_variable=recording_trigger_variable,
                 db_filename=db_filename,
+                recording_overflow_policy=recording_overflow_policy,
+                recording_schema=recording_schema,
+                recording_compaction=recording_compaction,
+                recording_compression=recording_compression,
+                recording_journal=self.recording_journal_combo.currentData() == "journal",
+                recording_modes=recording_modes,
+                recording_states=recording_states,
+                recording_checkpoint_wal_bytes=int(wal_mb) * 1024 * 1024,
+                recording_checkpoint_sec=float(checkpoint_sec),
             )
             self.plc_thread.start()
         
@@ -4098,6 +5164,7 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
                 self.comm_status["read_error"] = details["read_error"]
             else:
                 self.comm_status["read_error"] = None
+            self.comm_status["recorder"] = details.get("recorder")
         elif status_type == "info":
             self.comm_status["last_message"] = message
         
@@ -4190,6 +5257,42 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
         else:
             self.comm_db_size_label.setText("DB: --")
 
+        # Recording writer queue (Snap7 recording only)
+        rec = status.get("recorder") if status["connected"] else None
+        if rec:
+            rec_text = (
+                f"Rec queue: {rec['queue_depth']}/{rec['queue_max']} (peak {rec['queue_peak']})"
+                f" | dropped: {rec['dropped']} | spilled: {rec['spilled']}"
+            )
+            if rec.get("last_batch_ms") is not None:
+                rec_text += f" | batch: {rec['last_batch_ms']:.1f} ms"
+            if rec.get("compression_ratio"):
+                rec_text += f" | compression: {rec['compression_ratio']:.1f}x"
+            if rec.get("scheduled_kept") and rec["scheduled_kept"][1]:
+                kept, received = rec["scheduled_kept"]
+                rec_text += f" | kept: {100.0 * kept / received:.0f}% of polled"
+            if rec.get("last_checkpoint_ms") is not None:
+                rec_text += (
+                    f" | WAL: {rec['wal_bytes'] / 1e6:.1f} MB | checkpoint: {rec['last_checkpoint_ms']:.0f} ms"
+                    f" ({rec['last_checkpoint_reason']}, {rec['last_checkpoint_wal_bytes'] / 1e6:.1f} MB,"
+                    f" max {rec['max_checkpoint_ms']:.0f} ms)"
+                )
+            if rec.get("state_intervals") is not None:
+                rec_text += f" | state intervals: {rec['state_intervals']}"
+            journal = rec.get("journal")
+            if journal:
+                rec_text += f" | journal lag: {journal['written_seq'] - journal['committed_seq']}"
+                if journal["replayed_cycles"]:
+                    rec_text += f" (replayed {journal['replayed_cycles']})"
+                if journal.get("resent"):
+                    rec_text += f", resent {journal['resent']}x"
+            self.comm_recorder_label.setText(rec_text)
+            lagging = rec["dropped"] > 0 or rec["queue_depth"] > rec["queue_max"] * 0.5
+            self.comm_recorder_label.setStyleSheet(f"color: {'#FF9800' if lagging else '#aaa'}; font-size: 10px;")
+        else:
+            self.comm_recorder_label.setText("Rec queue: --")
+            self.comm_recorder_label.setStyleSheet("color: #aaa; font-size: 10px;")
+
         # Last message/error (connection errors; ADS variable read failures shown via read_error)
         if status["last_error"]:
             self.comm_message_label.setText(f"⚠ {status['last_error']}")
@@ -4889,6 +5992,52 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
         """Quote identifier for DuckDB (handles spaces and special chars)."""
         return '"' + str(name).replace('"', '""') + '"'
 
+    @staticmethod
+    def _offline_table_sql(conn, columns, filt=None):
+        """SQL of the offline_data rows (CSV, dose table) matching filt."""
+        return offline_filters.filtered_select_sql("offline_data", columns, filt)
+
+    @staticmethod
+    def _query_offline_columns(task, conn, cache, batches, filtered_sql, filt=None):
+        """
+        Worker: the columns of an offline graph, one query per batch, each published as (n_rows, {column: array}).
+        With a filter, every batch is filtered in DuckDB (filtered_sql), so only matching rows are fetched.
+        """
+        cur = task.cursor(conn)
+        for i, batch in enumerate(batches):
+            task.step(i, len(batches))
+            if cache is not None and not filt:
+                # Recording: only these columns are pivoted (or taken from the cache)
+                timestamps, data = cache.columns(batch, conn=cur)
+                data['timestamp'] = timestamps
+                n_rows = len(timestamps)
+            else:
+                # NumPy columns straight from DuckDB (NULL = masked), converted per array in the plot
+                result = cur.execute(filtered_sql(cur, batch, filt)).fetchnumpy()
+                data = dict(zip(batch, result.values()))
+                n_rows = len(next(iter(result.values()), []))
+            task.publish((n_rows, data))
+
+    @staticmethod
+    def _query_offline_linked_index(task, conn, filtered_sql, filt, order_col, linked, var_names, with_time):
+        """
+        Worker: one row per change of `linked` with the values of var_names at that change (discrete index
+        linked to a variable), computed with window functions in DuckDB (see linked_index). Published as
+        (n_changes, {discrete_index, timestamp, variable: array}).
+        """
+        cur = task.cursor(conn)
+        task.step(0, 1)
+        cols = list(dict.fromkeys([order_col] + (['timestamp'] if with_time else []) + [linked] + list(var_names)))
+        sql = linked_index.linked_index_sql(
+            f"({filtered_sql(cur, cols, filt)})", order_col, linked, var_names,
+            time_col='timestamp' if with_time else None,
+        )
+        index, timestamps, columns = linked_index.fetch_linked_index(cur, sql, linked, var_names, with_time=with_time)
+        data = dict(columns)
+        data[linked_index.INDEX_COLUMN] = index
+        data['timestamp'] = timestamps
+        task.publish((len(index), data))
+
     def add_new_graph(self):
         selected_items = self.var_list.selectedItems()
         if not selected_items:
@@ -4899,7 +6048,9 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
             if not self.offline_db or not self.offline_columns:
                 QMessageBox.warning(self, "No data", "Load a CSV or recording DB first (Offline Data).")
                 return
-        dialog = GraphConfigDialog(self.all_variables, self, selected_vars=var_names)
+        dialog = GraphConfigDialog(
+            self.all_variables, self, selected_vars=var_names, offline_columns=self.offline_columns if is_offline else None
+        )
         if dialog.exec() != QDialog.Accepted:
             return
         settings = dialog.get_settings()
@@ -4925,59 +6076,119 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
         vbox.addWidget(header)
 
         if is_offline:
-            # Offline: query DuckDB, create graph, set static data
+            # Offline: query DuckDB in the background, in batches of columns; the graph is created with the
+            # first batch (row count known) and each further batch is drawn as it arrives
             x_col = settings['x_axis']
             use_discrete_index = (x_col == "Discrete index (1, 2, 3…)")
-            if use_discrete_index:
+            # Time plots (against the index or the timestamp column) keep full columns, drawn level-of-detail
+            use_time_lod = x_col in ("Time (Index)", "timestamp")
+            if use_time_lod:
+                settings['x_axis'] = "Time (Index)"
+                cols = (['timestamp'] if 'timestamp' in self.offline_columns else []) + [
+                    v for v in var_names if v != 'timestamp'
+                ]
+            elif use_discrete_index:
                 cols = list(var_names)
-                x_data_for_static = None
             else:
                 cols = [x_col] + [v for v in var_names if v != x_col]
-                x_data_for_static = None
-            try:
-                quoted = [self._quote_duckdb_identifier(c) for c in cols]
-                sql = f"SELECT {', '.join(quoted)} FROM offline_data"
-                result = self.offline_db.execute(sql).fetchall()
-            except Exception as e:
-                logging.error(f"Offline query failed: {e}")
-                QMessageBox.warning(self, "Query failed", f"DuckDB query failed:\n{e}")
-                return
-            if not result:
-                QMessageBox.warning(self, "No rows", "CSV table has no rows.")
+            batches = [cols[i:i + OFFLINE_COLUMN_BATCH] for i in range(0, len(cols), OFFLINE_COLUMN_BATCH)]
+            filt = settings.get('filter')
+            # Discrete index linked to a variable: one row per change, computed in DuckDB like the live snapshots
+            linked = settings.get("discrete_index_linked_variable") if use_discrete_index else None
+            if linked and linked not in self.offline_columns:
+                linked = None
+            state = {'graph': None, 'timestamps': None, 'x_data': None, 'y_series': {}, 'density': False}
+
+            def on_columns(task, partial):
+                n_rows, data = partial
+                new_graph = state['graph']
+                if new_graph is None:
+                    if not n_rows:
+                        task.cancel()
+                        if filt:
+                            QMessageBox.warning(self, "No rows", f"No rows match the filter:\n{filt}")
+                        elif linked:
+                            QMessageBox.warning(self, "No rows", f"{linked} has no values in the offline data.")
+                        else:
+                            QMessageBox.warning(self, "No rows", "CSV table has no rows.")
+                        return
+                    buffer_size = min(max(n_rows, 500), 500000)
+                    comm_speed = 0.05
+                    new_graph = state['graph'] = DynamicPlotWidget(
+                        var_names,
+                        x_axis_source=settings['x_axis'],
+                        buffer_size=buffer_size,
+                        recipe_params=self.recipe_params,
+                        latest_values_cache=self.latest_values,
+                        variable_metadata=self.variable_metadata,
+                        comm_speed=comm_speed,
+                        graph_title=settings.get("graph_title", ""),
+                        y_axis_mode=settings.get("y_axis_mode", "auto"),
+                        y_axis_assignments=settings.get("y_axis_assignments"),
+                        display_deadband=settings.get("display_deadband", 0),
+                        discrete_index_linked_variable=settings.get("discrete_index_linked_variable"),
+                        limit_high=settings.get("limit_high"),
+                        limit_low=settings.get("limit_low"),
+                        all_variable_list=self.all_variables,
+                    )
+                    new_graph.offline_filter = filt
+                    xy_display = settings.get('xy_display', 'auto')
+                    state['density'] = not use_time_lod and not use_discrete_index and (
+                        xy_display == 'density' or (xy_display == 'auto' and n_rows > XY_DENSITY_AUTO_POINTS)
+                    )
+                    vbox.addWidget(new_graph)
+                    container.lbl_title = lbl_title
+                    container.graph = new_graph
+                    lbl_title.setText(new_graph.get_display_title())
+                    if filt:
+                        lbl_title.setToolTip(f"Filter: {filt}\n{n_rows:,} matching rows")
+                    self.graph_splitter.addWidget(container)
+                    self.graphs.append(new_graph)
+                    btn_close.clicked.connect(lambda: self.remove_graph(container, new_graph))
+                    new_graph.apply_background_theme(getattr(self, "_graph_background_mode", "dark"))
+                    state['timestamps'] = data.get('timestamp')
+                    if not use_time_lod and not use_discrete_index:
+                        state['x_data'] = data[x_col]
+                if new_graph not in self.graphs:
+                    task.cancel()  # graph closed while its columns were loading
+                    return
+                if linked:
+                    new_graph.set_static_linked_index(data[linked_index.INDEX_COLUMN], data['timestamp'], data)
+                elif use_time_lod:
+                    state['y_series'].update(
+                        {v: plot_lod.as_float_array(data[v]) for v in var_names if v in data and v != 'timestamp'}
+                    )
+                    new_graph.set_static_columns(state['timestamps'], state['y_series'])
+                elif state['density']:
+                    new_graph.set_static_density(state['x_data'], {v: data[v] for v in var_names if v in data})
+                else:
+                    new_graph.set_static_data(state['x_data'], {v: data[v] for v in var_names if v in data})
+                if self.offline_cache is not None:
+                    self._update_offline_memory_label(*self._offline_loaded_info)
+
+            def on_done(task):
+                if task.error is not None:
+                    QMessageBox.warning(self, "Query failed", f"DuckDB query failed:\n{task.error}")
+                elif self.offline_cache is not None and not task.cancelled:
+                    self._update_ram_label()
+
+            if linked:
+                # Snapshot the recipe parameters too (exported with each row, as live)
+                snapshot_vars = list(var_names) + [
+                    p for p in self.recipe_params if p in self.offline_columns and p not in var_names
+                ]
+                self._submit_offline_task(
+                    f"Indexing changes of {linked}…", self._query_offline_linked_index,
+                    self.offline_db, self.offline_filtered_sql, filt,
+                    'timestamp' if self.offline_cache is not None else 'rowid', linked, snapshot_vars,
+                    'timestamp' in self.offline_columns, on_partial=on_columns, on_done=on_done,
+                )
                 return
-            n_rows = len(result)
-            buffer_size = min(max(n_rows, 500), 500000)
-            comm_speed = 0.05
-            new_graph = DynamicPlotWidget(
-                var_names,
-                x_axis_source=settings['x_axis'],
-                buffer_size=buffer_size,
-                recipe_params=self.recipe_params,
-                latest_values_cache=self.latest_values,
-                variable_metadata=self.variable_metadata,
-                comm_speed=comm_speed,
-                graph_title=settings.get("graph_title", ""),
-                y_axis_mode=settings.get("y_axis_mode", "auto"),
-                y_axis_assignments=settings.get("y_axis_assignments"),
-                display_deadband=settings.get("display_deadband", 0),
-                discrete_index_linked_variable=settings.get("discrete_index_linked_variable"),
-                limit_high=settings.get("limit_high"),
-                limit_low=settings.get("limit_low"),
-                all_variable_list=self.all_variables,
+            self._submit_offline_task(
+                f"Querying {len(cols)} column{'s' if len(cols) != 1 else ''}…", self._query_offline_columns,
+                self.offline_db, self.offline_cache, batches, self.offline_filtered_sql, filt,
+                on_partial=on_columns, on_done=on_done,
             )
-            vbox.addWidget(new_graph)
-            container.lbl_title = lbl_title
-            container.graph = new_graph
-            lbl_title.setText(new_graph.get_display_title())
-            self.graph_splitter.addWidget(container)
-            self.graphs.append(new_graph)
-            btn_close.clicked.connect(lambda: self.remove_graph(container, new_graph))
-            col_index = {name: i for i, name in enumerate(cols)}
-            if not use_discrete_index:
-                x_data_for_static = [row[0] for row in result]
-            y_series = {v: [row[col_index[v]] for row in result] for v in var_names if v in col_index}
-            new_graph.set_static_data(x_data_for_static, y_series)
-            new_graph.apply_background_theme(getattr(self, "_graph_background_mode", "dark"))
             return
 
         # Online: use buffer_size and other options from GraphConfigDialog
@@ -5413,8 +6624,103 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
                 QPushButton:pressed { background-color: #cc5500; }
             """)
 
+    def _retention_policy(self):
+        return retention.RetentionPolicy(
+            raw_days=self.retention_raw_days_spin.value(),
+            rollup_days=self.retention_rollup_days_spin.value(),
+            quota_bytes=int(self.retention_quota_spin.value() * 1e9),
+        )
+
+    def _retention_enabled(self):
+        """True once the user has applied a retention policy (nothing is removed before that)."""
+        enabled = QSettings("DecAutomation", "Studio").value("retention_enabled", False)
+        if isinstance(enabled, str):
+            enabled = enabled.lower() in ("true", "1", "yes")
+        return bool(enabled)
+
+    def _start_retention_job(self, start_delay_sec=30.0):
+        """Start the background retention job on the recordings folder (never touches the file being recorded)."""
+        ext_dir = os.path.join(os.path.dirname(__file__), "external")
+        self.retention_job = retention.RetentionJob(
+            ext_dir, self._retention_policy(), start_delay_sec=start_delay_sec,
+            protected=lambda: [getattr(self.plc_thread, "db_path", None)] if self.plc_thread else [],
+        )
+        self.retention_job.start()
+
+    def _apply_retention_policy(self):
+        """Show what the policy would remove, then save it and let the background job apply it."""
+        policy = self._retention_policy()
+        if policy.raw_days and policy.rollup_days and policy.rollup_days < policy.raw_days:
+            self._show_toast("Rollups must be kept at least as long as raw data.")
+            return
+        ext_dir = os.path.join(os.path.dirname(__file__), "external")
+        protected = [getattr(self.plc_thread, "db_path", None)] if self.plc_thread else []
+        try:
+            plan = retention.plan_retention(ext_dir, policy, protected=protected)
+        except Exception as e:
+            QMessageBox.warning(self, "Retention", f"Could not evaluate the policy:\n{e}")
+            return
+        if plan:
+            n_strip = sum(1 for _, action, _ in plan if action == retention.ACTION_STRIP)
+            n_delete = len(plan) - n_strip
+            lines = "\n".join(f"{day.strftime('%d/%m/%Y')}: {action} ({reason})" for day, action, reason in plan[:15])
+            more = f"\n… and {len(plan) - 15} more" if len(plan) > 15 else ""
+            reply = QMessageBox.question(
+                self, "Apply retention policy?",
+                f"{n_strip} day(s) will keep only their rollups, {n_delete} day(s) will be deleted:\n\n{lines}{more}",
+                QMessageBox.StandardButton.Ok | QMessageBox.StandardButton.Cancel,
+                QMessageBox.StandardButton.Cancel,
+            )
+            if reply != QMessageBox.StandardButton.Ok:
+                return
+        self._save_last_config()
+        enabled = bool(policy.raw_days or policy.rollup_days or policy.quota_bytes)
+        s = QSettings("DecAutomation", "Studio")
+        s.setValue("retention_enabled", enabled)
+        s.sync()
+        job = getattr(self, "retention_job", None)
+        if not enabled:
+            # Every limit at 0: keep everything, no background job
+            if job is not None:
+                job.stop()
+                self.retention_job = None
+            self.offline_storage_label.setText("Usage: -- (retention disabled)")
+            self._show_toast("Retention disabled — recordings are kept")
+            return
+        if job is not None and job.is_alive():
+            job.set_policy(policy)
+        else:
+            self._start_retention_job(start_delay_sec=0.0)
+        self._show_toast("Retention policy saved" + (" — applying in the background" if plan else ""))
+
+    def _update_storage_label(self):
+        """Show recording disk usage and the last retention run (from the background job)."""
+        job = getattr(self, "retention_job", None)
+        if job is None or not hasattr(self, "offline_storage_label"):
+            return
+        usage = job.usage
+        if usage is None:
+            self.offline_storage_label.setText("Usage: measuring…")
+            return
+        text = f"Usage: {_format_size(usage['total_bytes'])}"
+        quota = job.policy.quota_bytes
+        if quota:
+            text += f" of {_format_size(quota)} ({100.0 * usage['total_bytes'] / quota:.0f}%)"
+        text += f" — {usage['raw_days']} day(s) raw, {usage['rollup_only_days']} rollups only"
+        if job.last_run is not None:
+            text += f"\nLast cleanup {job.last_run.strftime('%d/%m %H:%M')}: "
+            if job.last_error:
+                text += f"failed ({job.last_error})"
+            elif job.last_actions:
+                freed = sum(a[3] for a in job.last_actions)
+                text += f"{len(job.last_actions)} day(s) reduced/deleted, {_format_size(max(freed, 0))} freed"
+            else:
+                text += "nothing to do"
+        self.offline_storage_label.setText(text)
+
     def _update_ram_label(self):
-        """Update the subtle RAM usage label at the bottom-left."""
+        """Update the subtle RAM usage label at the bottom-left (and the offline storage usage)."""
+        self._update_storage_label()
         ram_mb = get_process_ram_mb()
         if ram_mb is not None:
             self.ram_label.setText(f"RAM: {ram_mb:.0f} MB")
@@ -5446,6 +6752,8 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
 
     def closeEvent(self, event):
         self._save_last_config()
+        if getattr(self, "retention_job", None) is not None:
+            self.retention_job.stop()
         # Close analytics window if open
         if self.analytics_window is not None:
             self.analytics_window.close()
@@ -5461,13 +6769,9 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
             self.ads_thread.stop()
             self.ads_thread.join(timeout=2.0)
         if self.plc_thread and self.plc_thread.is_alive():
-            self.plc_thread.stop()  # CHECKPOINT + close happens in stop()
-            self.plc_thread.join(timeout=2.0)
-        if self.plc_thread and getattr(self.plc_thread, "db_connection", None):
-            try:
-                self.plc_thread.db_connection.close()
-            except Exception:
-                pass
+            self.plc_thread.stop()
+            # The thread's run() converts the journal, flushes the recorder, CHECKPOINTs and closes the file
+            self.plc_thread.join(timeout=15.0)
         # Recording DB is kept on disk (daily .duckdb files) — offer CSV export as convenience
         if db_path and recording_has_data(db_path):
             reply = QMessageBox.question(
@@ -5488,7 +6792,9 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
                     )
                     if path:
                         try:
-                            n = export_recording_to_csv(db_path, from_dt, to_dt, interval_sec, path)
+                            n = export_recording_to_csv(
+                                db_path, from_dt, to_dt, interval_sec, path, filt=export_dlg.filter
+                            )
                             logging.info(f"Exported {n} rows to {path}")
                         except Exception as e:
                             logging.exception("Export recording failed")
@@ -5522,6 +6828,7 @@ class MainWindow(FramelessResizeMixin, QMainWindow):
                             logging.warning(f"Export graph {i} failed: {e}")
                     if exported:
                         self._show_toast(f"Exported {exported} graph(s) to CSV")
+        self.offline_tasks.shutdown()
         if self.offline_db:
             try:
                 self.offline_db.close()